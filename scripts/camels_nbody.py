@@ -4,79 +4,97 @@ import time
 import argparse
 import h5py
 import hdf5plugin
+from typing_extensions import Iterator
 
 import jax.numpy as jnp
-import jax
 import jax.random as random
 
+import ginjax.geometric as geom
 import ginjax.data as gc_data
+import ginjax.physics as physics
 
 
-def read_one_h5(filename: str) -> tuple:
+def read_snapshots(sim_dir: str) -> Iterator[tuple]:
     """
-    Given a filename and a type of data (train, test, or validation), read the data and return as jax arrays.
+    Lazily read the dark matter particles of each snapshot of one simulation, in time order. The
+    particle datasets are only valid until the next snapshot is requested.
+
     args:
-        filename (str): the full file path
-    returns: force, particle, and velocity
+        sim_dir: directory of the simulation, with files snapshot_000.hdf5, snapshot_001.hdf5, ...
+
+    returns:
+        iterator of positions, velocities, and masses (None when all particles have equal mass)
     """
-    data_dict = h5py.File(filename)["PartType1"]  # keys 'Coordinates', 'ParticleIDs', 'Velocities'
-    print(data_dict.keys())
-    print(data_dict["Coordinates"].shape)
-    print(data_dict["ParticleIDs"].shape)
-    print(data_dict["Velocities"].shape)
-    exit()
-    # 4 runs, 1000 time points, 512x512 grid
-    # time ranges from 0 to 5, presumably seconds
-    force = jax.device_put(
-        jnp.array(data_dict["force"][()]), jax.devices("cpu")[0]
-    )  # (4,512,512,2)
-    particles = jax.device_put(
-        jnp.array(data_dict["particles"][()]), jax.devices("cpu")[0]
-    )  # (4,1000,512,512,1)
-    # these are advected particles, might be a proxy of density?
-    velocity = jax.device_put(
-        jnp.array(data_dict["velocity"][()]), jax.devices("cpu")[0]
-    )  # (4,1000,512,512,2)
-    data_dict.close()
-
-    return force, particles[..., 0], velocity
-
-
-def read_data(data_dir: str, num_trajectories: int, downsample: int = 0) -> tuple:
+    snapshot_files = sorted(filter(lambda file: "snapshot_" in file, os.listdir(sim_dir)))
+    for filename in snapshot_files:
+        with h5py.File(f"{sim_dir}/{filename}", "r") as f:
+            # keys 'Coordinates', 'ParticleIDs', 'Velocities', all particles have the same mass
+            data_dict = f["PartType1"]
+            yield data_dict["Coordinates"], data_dict["Velocities"], None
+
+
+def read_one_simulation(
+    sim_dir: str, N: int, scheme: str = "cic", chunk_size: int = 2**20
+) -> geom.MultiImage:
     """
-    Load data from the multiple .hd5 files
+    Deposit every snapshot of one simulation onto an NxNxN grid of the periodic box.
+
     args:
-        data_dir (str): directory of the data
-        num_trajectories (int): total number of trajectories to read in
+        sim_dir: directory of the simulation
+        N: number of grid cells on each side
+        scheme: the mass assignment scheme, ngp, cic, or tsc
+        chunk_size: number of particles deposited at a time
+
+    returns:
+        MultiImage of density and velocity, shape (1,time,N,N,N,tensor)
     """
-    N = int(512 / (2**downsample))
-    D = 2
-    all_files = filter(lambda file: f"snapshot_" in file, os.listdir(data_dir))
+    D = 3
+    snapshot_files = sorted(filter(lambda file: "snapshot_" in file, os.listdir(sim_dir)))
+    with h5py.File(f"{sim_dir}/{snapshot_files[0]}", "r") as f:
+        box_size = float(f["Header"].attrs["BoxSize"])  # kpc/h
+        particle_mass = float(f["Header"].attrs["MassTable"][1])  # 1e10 Msun/h
 
-    all_force = jnp.zeros((0, N, N, D))
-    all_particles = jnp.zeros((0, 1000, N, N))
-    all_velocity = jnp.zeros((0, 1000, N, N, D))
-    for filename in all_files:
-        force, particles, velocity = read_one_h5(f"{data_dir}/{filename}")
+    multi_image = physics.particle_time_series(
+        read_snapshots(sim_dir), (N,) * D, box_size, scheme, chunk_size
+    )
+    multi_image[(0, 0)] = multi_image[(0, 0)] * particle_mass
+    return multi_image
 
-        all_force = jnp.concatenate([all_force, force])
-        all_particles = jnp.concatenate([all_particles, particles])
-        all_velocity = jnp.concatenate([all_velocity, velocity])
 
-        if len(all_force) >= num_trajectories:
-            break
+def read_data(
+    data_dir: str, num_trajectories: int, downsample: int = 0, scheme: str = "cic"
+) -> geom.MultiImage:
+    """
+    Load data from the simulation directories, each simulation is a trajectory.
+
+    args:
+        data_dir: directory of the data, with one subdirectory per simulation
+        num_trajectories: total number of trajectories to read in
+        downsample: number of times to halve the grid, particles are deposited directly onto the
+            smaller grid rather than pooling the full grid
+        scheme: the mass assignment scheme, ngp, cic, or tsc
 
-    if len(all_force) < num_trajectories:
+    returns:
+        MultiImage of density and velocity, shape (trajectories,time,spatial,tensor)
+    """
+    N = int(256 / (2**downsample))
+    sim_dirs = sorted(
+        filter(lambda file: os.path.isdir(f"{data_dir}/{file}"), os.listdir(data_dir))
+    )
+
+    if len(sim_dirs) < num_trajectories:
         print(
-            f"WARNING read_data: wanted {num_trajectories} trajectories, but only found {len(all_force)}"
+            f"WARNING read_data: wanted {num_trajectories} trajectories, but only found {len(sim_dirs)}"
         )
-        num_trajectories = len(all_force)
+        num_trajectories = len(sim_dirs)
 
-    all_force = all_force[:num_trajectories]
-    all_particles = all_particles[:num_trajectories]
-    all_velocity = all_velocity[:num_trajectories]
+    multi_image = None
+    for sim_dir in sim_dirs[:num_trajectories]:
+        trajectory = read_one_simulation(f"{data_dir}/{sim_dir}", N, scheme)
+        multi_image = trajectory if multi_image is None else multi_image.concat(trajectory)
 
-    return all_force, all_particles, all_velocity
+    assert multi_image is not None
+    return multi_image
 
 
 def get_data(
@@ -89,6 +107,7 @@ def get_data(
     delta_t: int = 1,
     downsample: int = 0,
     skip_initial: int = 0,
+    scheme: str = "cic",
 ) -> tuple:
     """
     Get train, val, and test data sets.
@@ -102,33 +121,35 @@ def get_data(
         delta_t (int): number of timesteps per model step, default 1
         downsample (int): number of times to spatial downsample, defaults to 0 (no downsampling)
         skip_initial (int): number of initial steps to skip, default to 0
+        scheme (str): the mass assignment scheme, ngp, cic, or tsc, defaults to cic
     """
-    D = 2
-    force, particles, velocity = read_data(
+    D = 3
+    fields = read_data(
         data_dir,
         num_train_traj + num_val_traj + num_test_traj,
-        downsample,  # downsampling handled prior to time_series_to_multi_images
+        downsample,  # downsampling handled by the deposit grid, prior to batch_time_series
+        scheme,
     )
+    total_steps = fields[(0, 0)].shape[1]
+    constant_fields = geom.MultiImage({}, D, is_torus=True)
 
     start = 0
     stop = num_train_traj
-    train_X, train_Y = gc_data.times_series_to_multi_images(
-        D,
-        {(0, 0): particles[start:stop], (1, 0): velocity[start:stop]},
-        {(1, 0): force[start:stop]},
-        False,
+    train_X, train_Y = gc_data.batch_time_series(
+        fields.get_subset(jnp.arange(start, stop)),
+        constant_fields,
+        total_steps,
         past_steps,
-        1,
+        1,  # future_steps
         skip_initial,
         delta_t,
     )
     start = stop
     stop = stop + num_val_traj
-    val_X, val_Y = gc_data.times_series_to_multi_images(
-        D,
-        {(0, 0): particles[start:stop], (1, 0): velocity[start:stop]},
-        {(1, 0): force[start:stop]},
-        False,  # is_torus
+    val_X, val_Y = gc_data.batch_time_series(
+        fields.get_subset(jnp.arange(start, stop)),
+        constant_fields,
+        total_steps,
         past_steps,
         1,  # future_steps
         skip_initial,
@@ -136,21 +157,19 @@ def get_data(
     )
     start = stop
     stop = stop + num_test_traj
-    test_single_X, test_single_Y = gc_data.times_series_to_multi_images(
-        D,
-        {(0, 0): particles[start:stop], (1, 0): velocity[start:stop]},
-        {(1, 0): force[start:stop]},
-        False,  # is_torus
+    test_single_X, test_single_Y = gc_data.batch_time_series(
+        fields.get_subset(jnp.arange(start, stop)),
+        constant_fields,
+        total_steps,
         past_steps,
         1,  # future_steps
         skip_initial,
         delta_t,
     )
-    test_rollout_X, test_rollout_Y = gc_data.times_series_to_multi_images(
-        D,
-        {(0, 0): particles[start:stop], (1, 0): velocity[start:stop]},
-        {(1, 0): force[start:stop]},
-        False,  # is_torus
+    test_rollout_X, test_rollout_Y = gc_data.batch_time_series(
+        fields.get_subset(jnp.arange(start, stop)),
+        constant_fields,
+        total_steps,
         past_steps,
         rollout_steps,
         skip_initial,
@@ -171,7 +190,9 @@ def get_data(
 
 def handleArgs(argv):
     parser = argparse.ArgumentParser()
-    parser.add_argument("data_dir", help="the directory where the .h5 files are located", type=str)
+    parser.add_argument(
+        "data_dir", help="the directory with a subdirectory of snapshots per simulation", type=str
+    )
     parser.add_argument("-e", "--epochs", help="number of epochs to run", type=int, default=50)
     parser.add_argument("-lr", help="learning rate", type=float, default=2e-4)
     parser.add_argument("-batch", help="batch size", type=int, default=16)
@@ -217,6 +238,13 @@ def handleArgs(argv):
         type=int,
         default=0,
     )
+    parser.add_argument(
+        "-scheme",
+        help="particle mass assignment scheme, one of ngp, cic, or tsc",
+        type=str,
+        choices=physics.DEPOSIT_SCHEMES,
+        default="cic",
+    )
     parser.add_argument("-t", "--trials", help="number of trials to run", type=int, default=1)
     parser.add_argument(
         "-v",
@@ -232,7 +260,7 @@ def handleArgs(argv):
 # Main
 args = handleArgs(sys.argv)
 
-D = 2
+D = 3
 past_steps = 4  # how many steps to look back to predict the next step
 rollout_steps = 5
 key = random.PRNGKey(time.time_ns()) if (args.seed is None) else random.PRNGKey(args.seed)
@@ -247,4 +275,5 @@ data = get_data(
     args.delta_t,
     args.downsample,
     args.skip_initial,
+    args.scheme,
 )
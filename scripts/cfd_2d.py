@@ -1,10 +1,10 @@
+import os
 import time
 import argparse
 import numpy as np
 from functools import partial
 import matplotlib.pyplot as plt
-import h5py
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 
 import jax.numpy as jnp
 import jax
@@ -16,34 +16,39 @@ import equinox as eqx
 import ginjax.geometric as geom
 import ginjax.ml as ml
 import ginjax.utils as utils
+import ginjax.stats as ginjax_stats
 import ginjax.data as gc_data
 import ginjax.models as models
 
 
-def read_one_h5(filename: str, num_trajectories: int) -> tuple:
+def read_one_h5(
+    filename: str,
+    start: int,
+    num_trajectories: int,
+    transform: Optional[Callable[[geom.MultiImage], geom.MultiImage]] = None,
+) -> gc_data.HDF5TrajectorySource:
     """
-    Given a filename and a type of data (train, test, or validation), read the data and return as jax arrays.
+    Get a lazy source of trajectories of the file, which are read in chunks as they are batched.
+
     args:
-        filename (str): the full file path
-        data_class (str): either 'train', 'test', or 'valid'
-    returns: u, vxy as jax arrays
-    """
-    data_dict = h5py.File(filename)
+        filename: the full file path
+        start: index of the first trajectory
+        num_trajectories: number of trajectories
+        transform: function applied to the MultiImages as they are read
 
-    # all of these are shape (num_trajectories, t, x, y) = (10K, 21, 128, 128)
-    density = jax.device_put(
-        jnp.array(data_dict["density"][:num_trajectories][()]), jax.devices("cpu")[0]
-    )
-    pressure = jax.device_put(
-        jnp.array(data_dict["pressure"][:num_trajectories][()]), jax.devices("cpu")[0]
+    returns:
+        the source, where each trajectory has density and pressure scalars and a velocity vector
+    """
+    # all datasets are shape (num_trajectories, t, x, y) = (10K, 21, 128, 128)
+    return gc_data.HDF5TrajectorySource(
+        filename,
+        {(0, 0): ["density", "pressure"], (1, 0): [["Vx", "Vy"]]},
+        D=2,
+        is_torus=True,
+        start=start,
+        n_trajectories=num_trajectories,
+        transform=transform,
     )
-    vx = jax.device_put(jnp.array(data_dict["Vx"][:num_trajectories][()]), jax.devices("cpu")[0])
-    vy = jax.device_put(jnp.array(data_dict["Vy"][:num_trajectories][()]), jax.devices("cpu")[0])
-    vxy = jnp.stack([vx, vy], axis=-1)
-
-    data_dict.close()
-
-    return density, pressure, vxy
 
 
 def get_data(
@@ -55,71 +60,59 @@ def get_data(
     past_steps: int,
     rollout_steps: int,
     normalize: bool = True,
-) -> tuple[geom.MultiImage, ...]:
-    density, pressure, velocity = read_one_h5(filename, n_train + n_val + n_test)
+    storage_dtype: Optional[str] = None,
+) -> tuple[gc_data.MultiImageDataset, ...]:
+    is_torus = True
+    total_steps = 21
 
+    transform = None
     if normalize:
-        density = (density - jnp.mean(density[: (n_train + n_val)])) / jnp.std(
-            density[: (n_train + n_val)]
+        # statistics of the train and validation trajectories, cached next to the data
+        field_stats = ginjax_stats.compute_stats(
+            read_one_h5(filename, 0, n_train + n_val).iter_chunks(),
+            n_steps=total_steps,
+            cache=f"{os.path.splitext(filename)[0]}_stats_n{n_train + n_val}.json",
         )
-        pressure = (pressure - jnp.mean(pressure[: (n_train + n_val)])) / jnp.std(
-            pressure[: (n_train + n_val)]
-        )
-        velocity = velocity / jnp.std(
-            velocity[: (n_train + n_val)]
-        )  # this one I am not so sure about
-
-    # (batch,2,timesteps,spatial)
-    density_pressure = jnp.concatenate([density[:, None], pressure[:, None]], axis=1)
-    # (batch,2*timesteps,spatial)
-    density_pressure = density_pressure.reshape(
-        (len(density_pressure), -1) + density_pressure.shape[3:]
-    )
-
-    is_torus = True
-    total_steps = 21
+        transform = field_stats.normalize
     constant_fields = geom.MultiImage({}, D, is_torus)
 
-    start = 0
-    stop = n_train
-    train_X, train_Y = gc_data.batch_time_series(
-        geom.MultiImage(
-            {(0, 0): density_pressure[start:stop], (1, 0): velocity[start:stop]}, D, is_torus
-        ),
+    train_source = read_one_h5(filename, 0, n_train, transform)
+    val_source = read_one_h5(filename, n_train, n_val, transform)
+    if storage_dtype is not None:
+        # the train and validation trajectories are read every epoch, so hold them on the host in
+        # reduced precision rather than reading the file each time
+        train_source, val_source = (
+            gc_data.CompressedMultiImage.from_chunks(source.iter_chunks(), storage_dtype)
+            for source in (train_source, val_source)
+        )
+
+    # all the datasets are lazy views, the trajectories are read and each window is only gathered
+    # when it is batched
+    train_X, train_Y = gc_data.lazy_batch_time_series(
+        train_source,
         constant_fields,
         total_steps,
         past_steps,
         1,
     )
-
-    start = start + n_train
-    stop = start + n_val
-    val_X, val_Y = gc_data.batch_time_series(
-        geom.MultiImage(
-            {(0, 0): density_pressure[start:stop], (1, 0): velocity[start:stop]}, D, is_torus
-        ),
+    val_X, val_Y = gc_data.lazy_batch_time_series(
+        val_source,
         constant_fields,
         total_steps,
         past_steps,
         1,
     )
 
-    start = start + n_val
-    stop = start + n_test
-    test_X, test_Y = gc_data.batch_time_series(
-        geom.MultiImage(
-            {(0, 0): density_pressure[start:stop], (1, 0): velocity[start:stop]}, D, is_torus
-        ),
+    test_source = read_one_h5(filename, n_train + n_val, n_test, transform)
+    test_X, test_Y = gc_data.lazy_batch_time_series(
+        test_source,
         constant_fields,
         total_steps,
         past_steps,
         1,
     )
-
-    test_rollout_X, test_rollout_Y = gc_data.batch_time_series(
-        geom.MultiImage(
-            {(0, 0): density_pressure[start:stop], (1, 0): velocity[start:stop]}, D, is_torus
-        ),
+    test_rollout_X, test_rollout_Y = gc_data.lazy_batch_time_series(
+        test_source,
         constant_fields,
         total_steps,
         past_steps,
@@ -276,7 +269,7 @@ def map_and_loss(
 
 
 def train_and_eval(
-    data: tuple[geom.MultiImage, ...],
+    data: tuple[gc_data.MultiImageDataset, ...],
     key: ArrayLike,
     model_name: str,
     model: models.MultiImageModule,
@@ -291,6 +284,9 @@ def train_and_eval(
     verbose: int = 1,
     plot_component: int = 0,
     is_wandb: bool = False,
+    device_budget: Optional[float] = None,
+    augmentation: Optional[gc_data.GroupAugmentation] = None,
+    loader: Optional[gc_data.WorkerLoader] = None,
 ) -> tuple[Optional[ArrayLike], ...]:
     (
         train_X,
@@ -309,6 +305,14 @@ def train_and_eval(
     if load_model is None:
         steps_per_epoch = int(np.ceil(train_X.get_L() / batch_size))
         key, subkey = random.split(key)
+        if device_budget is not None:
+            # keep the data on the device if it fits, otherwise batches are paged in every epoch
+            memory_budget = int(device_budget * 1e9)
+            train_X, train_Y, val_X, val_Y = (
+                gc_data.DeviceCache(data, memory_budget)
+                for data in (train_X, train_Y, val_X, val_Y)
+            )
+
         model, batch_stats, train_loss, val_loss = ml.train(
             train_X,
             train_Y,
@@ -327,6 +331,8 @@ def train_and_eval(
             validation_Y=val_Y,
             aux_data=batch_stats,
             is_wandb=is_wandb,
+            augmentation=augmentation,
+            loader=loader,
         )
 
         if save_model is not None:
@@ -367,23 +373,35 @@ def train_and_eval(
     )
     print(f"Test Loss: {test_loss}")
 
-    key, subkey = random.split(key)
-    test_rollout_loss, rollout_multi_image = ml.map_plus_loss_in_batches(
-        partial(map_and_loss, future_steps=rollout_steps, return_map=True),
+    save_prefix = None
+    if images_dir is not None:
+        save_prefix = f"{images_dir}{model_name}_L{train_X.get_L()}_e{epochs}_rollout"
+
+    test_rollout_loss = ml.rollout_loss_in_batches(
         model,
         test_rollout_X,
         test_rollout_Y,
         batch_size,
-        subkey,
+        dict(test_rollout_X.get_signature())[(1, 0)],  # past_steps
+        rollout_steps,
         aux_data=batch_stats,
-    )
+        save_prefix=save_prefix,
+    )["smse"]
     print(f"Test Rollout Loss: {test_rollout_loss}, Sum: {jnp.sum(test_rollout_loss)}")
 
     if images_dir is not None:
+        # predictions were streamed to disk, only read the samples that are plotted
+        n_plot = min(batch_size, test_rollout_Y.get_L())
+        plot_Y = test_rollout_Y.get_subset(jnp.arange(n_plot))
+        rollout_multi_image = plot_Y.empty()
+        for k, parity in plot_Y.keys():
+            predictions = np.load(f"{save_prefix}_k{k}_p{parity}.npy", mmap_mode="r")
+            rollout_multi_image.append(k, parity, jnp.array(predictions[:n_plot]))
+
         components = ["density", "pressure", "velocity_x", "velocity_y"]
         plot_multi_image(
             rollout_multi_image.get_one(),
-            test_rollout_Y.get_one(),
+            plot_Y.get_one(),
             f"{images_dir}{model_name}_L{train_X.get_L()}_e{epochs}_rollout.png",
             future_steps=rollout_steps,
             component=plot_component,
@@ -391,7 +409,7 @@ def train_and_eval(
             title=f"{components[plot_component]}",
         )
         plot_timestep_power(
-            [rollout_multi_image, test_rollout_Y],
+            [rollout_multi_image, plot_Y],
             ["test", "actual"],
             f"{images_dir}{model_name}_L{train_X.get_L()}_e{epochs}_{components[plot_component]}_power_spectrum.png",
             future_steps=rollout_steps,
@@ -417,6 +435,25 @@ def handleArgs() -> argparse.Namespace:
         type=int,
         default=5,
     )
+    parser.add_argument(
+        "--augment",
+        help="augment the training batches with random group elements, for non-equivariant models",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--load_workers",
+        help="number of processes that assemble training batches, 0 assembles them in training. "
+        "The workers are started once and reused by every epoch",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--storage_dtype",
+        help="hold the train and validation trajectories on the host in this reduced precision",
+        type=str,
+        default=None,
+        choices=gc_data.COMPRESSED_DTYPES,
+    )
     # need do to --wandb to activate, also need --wandb-entity your_wandb_name_here
     parser.add_argument("--wandb-project", help="the wandb project", type=str, default="cfd-2d")
 
@@ -424,359 +461,366 @@ def handleArgs() -> argparse.Namespace:
 
 
 # Main
-args = handleArgs()
-
-D = 2
-N = 128
-
-past_steps = 4  # how many steps to look back to predict the next step
-key = random.PRNGKey(time.time_ns()) if (args.seed is None) else random.PRNGKey(args.seed)
-
-# an attempt to reduce recompilation, but I don't think it actually is working
-n_test = args.batch if args.n_test is None else args.n_test
-n_val = args.batch if args.n_val is None else args.n_val
-
-data = get_data(
-    D,
-    args.data,
-    args.n_train,
-    n_val,
-    n_test,
-    past_steps,
-    args.rollout_steps,
-    args.normalize,
-)
-input_keys = data[0].get_signature()
-output_keys = data[1].get_signature()  # (((0, 0), 2), ((1, 0), 1))
-
-group_actions = geom.make_all_operators(D)
-conv_filters = geom.get_invariant_filters(
-    Ms=[3], ks=[0, 1, 2], parities=[0, 1], D=D, operators=group_actions
-)
-upsample_filters = geom.get_invariant_filters(
-    Ms=[2], ks=[0, 1, 2], parities=[0, 1], D=D, operators=group_actions
-)
-assert conv_filters is not None
-assert upsample_filters is not None
-
-train_kwargs = {
-    "batch_size": args.batch,
-    "epochs": args.epochs,
-    "rollout_steps": args.rollout_steps,
-    "save_model": args.save_model,
-    "load_model": args.load_model,
-    "images_dir": args.images_dir,
-    "verbose": args.verbose,
-    "plot_component": args.plot_component,
-    "is_wandb": args.wandb,
-}
-
-key, *subkeys = random.split(key, num=13)
-model_list = [
-    (
-        "dil_resnet64",
-        train_and_eval,
-        {
-            "model": models.DilResNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=64,
-                equivariant=False,
-                kernel_size=3,
-                key=subkeys[0],
-            ),
-            "lr": 2e-3,
-            **train_kwargs,
-        },
-    ),
-    (
-        "dil_resnet_equiv20",
-        train_and_eval,
-        {
-            "model": models.DilResNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=20,
-                conv_filters=conv_filters,
-                key=subkeys[1],
-            ),
-            "lr": 1e-3,
-            **train_kwargs,
-        },
-    ),
-    (
-        "dil_resnet_equiv48",
-        train_and_eval,
-        {
-            "model": models.DilResNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=48,
-                conv_filters=conv_filters,
-                key=subkeys[2],
-            ),
-            "lr": 1e-3,
-            **train_kwargs,
-        },
-    ),
-    (
-        "resnet",
-        train_and_eval,
-        {
-            "model": models.ResNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=128,
-                equivariant=False,
-                kernel_size=3,
-                key=subkeys[3],
-            ),
-            "lr": 1e-3,
-            **train_kwargs,
-        },
-    ),
-    (
-        "resnet_equiv_groupnorm_42",
-        train_and_eval,
-        {
-            "model": models.ResNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=42,
-                conv_filters=conv_filters,
-                key=subkeys[4],
-            ),
-            "lr": 7e-4,
-            **train_kwargs,
-        },
-    ),
-    (
-        "resnet_equiv_groupnorm_100",
-        train_and_eval,
-        {
-            "model": models.ResNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=100,  # very slow at 100
-                conv_filters=conv_filters,
-                key=subkeys[5],
-            ),
-            "lr": 7e-4,
-            **train_kwargs,
-        },
-    ),
-    (
-        "unetBase",
-        train_and_eval,
-        {
-            "model": models.UNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=64,
-                use_bias=True,
-                activation_f=jax.nn.gelu,
-                equivariant=False,
-                kernel_size=3,
-                use_group_norm=True,
-                key=subkeys[6],
-            ),
-            "lr": 8e-4,
-            **train_kwargs,
-        },
-    ),
-    (
-        "unetBase_equiv20",
-        train_and_eval,
-        {
-            "model": models.UNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=20,
-                conv_filters=conv_filters,
-                upsample_filters=upsample_filters,
-                key=subkeys[7],
-            ),
-            "lr": 6e-4,  # 4e-4 to 6e-4 works, larger sometimes explodes
-            **train_kwargs,
-        },
-    ),
-    (
-        "unetBase_equiv48",
-        train_and_eval,
-        {
-            "model": models.UNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=48,
-                activation_f=jax.nn.gelu,
-                conv_filters=conv_filters,
-                upsample_filters=upsample_filters,
-                key=subkeys[8],
-            ),
-            "lr": 4e-4,  # 4e-4 to 6e-4 works, larger sometimes explodes
-            **train_kwargs,
-        },
-    ),
-    (
-        "unet2015",
-        train_and_eval,
-        {
-            "model": models.UNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=64,
-                use_bias=False,
-                equivariant=False,
-                kernel_size=3,
-                use_batch_norm=True,
-                key=subkeys[9],
-            ),
-            "lr": 8e-4,
-            "has_aux": True,
-            **train_kwargs,
-        },
-    ),
-    (
-        "unet2015_equiv20",
-        train_and_eval,
-        {
-            "model": models.UNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=20,
-                use_bias=False,
-                conv_filters=conv_filters,
-                upsample_filters=upsample_filters,
-                key=subkeys[10],
-            ),
-            "lr": 7e-4,  # sometimes explodes for larger values
-            **train_kwargs,
-        },
-    ),
-    (
-        "unet2015_equiv48",
-        train_and_eval,
-        {
-            "model": models.UNet(
-                D,
-                input_keys,
-                output_keys,
-                depth=48,
-                use_bias=False,
-                conv_filters=conv_filters,
-                upsample_filters=upsample_filters,
-                key=subkeys[11],
-            ),
-            "lr": 3e-4,
-            **train_kwargs,
-        },
-    ),
-]
-
-key, subkey = random.split(key)
-
-# Use this for benchmarking the models with known learning rates.
-results = ml.benchmark(
-    lambda _: data,
-    model_list,
-    subkey,
-    "",
-    [0],
-    benchmark_type=ml.BENCHMARK_NONE,
-    num_trials=args.n_trials,
-    num_results=3 + args.rollout_steps,
-    is_wandb=args.wandb,
-    wandb_project=args.wandb_project,
-    wandb_entity=args.wandb_entity,
-)
-
-rollout_res = results[..., 3:]
-non_rollout_res = jnp.concatenate(
-    [results[..., :3], jnp.sum(rollout_res, axis=-1, keepdims=True)], axis=-1
-)
-print(non_rollout_res)
-mean_results = jnp.mean(
-    non_rollout_res, axis=0
-)  # includes the sum of rollout. (benchmark_vals,models,outputs)
-std_results = jnp.std(non_rollout_res, axis=0)
-print("Mean", mean_results, sep="\n")
-
-plot_mapping = {
-    "dil_resnet64": ("DilResNet64", "blue", "o", "dashed"),
-    "dil_resnet_equiv20": ("DilResNet20 (E)", "blue", "o", "dotted"),
-    "dil_resnet_equiv48": ("DilResNet48 (E)", "blue", "o", "solid"),
-    "resnet": ("ResNet128", "red", "s", "dashed"),
-    "resnet_equiv_groupnorm_42": ("ResNet42 (E)", "red", "s", "dotted"),
-    "resnet_equiv_groupnorm_100": ("ResNet100 (E)", "red", "s", "solid"),
-    "unetBase": ("UNet64 Norm", "green", "P", "dashed"),
-    "unetBase_equiv20": ("UNet20 Norm (E)", "green", "P", "dotted"),
-    "unetBase_equiv48": ("UNet48 Norm (E)", "green", "P", "solid"),
-    "unet2015": ("UNet64", "orange", "*", "dashed"),
-    "unet2015_equiv20": ("Unet20 (E)", "orange", "*", "dotted"),
-    "unet2015_equiv48": ("Unet48 (E)", "orange", "*", "solid"),
-}
-
-# print table
-output_types = ["train", "val", "test", f"rollout ({args.rollout_steps} steps)"]
-print("model ", end="")
-for output_type in output_types:
-    print(f"& {output_type} ", end="")
-
-print("\\\\")
-print("\\hline")
-
-for i in range(len(model_list) // 2):
-    for l in range(2):  # models come in a baseline and equiv pair
-        idx = 2 * i + l
-        print(f"{plot_mapping[model_list[idx][0]][0]} ", end="")
-
-        for j, result_type in enumerate(output_types):
-            if jnp.trunc(std_results[0, idx, j] * 1000) / 1000 > 0:
-                stdev = f"$\\pm$ {std_results[0,idx,j]:.3f}"
-            else:
-                stdev = ""
-
-            if jnp.allclose(
-                mean_results[0, idx, j],
-                min(float(mean_results[0, 2 * i, j]), float(mean_results[0, 2 * i + 1, j])),
-            ):
-                print(f'& \\textbf{"{"}{mean_results[0,idx,j]:.3f} {stdev}{"}"}', end="")
-            else:
-                print(f"& {mean_results[0,idx,j]:.3f} {stdev} ", end="")
-
-        print("\\\\")
+if __name__ == "__main__":
+    args = handleArgs()
+
+    D = 2
+    N = 128
+
+    past_steps = 4  # how many steps to look back to predict the next step
+    key = random.PRNGKey(time.time_ns()) if (args.seed is None) else random.PRNGKey(args.seed)
+
+    # an attempt to reduce recompilation, but I don't think it actually is working
+    n_test = args.batch if args.n_test is None else args.n_test
+    n_val = args.batch if args.n_val is None else args.n_val
+
+    data = get_data(
+        D,
+        args.data,
+        args.n_train,
+        n_val,
+        n_test,
+        past_steps,
+        args.rollout_steps,
+        args.normalize,
+        args.storage_dtype,
+    )
+    input_keys = data[0].get_signature()
+    output_keys = data[1].get_signature()  # (((0, 0), 2), ((1, 0), 1))
+
+    group_actions = geom.make_all_operators(D)
+    conv_filters = geom.get_invariant_filters(
+        Ms=[3], ks=[0, 1, 2], parities=[0, 1], D=D, operators=group_actions
+    )
+    upsample_filters = geom.get_invariant_filters(
+        Ms=[2], ks=[0, 1, 2], parities=[0, 1], D=D, operators=group_actions
+    )
+    assert conv_filters is not None
+    assert upsample_filters is not None
+
+    train_kwargs = {
+        "batch_size": args.batch,
+        "epochs": args.epochs,
+        "rollout_steps": args.rollout_steps,
+        "save_model": args.save_model,
+        "load_model": args.load_model,
+        "images_dir": args.images_dir,
+        "verbose": args.verbose,
+        "plot_component": args.plot_component,
+        "is_wandb": args.wandb,
+        "device_budget": args.device_budget,
+        "augmentation": (
+            gc_data.GroupAugmentation(D, (N, N), group_actions) if args.augment else None
+        ),
+        "loader": gc_data.WorkerLoader(args.load_workers) if args.load_workers > 0 else None,
+    }
+
+    key, *subkeys = random.split(key, num=13)
+    model_list = [
+        (
+            "dil_resnet64",
+            train_and_eval,
+            {
+                "model": models.DilResNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=64,
+                    equivariant=False,
+                    kernel_size=3,
+                    key=subkeys[0],
+                ),
+                "lr": 2e-3,
+                **train_kwargs,
+            },
+        ),
+        (
+            "dil_resnet_equiv20",
+            train_and_eval,
+            {
+                "model": models.DilResNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=20,
+                    conv_filters=conv_filters,
+                    key=subkeys[1],
+                ),
+                "lr": 1e-3,
+                **train_kwargs,
+            },
+        ),
+        (
+            "dil_resnet_equiv48",
+            train_and_eval,
+            {
+                "model": models.DilResNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=48,
+                    conv_filters=conv_filters,
+                    key=subkeys[2],
+                ),
+                "lr": 1e-3,
+                **train_kwargs,
+            },
+        ),
+        (
+            "resnet",
+            train_and_eval,
+            {
+                "model": models.ResNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=128,
+                    equivariant=False,
+                    kernel_size=3,
+                    key=subkeys[3],
+                ),
+                "lr": 1e-3,
+                **train_kwargs,
+            },
+        ),
+        (
+            "resnet_equiv_groupnorm_42",
+            train_and_eval,
+            {
+                "model": models.ResNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=42,
+                    conv_filters=conv_filters,
+                    key=subkeys[4],
+                ),
+                "lr": 7e-4,
+                **train_kwargs,
+            },
+        ),
+        (
+            "resnet_equiv_groupnorm_100",
+            train_and_eval,
+            {
+                "model": models.ResNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=100,  # very slow at 100
+                    conv_filters=conv_filters,
+                    key=subkeys[5],
+                ),
+                "lr": 7e-4,
+                **train_kwargs,
+            },
+        ),
+        (
+            "unetBase",
+            train_and_eval,
+            {
+                "model": models.UNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=64,
+                    use_bias=True,
+                    activation_f=jax.nn.gelu,
+                    equivariant=False,
+                    kernel_size=3,
+                    use_group_norm=True,
+                    key=subkeys[6],
+                ),
+                "lr": 8e-4,
+                **train_kwargs,
+            },
+        ),
+        (
+            "unetBase_equiv20",
+            train_and_eval,
+            {
+                "model": models.UNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=20,
+                    conv_filters=conv_filters,
+                    upsample_filters=upsample_filters,
+                    key=subkeys[7],
+                ),
+                "lr": 6e-4,  # 4e-4 to 6e-4 works, larger sometimes explodes
+                **train_kwargs,
+            },
+        ),
+        (
+            "unetBase_equiv48",
+            train_and_eval,
+            {
+                "model": models.UNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=48,
+                    activation_f=jax.nn.gelu,
+                    conv_filters=conv_filters,
+                    upsample_filters=upsample_filters,
+                    key=subkeys[8],
+                ),
+                "lr": 4e-4,  # 4e-4 to 6e-4 works, larger sometimes explodes
+                **train_kwargs,
+            },
+        ),
+        (
+            "unet2015",
+            train_and_eval,
+            {
+                "model": models.UNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=64,
+                    use_bias=False,
+                    equivariant=False,
+                    kernel_size=3,
+                    use_batch_norm=True,
+                    key=subkeys[9],
+                ),
+                "lr": 8e-4,
+                "has_aux": True,
+                **train_kwargs,
+            },
+        ),
+        (
+            "unet2015_equiv20",
+            train_and_eval,
+            {
+                "model": models.UNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=20,
+                    use_bias=False,
+                    conv_filters=conv_filters,
+                    upsample_filters=upsample_filters,
+                    key=subkeys[10],
+                ),
+                "lr": 7e-4,  # sometimes explodes for larger values
+                **train_kwargs,
+            },
+        ),
+        (
+            "unet2015_equiv48",
+            train_and_eval,
+            {
+                "model": models.UNet(
+                    D,
+                    input_keys,
+                    output_keys,
+                    depth=48,
+                    use_bias=False,
+                    conv_filters=conv_filters,
+                    upsample_filters=upsample_filters,
+                    key=subkeys[11],
+                ),
+                "lr": 3e-4,
+                **train_kwargs,
+            },
+        ),
+    ]
+
+    key, subkey = random.split(key)
 
+    # Use this for benchmarking the models with known learning rates.
+    results = ml.benchmark(
+        lambda _: data,
+        model_list,
+        subkey,
+        "",
+        [0],
+        benchmark_type=ml.BENCHMARK_NONE,
+        num_trials=args.n_trials,
+        num_results=3 + args.rollout_steps,
+        is_wandb=args.wandb,
+        wandb_project=args.wandb_project,
+        wandb_entity=args.wandb_entity,
+    )
+
+    rollout_res = results[..., 3:]
+    non_rollout_res = jnp.concatenate(
+        [results[..., :3], jnp.sum(rollout_res, axis=-1, keepdims=True)], axis=-1
+    )
+    print(non_rollout_res)
+    mean_results = jnp.mean(
+        non_rollout_res, axis=0
+    )  # includes the sum of rollout. (benchmark_vals,models,outputs)
+    std_results = jnp.std(non_rollout_res, axis=0)
+    print("Mean", mean_results, sep="\n")
+
+    plot_mapping = {
+        "dil_resnet64": ("DilResNet64", "blue", "o", "dashed"),
+        "dil_resnet_equiv20": ("DilResNet20 (E)", "blue", "o", "dotted"),
+        "dil_resnet_equiv48": ("DilResNet48 (E)", "blue", "o", "solid"),
+        "resnet": ("ResNet128", "red", "s", "dashed"),
+        "resnet_equiv_groupnorm_42": ("ResNet42 (E)", "red", "s", "dotted"),
+        "resnet_equiv_groupnorm_100": ("ResNet100 (E)", "red", "s", "solid"),
+        "unetBase": ("UNet64 Norm", "green", "P", "dashed"),
+        "unetBase_equiv20": ("UNet20 Norm (E)", "green", "P", "dotted"),
+        "unetBase_equiv48": ("UNet48 Norm (E)", "green", "P", "solid"),
+        "unet2015": ("UNet64", "orange", "*", "dashed"),
+        "unet2015_equiv20": ("Unet20 (E)", "orange", "*", "dotted"),
+        "unet2015_equiv48": ("Unet48 (E)", "orange", "*", "solid"),
+    }
+
+    # print table
+    output_types = ["train", "val", "test", f"rollout ({args.rollout_steps} steps)"]
+    print("model ", end="")
+    for output_type in output_types:
+        print(f"& {output_type} ", end="")
+
+    print("\\\\")
     print("\\hline")
 
-print("\n")
-
-if args.images_dir:
-    for i, (model_name, _) in enumerate(model_list):
-        label, color, marker, linestyle = plot_mapping[model_name]
-        plt.plot(
-            jnp.arange(1, 1 + args.rollout_steps),
-            jnp.mean(rollout_res, axis=0)[0, i],
-            label=label,
-            marker=marker,
-            linestyle=linestyle,
-            color=color,
-        )
+    for i in range(len(model_list) // 2):
+        for l in range(2):  # models come in a baseline and equiv pair
+            idx = 2 * i + l
+            print(f"{plot_mapping[model_list[idx][0]][0]} ", end="")
+
+            for j, result_type in enumerate(output_types):
+                if jnp.trunc(std_results[0, idx, j] * 1000) / 1000 > 0:
+                    stdev = f"$\\pm$ {std_results[0,idx,j]:.3f}"
+                else:
+                    stdev = ""
+
+                if jnp.allclose(
+                    mean_results[0, idx, j],
+                    min(float(mean_results[0, 2 * i, j]), float(mean_results[0, 2 * i + 1, j])),
+                ):
+                    print(f'& \\textbf{"{"}{mean_results[0,idx,j]:.3f} {stdev}{"}"}', end="")
+                else:
+                    print(f"& {mean_results[0,idx,j]:.3f} {stdev} ", end="")
+
+            print("\\\\")
+
+        print("\\hline")
+
+    print("\n")
+
+    if args.images_dir:
+        for i, (model_name, _) in enumerate(model_list):
+            label, color, marker, linestyle = plot_mapping[model_name]
+            plt.plot(
+                jnp.arange(1, 1 + args.rollout_steps),
+                jnp.mean(rollout_res, axis=0)[0, i],
+                label=label,
+                marker=marker,
+                linestyle=linestyle,
+                color=color,
+            )
 
-    plt.legend()
-    plt.title(f"MSE vs. Rollout Step, Mean of {args.n_trials} Trials")
-    plt.xlabel("Rollout Step")
-    plt.ylabel("SMSE")
-    plt.yscale("log")
-    plt.savefig(f"{args.images_dir}/rollout_loss_plot.png")
-    plt.close()
+        plt.legend()
+        plt.title(f"MSE vs. Rollout Step, Mean of {args.n_trials} Trials")
+        plt.xlabel("Rollout Step")
+        plt.ylabel("SMSE")
+        plt.yscale("log")
+        plt.savefig(f"{args.images_dir}/rollout_loss_plot.png")
+        plt.close()
@@ -6,7 +6,6 @@ import time
 import matplotlib.pyplot as plt
 from typing_extensions import Optional, Self
 
-import jax.numpy as jnp
 import jax.random as random
 import jax
 from jax.typing import ArrayLike
@@ -16,56 +15,23 @@ import equinox as eqx
 import ginjax.geometric as geom
 import ginjax.ml as ml
 import ginjax.models as models
+import ginjax.physics as physics
 
 # Generate data for the gravity problem
 
 
-def get_gravity_field(
-    N: int, D: int, point_position: jax.Array, point_mass: jax.Array
-) -> jax.Array:
-    # (N,)*D + (D,)
-    positions = jnp.stack(jnp.meshgrid(*(jnp.arange(N),) * D, indexing="ij"), axis=-1)
-    r_vec = point_position.reshape((1,) * D + (D,)) - positions
-    r_squared = jnp.linalg.norm(r_vec, axis=-1, keepdims=True) ** 3
-    # at the pixel where the planet is, set it to 0 rather than dividing by 0
-    gravity_field = jnp.where(
-        r_squared == 0, jnp.zeros_like(r_squared), (point_mass / r_squared) * r_vec
-    )
-    assert isinstance(gravity_field, jax.Array)
-    return gravity_field
-
-
-def get_mass_gravity_fields(
-    N: int, D: int, planets: jax.Array, rand_key: ArrayLike
-) -> tuple[geom.MultiImage, geom.MultiImage]:
-    # Sample uniformly the cells
-    indices = jnp.stack(jnp.meshgrid(*(jnp.arange(N),) * D, indexing="ij"), axis=-1)
-    location_choices = random.choice(
-        rand_key, indices.reshape((-1, D)), shape=(num_points,), replace=False, axis=0
-    )
-
-    vmap_gravity_field = jax.vmap(get_gravity_field, in_axes=(None, None, 0, 0))
-    gravity_field = jnp.sum(vmap_gravity_field(N, D, location_choices, planets), axis=0)
-
-    # likely a nice jax way of doing this, but this works
-    point_mass = jnp.zeros((N,) * D)
-    for (x, y), mass in zip(location_choices, planets):
-        point_mass = point_mass.at[x, y].set(mass)
-
-    masses_images = geom.MultiImage({(0, 0): point_mass[None]}, D, is_torus=False)
-    gravity_field_images = geom.MultiImage({(1, 0): gravity_field[None]}, D, is_torus=False)
-    return masses_images, gravity_field_images
-
-
 def get_data(
-    N: int, D: int, num_points: int, rand_key: ArrayLike, num_images: int = 1
+    N: int,
+    D: int,
+    num_points: int,
+    rand_key: ArrayLike,
+    num_images: int = 1,
+    force_law: str = "inverse_square",
 ) -> tuple[geom.MultiImage, geom.MultiImage]:
-    rand_key, subkey = random.split(rand_key)
-    planets = random.uniform(subkey, shape=(num_images, num_points))
-    planets = planets / jnp.max(planets, axis=1, keepdims=True)
-
-    return jax.vmap(get_mass_gravity_fields, in_axes=(None, None, 0, 0))(
-        N, D, planets, random.split(rand_key, num=num_images)
+    # point masses with isolated boundaries, the gravitational field is found with an FFT
+    # convolution. The benchmark uses the inverse square law, poisson is the 2D law of 1/r.
+    return physics.get_gravity_data(
+        rand_key, (N,) * D, num_points, num_images, is_torus=False, force_law=force_law
     )
 
 
@@ -182,6 +148,13 @@ def handleArgs(argv):
         type=int,
         default=1,
     )
+    parser.add_argument(
+        "--force_law",
+        help="force law of the point masses, the benchmark is inverse_square",
+        type=str,
+        choices=physics.FORCE_LAWS,
+        default="inverse_square",
+    )
     return parser.parse_args()
 
 
@@ -198,13 +171,13 @@ num_val_images = 6
 key = random.PRNGKey(args.seed if args.seed else time.time_ns())
 
 key, subkey = random.split(key)
-validation_X, validation_Y = get_data(N, D, num_points, subkey, num_val_images)
+validation_X, validation_Y = get_data(N, D, num_points, subkey, num_val_images, args.force_law)
 
 key, subkey = random.split(key)
-test_X, test_Y = get_data(N, D, num_points, subkey, num_test_images)
+test_X, test_Y = get_data(N, D, num_points, subkey, num_test_images, args.force_law)
 
 key, subkey = random.split(key)
-train_X, train_Y = get_data(N, D, num_points, subkey, num_train_images)
+train_X, train_Y = get_data(N, D, num_points, subkey, num_train_images, args.force_law)
 
 # start with basic 3x3 scalar, vector, and 2nd order tensor images
 group_actions = geom.make_all_operators(D)
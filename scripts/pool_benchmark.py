@@ -0,0 +1,73 @@
+# Benchmark the max norm and average pooling of batched MultiImages in 2D and 3D
+import sys
+import time
+import argparse
+
+import jax
+import jax.numpy as jnp
+import jax.random as random
+
+import ginjax.geometric as geom
+import ginjax.ml as ml
+
+
+def time_f(f, x: geom.MultiImage, trials: int) -> float:
+    """
+    Time a jitted function after compiling it.
+
+    args:
+        f: the function of a MultiImage
+        x: the input
+        trials: timed repetitions
+
+    returns:
+        the time per call
+    """
+    f = jax.jit(f)
+    jax.block_until_ready(f(x))
+    start = time.time()
+    for _ in range(trials):
+        jax.block_until_ready(f(x))
+
+    return (time.time() - start) / trials
+
+
+def handleArgs(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-D", help="dimensions to benchmark", type=int, nargs="+", default=[2, 3])
+    parser.add_argument("-N2", help="spatial side length in 2D", type=int, default=128)
+    parser.add_argument("-N3", help="spatial side length in 3D", type=int, default=32)
+    parser.add_argument("-batch", help="batch size", type=int, default=8)
+    parser.add_argument("-channels", help="channels of each type", type=int, default=16)
+    parser.add_argument("-patch_len", help="side length of the patches", type=int, default=2)
+    parser.add_argument("-trials", help="timed repetitions", type=int, default=10)
+    parser.add_argument("-seed", help="the random number seed", type=int, default=0)
+    return parser.parse_args()
+
+
+# Main
+args = handleArgs(sys.argv)
+key = random.PRNGKey(args.seed)
+
+pools = {
+    "MaxNormPool": ml.MaxNormPool(args.patch_len),
+    "average_pool": lambda x: x.average_pool(args.patch_len),
+}
+for D in args.D:
+    N = args.N2 if D == 2 else args.N3
+    x = geom.MultiImage({}, D)
+    for k in [0, 1, 2]:
+        key, subkey = random.split(key)
+        x.append(k, 0, random.normal(subkey, (args.batch, args.channels) + (N,) * D + (D,) * k))
+
+    for name, pool in pools.items():
+        forward_time = time_f(pool, x, args.trials)
+        backward_time = time_f(
+            jax.grad(lambda x: sum(jnp.sum(block**2) for block in pool(x).values())),
+            x,
+            args.trials,
+        )
+        print(
+            f"D={D} N={N} {name}: forward {forward_time:.5f}s, "
+            f"forward+backward {backward_time:.5f}s"
+        )
@@ -0,0 +1,182 @@
+# Benchmark the equivariance error, the error relative to float32, and the speed of the models
+# under each mixed precision policy
+import sys
+import time
+import argparse
+
+import jax
+import jax.numpy as jnp
+import jax.random as random
+import equinox as eqx
+
+import ginjax.geometric as geom
+import ginjax.ml as ml
+import ginjax.models as models
+
+
+def get_model(
+    model_name: str,
+    D: int,
+    input_keys: geom.Signature,
+    output_keys: geom.Signature,
+    depth: int,
+    policy: ml.Policy,
+    key: jax.Array,
+) -> models.MultiImageModule:
+    """
+    Construct one of the equivariant models with a policy. The same key gives the same float32
+    parameters for every policy, so the outputs are comparable.
+
+    args:
+        model_name: one of unet, dil_resnet, resnet
+        D: the dimension of the space
+        input_keys: the input signature
+        output_keys: the output signature
+        depth: the depth of the model
+        policy: the mixed precision policy
+        key: jax.random key
+
+    returns:
+        the model
+    """
+    operators = geom.make_all_operators(D)
+    conv_filters = geom.get_invariant_filters([3], [0, 1, 2], [0, 1], D, operators)
+    if model_name == "unet":
+        upsample_filters = geom.get_invariant_filters([2], [0, 1, 2], [0, 1], D, operators)
+        return models.UNet(
+            D,
+            input_keys,
+            output_keys,
+            depth,
+            num_downsamples=2,
+            conv_filters=conv_filters,
+            upsample_filters=upsample_filters,
+            use_group_norm=True,
+            key=key,
+            policy=policy,
+        )
+    elif model_name == "dil_resnet":
+        return models.DilResNet(
+            D,
+            input_keys,
+            output_keys,
+            depth,
+            num_blocks=1,
+            conv_filters=conv_filters,
+            use_group_norm=True,
+            key=key,
+            policy=policy,
+        )
+    else:
+        return models.ResNet(
+            D,
+            input_keys,
+            output_keys,
+            depth,
+            num_blocks=2,
+            conv_filters=conv_filters,
+            key=key,
+            policy=policy,
+        )
+
+
+def relative_error(a: geom.MultiImage, b: geom.MultiImage) -> float:
+    """
+    The largest absolute difference between a and b, relative to the largest value of b.
+
+    args:
+        a: a MultiImage
+        b: the reference MultiImage
+
+    returns:
+        the relative error
+    """
+    return float(
+        jnp.max(jnp.abs(a.to_vector().astype(jnp.float32) - b.to_vector()))
+        / jnp.max(jnp.abs(b.to_vector()))
+    )
+
+
+def handleArgs(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--models",
+        help="the models to benchmark",
+        type=str,
+        nargs="+",
+        choices=["unet", "dil_resnet", "resnet"],
+        default=["unet", "dil_resnet", "resnet"],
+    )
+    parser.add_argument("-N", help="spatial side length", type=int, default=32)
+    parser.add_argument("-depth", help="depth of the models", type=int, default=8)
+    parser.add_argument("-batch", help="batch size", type=int, default=4)
+    parser.add_argument("-trials", help="timed repetitions", type=int, default=5)
+    parser.add_argument("-seed", help="the random number seed", type=int, default=0)
+    return parser.parse_args()
+
+
+# Main
+args = handleArgs(sys.argv)
+
+D = 2
+key = random.PRNGKey(args.seed)
+operators = geom.make_all_operators(D)
+
+key, subkey1, subkey2 = random.split(key, num=3)
+x = geom.MultiImage(
+    {
+        (0, 0): random.normal(subkey1, shape=(args.batch, 2) + (args.N,) * D),
+        (1, 0): random.normal(subkey2, shape=(args.batch, 1) + (args.N,) * D + (D,)),
+    },
+    D,
+)
+output_keys = geom.Signature((((0, 0), 1), ((1, 0), 1)))
+
+
+@eqx.filter_jit
+def forward(model: models.MultiImageModule, x: geom.MultiImage) -> geom.MultiImage:
+    return jax.vmap(lambda one_x: model(one_x)[0])(x)
+
+
+@eqx.filter_jit
+def forward_backward(model: models.MultiImageModule, x: geom.MultiImage) -> jax.Array:
+    return eqx.filter_grad(lambda m: jnp.sum(forward(m, x).to_vector() ** 2))(model)
+
+
+for model_name in args.models:
+    key, subkey = random.split(key)
+    reference = None
+    for policy_name in ml.POLICY_NAMES:
+        model = get_model(
+            model_name,
+            D,
+            x.get_signature(),
+            output_keys,
+            args.depth,
+            ml.Policy.from_name(policy_name),
+            subkey,
+        )
+        out = forward(model, x)
+        if reference is None:
+            reference = out
+
+        # max over the group of |f(gx) - gf(x)| / max|gf(x)|
+        equivariance_error = max(
+            relative_error(
+                forward(model, x.times_group_element(gg)),
+                out.times_group_element(gg, jax.lax.Precision.HIGHEST),
+            )
+            for gg in operators
+        )
+
+        jax.block_until_ready(forward_backward(model, x))  # compile
+        start = time.time()
+        for _ in range(args.trials):
+            jax.block_until_ready(forward_backward(model, x))
+        step_time = (time.time() - start) / args.trials
+
+        print(
+            f"{model_name} {policy_name}: equivariance err {equivariance_error:.3e}, "
+            f"err vs float32 {relative_error(out, reference):.3e}, "
+            f"forward+backward {step_time:.4f}s"
+        )
@@ -0,0 +1,156 @@
+# Benchmark the memory/time trade-off of the rematerialization policies of the models
+import sys
+import time
+import argparse
+
+import jax
+import jax.numpy as jnp
+import jax.random as random
+import equinox as eqx
+
+import ginjax.geometric as geom
+import ginjax.ml as ml
+import ginjax.models as models
+
+
+def get_model(
+    model_name: str,
+    D: int,
+    input_keys: geom.Signature,
+    output_keys: geom.Signature,
+    depth: int,
+    remat: str,
+    remat_every: int,
+    key: jax.Array,
+) -> models.MultiImageModule:
+    """
+    Construct one of the equivariant models with a remat policy. The same key gives the same
+    parameters for every policy.
+
+    args:
+        model_name: one of unet, dil_resnet, resnet
+        D: the dimension of the space
+        input_keys: the input signature
+        output_keys: the output signature
+        depth: the depth of the model
+        remat: the remat policy, one of models.REMAT_POLICIES
+        remat_every: number of blocks per checkpointed segment for models.REMAT_EVERY_N
+        key: jax.random key
+
+    returns:
+        the model
+    """
+    operators = geom.make_all_operators(D)
+    conv_filters = geom.get_invariant_filters([3], [0, 1, 2], [0, 1], D, operators)
+    remat_kwargs = {"remat": remat, "remat_every": remat_every}
+    if model_name == "unet":
+        upsample_filters = geom.get_invariant_filters([2], [0, 1, 2], [0, 1], D, operators)
+        return models.UNet(
+            D,
+            input_keys,
+            output_keys,
+            depth,
+            num_downsamples=2,
+            num_conv=4,
+            conv_filters=conv_filters,
+            upsample_filters=upsample_filters,
+            use_group_norm=True,
+            key=key,
+            **remat_kwargs,
+        )
+    elif model_name == "dil_resnet":
+        return models.DilResNet(
+            D,
+            input_keys,
+            output_keys,
+            depth,
+            num_blocks=4,
+            conv_filters=conv_filters,
+            use_group_norm=True,
+            key=key,
+            **remat_kwargs,
+        )
+    else:
+        return models.ResNet(
+            D,
+            input_keys,
+            output_keys,
+            depth,
+            num_blocks=8,
+            conv_filters=conv_filters,
+            key=key,
+            **remat_kwargs,
+        )
+
+
+def handleArgs(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--models",
+        help="the models to benchmark",
+        type=str,
+        nargs="+",
+        choices=["unet", "dil_resnet", "resnet"],
+        default=["unet", "dil_resnet", "resnet"],
+    )
+    parser.add_argument("-N", help="spatial side length", type=int, default=32)
+    parser.add_argument("-depth", help="depth of the models", type=int, default=8)
+    parser.add_argument("-batch", help="batch size", type=int, default=4)
+    parser.add_argument("-remat_every", help="blocks per segment for every_n", type=int, default=2)
+    parser.add_argument("-trials", help="timed repetitions", type=int, default=5)
+    parser.add_argument("-seed", help="the random number seed", type=int, default=0)
+    return parser.parse_args()
+
+
+# Main
+args = handleArgs(sys.argv)
+
+D = 2
+key = random.PRNGKey(args.seed)
+
+key, subkey1, subkey2 = random.split(key, num=3)
+x = geom.MultiImage(
+    {
+        (0, 0): random.normal(subkey1, shape=(args.batch, 2) + (args.N,) * D),
+        (1, 0): random.normal(subkey2, shape=(args.batch, 1) + (args.N,) * D + (D,)),
+    },
+    D,
+)
+output_keys = geom.Signature((((0, 0), 1), ((1, 0), 1)))
+
+
+def loss(params: models.MultiImageModule, static: models.MultiImageModule) -> jax.Array:
+    model = eqx.combine(params, static)
+    return jnp.sum(jax.vmap(lambda one_x: model(one_x)[0])(x).to_vector() ** 2)
+
+
+for model_name in args.models:
+    key, subkey = random.split(key)
+    for remat in models.REMAT_POLICIES:
+        model = get_model(
+            model_name,
+            D,
+            x.get_signature(),
+            output_keys,
+            args.depth,
+            remat,
+            args.remat_every,
+            subkey,
+        )
+        params, static = eqx.partition(model, eqx.is_array)
+        # jax.jit rather than eqx.filter_jit so the compiled step has a memory analysis
+        step = jax.jit(jax.grad(lambda params: loss(params, static)))
+        compiled = step.lower(params).compile()
+        memory = compiled.memory_analysis()
+        temp_bytes = memory.temp_size_in_bytes if memory is not None else float("nan")
+
+        jax.block_until_ready(compiled(params))
+        start = time.time()
+        for _ in range(args.trials):
+            jax.block_until_ready(compiled(params))
+        step_time = (time.time() - start) / args.trials
+
+        print(
+            f"{model_name} {remat}: temp memory {temp_bytes / 2**20:.1f} MiB, "
+            f"forward+backward {step_time:.4f}s"
+        )
@@ -0,0 +1,116 @@
+# Benchmark the FLOPs and time of SeparableConvContract against ConvContract, both at the same
+# number of channels and at matched parameter counts
+import sys
+import time
+import argparse
+
+import jax
+import jax.random as random
+import equinox as eqx
+
+import ginjax.geometric as geom
+import ginjax.ml as ml
+import ginjax.models as models
+
+
+def get_signature(depth: int) -> geom.Signature:
+    """
+    A signature of scalars and vectors with depth channels each.
+
+    args:
+        depth: the number of channels of each type
+
+    returns:
+        the signature
+    """
+    return geom.Signature((((0, 0), depth), ((1, 0), depth)))
+
+
+def benchmark(layer: eqx.Module, x: geom.MultiImage, trials: int) -> tuple[float, float]:
+    """
+    Get the FLOPs from the compiled cost analysis and the time of a batched forward pass.
+
+    args:
+        layer: the layer
+        x: the batched input
+        trials: timed repetitions
+
+    returns:
+        the FLOPs and the time per forward pass
+    """
+    params, static = eqx.partition(layer, eqx.is_array)
+
+    def forward(params: eqx.Module, x: geom.MultiImage) -> geom.MultiImage:
+        return jax.vmap(eqx.combine(params, static))(x)
+
+    compiled = jax.jit(forward).lower(params, x).compile()
+    cost = compiled.cost_analysis()
+    cost = cost[0] if isinstance(cost, list) else cost
+    flops = cost.get("flops", float("nan")) if cost is not None else float("nan")
+
+    jax.block_until_ready(compiled(params, x))
+    start = time.time()
+    for _ in range(trials):
+        jax.block_until_ready(compiled(params, x))
+
+    return flops, (time.time() - start) / trials
+
+
+def handleArgs(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-D", help="dimensions to benchmark", type=int, nargs="+", default=[2, 3])
+    parser.add_argument("-N2", help="spatial side length in 2D", type=int, default=64)
+    parser.add_argument("-N3", help="spatial side length in 3D", type=int, default=16)
+    parser.add_argument("-depth", help="channels per type of ConvContract", type=int, default=32)
+    parser.add_argument("-batch", help="batch size", type=int, default=4)
+    parser.add_argument("-trials", help="timed repetitions", type=int, default=10)
+    parser.add_argument("-seed", help="the random number seed", type=int, default=0)
+    return parser.parse_args()
+
+
+# Main
+args = handleArgs(sys.argv)
+key = random.PRNGKey(args.seed)
+
+for D in args.D:
+    N = args.N2 if D == 2 else args.N3
+    operators = geom.make_all_operators(D)
+    conv_filters = geom.get_invariant_filters([3], [0, 1, 2], [0, 1], D, operators)
+    pointwise_filters = geom.get_invariant_filters([1], [0, 1, 2], [0, 1], D, operators)
+
+    def make_separable(depth: int, key: jax.Array) -> ml.SeparableConvContract:
+        return ml.SeparableConvContract(
+            get_signature(depth), get_signature(depth), conv_filters, pointwise_filters, key=key
+        )
+
+    key, subkey = random.split(key)
+    dense = ml.ConvContract(
+        get_signature(args.depth), get_signature(args.depth), conv_filters, key=subkey
+    )
+    dense_params = models.count_params(dense)
+
+    # the smallest separable depth with at least as many parameters as the dense layer
+    matched_depth = args.depth
+    while models.count_params(make_separable(matched_depth, subkey)) < dense_params:
+        matched_depth += 1
+
+    layers = {
+        f"ConvContract depth {args.depth}": dense,
+        f"SeparableConvContract depth {args.depth}": make_separable(args.depth, subkey),
+        f"SeparableConvContract depth {matched_depth}": make_separable(matched_depth, subkey),
+    }
+    for name, layer in layers.items():
+        depth = layer.input_keys[0][1]
+        key, subkey1, subkey2 = random.split(key, num=3)
+        x = geom.MultiImage(
+            {
+                (0, 0): random.normal(subkey1, shape=(args.batch, depth) + (N,) * D),
+                (1, 0): random.normal(subkey2, shape=(args.batch, depth) + (N,) * D + (D,)),
+            },
+            D,
+        )
+        flops, forward_time = benchmark(layer, x, args.trials)
+        print(
+            f"D={D} N={N} {name}: {models.count_params(layer)} params, {flops / 1e9:.3f} GFLOPs, "
+            f"forward {forward_time:.4f}s"
+        )
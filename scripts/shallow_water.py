@@ -1,10 +1,15 @@
 import os
+import glob
+import shutil
 import time
+import itertools
 import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from functools import partial
 import xarray as xr
-from typing_extensions import Optional, Union
+from typing_extensions import Callable, Optional, Union
 
 import jax.numpy as jnp
 import jax
@@ -18,6 +23,7 @@ import ginjax.ml as ml
 import ginjax.data as gc_data
 import ginjax.models as models
 import ginjax.utils as utils
+import ginjax.stats as ginjax_stats
 
 
 def read_orography(
@@ -43,144 +49,200 @@ def read_orography(
     orography = xr.open_mfdataset(root_dir + "/" + file)
     # loads as (96,192), swap to (192,96)
     orography_arr = jax.device_put(jnp.array(orography["orog"].to_numpy()), jax.devices("cpu")[0]).T
+    orography_image = geom.MultiImage({(0, 0): orography_arr.reshape((1, 192, 96))}, D, is_torus)
     if normalize:
-        orography_arr = (orography_arr - jnp.mean(orography_arr)) / jnp.std(orography_arr)
+        orography_image = ginjax_stats.MultiImageStats().update(orography_image).normalize(
+            orography_image
+        )
+
+    return orography_image
+
 
-    return geom.MultiImage({(0, 0): orography_arr.reshape((1, 192, 96))}, D, is_torus)
+# The store of each data class is at data_dir/data_class/store/ and has the fields
+#   uv: (trajectories,timesteps,spatial,D) velocity, float32
+#   pres: (trajectories,timesteps,spatial) pressure scalar, float32
+#   vor: (trajectories,timesteps,spatial) vorticity pseudoscalar, float32
+#   div: (trajectories,timesteps,spatial) divergence scalar, float32
+#   lat: (96,) latitudes in degrees
+# where spatial is (lon,lat) = (192,96) and the trajectories are ordered by seed then run.
+STORE_DIR = "store"
+TOTAL_STEPS = 88
+SPATIAL_DIMS = (192, 96)  # (lon,lat) (x,y)
+
+# the fields of the store that make up the channels of each (k,parity) of the multi images
+INPUT_LAYOUT = {(0, 0): ["pres"], (1, 0): ["uv"]}
+PRES_VOR_LAYOUT = {(0, 0): ["pres"], (0, 1): ["vor"], (1, 0): ["uv"]}
+
+
+def get_seed_runs(data_dir: str, data_class: str) -> list[tuple[str, list[str]]]:
+    """
+    Get the netCDF files of each run of each seed of the data class, in order.
+
+    args:
+        data_dir: the data directory, probably something/ShallowWater-2D
+        data_class: one of "train", "valid", or "test"
+
+    returns:
+        list of the seed and the paths of the output.nc files of its runs
+    """
+    seeds = sorted(filter(lambda path: "seed=" in path, os.listdir(f"{data_dir}/{data_class}/")))
+    return [
+        (seed, sorted(glob.glob(os.path.join(data_dir, data_class, seed, "run*", "output.nc"))))
+        for seed in seeds
+    ]
 
 
 def read_one_seed(
-    data_dir: str, data_class: str, seed: str
-) -> tuple[jax.Array, jax.Array, jax.Array, jax.Array, jax.Array]:
+    run_files: list[str],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """
-    Read all the runs of one seed and combine them into blocks of data. The runs from the directory
-    data_dir/data_class/seed/ will be read and made into uv, pres, vor, and lat data blocks. If
-    there is an `all_data.npy` file in that directory, that is loaded. Otherwise, the separate
-    mfd_datasets are loaded, then saved to an `all_data.npy` file. This will allow the data to be
-    loaded much quicker on the next run.
+    Read all the runs of one seed from their netCDF files and combine them into blocks of data.
 
     Note that the data is stored as (lat,lon) or (96,192), but we swap it to (lon,lat) or (192,96)
     because multi images are expected to by an (x,y) grid.
 
     args:
-        data_dir: the data directory, probably something/ShallowWater-2D
-        data_class: one of "train", "valid", or "test"
-        seed: the particular seed we are reading, probably
+        run_files: the output.nc files of each run of the seed
 
     returns:
-        The jax data arrays, uv, pres, vor, and lats. Their shapes are as follows:
+        The numpy data arrays, uv, pres, vor, div, and lats. Their shapes are as follows:
         uv: (batch,timesteps,spatial,D)
         pres: (batch,timesteps,spatial)
         vor: (batch,timesteps,spatial)
+        div: (batch,timesteps,spatial)
         lats: (96,)
     """
-    target_file = f"{data_dir}/{data_class}/{seed}/all_data.npy"
-    if "all_data.npy" in os.listdir(f"{data_dir}/{data_class}/{seed}/"):
-        dataset = jnp.load(target_file, allow_pickle=True).item()
-        u = jax.device_put(dataset["u"], jax.devices("cpu")[0])  # velocity in x direction
-        v = jax.device_put(dataset["v"], jax.devices("cpu")[0])  # velocity in y direction
-        pres = jax.device_put(dataset["pres"], jax.devices("cpu")[0])  # pressure scalar
-        vor = jax.device_put(dataset["vor"], jax.devices("cpu")[0])  # vorticity pseudoscalar
-        div = jax.device_put(dataset["div"], jax.devices("cpu")[0])  # divergence scalar
-
-        lat = jax.device_put(dataset["lat"], jax.devices("cpu")[0])  # latitude degrees
-        # lon = jax.device_put(dataset["lon"], jax.devices("cpu")[0])  # longitude degrees
-    else:
-        datals = os.path.join(data_dir, data_class, seed, "run*", "output.nc")
-        dataset = xr.open_mfdataset(datals, concat_dim="b", combine="nested", parallel=True)  # dict
-        # all have shape (batch, timesteps, lev, lat, lon) = (25,88,1,96,192)
-        # u: zonal velocity, in x direction
-        u = jax.device_put(jnp.array(dataset["u"].to_numpy()), jax.devices("cpu")[0])
-        # v: meridonal velocity, in y direction
-        v = jax.device_put(jnp.array(dataset["v"].to_numpy()), jax.devices("cpu")[0])
-        # pressure scalar, does not have lev dim
-        pres = jax.device_put(jnp.array(dataset["pres"].to_numpy()), jax.devices("cpu")[0])
-        # vorticity pseudoscalar
-        vor = jax.device_put(jnp.array(dataset["vor"].to_numpy()), jax.devices("cpu")[0])
-        # divergence scalar
-        div = jax.device_put(jnp.array(dataset["div"].to_numpy()), jax.devices("cpu")[0])
-
-        # all have shape (96,)
-        # latitudes
-        lat = jax.device_put(jnp.array(dataset["lat"].to_numpy()), jax.devices("cpu")[0])
-        # longitudes
-        lon = jax.device_put(jnp.array(dataset["lon"].to_numpy()), jax.devices("cpu")[0])
-
-        jnp.save(
-            target_file,
-            {"u": u, "v": v, "pres": pres, "vor": vor, "lat": lat, "lon": lon, "div": div},
-        )
+    dataset = xr.open_mfdataset(run_files, concat_dim="b", combine="nested")
+    # all have shape (batch, timesteps, lev, lat, lon) = (25,88,1,96,192) except pres with no lev.
+    # u is zonal velocity, in x direction, v is meridonal velocity, in y direction
+    u = dataset["u"].to_numpy()[:, :, 0]
+    v = dataset["v"].to_numpy()[:, :, 0]
+    pres = dataset["pres"].to_numpy()
+    vor = dataset["vor"].to_numpy()[:, :, 0]
+    div = dataset["div"].to_numpy()[:, :, 0]
+    lat = dataset["lat"].to_numpy()  # (96,)
+    dataset.close()
 
     # Data is loaded with shape (96,192), or (latitude,longitude) or (y,x). This means that the
     # normal way we think of arrays, by rows then columns it will be layed out like a typical map.
     # However, this is backwards of when we think of accessing elements [x,y] where the x-coordinate
     # is the first and the y-coordinate is second. So we will flip them.
-    u = jnp.moveaxis(u, -2, -1)
-    v = jnp.moveaxis(v, -2, -1)
-    pres = jnp.moveaxis(pres, -2, -1)
-    vor = jnp.moveaxis(vor, -2, -1)
-    div = jnp.moveaxis(div, -2, -1)
+    uv = np.stack([np.swapaxes(u, -2, -1), np.swapaxes(v, -2, -1)], axis=-1)
+    return uv, np.swapaxes(pres, -2, -1), np.swapaxes(vor, -2, -1), np.swapaxes(div, -2, -1), lat
+
+
+def write_one_seed(store_dir: str, run_files: list[str], offset: int) -> np.ndarray:
+    """
+    Read one seed and write it into its slice of the trajectories of the store. Each seed writes a
+    disjoint slice, so multiple processes can write to the store at once.
+
+    args:
+        store_dir: the directory of the store
+        run_files: the output.nc files of each run of the seed
+        offset: index of the first trajectory of this seed in the store
+
+    returns:
+        the latitudes of the seed
+    """
+    uv, pres, vor, div, lat = read_one_seed(run_files)
+    store, _ = gc_data.open_array_store(store_dir, mode="r+")
+    for name, arr in [("uv", uv), ("pres", pres), ("vor", vor), ("div", div)]:
+        store[name][offset : offset + len(arr)] = arr
+        store[name].flush()
+
+    return lat
+
+
+def ingest_data_class(data_dir: str, data_class: str, num_workers: int = 1) -> None:
+    """
+    Convert the netCDF runs of every seed of the data class into an array store which can be
+    memory mapped when loading. The seeds are converted in parallel by num_workers processes, which
+    are forked, so this must run before JAX is initialized. It is only run by the --ingest step.
+    An existing store of the data class is replaced once the new one is complete.
+
+    args:
+        data_dir: the data directory, probably something/ShallowWater-2D
+        data_class: one of "train", "valid", or "test"
+        num_workers: number of processes that convert seeds
+    """
+    seed_runs = get_seed_runs(data_dir, data_class)
+    offsets = np.cumsum([0] + [len(run_files) for _, run_files in seed_runs])
+    n_trajectories = int(offsets[-1])
+    print(f"Ingesting {n_trajectories} {data_class} trajectories from {len(seed_runs)} seeds")
+
+    # write to a temporary directory so that a partial conversion is never loaded
+    store_dir = f"{data_dir}/{data_class}/{STORE_DIR}"
+    tmp_dir = f"{store_dir}_tmp"
+    if os.path.exists(tmp_dir):
+        print(f"Removing {tmp_dir} left by an incomplete ingest")
+        shutil.rmtree(tmp_dir)
+
+    gc_data.create_array_store(
+        tmp_dir,
+        {
+            "uv": ((n_trajectories, TOTAL_STEPS) + SPATIAL_DIMS + (2,), "float32"),
+            "pres": ((n_trajectories, TOTAL_STEPS) + SPATIAL_DIMS, "float32"),
+            "vor": ((n_trajectories, TOTAL_STEPS) + SPATIAL_DIMS, "float32"),
+            "div": ((n_trajectories, TOTAL_STEPS) + SPATIAL_DIMS, "float32"),
+            "lat": ((SPATIAL_DIMS[1],), "float32"),
+        },
+        {"seeds": [seed for seed, _ in seed_runs], "offsets": offsets.tolist()},
+    )
+
+    jobs = [(tmp_dir, run_files, int(offset)) for (_, run_files), offset in zip(seed_runs, offsets)]
+    if num_workers > 1:
+        # fork rather than spawn so that the workers don't rerun this script. This is safe because
+        # the --ingest step exits before JAX is initialized, and the workers only use xarray and
+        # numpy
+        with ProcessPoolExecutor(num_workers, mp_context=mp.get_context("fork")) as executor:
+            lats = list(executor.map(write_one_seed, *zip(*jobs)))
+    else:
+        lats = [write_one_seed(*job) for job in jobs]
 
-    uv = jnp.stack([u[:, :, 0, ...], v[:, :, 0, ...]], axis=-1)
-    return uv, pres, vor[:, :, 0, ...], div[:, :, 0, ...], lat
+    store, _ = gc_data.open_array_store(tmp_dir, mode="r+")
+    store["lat"][:] = lats[0]  # assume lats are the same for all the data
+    store["lat"].flush()
+    if os.path.exists(store_dir):
+        print(f"Replacing the existing store {store_dir}")
+        shutil.rmtree(store_dir)
+
+    os.replace(tmp_dir, store_dir)
 
 
 def read_all_seeds(
-    data_dir: str, n_trajectories: int, data_class: str
-) -> tuple[jax.Array, jax.Array, jax.Array, jax.Array, jax.Array]:
+    data_dir: str,
+    n_trajectories: int,
+    data_class: str,
+    layout: dict[tuple[int, int], list[str]],
+    transform: Optional[Callable[[geom.MultiImage], geom.MultiImage]] = None,
+) -> gc_data.ArrayStoreSource:
     """
-    Given a specific dataset and data class (train, valid, or test), read seeds until we get to
-    n_trajectories, and then return the data.
+    Given a specific dataset and data class (train, valid, or test), open a lazy source of the
+    first n_trajectories of the array store. The store is only memory mapped, so the trajectories
+    are read when a batch needs them. The store is created from the netCDF files by running this
+    script with --ingest first.
 
     args:
         data_dir: directory of the data
         n_trajectories: number of trajectories
         data_class: type of data, either train, valid, or test
+        layout: map from (k,parity) to the fields of the store of its channels
+        transform: function applied to each batch of trajectories that is read, such as a
+            normalization
 
     returns:
-        The jax data arrays, uv, pres, vor, and lats. Their shapes are as follows:
-        uv: (batch,timesteps,spatial,D)
-        pres: (batch,timesteps,spatial)
-        vor: (batch,timesteps,spatial)
-        div: (batch,timesteps,spatial)
-        lats: (96,)
+        the source of trajectories, each of shape (channels*timesteps,spatial,tensor)
     """
-    all_seeds = sorted(os.listdir(f"{data_dir}/{data_class}/"))
-    all_seeds = filter(lambda path: "seed=" in path, all_seeds)
-
-    spatial_dims = (192, 96)  # (lon,lat) (x,y)
-    D = 2
-    total_steps = 88
-    all_uv = jnp.zeros((0, total_steps) + spatial_dims + (D,))
-    all_pres = jnp.zeros((0, total_steps) + spatial_dims)
-    all_vor = jnp.zeros((0, total_steps) + spatial_dims)
-    all_div = jnp.zeros((0, total_steps) + spatial_dims)
-    lats = jnp.zeros(96)  # assume lats are the same for all the data
-    for seed in all_seeds:
-        uv, pres, vor, div, lats = read_one_seed(data_dir, data_class, seed)
-
-        all_uv = jnp.concatenate([all_uv, uv])
-        all_pres = jnp.concatenate([all_pres, pres])
-        all_vor = jnp.concatenate([all_vor, vor])
-        all_div = jnp.concatenate([all_div, div])
-
-        if len(all_uv) >= n_trajectories:
-            break
-
-    if len(all_uv) < n_trajectories:
-        print(
-            f"WARNING get_data_layers: wanted {n_trajectories} {data_class} trajectories, "
-            f"but only found {len(all_uv)}",
+    store_dir = f"{data_dir}/{data_class}/{STORE_DIR}"
+    if not os.path.exists(store_dir):
+        raise FileNotFoundError(
+            f"read_all_seeds: no array store at {store_dir}, convert the netCDF files by running "
+            "this script with --ingest first"
         )
-        n_trajectories = len(all_uv)
-
-    # (b,timesteps,spatial,tensor)
-    all_uv = all_uv[:n_trajectories]
-    all_pres = all_pres[:n_trajectories]
-    all_vor = all_vor[:n_trajectories]
-    all_div = all_div[:n_trajectories]
 
-    return all_uv, all_pres, all_vor, all_div, lats
+    return gc_data.ArrayStoreSource(
+        store_dir, layout, D, (True, False), n_trajectories=n_trajectories, transform=transform
+    )
 
 
 def make_constant_fields(
@@ -241,68 +303,45 @@ def make_constant_fields(
 
 
 def get_data_multi_images(
-    uv: jax.Array,
-    pres: jax.Array,
-    vor: jax.Array,
-    div: jax.Array,
+    source_x: gc_data.MultiImageDataset,
+    source_y: gc_data.MultiImageDataset,
     constant_fields: geom.MultiImage,
-    pres_vor_form: bool,
     total_steps: int,
     past_steps: int,
     future_steps: int,
     skip_initial: int = 4,
     subsample: int = 1,
-    is_torus: Union[bool, tuple[bool, ...]] = (True, False),
-) -> tuple[geom.MultiImage, geom.MultiImage]:
+) -> tuple[gc_data.TimeSeriesWindows, gc_data.TimeSeriesWindows]:
     """
-    Construct the multi images from the data.
+    Construct the lazy windows of the input and output multi images from the trajectories.
 
     args:
-        uv: velocity data array, shape (batch,timesteps,spatial,tensor)
-        pres: pressure data array, shape (batch,timesteps,spatial,tensor)
-        vor: vorticity data array, shape (batch,timesteps,spatial,tensor)
-        div: divergence data array, shape (batch,timesteps,spatial,tensor)
+        source_x: the trajectories of the input fields, shape
+            (batch,channels*timesteps,spatial,tensor)
+        source_y: the trajectories of the output fields, shape
+            (batch,channels*timesteps,spatial,tensor)
         constant_fields: fields that do not vary by timestep, shape (channels,spatial,tensor)
-        pres_vor_form: use pressure/vorticity form instead
         total_steps: the number of timesteps
         past_steps: the lookback window, how many steps we look back to predict the next one
         future_steps: the number of steps in the future to compare against
         skip_initial: how many initial timesteps to skip
         subsample: timesteps are 6 simulation hours, can subsample for longer timesteps
-        is_torus: toroidal structure of the images
 
     returns:
-        the input and output multi images
+        the input windows, which append the constant fields to each batch, and the output windows
     """
-    # add the batch dimension
-    batch_const_fields = constant_fields.empty()
-    for (k, p), image in constant_fields.items():
-        batch_const_fields.append(k, p, jnp.full((len(uv),) + image.shape, image[None]))
-
-    if pres_vor_form:
-        multi_image = geom.MultiImage({(0, 0): pres, (0, 1): vor, (1, 0): uv}, D, is_torus)
-        multi_image_x, multi_image_y = gc_data.batch_time_series(
-            multi_image,
-            batch_const_fields,
-            total_steps,
-            past_steps,
-            future_steps,
-            skip_initial,
-            subsample,
-        )
-        del multi_image_x.data[(0, 1)]  # remove vorticity from input
-    else:
-        multi_image = geom.MultiImage({(0, 0): pres, (1, 0): uv}, D, is_torus)
-        multi_image_x, multi_image_y = gc_data.batch_time_series(
-            multi_image,
-            batch_const_fields,
-            total_steps,
-            past_steps,
-            future_steps,
-            skip_initial,
-            subsample,
-        )
-
+    multi_image_x, _ = gc_data.lazy_batch_time_series(
+        source_x, constant_fields, total_steps, past_steps, future_steps, skip_initial, subsample
+    )
+    _, multi_image_y = gc_data.lazy_batch_time_series(
+        source_y,
+        constant_fields.empty(),
+        total_steps,
+        past_steps,
+        future_steps,
+        skip_initial,
+        subsample,
+    )
     return multi_image_x, multi_image_y
 
 
@@ -322,14 +361,14 @@ def get_data(
     include_orography: bool = False,
 ) -> tuple[
     tuple[
-        geom.MultiImage,
-        geom.MultiImage,
-        geom.MultiImage,
-        geom.MultiImage,
-        geom.MultiImage,
-        geom.MultiImage,
-        geom.MultiImage,
-        geom.MultiImage,
+        gc_data.TimeSeriesWindows,
+        gc_data.TimeSeriesWindows,
+        gc_data.TimeSeriesWindows,
+        gc_data.TimeSeriesWindows,
+        gc_data.TimeSeriesWindows,
+        gc_data.TimeSeriesWindows,
+        gc_data.TimeSeriesWindows,
+        gc_data.TimeSeriesWindows,
     ],
     dict[tuple[int, int], int],
 ]:
@@ -355,37 +394,35 @@ def get_data(
         train, val, test one step, and test rollout input and output multi images. Also a multi
         image of the constant fields.
     """
-    train_uv, train_pres, train_vor, train_div, lats = read_all_seeds(data_dir, n_train, "train")
-    val_uv, val_pres, val_vor, val_div, _ = read_all_seeds(data_dir, n_val, "valid")
-    test_uv, test_pres, test_vor, test_div, _ = read_all_seeds(data_dir, n_test, "test")
-
+    transform = None
     if normalize:
-        pres_mean = jnp.mean(jnp.concatenate([train_pres, val_pres]))
-        pres_std = jnp.std(jnp.concatenate([train_pres, val_pres]))
-        train_pres = (train_pres - pres_mean) / pres_std
-        val_pres = (val_pres - pres_mean) / pres_std
-        test_pres = (test_pres - pres_mean) / pres_std
-
-        vor_std = jnp.std(jnp.concatenate([train_vor, val_vor]))
-        train_vor = train_vor / vor_std
-        val_vor = val_vor / vor_std
-        test_vor = test_vor / vor_std
-
-        div_mean = jnp.mean(jnp.concatenate([train_div, val_div]))
-        div_std = jnp.std(jnp.concatenate([train_div, val_div]))
-        train_div = (train_div - div_mean) / div_std
-        val_div = (val_div - div_mean) / div_std
-        test_div = (test_div - div_mean) / div_std
-
-        uv_std = jnp.std(jnp.concatenate([train_uv, val_uv]))
-        train_uv = train_uv / uv_std
-        val_uv = val_uv / uv_std
-        test_uv = test_uv / uv_std
+        # statistics of the train and validation data, cached next to the train store. They are
+        # streamed from the store a chunk of trajectories at a time, and each batch is normalized
+        # as it is read
+        train_source = read_all_seeds(data_dir, n_train, "train", PRES_VOR_LAYOUT)
+        val_source = read_all_seeds(data_dir, n_val, "valid", PRES_VOR_LAYOUT)
+        field_stats = ginjax_stats.compute_stats(
+            itertools.chain(train_source.iter_chunks(), val_source.iter_chunks()),
+            n_steps=train_source.arrays["uv"].shape[1],
+            cache=(
+                f"{data_dir}/train/{STORE_DIR}/stats_pres_vor_uv_train{n_train}_valid{n_val}.json"
+            ),
+        )
+        transform = field_stats.normalize
+
+    # the input never has the vorticity, the output does in pressure/vorticity form
+    output_layout = PRES_VOR_LAYOUT if pres_vor_form else INPUT_LAYOUT
+    train_x_source, train_y_source, val_x_source, val_y_source, test_x_source, test_y_source = (
+        read_all_seeds(data_dir, n_trajectories, data_class, layout, transform)
+        for n_trajectories, data_class in [(n_train, "train"), (n_val, "valid"), (n_test, "test")]
+        for layout in [INPUT_LAYOUT, output_layout]
+    )
 
     D = 2
     is_torus = (True, False)
-    total_steps = train_uv.shape[1]
-    spatial_dims = train_uv.shape[2:4]
+    total_steps = train_x_source.arrays["uv"].shape[1]
+    spatial_dims = train_x_source.arrays["uv"].shape[2:4]
+    lats = jnp.array(train_x_source.arrays["lat"])
 
     orography = read_orography(D, is_torus, normalize, data_dir)
     constant_fields = make_constant_fields(
@@ -400,56 +437,40 @@ def get_data(
     )
 
     train_X, train_Y = get_data_multi_images(
-        train_uv,
-        train_pres,
-        train_vor,
-        train_div,
+        train_x_source,
+        train_y_source,
         constant_fields,
-        pres_vor_form,
         total_steps,
         past_steps,
         1,
         subsample=subsample,
-        is_torus=is_torus,
     )
     val_X, val_Y = get_data_multi_images(
-        val_uv,
-        val_pres,
-        val_vor,
-        val_div,
+        val_x_source,
+        val_y_source,
         constant_fields,
-        pres_vor_form,
         total_steps,
         past_steps,
         1,
         subsample=subsample,
-        is_torus=is_torus,
     )
     test_single_X, test_single_Y = get_data_multi_images(
-        test_uv,
-        test_pres,
-        test_vor,
-        test_div,
+        test_x_source,
+        test_y_source,
         constant_fields,
-        pres_vor_form,
         total_steps,
         past_steps,
         1,
         subsample=subsample,
-        is_torus=is_torus,
     )
     test_rollout_X, test_rollout_Y = get_data_multi_images(
-        test_uv,
-        test_pres,
-        test_vor,
-        test_div,
+        test_x_source,
+        test_y_source,
         constant_fields,
-        pres_vor_form,
         total_steps,
         past_steps,
         rollout_steps,
         subsample=subsample,
-        is_torus=is_torus,
     )
     constant_fields_dict = {k: n_channels for k, n_channels in constant_fields.get_signature()}
 
@@ -500,7 +521,7 @@ def map_and_loss(
 
 
 def train_and_eval(
-    data: tuple[geom.MultiImage, ...],
+    data: tuple[Union[geom.MultiImage, gc_data.MultiImageDataset], ...],
     key: ArrayLike,
     model_name: str,
     model: models.MultiImageModule,
@@ -516,6 +537,7 @@ def train_and_eval(
     plot_component: int = 0,
     constant_fields: dict[tuple[int, int], int] = {},
     is_wandb: bool = False,
+    device_budget: Optional[float] = None,
 ) -> tuple[Optional[ArrayLike], ...]:
     (
         train_X,
@@ -536,6 +558,14 @@ def train_and_eval(
     if load_model is None:
         steps_per_epoch = int(np.ceil(train_X.get_L() / batch_size))
         key, subkey = random.split(key)
+        if device_budget is not None:
+            # keep the data on the device if it fits, otherwise batches are paged in every epoch
+            memory_budget = int(device_budget * 1e9)
+            train_X, train_Y, val_X, val_Y = (
+                gc_data.DeviceCache(data, memory_budget)
+                for data in (train_X, train_Y, val_X, val_Y)
+            )
+
         model, batch_stats, train_loss, val_loss = ml.train(
             train_X,
             train_Y,
@@ -594,16 +624,16 @@ def train_and_eval(
     )
     print(f"Test Loss: {test_loss}")
 
-    key, subkey = random.split(key)
-    test_rollout_loss, rollout_multi_image = ml.map_plus_loss_in_batches(
-        partial(map_and_loss_f, future_steps=rollout_steps, return_map=True),
+    test_rollout_loss = ml.rollout_loss_in_batches(
         model,
         test_rollout_X,
         test_rollout_Y,
         batch_size,
-        subkey,
+        test_rollout_X.time_idxs.shape[1],  # past_steps
+        rollout_steps,
+        constant_fields,
         aux_data=batch_stats,
-    )
+    )["smse"]
     print(f"Test Rollout Loss: {test_rollout_loss}, Sum: {jnp.sum(test_rollout_loss)}")
 
     return train_loss, val_loss, test_loss, *test_rollout_loss
@@ -660,6 +690,18 @@ def handleArgs() -> argparse.Namespace:
         type=int,
         default=1,
     )
+    parser.add_argument(
+        "--ingest",
+        help="convert the netCDF files of every data class to array stores, then exit. Run this "
+        "once before training, it replaces any existing stores",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--ingest_workers",
+        help="number of processes used to convert the netCDF files, default 1",
+        type=int,
+        default=1,
+    )
     # need do to --wandb to activate, also need --wandb-entity your_wandb_name_here
     parser.add_argument(
         "--wandb-project", help="the wandb project", type=str, default="shallow-water"
@@ -671,6 +713,13 @@ def handleArgs() -> argparse.Namespace:
 # Main
 args = handleArgs()
 
+if args.ingest:
+    # its own step, since the ingest workers are forked and JAX must not be initialized yet
+    for data_class in ["train", "valid", "test"]:
+        ingest_data_class(args.data, data_class, args.ingest_workers)
+
+    exit()
+
 D = 2
 
 key = random.PRNGKey(time.time_ns()) if (args.seed is None) else random.PRNGKey(args.seed)
@@ -717,6 +766,7 @@ train_kwargs = {
     "plot_component": args.plot_component,
     "constant_fields": constant_fields,
     "is_wandb": args.wandb,
+    "device_budget": args.device_budget,
 }
 
 key, *subkeys = random.split(key, num=13)
@@ -0,0 +1,171 @@
+# Benchmark reduced precision storage of the cfd_2d and shallow_water datasets against float32
+import sys
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+import ginjax.geometric as geom
+import ginjax.data as gc_data
+
+
+def read_cfd_2d(filename: str, n_trajectories: int) -> geom.MultiImage:
+    """
+    Read trajectories of a cfd_2d .hdf5 file, in the layout of scripts/cfd_2d.py.
+
+    args:
+        filename: the .hdf5 file
+        n_trajectories: number of trajectories to read
+
+    returns:
+        MultiImage of shape (trajectories,channels*time,spatial,tensor)
+    """
+    source = gc_data.HDF5TrajectorySource(
+        filename,
+        {(0, 0): ["density", "pressure"], (1, 0): [["Vx", "Vy"]]},
+        D=2,
+        n_trajectories=n_trajectories,
+    )
+    multi_image = source.to_multi_image()
+    source.close()
+    return multi_image
+
+
+def read_shallow_water(data_dir: str, n_trajectories: int) -> geom.MultiImage:
+    """
+    Read trajectories of the train array store made by `scripts/shallow_water.py --ingest`.
+
+    args:
+        data_dir: the data directory, probably something/ShallowWater-2D
+        n_trajectories: number of trajectories to read
+
+    returns:
+        MultiImage of shape (trajectories,channels*time,spatial,tensor)
+    """
+    store, _ = gc_data.open_array_store(f"{data_dir}/train/store")
+    scalars = np.concatenate([store["pres"][:n_trajectories], store["div"][:n_trajectories]], 1)
+    return geom.MultiImage(
+        {
+            (0, 0): jnp.array(scalars),
+            (0, 1): jnp.array(store["vor"][:n_trajectories]),
+            (1, 0): jnp.array(store["uv"][:n_trajectories]),
+        },
+        2,
+        (True, False),
+    )
+
+
+def time_epoch(dataset: gc_data.MultiImageDataset, batch_size: int) -> float:
+    """
+    Time reading every batch of the dataset onto the device, as in an epoch of training.
+
+    args:
+        dataset: the dataset
+        batch_size: the batch size
+
+    returns:
+        the time in seconds
+    """
+    start = time.time()
+    for batch_start in range(0, dataset.get_L(), batch_size):
+        idxs = jnp.arange(batch_start, min(batch_start + batch_size, dataset.get_L()))
+        jax.block_until_ready(dataset.get_subset(idxs).to_vector())
+
+    return time.time() - start
+
+
+class Float32Store(gc_data.MultiImageDataset):
+    """
+    The float32 path, a memory mapped array store read one batch at a time.
+    """
+
+    def __init__(self, directory: str, D: int, is_torus: tuple[bool, ...]) -> None:
+        self.arrays, _ = gc_data.open_array_store(directory)
+        self.D = D
+        self.is_torus = is_torus
+
+    def get_L(self) -> int:
+        return len(next(iter(self.arrays.values())))
+
+    def get_subset(self, idxs: jax.Array) -> geom.MultiImage:
+        return self.from_host(self.get_host_subset(np.asarray(idxs)))
+
+    def get_host_subset(self, idxs: np.ndarray) -> dict[str, np.ndarray]:
+        return {name: arr[idxs] for name, arr in self.arrays.items()}
+
+    def from_host(self, host_subset: dict[str, np.ndarray]) -> geom.MultiImage:
+        out = geom.MultiImage({}, self.D, self.is_torus)
+        for name, arr in host_subset.items():
+            k, parity = gc_data.parse_block_name(name)
+            out.append(k, parity, jnp.asarray(arr))
+
+        return out
+
+
+def handleArgs(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "dataset", help="the dataset", type=str, choices=["cfd_2d", "shallow_water"]
+    )
+    parser.add_argument(
+        "data", help="the cfd_2d .hdf5 file, or the shallow_water data directory", type=str
+    )
+    parser.add_argument("-n", help="number of trajectories", type=int, default=16)
+    parser.add_argument("-batch", help="batch size", type=int, default=4)
+    parser.add_argument(
+        "--store_dir",
+        help="where to write the stores, defaults to a temporary directory",
+        type=str,
+        default=None,
+    )
+    return parser.parse_args()
+
+
+# Main
+args = handleArgs(sys.argv)
+
+if args.dataset == "cfd_2d":
+    multi_image = read_cfd_2d(args.data, args.n)
+else:
+    multi_image = read_shallow_water(args.data, args.n)
+
+print(f"{args.dataset}: {multi_image.get_L()} trajectories, {multi_image.get_signature()}")
+
+with tempfile.TemporaryDirectory(dir=args.store_dir) as store_dir:
+    float32_dir = f"{store_dir}/float32"
+    gc_data.create_array_store(
+        float32_dir,
+        {f"k{k}_p{parity}": (block.shape, "float32") for (k, parity), block in multi_image.items()},
+    )
+    arrays, _ = gc_data.open_array_store(float32_dir, mode="r+")
+    for (k, parity), block in multi_image.items():
+        arrays[f"k{k}_p{parity}"][:] = np.asarray(block, dtype=np.float32)
+        arrays[f"k{k}_p{parity}"].flush()
+
+    float32_store = Float32Store(float32_dir, multi_image.D, multi_image.is_torus)
+    time_epoch(float32_store, args.batch)  # compile and warm the page cache
+    float32_bytes = gc_data.get_nbytes(multi_image)
+    float32_time = time_epoch(float32_store, args.batch)
+    print(f"float32: {float32_bytes / 2**20:.1f} MiB, epoch read {float32_time:.3f}s")
+
+    for dtype in gc_data.COMPRESSED_DTYPES:
+        compressed = gc_data.CompressedMultiImage.from_multi_image(multi_image, dtype)
+        compressed.save(f"{store_dir}/{dtype}")
+        loaded = gc_data.CompressedMultiImage.load(f"{store_dir}/{dtype}")
+        nbytes = sum(
+            os.path.getsize(f"{store_dir}/{dtype}/{filename}")
+            for filename in os.listdir(f"{store_dir}/{dtype}")
+        )
+
+        time_epoch(loaded, args.batch)
+        epoch_time = time_epoch(loaded, args.batch)
+        print(
+            f"{dtype}: {nbytes / 2**20:.1f} MiB ({nbytes / float32_bytes:.2f}x), "
+            f"epoch read {epoch_time:.3f}s ({epoch_time / float32_time:.2f}x)"
+        )
+        for key, error in gc_data.compression_error(multi_image, loaded).items():
+            print(f"    {key}: max abs err {error['max_abs']:.3e}, rel rms {error['rel_rms']:.3e}")
@@ -1,7 +1,24 @@
-from typing_extensions import Union
+import io
+import os
+import abc
+import copy
+import pickle
+import json
+import math
+import functools
+import queue
+import traceback
+import warnings
+import multiprocessing as mp
+from multiprocessing import resource_tracker, shared_memory
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing_extensions import Any, Callable, Iterable, Iterator, Optional, Self, Sequence, Union
+import numpy as np
 
 import jax.numpy as jnp
 import jax
+from jax.typing import ArrayLike
 
 import ginjax.geometric as geom
 
@@ -50,6 +67,30 @@ def time_series_idxs(past_steps: int, future_steps: int, delta_t: int, total_ste
     return in_idxs, out_idxs
 
 
+def is_batched_constant(dynamic_fields: geom.MultiImage, constant_fields: geom.MultiImage) -> bool:
+    """
+    Whether the constant fields have the same leading batch axis as the dynamic fields, or are a
+    single set of constant fields shared by every trajectory without a batch axis.
+
+    args:
+        dynamic_fields: the dynamic fields, shape (batch,channels*time,spatial,tensor)
+        constant_fields: the constant fields, shape (batch,channels,spatial,tensor) or
+            (channels,spatial,tensor)
+
+    returns:
+        True if the constant fields have a batch axis
+    """
+    if len(constant_fields.values()) == 0:
+        return False
+
+    n_leading = constant_fields.get_n_leading()
+    assert n_leading in {dynamic_fields.get_n_leading(), dynamic_fields.get_n_leading() - 1}, (
+        f"is_batched_constant: constant fields must have {dynamic_fields.get_n_leading()} or "
+        f"{dynamic_fields.get_n_leading() - 1} leading axes, but found {n_leading}"
+    )
+    return n_leading == dynamic_fields.get_n_leading()
+
+
 def batch_time_series(
     dynamic_fields: geom.MultiImage,
     constant_fields: geom.MultiImage,
@@ -59,14 +100,19 @@ def batch_time_series(
     skip_initial: int = 0,
     delta_t: int = 1,
     downsample: int = 0,
-) -> tuple[geom.MultiImage, geom.MultiImage]:
+) -> tuple[Union[geom.MultiImage, "ConstantFieldsView"], geom.MultiImage]:
     """
     Given time series fields batch an initial batch dimension, convert them to input and output
     MultiImages based on the number of past steps, future steps, and any subsampling/downsampling.
+    The output has shape (batch,channels*future_steps,spatial,tensor) with the steps of each channel
+    contiguous, which is the layout expected from a model that predicts multiple steps per call. To
+    train such a model, set future_steps to the number of steps it outputs (the model_steps of
+    `ml.autoregressive_map`).
 
     args:
         dynamic_fields: the dynamic fields, shape (batch,channels*time,spatial,tensor)
-        constant_fields: the constant fields, shape (batch,channels,spatial,tensor)
+        constant_fields: the constant fields, shape (batch,channels,spatial,tensor), or
+            (channels,spatial,tensor) if they are shared by every trajectory
         total_steps: total number of timesteps we are working with
         past_steps: number of historical steps to use in the model
         future_steps: number of future steps
@@ -76,12 +122,17 @@ def batch_time_series(
             of 2
 
     returns:
-        tuple of MultiImages multi_image_X and multi_image_Y
+        tuple of MultiImages multi_image_X and multi_image_Y. If the constant fields are shared by
+            every trajectory, multi_image_X is a ConstantFieldsView which stores them once.
     """
+    shared_constants = len(constant_fields.values()) != 0 and not is_batched_constant(
+        dynamic_fields, constant_fields
+    )
+    batch_constant_fields = constant_fields.empty() if shared_constants else constant_fields
     vmap_f = jax.vmap(times_series_to_multi_images, in_axes=(0, 0) + (None,) * 6)
     multi_image_x, multi_image_y = vmap_f(
         dynamic_fields,
-        constant_fields,
+        batch_constant_fields,
         total_steps,
         past_steps,
         future_steps,
@@ -95,6 +146,12 @@ def batch_time_series(
     for key, image in multi_image_y.items():
         multi_image_y[key] = image.reshape((-1,) + image.shape[2:])
 
+    if shared_constants:
+        for _ in range(downsample):
+            constant_fields = constant_fields.average_pool(2)
+
+        return ConstantFieldsView(multi_image_x, constant_fields), multi_image_y
+
     return multi_image_x, multi_image_y
 
 
@@ -128,6 +185,11 @@ def times_series_to_multi_images(
     """
     assert len(dynamic_fields.values()) != 0
 
+    # pooling is per frame, so pool the time series once before the frames are duplicated by windows
+    for _ in range(downsample):
+        dynamic_fields = dynamic_fields.average_pool(2)
+        constant_fields = constant_fields.average_pool(2)
+
     spatial_dims = dynamic_fields.get_spatial_dims()
     D = dynamic_fields.D
     input_idxs, output_idxs = time_series_idxs(
@@ -165,10 +227,1986 @@ def times_series_to_multi_images(
 
     batch = len(next(iter(multi_image_x.values())))
     for (k, parity), image in constant_fields.items():
-        multi_image_x.append(k, parity, jnp.full((batch,) + image.shape, image), axis=1)
+        multi_image_x.append(k, parity, jnp.broadcast_to(image, (batch,) + image.shape), axis=1)
+
+    return multi_image_x, multi_image_y
+
+
+class ResolutionPyramid:
+    """
+    A cache of the raw time series at multiple resolutions, so that experiments which sweep over
+    the amount of downsampling only pool the data once per resolution. Each level is the previous
+    level average pooled by a factor of 2, and is computed from the highest cached resolution below
+    it the first time it is requested. Pass the fields of a level to the time series functions with
+    downsample=0.
+    """
+
+    levels: dict[int, tuple[geom.MultiImage, geom.MultiImage]]
+
+    def __init__(
+        self: Self, dynamic_fields: geom.MultiImage, constant_fields: geom.MultiImage
+    ) -> None:
+        """
+        Construct the pyramid from the full resolution fields.
+
+        args:
+            dynamic_fields: the dynamic fields, shape (batch,channels*time,spatial,tensor)
+            constant_fields: the constant fields, shape (batch,channels,spatial,tensor), or
+                (channels,spatial,tensor) if they are shared by every trajectory
+        """
+        self.levels = {0: (dynamic_fields, constant_fields)}
+
+    def get(self: Self, downsample: int) -> tuple[geom.MultiImage, geom.MultiImage]:
+        """
+        Get the dynamic and constant fields downsampled by a factor of 2, downsample times.
+
+        args:
+            downsample: number of times to downsample the fields by average pooling
+
+        returns:
+            the dynamic fields and constant fields at that resolution
+        """
+        assert downsample >= 0, f"ResolutionPyramid::get: downsample must be >= 0, got {downsample}"
+        level = max(cached_level for cached_level in self.levels if cached_level <= downsample)
+        dynamic_fields, constant_fields = self.levels[level]
+        for next_level in range(level + 1, downsample + 1):
+            dynamic_fields = dynamic_fields.average_pool(2)
+            constant_fields = constant_fields.average_pool(2)
+            self.levels[next_level] = (dynamic_fields, constant_fields)
+
+        return dynamic_fields, constant_fields
+
+
+# ------------------------------------------------------------------------------
+# Lazy datasets
+
+
+def block_name(k: int, parity: int) -> str:
+    """
+    Get the name of the image block of (k,parity), used to name arrays outside of a MultiImage.
+
+    args:
+        k: the tensor order
+        parity: the parity
+
+    returns:
+        the name, e.g. k1_p0
+    """
+    return f"k{k}_p{parity}"
+
+
+def parse_block_name(name: str) -> tuple[int, int]:
+    """
+    Get the (k,parity) of a name made by `block_name`.
+
+    args:
+        name: the name
+
+    returns:
+        the tuple (k,parity)
+    """
+    k, parity = name.split("_")
+    return int(k[1:]), int(parity[1:])
+
+
+class MultiImageDataset(abc.ABC):
+    """
+    Base class for datasets which behave like a MultiImage with a leading batch axis for the
+    purposes of batching, but only construct the MultiImage of a batch when it is requested. This
+    allows them to be passed to `ml.iterate_batches`, `ml.train`, and the `ml.*_in_batches`
+    functions in place of a MultiImage. Subclasses must implement get_L, get_subset, and the
+    get_host_subset and from_host pair used by worker processes.
+    """
+
+    D: int
+    is_torus: tuple[bool, ...]
+
+    @abc.abstractmethod
+    def get_L(self: Self) -> int:
+        """
+        Get the number of samples in the dataset.
+
+        returns:
+            the number of samples
+        """
+
+    @abc.abstractmethod
+    def get_subset(self: Self, idxs: jax.Array) -> geom.MultiImage:
+        """
+        Construct the MultiImage of the samples idxs.
+
+        args:
+            idxs (jnp.array): array of indices to select the subset
+
+        returns:
+            a MultiImage of shape (len(idxs),channels,spatial,tensor)
+        """
+
+    @abc.abstractmethod
+    def get_host_subset(self: Self, idxs: np.ndarray) -> dict[str, np.ndarray]:
+        """
+        Assemble the samples idxs as numpy arrays without calling JAX, so that it can run in a
+        worker process of a `WorkerLoader`. The batch is then finished on the device by from_host.
+
+        args:
+            idxs: array of indices to select the subset
+
+        returns:
+            the named arrays of the subset
+        """
+
+    @abc.abstractmethod
+    def from_host(self: Self, host_subset: dict[str, np.ndarray]) -> geom.MultiImage:
+        """
+        Construct the MultiImage of a subset assembled by get_host_subset.
+
+        args:
+            host_subset: the named arrays of the subset
+
+        returns:
+            a MultiImage of shape (len(idxs),channels,spatial,tensor)
+        """
+
+    def get_one(self: Self, idx: int = 0, keepdims: bool = True) -> geom.MultiImage:
+        """
+        Get a single sample of the dataset as a MultiImage.
+
+        args:
+            idx: index of the sample
+            keepdims: whether to keep the leading batch axis
+
+        returns:
+            the MultiImage of that sample
+        """
+        one = self.get_subset(jnp.array([idx]))
+        return one if keepdims else one.get_one(keepdims=False)
+
+    def get_signature(self: Self) -> geom.Signature:
+        """
+        Get the signature of the MultiImages produced by this dataset.
+
+        returns:
+            the signature tuple
+        """
+        return self.get_one().get_signature()
+
+    def get_spatial_dims(self: Self) -> tuple[int, ...]:
+        """
+        Get the spatial dimensions of the MultiImages produced by this dataset.
+
+        returns:
+            the spatial dimensions
+        """
+        return self.get_one().get_spatial_dims()
+
+    def to_multi_image(self: Self) -> geom.MultiImage:
+        """
+        Materialize the entire dataset as a single MultiImage.
+
+        returns:
+            the MultiImage of shape (L,channels,spatial,tensor)
+        """
+        return self.get_subset(jnp.arange(self.get_L()))
+
+    def get_nbytes(self: Self) -> int:
+        """
+        Get the number of bytes of the data the dataset is constructed from. Views such as
+        TimeSeriesWindows count their raw data, which is smaller than their materialized samples.
+
+        returns:
+            the number of bytes
+        """
+        return self.get_L() * get_nbytes(self.get_one())
+
+    def device_put(self: Self, device: jax.Device) -> Optional["MultiImageDataset"]:
+        """
+        Put the data the dataset is constructed from on the device, without materializing its
+        samples. Used by DeviceCache to pin a dataset.
+
+        args:
+            device: the device
+
+        returns:
+            the same dataset with its data on the device, or None if it can't be put on a device,
+                such as a dataset which is read from files
+        """
+        return None
+
+    def host_view(
+        self: Self, memo: Optional[dict[int, "MultiImageDataset"]] = None
+    ) -> "MultiImageDataset":
+        """
+        Get a view of the dataset which only supports get_host_subset, which is sent to the worker
+        processes of a `WorkerLoader`. It holds only what get_host_subset needs, so it can be
+        pickled without JAX arrays, open files, or functions such as the transform of a source,
+        which are only used by from_host. Defaults to the dataset itself.
+
+        args:
+            memo: map from the id of each dataset to its view, so that a dataset shared by several
+                datasets, such as the source of the X and Y of `lazy_batch_time_series`, has a
+                single view
+
+        returns:
+            the view of the dataset
+        """
+        return self
+
+
+class TimeSeriesWindows(MultiImageDataset):
+    """
+    A lazy view of the overlapping windows of a batch of time series. Rather than storing every
+    window, which duplicates each frame once per window it appears in, only the raw time series are
+    stored and the windows of a batch are gathered when get_subset is called. Constant fields
+    shared by every trajectory are stored once and broadcast into each batch. The time series may
+    themselves be a MultiImageDataset, such as an HDF5TrajectorySource, in which case only the
+    trajectories of the batch are loaded. The samples are ordered the same as `batch_time_series`,
+    by trajectory then by window.
+    """
+
+    fields: Union[geom.MultiImage, MultiImageDataset]
+    constant_fields: geom.MultiImage
+    time_idxs: jax.Array
+    total_steps: int
+    batched_constants: bool
+    host_time_idxs: np.ndarray
+    host_fields: Optional[dict[str, np.ndarray]]
+
+    def __init__(
+        self: Self,
+        fields: Union[geom.MultiImage, MultiImageDataset],
+        constant_fields: geom.MultiImage,
+        time_idxs: jax.Array,
+        total_steps: int,
+    ) -> None:
+        """
+        Construct the view of windows of the time series.
+
+        args:
+            fields: the time series, shape (trajectories,channels*time,spatial,tensor)
+            constant_fields: fields appended to every window, shape
+                (trajectories,channels,spatial,tensor) or (channels,spatial,tensor) if shared
+            time_idxs: the timesteps of each window, shape (windows,steps)
+            total_steps: total number of timesteps of each channel of fields
+        """
+        assert len(time_idxs.shape) == 2, (
+            f"TimeSeriesWindows: time_idxs must have shape (windows,steps), "
+            f"but got {time_idxs.shape}"
+        )
+        self.D = fields.D
+        self.is_torus = fields.is_torus
+        self.fields = fields
+        self.constant_fields = constant_fields
+        self.time_idxs = time_idxs
+        self.total_steps = total_steps
+
+        sample_fields = fields if isinstance(fields, geom.MultiImage) else fields.get_one()
+        self.batched_constants = is_batched_constant(sample_fields, constant_fields)
+
+        # numpy views used by get_host_subset, which are free for time series on the cpu
+        self.host_time_idxs = np.asarray(time_idxs)
+        self.host_fields = None
+        if isinstance(fields, geom.MultiImage):
+            self.host_fields = {
+                block_name(k, parity): np.asarray(image_block)
+                for (k, parity), image_block in fields.items()
+            }
+
+    def get_L(self: Self) -> int:
+        return self.fields.get_L() * len(self.time_idxs)
+
+    def get_nbytes(self: Self) -> int:
+        return get_nbytes(self.fields) + get_nbytes(self.constant_fields) + self.time_idxs.nbytes
+
+    def device_put(self: Self, device: jax.Device) -> Optional[Self]:
+        if not isinstance(self.fields, geom.MultiImage):
+            return None
+
+        # the host views still hold the same data, so they are kept for get_host_subset
+        pinned = copy.copy(self)
+        pinned.fields = jax.device_put(self.fields, device)
+        pinned.constant_fields = jax.device_put(self.constant_fields, device)
+        pinned.time_idxs = jax.device_put(self.time_idxs, device)
+        return pinned
+
+    def host_view(
+        self: Self, memo: Optional[dict[int, MultiImageDataset]] = None
+    ) -> MultiImageDataset:
+        memo = {} if memo is None else memo
+        view = copy.copy(self)
+        if isinstance(self.fields, MultiImageDataset):
+            view.fields = self.fields.host_view(memo)
+        else:
+            view.fields = geom.MultiImage({}, self.D, self.is_torus)  # host_fields are used
+
+        view.constant_fields = geom.MultiImage({}, self.D, self.is_torus)
+        return view
+
+    def get_subset(self: Self, idxs: jax.Array) -> geom.MultiImage:
+        assert isinstance(
+            idxs, jnp.ndarray
+        ), "TimeSeriesWindows::get_subset arg idxs must be a jax array"
+        n_windows, n_steps = self.time_idxs.shape
+        traj_idxs = idxs // n_windows
+        time_idxs = self.time_idxs[idxs % n_windows]  # (batch,steps)
+
+        if isinstance(self.fields, geom.MultiImage):
+            fields = self.fields
+            field_idxs = traj_idxs
+        else:
+            # only load each trajectory of the batch once
+            unique_idxs, field_idxs = np.unique(np.asarray(traj_idxs), return_inverse=True)
+            fields = self.fields.get_subset(jnp.array(unique_idxs))
+            field_idxs = jnp.array(field_idxs.reshape(-1))
+
+        out = geom.MultiImage({}, self.D, self.is_torus)
+        for (k, parity), image_block in fields.items():
+            out.append(k, parity, self._gather_windows(image_block, field_idxs, time_idxs))
+
+        return self._append_constants(out, traj_idxs)
+
+    def get_host_subset(self: Self, idxs: np.ndarray) -> dict[str, np.ndarray]:
+        n_windows = len(self.host_time_idxs)
+        traj_idxs = idxs // n_windows
+        time_idxs = self.host_time_idxs[idxs % n_windows]  # (batch,steps)
+
+        if self.host_fields is not None:
+            host_subset = {
+                name: self._gather_windows(image_block, traj_idxs, time_idxs)
+                for name, image_block in self.host_fields.items()
+            }
+        else:
+            # load the trajectories in the worker, the windows are gathered on the device
+            unique_idxs, field_idxs = np.unique(traj_idxs, return_inverse=True)
+            host_subset = {
+                f"fields/{name}": arr
+                for name, arr in self.fields.get_host_subset(unique_idxs).items()
+            }
+            host_subset["field_idxs"] = field_idxs.reshape(-1)
+            host_subset["time_idxs"] = time_idxs
+
+        host_subset["traj_idxs"] = traj_idxs
+        return host_subset
+
+    def from_host(self: Self, host_subset: dict[str, np.ndarray]) -> geom.MultiImage:
+        out = geom.MultiImage({}, self.D, self.is_torus)
+        if self.host_fields is not None:
+            for name in self.host_fields.keys():
+                k, parity = parse_block_name(name)
+                out.append(k, parity, jnp.asarray(host_subset[name]))
+        else:
+            assert isinstance(self.fields, MultiImageDataset)
+            fields = self.fields.from_host(
+                {
+                    name[len("fields/") :]: arr
+                    for name, arr in host_subset.items()
+                    if name.startswith("fields/")
+                }
+            )
+            field_idxs = jnp.asarray(host_subset["field_idxs"])
+            time_idxs = jnp.asarray(host_subset["time_idxs"])
+            for (k, parity), image_block in fields.items():
+                out.append(k, parity, self._gather_windows(image_block, field_idxs, time_idxs))
+
+        return self._append_constants(out, jnp.asarray(host_subset["traj_idxs"]))
+
+    def _gather_windows(self: Self, image_block: Any, field_idxs: Any, time_idxs: Any) -> Any:
+        """
+        Gather the windows of an image block of the time series, with either jax or numpy arrays.
+
+        args:
+            image_block: the time series, shape (trajectories,channels*time,spatial,tensor)
+            field_idxs: the trajectory of each window, shape (batch,)
+            time_idxs: the timesteps of each window, shape (batch,steps)
+
+        returns:
+            the windows, shape (batch,channels*steps,spatial,tensor)
+        """
+        xp = np if isinstance(image_block, np.ndarray) else jnp
+        img_shape = image_block.shape[2:]
+        exp_block = image_block.reshape((len(image_block), -1, self.total_steps) + img_shape)
+        # advanced indices separated by a slice go first, so this is (batch,steps,channels,...)
+        windows = exp_block[field_idxs[:, None], :, time_idxs]
+        return xp.moveaxis(windows, 1, 2).reshape((len(field_idxs), -1) + img_shape)
+
+    def _append_constants(
+        self: Self, out: geom.MultiImage, traj_idxs: jax.Array
+    ) -> geom.MultiImage:
+        """
+        Append the constant fields of each window to a batch of windows.
+
+        args:
+            out: the batch of windows
+            traj_idxs: the trajectory of each window, shape (batch,)
+
+        returns:
+            the batch with the constant fields as the last channels
+        """
+        if not self.batched_constants:
+            return _broadcast_constants(out, self.constant_fields, len(traj_idxs))
+
+        for (k, parity), image_block in self.constant_fields.items():
+            out.append(k, parity, image_block[traj_idxs], axis=1)
+
+        return out
+
+
+def _broadcast_constants(
+    out: geom.MultiImage, constant_fields: geom.MultiImage, batch: int
+) -> geom.MultiImage:
+    """
+    Append constant fields shared by every sample to a batch, broadcasting them over the batch.
+
+    args:
+        out: the batch, shape (batch,channels,spatial,tensor)
+        constant_fields: the shared constant fields, shape (channels,spatial,tensor)
+        batch: the size of the batch
+
+    returns:
+        the batch with the constant fields as the last channels
+    """
+    for (k, parity), image_block in constant_fields.items():
+        out.append(k, parity, jnp.broadcast_to(image_block, (batch,) + image_block.shape), axis=1)
+
+    return out
+
+
+class ConstantFieldsView(MultiImageDataset):
+    """
+    A view of a MultiImage of samples and constant fields shared by every sample, such as the
+    orography of a dataset where every trajectory is on the same grid. The constant fields are
+    stored once and broadcast into each batch as its last channels, rather than being copied into
+    every sample. Returned by `batch_time_series` for shared constant fields.
+    """
+
+    fields: geom.MultiImage
+    constant_fields: geom.MultiImage
+    host_fields: dict[str, np.ndarray]
+
+    def __init__(self: Self, fields: geom.MultiImage, constant_fields: geom.MultiImage) -> None:
+        """
+        Construct the view.
+
+        args:
+            fields: the samples, shape (samples,channels,spatial,tensor)
+            constant_fields: fields appended to every sample, shape (channels,spatial,tensor)
+        """
+        assert (
+            len(constant_fields.values()) == 0
+            or fields.get_n_leading() == constant_fields.get_n_leading() + 1
+        ), (
+            f"ConstantFieldsView: constant fields must have one less leading axis than the fields, "
+            f"but got {constant_fields.get_n_leading()} and {fields.get_n_leading()}"
+        )
+        self.D = fields.D
+        self.is_torus = fields.is_torus
+        self.fields = fields
+        self.constant_fields = constant_fields
+        # numpy views used by get_host_subset, which are free for samples on the cpu
+        self.host_fields = {
+            block_name(k, parity): np.asarray(image_block)
+            for (k, parity), image_block in fields.items()
+        }
+
+    def get_L(self: Self) -> int:
+        return self.fields.get_L()
+
+    def get_nbytes(self: Self) -> int:
+        return get_nbytes(self.fields) + get_nbytes(self.constant_fields)
+
+    def device_put(self: Self, device: jax.Device) -> Self:
+        # the host views still hold the same data, so they are kept for get_host_subset
+        pinned = copy.copy(self)
+        pinned.fields = jax.device_put(self.fields, device)
+        pinned.constant_fields = jax.device_put(self.constant_fields, device)
+        return pinned
+
+    def host_view(
+        self: Self, memo: Optional[dict[int, MultiImageDataset]] = None
+    ) -> MultiImageDataset:
+        view = copy.copy(self)  # host_fields are used
+        view.fields = geom.MultiImage({}, self.D, self.is_torus)
+        view.constant_fields = geom.MultiImage({}, self.D, self.is_torus)
+        return view
+
+    def get_subset(self: Self, idxs: jax.Array) -> geom.MultiImage:
+        return _broadcast_constants(self.fields.get_subset(idxs), self.constant_fields, len(idxs))
+
+    def get_host_subset(self: Self, idxs: np.ndarray) -> dict[str, np.ndarray]:
+        return {name: image_block[idxs] for name, image_block in self.host_fields.items()}
+
+    def from_host(self: Self, host_subset: dict[str, np.ndarray]) -> geom.MultiImage:
+        out = geom.MultiImage({}, self.D, self.is_torus)
+        for name in self.host_fields.keys():
+            k, parity = parse_block_name(name)
+            out.append(k, parity, jnp.asarray(host_subset[name]))
+
+        return _broadcast_constants(out, self.constant_fields, out.get_L())
+
+
+class HDF5TrajectorySource(MultiImageDataset):
+    """
+    A lazy source of trajectories stored in an HDF5 file, where each dataset of the file has shape
+    (trajectories,time,spatial,tensor). Each sample is a single trajectory, assembled into a
+    MultiImage of shape (channels*time,spatial,tensor) according to a layout which maps each
+    (k,parity) to the datasets of its channels. Nothing is read until get_subset is called, and
+    then the requested trajectories are read one chunk of the file at a time, so each compressed
+    chunk is only decompressed once per call. Can be used as the fields of `lazy_batch_time_series`.
+    The trajectories of the last call are kept, so views which share the source, such as the X and
+    Y of `lazy_batch_time_series`, read the trajectories of each batch from the file only once.
+
+    Reads may be spread over worker threads. Note that h5py serializes its calls into the HDF5
+    library with a global lock, so the threads mostly overlap the decompression filters that release
+    it (such as those of hdf5plugin) and the numpy assembly of the chunks.
+    """
+
+    filename: str
+    layout: dict[tuple[int, int], Sequence[Union[str, Sequence[str]]]]
+    start: int
+    n_trajectories: int
+    total_steps: int
+    chunk_len: int
+    num_workers: int
+    transform: Optional[Callable[[geom.MultiImage], geom.MultiImage]]
+    file: Any
+    pid: int
+    last_read: Optional[tuple[bytes, dict[str, np.ndarray]]]
+
+    def __init__(
+        self: Self,
+        filename: str,
+        layout: dict[tuple[int, int], Sequence[Union[str, Sequence[str]]]],
+        D: int,
+        is_torus: Union[bool, tuple[bool, ...]] = True,
+        start: int = 0,
+        n_trajectories: Optional[int] = None,
+        num_workers: int = 0,
+        transform: Optional[Callable[[geom.MultiImage], geom.MultiImage]] = None,
+    ) -> None:
+        """
+        Construct the source. Requires h5py, and any plugins needed to decompress the file, such
+        as hdf5plugin, must be imported before reading.
+
+        args:
+            filename: the HDF5 file
+            layout: map from (k,parity) to a list of channels, where each channel is either the
+                name of a dataset, or a list of the names of the datasets of each component of a
+                vector, which are stacked on a new last axis
+            D: dimension of the images
+            is_torus: whether the images are a torus
+            start: index of the first trajectory of the file to use
+            n_trajectories: number of trajectories to use, defaults to all after start
+            num_workers: number of threads used to read chunks, 0 reads in the calling thread
+            transform: function applied to each MultiImage that is read, such as a normalization
+        """
+        import h5py
+
+        self.filename = filename
+        self.layout = layout
+        self.D = D
+        self.is_torus = (is_torus,) * D if isinstance(is_torus, bool) else is_torus
+        self.start = start
+        self.num_workers = num_workers
+        self.transform = transform
+        self.file = h5py.File(filename, "r")
+        self.pid = os.getpid()
+        self.last_read = None
+
+        first_dataset = self.file[self.dataset_names()[0]]
+        available = len(first_dataset) - start
+        if n_trajectories is not None and n_trajectories > available:
+            warnings.warn(
+                f"HDF5TrajectorySource: wanted {n_trajectories} trajectories, "
+                f"but only found {available}"
+            )
+
+        n_trajectories = available if n_trajectories is None else n_trajectories
+        self.n_trajectories = min(n_trajectories, available)
+        self.total_steps = first_dataset.shape[1]
+        self.chunk_len = first_dataset.chunks[0] if first_dataset.chunks else len(first_dataset)
+
+    def dataset_names(self: Self) -> list[str]:
+        """
+        Get the names of all the datasets used by the layout.
+
+        returns:
+            the dataset names, in layout order
+        """
+        names = []
+        for channels in self.layout.values():
+            for channel in channels:
+                names.extend([channel] if isinstance(channel, str) else channel)
+
+        return names
+
+    def close(self: Self) -> None:
+        """
+        Close the HDF5 file.
+        """
+        self.file.close()
+
+    def get_L(self: Self) -> int:
+        return self.n_trajectories
+
+    def host_view(
+        self: Self, memo: Optional[dict[int, MultiImageDataset]] = None
+    ) -> MultiImageDataset:
+        memo = {} if memo is None else memo
+        if id(self) not in memo:
+            view = copy.copy(self)
+            view.transform = None
+            view.file = None  # reopened by _read_rows in the worker
+            view.pid = -1
+            view.last_read = None
+            memo[id(self)] = view
+
+        return memo[id(self)]
+
+    def _read_rows(self: Self, name: str, file_idxs: np.ndarray) -> np.ndarray:
+        """
+        Read the rows file_idxs of a dataset, which must be sorted and unique, from one chunk.
+        """
+        if os.getpid() != self.pid:
+            # HDF5 file handles can't be shared with a worker process, so reopen the file
+            import h5py
+
+            self.file = h5py.File(self.filename, "r")
+            self.pid = os.getpid()
+
+        dataset = self.file[name]
+        first = int(file_idxs[0])
+        return dataset[first : int(file_idxs[-1]) + 1][file_idxs - first]
+
+    def get_subset(self: Self, idxs: jax.Array) -> geom.MultiImage:
+        assert isinstance(
+            idxs, jnp.ndarray
+        ), "HDF5TrajectorySource::get_subset arg idxs must be a jax array"
+        return self.from_host(self.get_host_subset(np.asarray(idxs)))
+
+    def get_host_subset(self: Self, idxs: np.ndarray) -> dict[str, np.ndarray]:
+        read_key = np.asarray(idxs, dtype=np.int64).tobytes()
+        if self.last_read is not None and self.last_read[0] == read_key:
+            return self.last_read[1]
+
+        unique_idxs, inverse = np.unique(idxs + self.start, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        # group the requested trajectories by the chunk of the file that they are in
+        chunk_groups = np.split(
+            unique_idxs, np.flatnonzero(np.diff(unique_idxs // self.chunk_len)) + 1
+        )
+        names = self.dataset_names()
+        tasks = [(name, group) for name in names for group in chunk_groups]
+        if self.num_workers > 0:
+            with ThreadPoolExecutor(self.num_workers) as executor:
+                results = list(executor.map(lambda task: self._read_rows(*task), tasks))
+        else:
+            results = [self._read_rows(*task) for task in tasks]
+
+        n_groups = len(chunk_groups)
+        rows = {
+            name: np.concatenate(results[i * n_groups : (i + 1) * n_groups])[inverse]
+            for i, name in enumerate(names)
+        }
+
+        host_subset = {}
+        for (k, parity), channels in self.layout.items():
+            channel_data = []
+            for channel in channels:
+                if isinstance(channel, str):
+                    channel_data.append(rows[channel])
+                else:
+                    channel_data.append(np.stack([rows[name] for name in channel], axis=-1))
+
+            # (batch,channels,time,spatial,tensor) -> (batch,channels*time,spatial,tensor)
+            block = np.stack(channel_data, axis=1)
+            host_subset[block_name(k, parity)] = block.reshape((len(idxs), -1) + block.shape[3:])
+
+        self.last_read = (read_key, host_subset)
+        return host_subset
+
+    def from_host(self: Self, host_subset: dict[str, np.ndarray]) -> geom.MultiImage:
+        out = geom.MultiImage({}, self.D, self.is_torus)
+        for k, parity in self.layout.keys():
+            out.append(k, parity, jnp.array(host_subset[block_name(k, parity)]))
+
+        return out if self.transform is None else self.transform(out)
+
+    def iter_chunks(self: Self) -> Iterator[geom.MultiImage]:
+        """
+        Iterate over all the trajectories in order, one chunk of the file at a time.
+
+        returns:
+            an iterator of MultiImages of shape (chunk,channels*time,spatial,tensor)
+        """
+        first_chunk = self.start // self.chunk_len
+        for chunk in range(first_chunk, math.ceil((self.start + self.get_L()) / self.chunk_len)):
+            start = max(chunk * self.chunk_len, self.start) - self.start
+            stop = min((chunk + 1) * self.chunk_len - self.start, self.get_L())
+            yield self.get_subset(jnp.arange(start, stop))
+
+
+def lazy_batch_time_series(
+    dynamic_fields: Union[geom.MultiImage, MultiImageDataset],
+    constant_fields: geom.MultiImage,
+    total_steps: int,
+    past_steps: int,
+    future_steps: int,
+    skip_initial: int = 0,
+    delta_t: int = 1,
+    downsample: int = 0,
+) -> tuple[TimeSeriesWindows, TimeSeriesWindows]:
+    """
+    The lazy version of `batch_time_series`. Rather than constructing the input and output
+    MultiImages of every window, this returns views which gather the windows of a batch on demand,
+    so the memory used is that of the time series rather than that of all the overlapping windows.
+    The samples are the same, and in the same order, as `batch_time_series`.
+
+    args:
+        dynamic_fields: the dynamic fields, shape (batch,channels*time,spatial,tensor), or a
+            MultiImageDataset of trajectories such as an HDF5TrajectorySource
+        constant_fields: the constant fields, shape (batch,channels,spatial,tensor), or
+            (channels,spatial,tensor) if they are shared by every trajectory
+        total_steps: total number of timesteps we are working with
+        past_steps: number of historical steps to use in the model
+        future_steps: number of future steps
+        skip_initial: number of initial time steps to skip
+        delta_t: number of timesteps per model step
+        downsample: number of times to downsample the image by average pooling, decreases by a factor
+            of 2. Must be 0 if dynamic_fields is a MultiImageDataset.
+
+    returns:
+        tuple of views multi_image_X and multi_image_Y
+    """
+    input_idxs, output_idxs = time_series_idxs(
+        past_steps, future_steps, delta_t, total_steps - skip_initial
+    )
+
+    if isinstance(dynamic_fields, MultiImageDataset):
+        assert downsample == 0, "lazy_batch_time_series: cannot downsample a MultiImageDataset"
+    else:
+        assert len(dynamic_fields.values()) != 0
 
     for _ in range(downsample):
-        multi_image_x = multi_image_x.average_pool(2)
-        multi_image_y = multi_image_y.average_pool(2)
+        dynamic_fields = dynamic_fields.average_pool(2)
+        constant_fields = constant_fields.average_pool(2)
 
+    multi_image_x = TimeSeriesWindows(
+        dynamic_fields, constant_fields, skip_initial + input_idxs, total_steps
+    )
+    multi_image_y = TimeSeriesWindows(
+        dynamic_fields,
+        geom.MultiImage({}, dynamic_fields.D, dynamic_fields.is_torus),
+        skip_initial + output_idxs,
+        total_steps,
+    )
     return multi_image_x, multi_image_y
+
+
+# ------------------------------------------------------------------------------
+# Device caching
+
+
+def get_nbytes(multi_images: Union[geom.MultiImage, MultiImageDataset]) -> int:
+    """
+    Get the number of bytes of a MultiImage, or of the data a dataset is constructed from.
+
+    args:
+        multi_images: the MultiImage or MultiImageDataset
+
+    returns:
+        the number of bytes
+    """
+    if isinstance(multi_images, MultiImageDataset):
+        return multi_images.get_nbytes()
+    else:
+        return sum(image_block.nbytes for image_block in multi_images.values())
+
+
+class DeviceCache(MultiImageDataset):
+    """
+    A dataset which keeps its data on the compute device when it fits within a memory budget. If it
+    is pinned on the device, batches are gathered there and there is no host to device traffic
+    after the initial transfer. Otherwise, the data stays on the host and each batch is gathered on
+    the host and then transferred. The bytes transferred are counted in h2d_bytes, which `ml.train`
+    reports each epoch.
+
+    A MultiImageDataset is never materialized. Views such as TimeSeriesWindows are pinned by putting
+    their raw data on the device and gathering the samples of each batch there. Datasets which can't
+    be put on a device, such as those read from files, are always paged.
+    """
+
+    data: Union[geom.MultiImage, MultiImageDataset]
+    device: jax.Device
+    is_pinned: bool
+    h2d_bytes: int
+
+    def __init__(
+        self: Self,
+        data: Union[geom.MultiImage, MultiImageDataset],
+        memory_budget: Optional[int] = None,
+        device: Optional[jax.Device] = None,
+    ) -> None:
+        """
+        Constructor for the DeviceCache.
+
+        args:
+            data: the MultiImage or MultiImageDataset, typically on the cpu
+            memory_budget: the maximum number of bytes to pin on the device. Defaults to half the
+                free memory of the device when the device reports it, otherwise the data is paged.
+            device: the device to cache on, defaults to jax.devices()[0]
+        """
+        self.device = jax.devices()[0] if device is None else device
+        self.D = data.D
+        self.is_torus = data.is_torus
+
+        if memory_budget is None:
+            memory_stats = self.device.memory_stats()
+            if memory_stats is not None and "bytes_limit" in memory_stats:
+                free_bytes = memory_stats["bytes_limit"] - memory_stats.get("bytes_in_use", 0)
+                memory_budget = free_bytes // 2
+
+        nbytes = get_nbytes(data)
+        pinned_data = None
+        if memory_budget is not None and nbytes <= memory_budget:
+            if isinstance(data, geom.MultiImage):
+                pinned_data = jax.device_put(data, self.device)
+            else:
+                pinned_data = data.device_put(self.device)
+
+        self.is_pinned = pinned_data is not None
+        self.h2d_bytes = 0
+        if pinned_data is not None:
+            self.data = pinned_data
+            self.h2d_bytes += nbytes
+        else:
+            # on the host as numpy, so batches can also be assembled by worker processes
+            self.data = HostMultiImage(data) if isinstance(data, geom.MultiImage) else data
+
+    def get_L(self: Self) -> int:
+        """
+        Get the number of samples in the dataset.
+
+        returns:
+            the number of samples
+        """
+        return self.data.get_L()
+
+    def get_nbytes(self: Self) -> int:
+        return get_nbytes(self.data)
+
+    def host_view(
+        self: Self, memo: Optional[dict[int, MultiImageDataset]] = None
+    ) -> MultiImageDataset:
+        view = copy.copy(self)
+        if self.is_pinned:
+            view.data = geom.MultiImage({}, self.D, self.is_torus)  # gathered on the device
+        else:
+            assert isinstance(self.data, MultiImageDataset)
+            view.data = self.data.host_view(memo)
+
+        return view
+
+    def get_subset(self: Self, idxs: jax.Array) -> geom.MultiImage:
+        """
+        Construct the MultiImage of the samples idxs on the device.
+
+        args:
+            idxs (jnp.array): array of indices to select the subset
+
+        returns:
+            a MultiImage of shape (len(idxs),channels,spatial,tensor)
+        """
+        if self.is_pinned:
+            return self.data.get_subset(jax.device_put(idxs, self.device))
+        else:
+            subset = self.data.get_subset(idxs)
+            self.h2d_bytes += get_nbytes(subset)
+            return jax.device_put(subset, self.device)
+
+    def get_host_subset(self: Self, idxs: np.ndarray) -> dict[str, np.ndarray]:
+        if self.is_pinned:
+            return {"idxs": idxs}  # gathered on the device by from_host
+        else:
+            assert isinstance(self.data, MultiImageDataset)
+            return self.data.get_host_subset(idxs)
+
+    def from_host(self: Self, host_subset: dict[str, np.ndarray]) -> geom.MultiImage:
+        if self.is_pinned:
+            return self.get_subset(jnp.asarray(host_subset["idxs"]))
+        else:
+            assert isinstance(self.data, MultiImageDataset)
+            subset = self.data.from_host(host_subset)
+            self.h2d_bytes += get_nbytes(subset)
+            return jax.device_put(subset, self.device)
+
+
+# ------------------------------------------------------------------------------
+# Data augmentation
+
+
+@functools.partial(jax.jit, static_argnums=[0, 2, 6])
+def _augment_block(
+    D: int,
+    image_block: jax.Array,
+    parity: int,
+    op_idxs: jax.Array,
+    pixel_idxs: jax.Array,
+    operators: jax.Array,
+    precision: Optional[jax.lax.Precision] = None,
+) -> jax.Array:
+    """
+    Apply a possibly different group element to each sample of an image block.
+
+    args:
+        D: dimension of the images
+        image_block: the block, shape (samples,channels,spatial,tensor)
+        parity: parity of the block
+        op_idxs: the index of the operator applied to each sample, shape (samples,)
+        pixel_idxs: for each operator, the flat index of the pixel that moves to each pixel, shape
+            (operators,pixels)
+        operators: the operators, shape (operators,D,D)
+        precision: einsum precision
+
+    returns:
+        the transformed block
+    """
+    n_samples, n_channels = image_block.shape[:2]
+    _, k = geom.parse_shape(image_block.shape[2:], D)
+    block = image_block.reshape((n_samples, n_channels, -1) + (D,) * k)
+    # gather the pixels of each sample with the indices of its operator, (samples,channels,pixels)
+    block = jax.vmap(lambda sample, idxs: sample[:, idxs])(block, pixel_idxs[op_idxs])
+
+    ggs = operators[op_idxs]  # (samples,D,D)
+    # the operators are signed permutations, so they are exact in the block's dtype, and casting
+    # them keeps a bf16/f16 block from being promoted by the einsum
+    parity_flip = (jnp.linalg.det(ggs) ** parity).astype(image_block.dtype)
+    ggs = ggs.astype(image_block.dtype)
+    for tensor_axis in range(3, 3 + k):
+        block = jnp.moveaxis(block, tensor_axis, -1)
+        block = jnp.einsum("s...j,sij->s...i", block, ggs, precision=precision)
+        block = jnp.moveaxis(block, -1, tensor_axis)
+
+    block = block * parity_flip.reshape((n_samples,) + (1,) * (block.ndim - 1))
+    return block.reshape(image_block.shape)
+
+
+class GroupAugmentation:
+    """
+    Data augmentation by random elements of a group of operators, such as `make_all_operators(D)`,
+    applied on the device to whole batches. Each sample gets its own random operator, and the
+    gather indices of every operator are computed once, so a batch is transformed by a single
+    gather and einsum per (k,parity). Only operators that map the grid onto itself are used, so for
+    non-square images the rotations that exchange axes of different lengths are dropped.
+    """
+
+    D: int
+    operators: jax.Array
+    pixel_idxs: jax.Array
+
+    def __init__(
+        self: Self, D: int, spatial_dims: tuple[int, ...], operators: Sequence[np.ndarray]
+    ) -> None:
+        """
+        Constructor for GroupAugmentation.
+
+        args:
+            D: dimension of the images
+            spatial_dims: spatial dimensions of the images
+            operators: the group operators, DxD matrices
+        """
+        self.D = D
+        operators = [
+            gg
+            for gg in operators
+            if np.array_equal(np.abs(gg @ np.array(spatial_dims)), np.array(spatial_dims))
+        ]
+        assert len(operators) > 0, f"GroupAugmentation: no operators preserve {spatial_dims}"
+
+        pixel_idxs = []
+        for gg in operators:
+            rotated_keys = geom.get_rotated_keys(D, np.zeros(spatial_dims), gg)
+            pixel_idxs.append(
+                np.ravel_multi_index(tuple(rotated_keys.T), spatial_dims, mode="wrap")
+            )
+
+        self.operators = jnp.array(np.stack(operators), dtype=float)
+        self.pixel_idxs = jnp.array(np.stack(pixel_idxs))
+
+    def apply(
+        self: Self,
+        multi_image: geom.MultiImage,
+        op_idxs: jax.Array,
+        precision: Optional[jax.lax.Precision] = None,
+    ) -> geom.MultiImage:
+        """
+        Apply the operators op_idxs to the samples of a MultiImage.
+
+        args:
+            multi_image: MultiImage of shape (samples,channels,spatial,tensor), with any number of
+                leading axes before channels which are all treated as samples
+            op_idxs: the index of the operator of each sample, with the shape of the sample axes
+            precision: einsum precision, for equality tests use Precision.HIGH
+
+        returns:
+            the transformed MultiImage
+        """
+        n_samples = op_idxs.size
+        out = multi_image.empty()
+        for (k, parity), image_block in multi_image.items():
+            augmented_block = _augment_block(
+                self.D,
+                image_block.reshape((n_samples, -1) + image_block.shape[op_idxs.ndim + 1 :]),
+                parity,
+                op_idxs.reshape(-1),
+                self.pixel_idxs,
+                self.operators,
+                precision,
+            )
+            out.append(k, parity, augmented_block.reshape(image_block.shape))
+
+        return out
+
+    def __call__(
+        self: Self, key: ArrayLike, *multi_images: geom.MultiImage
+    ) -> tuple[geom.MultiImage, ...]:
+        """
+        Draw a random operator for each sample, and apply it to that sample of every MultiImage,
+        so inputs and targets stay consistent.
+
+        args:
+            key: jax.random key
+            multi_images: MultiImages with the same sample axes, e.g. a batch (X,Y)
+
+        returns:
+            the transformed MultiImages
+        """
+        sample_shape = next(iter(multi_images[0].values())).shape[
+            : multi_images[0].get_n_leading() - 1
+        ]
+        op_idxs = jax.random.randint(key, sample_shape, 0, len(self.operators))
+        return tuple(self.apply(multi_image, op_idxs) for multi_image in multi_images)
+
+
+# ------------------------------------------------------------------------------
+# Worker processes
+
+
+class HostMultiImage(MultiImageDataset):
+    """
+    A MultiImage held as numpy arrays, so that its batches can be gathered by worker processes.
+    For a MultiImage on the cpu, the arrays are views of the same memory.
+    """
+
+    blocks: dict[str, np.ndarray]
+
+    def __init__(self: Self, multi_image: geom.MultiImage) -> None:
+        """
+        Constructor for HostMultiImage.
+
+        args:
+            multi_image: the MultiImage, shape (samples,channels,spatial,tensor)
+        """
+        self.D = multi_image.D
+        self.is_torus = multi_image.is_torus
+        self.blocks = {
+            block_name(k, parity): np.asarray(image_block)
+            for (k, parity), image_block in multi_image.items()
+        }
+
+    def get_L(self: Self) -> int:
+        return len(next(iter(self.blocks.values())))
+
+    def get_nbytes(self: Self) -> int:
+        return sum(image_block.nbytes for image_block in self.blocks.values())
+
+    def get_subset(self: Self, idxs: jax.Array) -> geom.MultiImage:
+        return self.from_host(self.get_host_subset(np.asarray(idxs)))
+
+    def get_host_subset(self: Self, idxs: np.ndarray) -> dict[str, np.ndarray]:
+        return {name: image_block[idxs] for name, image_block in self.blocks.items()}
+
+    def from_host(self: Self, host_subset: dict[str, np.ndarray]) -> geom.MultiImage:
+        out = geom.MultiImage({}, self.D, self.is_torus)
+        for name in self.blocks.keys():
+            k, parity = parse_block_name(name)
+            out.append(k, parity, jnp.asarray(host_subset[name]))
+
+        return out
+
+
+class _SharedArrayPickler(pickle.Pickler):
+    """
+    Pickles the host views of datasets for the worker processes of a `WorkerLoader`. Large numpy
+    arrays are copied once into shared memory, which every worker maps, rather than into the
+    pickle of every worker. JAX arrays are sent as numpy arrays and devices are dropped, so the
+    workers never hold JAX data.
+    """
+
+    min_shared_bytes: int
+    blocks: list[shared_memory.SharedMemory]
+    shared_ids: dict[tuple, tuple]
+
+    def __init__(self: Self, file: Any, min_shared_bytes: int = 2**20) -> None:
+        """
+        Constructor for the _SharedArrayPickler.
+
+        args:
+            file: the file to write the pickle to
+            min_shared_bytes: arrays with at least this many bytes are put in shared memory
+        """
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.min_shared_bytes = min_shared_bytes
+        self.blocks = []
+        self.shared_ids = {}
+
+    def persistent_id(self: Self, obj: Any) -> Optional[tuple]:
+        if isinstance(obj, jax.Device):
+            return ("device",)
+        if not isinstance(obj, (np.ndarray, jax.Array)):
+            return None
+
+        arr = np.asarray(obj)
+        if arr.nbytes < self.min_shared_bytes:
+            return None if isinstance(obj, np.ndarray) else ("array", arr)
+
+        # views of the same memory, such as a jax array on the cpu and its numpy view, share a block
+        key = (arr.__array_interface__["data"][0], arr.shape, arr.strides, arr.dtype.str)
+        if key not in self.shared_ids:
+            shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+            np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[...] = arr
+            self.blocks.append(shm)
+            self.shared_ids[key] = ("shared", shm.name, arr.shape, arr.dtype.str)
+
+        return self.shared_ids[key]
+
+
+class _SharedArrayUnpickler(pickle.Unpickler):
+    """
+    Unpickles the host views of datasets pickled by `_SharedArrayPickler` in a worker process. The
+    shared memory blocks are kept open in blocks for as long as the views are used.
+    """
+
+    blocks: list[shared_memory.SharedMemory]
+
+    def __init__(self: Self, file: Any) -> None:
+        """
+        Constructor for the _SharedArrayUnpickler.
+
+        args:
+            file: the file to read the pickle from
+        """
+        super().__init__(file)
+        self.blocks = []
+
+    def persistent_load(self: Self, pid: Any) -> Any:
+        if pid[0] == "device":
+            return None
+        elif pid[0] == "array":
+            return pid[1]
+
+        _, name, shape, dtype = pid
+        shm = shared_memory.SharedMemory(name=name)
+        self.blocks.append(shm)
+        return np.ndarray(shape, dtype, buffer=shm.buf)
+
+
+def _worker_loop(task_queue: Any, result_queue: Any) -> None:
+    """
+    The loop of a worker process of a WorkerLoader. A ("datasets", payload) task replaces the
+    datasets with the host views pickled in the payload, see `_SharedArrayPickler`, and is
+    acknowledged with a result of batch_idx -1. For each ("batch", batch_idx, idxs) task it
+    assembles the batch of every dataset with get_host_subset and copies all the arrays into one
+    new shared memory block. Only the name and layout of the block are sent back, so the arrays are
+    never pickled. The batches are assembled with numpy only.
+
+    args:
+        task_queue: queue of the tasks of this worker, or None to stop
+        result_queue: queue of results (batch_idx, shared memory name, layout), where the layout is
+            a list of (dataset index, array name, shape, dtype, offset). If a task failed, the
+            name is None and the layout is the traceback.
+    """
+    datasets = []
+    blocks = []
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+
+        if task[0] == "datasets":
+            # release the old views before closing the shared memory that their arrays map
+            datasets = []
+            for shm in blocks:
+                shm.close()
+
+            try:
+                unpickler = _SharedArrayUnpickler(io.BytesIO(task[1]))
+                datasets = unpickler.load()
+                blocks = unpickler.blocks
+                result_queue.put((-1, None, None))
+            except Exception:
+                blocks = []
+                result_queue.put((-1, None, traceback.format_exc()))
+
+            continue
+
+        _, batch_idx, idxs = task
+        try:
+            arrays = [
+                (i, name, np.ascontiguousarray(arr))
+                for i, dataset in enumerate(datasets)
+                for name, arr in dataset.get_host_subset(idxs).items()
+            ]
+            layout = []
+            offset = 0
+            for i, name, arr in arrays:
+                layout.append((i, name, arr.shape, arr.dtype.str, offset))
+                offset += -(-arr.nbytes // 64) * 64  # keep each array 64 byte aligned
+
+            shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+            for (i, name, arr), (_, _, shape, dtype, offset) in zip(arrays, layout):
+                np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)[...] = arr
+
+            shm.close()
+            result_queue.put((batch_idx, shm.name, layout))
+        except Exception:
+            result_queue.put((batch_idx, None, traceback.format_exc()))
+
+
+class WorkerLoader:
+    """
+    Assembles batches in worker processes, for datasets whose batch assembly (reading files,
+    indexing, windowing) would otherwise hold up training. The workers are spawned on the first
+    call and reused by every later call, so they are started once rather than every epoch. The host
+    views of the datasets, see `MultiImageDataset.host_view`, are sent to the workers when the
+    datasets change, with their large arrays in shared memory. The workers assemble batches with
+    the datasets' get_host_subset, which uses only numpy, and the batches are handed back through
+    shared memory and finished on the device by from_host, which is also where any normalization of
+    the dataset happens. The batches are the same, and in the same order, as `ml.iterate_batches`
+    with the same key, regardless of the number of workers.
+
+    The workers are spawned rather than forked, since forking a process after JAX has started its
+    threads may deadlock the child. Spawned processes import the main module of the program, so a
+    script which uses a WorkerLoader must only run under `if __name__ == "__main__":`. Call close
+    to stop the workers, otherwise they are stopped when the program exits.
+    """
+
+    num_workers: int
+    prefetch: int
+    workers: list[Any]
+    task_queues: list[Any]
+    result_queue: Any
+    sent: list[Union[geom.MultiImage, MultiImageDataset]]
+
+    def __init__(self: Self, num_workers: int, prefetch: int = 2) -> None:
+        """
+        Constructor for WorkerLoader.
+
+        args:
+            num_workers: number of worker processes
+            prefetch: number of batches each worker may assemble ahead of training
+        """
+        assert num_workers > 0, f"WorkerLoader: num_workers must be positive, got {num_workers}"
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.workers = []
+        self.task_queues = []
+        self.result_queue = None
+        self.sent = []  # the datasets whose host views the workers hold
+
+    def start(self: Self) -> None:
+        """
+        Spawn the worker processes, if they are not already running.
+        """
+        if self.workers:
+            return
+
+        ctx = mp.get_context("spawn")
+        resource_tracker.ensure_running()  # shared by the workers, so they can hand off blocks
+        self.task_queues = [ctx.Queue() for _ in range(self.num_workers)]
+        self.result_queue = ctx.Queue()
+        self.workers = [
+            ctx.Process(target=_worker_loop, args=(task_queue, self.result_queue), daemon=True)
+            for task_queue in self.task_queues
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def close(self: Self) -> None:
+        """
+        Stop the worker processes. A later call starts new ones.
+        """
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+
+        self.workers = []
+        self.task_queues = []
+        self.result_queue = None
+        self.sent = []
+
+    def _get_result(self: Self) -> tuple[int, Optional[str], Any]:
+        """
+        Wait for the next result of the workers.
+
+        returns:
+            the result (batch_idx, shared memory name, layout)
+        """
+        while True:
+            try:
+                return self.result_queue.get(timeout=1)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    self.close()
+                    raise RuntimeError("WorkerLoader: a worker process exited unexpectedly")
+
+    def _send_datasets(self: Self, datasets: Sequence[MultiImageDataset]) -> None:
+        """
+        Replace the datasets of every worker with the host views of datasets.
+
+        args:
+            datasets: the datasets
+        """
+        buffer = io.BytesIO()
+        pickler = _SharedArrayPickler(buffer)
+        memo = {}
+        pickler.dump([dataset.host_view(memo) for dataset in datasets])
+        try:
+            for task_queue in self.task_queues:
+                task_queue.put(("datasets", buffer.getvalue()))
+
+            errors = [self._get_result()[2] for _ in self.workers]
+        finally:
+            # every worker has mapped the blocks or failed, so they are freed once the workers do
+            for shm in pickler.blocks:
+                shm.close()
+                shm.unlink()
+
+        for error in errors:
+            if error is not None:
+                self.sent = []
+                raise RuntimeError(f"WorkerLoader: worker failed to load the datasets\n{error}")
+
+    def __call__(
+        self: Self,
+        multi_images: Sequence[Union[geom.MultiImage, MultiImageDataset]],
+        batch_size: int,
+        rand_key: Optional[ArrayLike],
+        devices: Optional[list[jax.Device]] = None,
+    ) -> Iterator[tuple[geom.MultiImage, ...]]:
+        """
+        Iterate over the batches of an epoch.
+
+        args:
+            multi_images: MultiImages or datasets which all get simultaneously batched
+            batch_size: length of the batch
+            rand_key: key for the randomness. If None, the order won't be random
+            devices: gpu/cpu devices to use, if None (default) then sets this to jax.devices()
+
+        returns:
+            iterator of tuples of batches, one per item of multi_images
+        """
+        datasets = [
+            HostMultiImage(multi_image) if isinstance(multi_image, geom.MultiImage) else multi_image
+            for multi_image in multi_images
+        ]
+        devices = jax.devices() if devices is None else devices
+
+        # the same order as ml.iterate_batches
+        L = datasets[0].get_L()
+        batch_indices = np.asarray(
+            jnp.arange(L) if rand_key is None else jax.random.permutation(rand_key, L)
+        )
+        n_batches = L // batch_size  # if L is not divisible by batch, the remainder is ignored
+
+        self.start()
+        if len(self.sent) != len(multi_images) or any(
+            sent is not multi_image for sent, multi_image in zip(self.sent, multi_images)
+        ):
+            self._send_datasets(datasets)
+            self.sent = list(multi_images)
+
+        n_submitted = 0
+        n_received = 0
+        results = {}
+        try:
+            for batch_idx in range(n_batches):
+                while n_submitted < min(n_batches, batch_idx + self.num_workers * self.prefetch):
+                    idxs = batch_indices[n_submitted * batch_size : (n_submitted + 1) * batch_size]
+                    self.task_queues[n_submitted % self.num_workers].put(
+                        ("batch", n_submitted, idxs)
+                    )
+                    n_submitted += 1
+
+                while batch_idx not in results:  # batches may finish out of order
+                    result_batch_idx, shm_name, layout = self._get_result()
+                    results[result_batch_idx] = (shm_name, layout)
+                    n_received += 1
+
+                shm_name, layout = results.pop(batch_idx)
+                if shm_name is None:
+                    raise RuntimeError(f"WorkerLoader: worker failed to assemble a batch\n{layout}")
+
+                host_subsets = [{} for _ in datasets]
+                shm = shared_memory.SharedMemory(name=shm_name)
+                try:
+                    for i, name, shape, dtype, offset in layout:
+                        # copy out of the block, since it is freed before the batch is used
+                        host_subsets[i][name] = np.array(
+                            np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+                        )
+                finally:
+                    shm.close()
+                    shm.unlink()
+
+                yield tuple(
+                    dataset.from_host(host_subset).reshape_pmap(devices)
+                    for dataset, host_subset in zip(datasets, host_subsets)
+                )
+        finally:
+            # wait for the batches that were assembled ahead, so the workers are idle for the next
+            # call, and free the ones that were never used
+            try:
+                while n_received < n_submitted:
+                    result_batch_idx, shm_name, layout = self._get_result()
+                    results[result_batch_idx] = (shm_name, layout)
+                    n_received += 1
+            finally:
+                for shm_name, _ in results.values():
+                    if shm_name is not None:
+                        shm = shared_memory.SharedMemory(name=shm_name)
+                        shm.close()
+                        shm.unlink()
+
+
+# ------------------------------------------------------------------------------
+# Array stores
+
+ARRAY_STORE_METADATA = "metadata.json"
+
+
+def create_array_store(
+    directory: str,
+    fields: dict[str, tuple[tuple[int, ...], str]],
+    metadata: dict[str, Any] = {},
+) -> None:
+    """
+    Create an array store, a directory with one preallocated .npy file per field and a
+    `metadata.json` file describing them. The layout of the metadata is
+    {"fields": {name: {"shape": shape, "dtype": dtype}}, "metadata": metadata}. Once created, the
+    fields can be filled in place, possibly by multiple processes writing disjoint slices, by
+    opening the store with mode "r+". Because the .npy files are uncompressed and C-ordered, each
+    slice of the leading axis (e.g. one trajectory) is contiguous on disk, and loading the store is
+    a memory map with no copying or unpickling.
+
+    args:
+        directory: the directory of the store, created if it does not exist
+        fields: map from field name to the shape and dtype of that field
+        metadata: any other json serializable information to save with the store
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, (shape, dtype) in fields.items():
+        arr = np.lib.format.open_memmap(
+            os.path.join(directory, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape
+        )
+        arr.flush()
+
+    with open(os.path.join(directory, ARRAY_STORE_METADATA), "w") as f:
+        json.dump(
+            {
+                "fields": {
+                    name: {"shape": list(shape), "dtype": np.dtype(dtype).str}
+                    for name, (shape, dtype) in fields.items()
+                },
+                "metadata": metadata,
+            },
+            f,
+        )
+
+
+def open_array_store(
+    directory: str, mode: str = "r"
+) -> tuple[dict[str, np.ndarray], dict[str, Any]]:
+    """
+    Open an array store created by `create_array_store` as memory maps.
+
+    args:
+        directory: the directory of the store
+        mode: the mode passed to np.load as mmap_mode, "r" to read or "r+" to fill in the fields
+
+    returns:
+        a map from field name to its memory mapped array, and the metadata of the store
+    """
+    with open(os.path.join(directory, ARRAY_STORE_METADATA), "r") as f:
+        store_metadata = json.load(f)
+
+    arrays = {}
+    for name, field_metadata in store_metadata["fields"].items():
+        arr = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode)
+        assert list(arr.shape) == field_metadata["shape"], (
+            f"open_array_store: field {name} has shape {arr.shape}, "
+            f"but the metadata says {field_metadata['shape']}"
+        )
+        arrays[name] = arr
+
+    return arrays, store_metadata["metadata"]
+
+
+class ArrayStoreSource(MultiImageDataset):
+    """
+    A lazy source of trajectories stored in an array store, see `create_array_store`, where each
+    field of the store has shape (trajectories,time,spatial,tensor). Like `HDF5TrajectorySource`,
+    each sample is a single trajectory, assembled into a MultiImage of shape
+    (channels*time,spatial,tensor) according to a layout which maps each (k,parity) to the fields
+    of its channels. The fields are memory maps, so opening the source reads nothing, and
+    get_subset only reads the requested trajectories. Can be used as the fields of
+    `lazy_batch_time_series`.
+    """
+
+    directory: str
+    layout: dict[tuple[int, int], Sequence[str]]
+    start: int
+    n_trajectories: int
+    transform: Optional[Callable[[geom.MultiImage], geom.MultiImage]]
+    arrays: dict[str, np.ndarray]
+
+    def __init__(
+        self: Self,
+        directory: str,
+        layout: dict[tuple[int, int], Sequence[str]],
+        D: int,
+        is_torus: Union[bool, tuple[bool, ...]] = True,
+        start: int = 0,
+        n_trajectories: Optional[int] = None,
+        transform: Optional[Callable[[geom.MultiImage], geom.MultiImage]] = None,
+    ) -> None:
+        """
+        Construct the source.
+
+        args:
+            directory: the directory of the store
+            layout: map from (k,parity) to the names of the fields of its channels
+            D: dimension of the images
+            is_torus: whether the images are a torus
+            start: index of the first trajectory of the store to use
+            n_trajectories: number of trajectories to use, defaults to all after start
+            transform: function applied to each MultiImage that is read, such as a normalization
+        """
+        self.directory = directory
+        self.layout = layout
+        self.D = D
+        self.is_torus = (is_torus,) * D if isinstance(is_torus, bool) else is_torus
+        self.start = start
+        self.transform = transform
+        self.arrays, _ = open_array_store(directory)
+
+        first_name = next(iter(layout.values()))[0]
+        available = len(self.arrays[first_name]) - start
+        if n_trajectories is not None and n_trajectories > available:
+            warnings.warn(
+                f"ArrayStoreSource: wanted {n_trajectories} trajectories, "
+                f"but only found {available}"
+            )
+
+        n_trajectories = available if n_trajectories is None else n_trajectories
+        self.n_trajectories = min(n_trajectories, available)
+
+    def __getstate__(self: Self) -> dict[str, Any]:
+        # the memory maps are reopened rather than pickled with all their data
+        state = self.__dict__.copy()
+        del state["arrays"]
+        return state
+
+    def __setstate__(self: Self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.arrays, _ = open_array_store(self.directory)
+
+    def get_L(self: Self) -> int:
+        return self.n_trajectories
+
+    def host_view(
+        self: Self, memo: Optional[dict[int, MultiImageDataset]] = None
+    ) -> MultiImageDataset:
+        view = copy.copy(self)
+        view.transform = None
+        return view
+
+    def get_subset(self: Self, idxs: jax.Array) -> geom.MultiImage:
+        assert isinstance(
+            idxs, jnp.ndarray
+        ), "ArrayStoreSource::get_subset arg idxs must be a jax array"
+        return self.from_host(self.get_host_subset(np.asarray(idxs)))
+
+    def get_host_subset(self: Self, idxs: np.ndarray) -> dict[str, np.ndarray]:
+        file_idxs = self.start + np.asarray(idxs)
+        host_subset = {}
+        for (k, parity), names in self.layout.items():
+            # (batch,channels,time,spatial,tensor) -> (batch,channels*time,spatial,tensor)
+            block = np.stack([self.arrays[name][file_idxs] for name in names], axis=1)
+            host_subset[block_name(k, parity)] = block.reshape((len(idxs), -1) + block.shape[3:])
+
+        return host_subset
+
+    def from_host(self: Self, host_subset: dict[str, np.ndarray]) -> geom.MultiImage:
+        out = geom.MultiImage({}, self.D, self.is_torus)
+        for k, parity in self.layout.keys():
+            out.append(k, parity, jnp.array(host_subset[block_name(k, parity)]))
+
+        return out if self.transform is None else self.transform(out)
+
+    def iter_chunks(self: Self, chunk_len: int = 16) -> Iterator[geom.MultiImage]:
+        """
+        Iterate over all the trajectories in order, chunk_len at a time.
+
+        args:
+            chunk_len: number of trajectories per chunk
+
+        returns:
+            an iterator of MultiImages of shape (chunk,channels*time,spatial,tensor)
+        """
+        for start in range(0, self.get_L(), chunk_len):
+            yield self.get_subset(jnp.arange(start, min(start + chunk_len, self.get_L())))
+
+
+# ------------------------------------------------------------------------------
+# Compressed storage
+
+COMPRESSED_DTYPES = ("float16", "bfloat16", "uint8", "uint16")
+
+
+def _zero_code(dtype: str) -> int:
+    """
+    The code of zero for the scale only quantization of tensor images, the middle of the range.
+
+    args:
+        dtype: the integer compressed dtype, uint8 or uint16
+
+    returns:
+        the zero code
+    """
+    return int(np.iinfo(dtype).max) // 2 + 1
+
+
+def _encode_block(
+    image_block: np.ndarray, k: int, dtype: str
+) -> tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    Encode an image block in a compressed dtype. With the integer dtypes, each scalar image of each
+    sample and channel is quantized between its minimum and maximum. Tensor images are quantized
+    symmetrically about zero with a scale from the largest norm of the image and no offset, so the
+    quantization commutes with the signed permutations of the group operators.
+
+    args:
+        image_block: the block, shape (samples,channels,spatial,tensor)
+        k: the order of the tensors of the block
+        dtype: the compressed dtype, one of COMPRESSED_DTYPES
+
+    returns:
+        the codes, the scales of shape (samples,channels) or None for the float dtypes, and the
+            offsets of shape (samples,channels) or None unless it is a scalar integer block
+    """
+    if dtype == "bfloat16":
+        return np.asarray(jnp.asarray(image_block, jnp.bfloat16)).view(np.uint16), None, None
+    elif dtype == "float16":
+        return image_block.astype(np.float16), None, None
+
+    image_axes = tuple(range(2, image_block.ndim))
+    image_shape = image_block.shape[:2] + (1,) * len(image_axes)
+    if k == 0:
+        low = np.min(image_block, axis=image_axes)
+        high = np.max(image_block, axis=image_axes)
+        scale = (high - low) / np.iinfo(dtype).max
+        scale = np.where(scale == 0, 1, scale).astype(np.float32)
+        normalized = (image_block - low.reshape(image_shape)) / scale.reshape(image_shape)
+        return np.rint(normalized).astype(dtype), scale, low
+
+    # norms in float64 so the scale does not depend on the order of the tensor components
+    tensor_axes = tuple(range(image_block.ndim - k, image_block.ndim))
+    norms = np.sqrt(np.sum(image_block.astype(np.float64) ** 2, axis=tensor_axes))
+    scale = np.max(norms, axis=tuple(range(2, norms.ndim))) / (_zero_code(dtype) - 1)
+    scale = np.where(scale == 0, 1, scale).astype(np.float32)
+    normalized = image_block / scale.reshape(image_shape)
+    return (np.rint(normalized) + _zero_code(dtype)).astype(dtype), scale, None
+
+
+@functools.partial(jax.jit, static_argnums=[3, 4])
+def _decode_block(
+    codes: jax.Array,
+    scale: Optional[jax.Array],
+    offset: Optional[jax.Array],
+    dtype: str,
+    n_leading: int,
+) -> jax.Array:
+    """
+    Decode a compressed image block to float32.
+
+    args:
+        codes: the stored block, shape (samples,channels,spatial,tensor)
+        scale: the scale of each image, shape (samples,channels), None for float dtypes
+        offset: the offset of each image, shape (samples,channels), None for float dtypes and for
+            the scale only quantization of tensor images
+        dtype: the compressed dtype, one of COMPRESSED_DTYPES
+        n_leading: number of leading axes of the block
+
+    returns:
+        the decoded block
+    """
+    if dtype == "bfloat16":
+        return jax.lax.bitcast_convert_type(codes, jnp.bfloat16).astype(jnp.float32)
+    elif dtype == "float16":
+        return codes.astype(jnp.float32)
+
+    assert scale is not None
+    image_shape = scale.shape + (1,) * (codes.ndim - n_leading)
+    if offset is None:
+        return (codes.astype(jnp.float32) - _zero_code(dtype)) * scale.reshape(image_shape)
+    else:
+        return codes.astype(jnp.float32) * scale.reshape(image_shape) + offset.reshape(image_shape)
+
+
+class CompressedMultiImage(MultiImageDataset):
+    """
+    A MultiImage stored in reduced precision on the host, which is decoded to float32 on the device
+    when a batch is requested, so host memory and host to device traffic are halved (float16 or
+    bfloat16) or quartered (uint8). With the integer dtypes, each scalar image of each sample and
+    channel is quantized between its own minimum and maximum, so the error is relative to the range
+    of that image. Vector and tensor images are quantized about zero with only a scale, from their
+    largest norm, so the compression is equivariant. It may be saved to and memory mapped from an
+    array store.
+    """
+
+    dtype: str
+    codes: dict[tuple[int, int], np.ndarray]
+    scales: dict[tuple[int, int], np.ndarray]
+    offsets: dict[tuple[int, int], np.ndarray]
+
+    def __init__(
+        self: Self,
+        codes: dict[tuple[int, int], np.ndarray],
+        D: int,
+        is_torus: Union[bool, tuple[bool, ...]],
+        dtype: str,
+        scales: dict[tuple[int, int], np.ndarray] = {},
+        offsets: dict[tuple[int, int], np.ndarray] = {},
+    ) -> None:
+        """
+        Constructor for an already encoded CompressedMultiImage, see `from_multi_image`.
+
+        args:
+            codes: the stored blocks, shape (samples,channels,spatial,tensor). Stored as uint16 if
+                dtype is bfloat16.
+            D: dimension of the images
+            is_torus: toroidal structure of the images
+            dtype: the compressed dtype, one of COMPRESSED_DTYPES
+            scales: the scale of each image of the integer dtypes, shape (samples,channels)
+            offsets: the offset of each scalar image of the integer dtypes, shape
+                (samples,channels)
+        """
+        assert dtype in COMPRESSED_DTYPES, (
+            f"CompressedMultiImage: dtype {dtype} must be one of {COMPRESSED_DTYPES}"
+        )
+        self.codes = codes
+        self.D = D
+        self.is_torus = (is_torus,) * D if isinstance(is_torus, bool) else is_torus
+        self.dtype = dtype
+        self.scales = scales
+        self.offsets = offsets
+
+    @classmethod
+    def from_multi_image(cls, multi_image: geom.MultiImage, dtype: str) -> Self:
+        """
+        Compress a MultiImage.
+
+        args:
+            multi_image: the MultiImage, shape (samples,channels,spatial,tensor)
+            dtype: the compressed dtype, one of COMPRESSED_DTYPES
+
+        returns:
+            the CompressedMultiImage
+        """
+        return cls.from_chunks([multi_image], dtype)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[geom.MultiImage], dtype: str) -> Self:
+        """
+        Compress a dataset one chunk of samples at a time, such as the chunks of
+        `HDF5TrajectorySource.iter_chunks`, so the whole dataset is never held in float32.
+
+        args:
+            chunks: MultiImages with the same signature, shape (chunk,channels,spatial,tensor)
+            dtype: the compressed dtype, one of COMPRESSED_DTYPES
+
+        returns:
+            the CompressedMultiImage
+        """
+        encoded = defaultdict(list)
+        multi_image = None
+        for multi_image in chunks:
+            for (k, parity), image_block in multi_image.items():
+                encoded[(k, parity)].append(
+                    _encode_block(np.asarray(image_block, dtype=np.float32), k, dtype)
+                )
+
+        assert multi_image is not None, "CompressedMultiImage::from_chunks: no chunks"
+        codes = {}
+        scales = {}
+        offsets = {}
+        for key, blocks in encoded.items():
+            block_codes, block_scales, block_offsets = zip(*blocks)
+            codes[key] = np.concatenate(block_codes)
+            if block_scales[0] is not None:
+                scales[key] = np.concatenate(block_scales)
+            if block_offsets[0] is not None:
+                offsets[key] = np.concatenate(block_offsets)
+
+        return cls(codes, multi_image.D, multi_image.is_torus, dtype, scales, offsets)
+
+    def get_L(self: Self) -> int:
+        """
+        Get the number of samples in the dataset.
+
+        returns:
+            the number of samples
+        """
+        return len(next(iter(self.codes.values())))
+
+    def get_nbytes(self: Self) -> int:
+        return sum(
+            arr.nbytes
+            for arrays in [self.codes, self.scales, self.offsets]
+            for arr in arrays.values()
+        )
+
+    def get_subset(self: Self, idxs: jax.Array) -> geom.MultiImage:
+        """
+        Transfer the compressed samples idxs to the device and decode them.
+
+        args:
+            idxs (jnp.array): array of indices to select the subset
+
+        returns:
+            a float32 MultiImage of shape (len(idxs),channels,spatial,tensor)
+        """
+        return self.from_host(self.get_host_subset(np.asarray(idxs)))
+
+    def get_host_subset(self: Self, idxs: np.ndarray) -> dict[str, np.ndarray]:
+        host_subset = {}
+        for (k, parity), codes in self.codes.items():
+            host_subset[f"codes_{block_name(k, parity)}"] = codes[idxs]
+            if (k, parity) in self.scales:
+                host_subset[f"scales_{block_name(k, parity)}"] = self.scales[(k, parity)][idxs]
+            if (k, parity) in self.offsets:
+                host_subset[f"offsets_{block_name(k, parity)}"] = self.offsets[(k, parity)][idxs]
+
+        return host_subset
+
+    def from_host(self: Self, host_subset: dict[str, np.ndarray]) -> geom.MultiImage:
+        out = geom.MultiImage({}, self.D, self.is_torus)
+        for k, parity in self.codes.keys():
+            name = block_name(k, parity)
+            scale = offset = None
+            if (k, parity) in self.scales:
+                scale = jnp.asarray(host_subset[f"scales_{name}"])
+            if (k, parity) in self.offsets:
+                offset = jnp.asarray(host_subset[f"offsets_{name}"])
+
+            codes = jnp.asarray(host_subset[f"codes_{name}"])
+            out.append(k, parity, _decode_block(codes, scale, offset, self.dtype, 2))
+
+        return out
+
+    def save(self: Self, directory: str) -> None:
+        """
+        Save to an array store, see `create_array_store`.
+
+        args:
+            directory: the directory of the store
+        """
+        arrays = {}
+        for (k, parity), codes in self.codes.items():
+            arrays[f"codes_k{k}_p{parity}"] = codes
+            if (k, parity) in self.scales:
+                arrays[f"scales_k{k}_p{parity}"] = self.scales[(k, parity)]
+            if (k, parity) in self.offsets:
+                arrays[f"offsets_k{k}_p{parity}"] = self.offsets[(k, parity)]
+
+        create_array_store(
+            directory,
+            {name: (arr.shape, arr.dtype.str) for name, arr in arrays.items()},
+            {
+                "D": self.D,
+                "is_torus": list(self.is_torus),
+                "dtype": self.dtype,
+                "keys": [list(key) for key in self.codes.keys()],
+            },
+        )
+        stored_arrays, _ = open_array_store(directory, mode="r+")
+        for name, arr in arrays.items():
+            stored_arrays[name][:] = arr
+            stored_arrays[name].flush()
+
+    @classmethod
+    def load(cls, directory: str) -> Self:
+        """
+        Memory map a CompressedMultiImage saved with `save`.
+
+        args:
+            directory: the directory of the store
+
+        returns:
+            the CompressedMultiImage
+        """
+        arrays, metadata = open_array_store(directory)
+        codes = {}
+        scales = {}
+        offsets = {}
+        for k, parity in metadata["keys"]:
+            codes[(k, parity)] = arrays[f"codes_k{k}_p{parity}"]
+            if f"scales_k{k}_p{parity}" in arrays:
+                scales[(k, parity)] = arrays[f"scales_k{k}_p{parity}"]
+            if f"offsets_k{k}_p{parity}" in arrays:
+                offsets[(k, parity)] = arrays[f"offsets_k{k}_p{parity}"]
+
+        return cls(
+            codes, metadata["D"], tuple(metadata["is_torus"]), metadata["dtype"], scales, offsets
+        )
+
+
+def compression_error(
+    multi_image: geom.MultiImage, compressed: CompressedMultiImage, batch_size: int = 64
+) -> dict[tuple[int, int], dict[str, float]]:
+    """
+    Get the error of a compressed MultiImage with respect to the original, for each (k,parity).
+    The samples are decoded batch_size at a time.
+
+    args:
+        multi_image: the original MultiImage
+        compressed: the compressed MultiImage
+        batch_size: number of samples to decode at a time
+
+    returns:
+        for each (k,parity), the max absolute error and the root mean square error relative to the
+            root mean square of the original, as {"max_abs": float, "rel_rms": float}
+    """
+    max_abs = {key: 0.0 for key in multi_image.keys()}
+    sq_err = {key: 0.0 for key in multi_image.keys()}
+    sq_data = {key: 0.0 for key in multi_image.keys()}
+    for start in range(0, multi_image.get_L(), batch_size):
+        idxs = jnp.arange(start, min(start + batch_size, multi_image.get_L()))
+        decoded = compressed.get_subset(idxs)
+        for key, image_block in multi_image.get_subset(idxs).items():
+            err = np.asarray(decoded[key], dtype=np.float64) - np.asarray(image_block, np.float64)
+            max_abs[key] = max(max_abs[key], float(np.max(np.abs(err))))
+            sq_err[key] += float(np.sum(err**2))
+            sq_data[key] += float(np.sum(np.asarray(image_block, np.float64) ** 2))
+
+    return {
+        key: {
+            "max_abs": max_abs[key],
+            "rel_rms": math.sqrt(sq_err[key] / sq_data[key]) if sq_data[key] > 0 else 0.0,
+        }
+        for key in multi_image.keys()
+    }
@@ -5,8 +5,10 @@ from .functional_geometric_image import (
     convolve as convolve,
     convolve_ravel as convolve_ravel,
     convolve_contract as convolve_contract,
+    convolve_contract_basis as convolve_contract_basis,
     get_contraction_indices as get_contraction_indices,
     multicontract as multicontract,
+    get_rotated_keys as get_rotated_keys,
     times_group_element as times_group_element,
     tensor_times_gg as tensor_times_gg,
     norm as norm,
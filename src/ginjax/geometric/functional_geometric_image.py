@@ -232,6 +232,8 @@ def convolve(
     lhs_dilation: Optional[tuple[int, ...]] = None,
     rhs_dilation: Union[int, tuple[int, ...]] = 1,
     tensor_expand: bool = True,
+    dtype: Optional[jnp.dtype] = jnp.float32,
+    preferred_element_type: Optional[jnp.dtype] = None,
 ) -> jax.Array:
     """
     Here is how this function works:
@@ -261,6 +263,9 @@ def convolve(
         rhs_dilation: amount of dilation to apply to filter in each dimension D, defaults to 1
         tensor_expand: expand the tensor of image and filter to do tensor convolution, defaults to True.
             If there is something more complicated going on (e.g. conv_contract), you can skip this step.
+        dtype: if present, cast the image and filter to dtype before convolving, defaults to float32
+        preferred_element_type: dtype to accumulate and return the convolution in, e.g. float32
+            for a bfloat16 dtype. Defaults to None, which is the dtype of the inputs.
 
     returns:
         convolved_image, shape (batch,out_c,spatial,tensor)
@@ -277,8 +282,10 @@ def convolve(
 
     if tensor_expand:
         img_expanded, filter_expanded = pre_tensor_product_expand(
-            D, image, filter_image, a_offset=2, b_offset=2, dtype=jnp.float32
+            D, image, filter_image, a_offset=2, b_offset=2, dtype=dtype
         )
+    elif dtype is not None:
+        img_expanded, filter_expanded = image.astype(dtype), filter_image.astype(dtype)
     else:
         img_expanded, filter_expanded = image, filter_image
 
@@ -302,7 +309,15 @@ def convolve(
 
     # (batch,spatial,out_tensor*out_c)
     convolved_array = convolve_ravel(
-        D, img_formatted, filter_formatted, is_torus, stride, padding, lhs_dilation, rhs_dilation
+        D,
+        img_formatted,
+        filter_formatted,
+        is_torus,
+        stride,
+        padding,
+        lhs_dilation,
+        rhs_dilation,
+        preferred_element_type,
     )
     out_shape = convolved_array.shape[:-1] + (D,) * output_k + (out_c,)
     return jnp.moveaxis(convolved_array.reshape(out_shape), -1, 1)  # move out_c to 2nd axis
@@ -318,6 +333,7 @@ def convolve_ravel(
     padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]] = None,
     lhs_dilation: Optional[tuple[int, ...]] = None,
     rhs_dilation: Union[int, tuple[int, ...]] = 1,
+    preferred_element_type: Optional[jnp.dtype] = None,
 ) -> jax.Array:
     """
     Raveled verson of convolution. Assumes the channels are all lined up correctly for the tensor
@@ -336,6 +352,8 @@ def convolve_ravel(
             defaults to 'TORUS' if image.is_torus, else 'SAME'
         lhs_dilation: amount of dilation to apply to image in each dimension D, also transposed conv
         rhs_dilation: amount of dilation to apply to filter in each dimension D, defaults to 1
+        preferred_element_type: dtype to accumulate and return the convolution in, defaults to
+            None, which is the dtype of the inputs
 
     returns:
         convolved_image, shape (batch,spatial,tensor*out_c)
@@ -396,6 +414,7 @@ def convolve_ravel(
         rhs_dilation=rhs_dilation,
         dimension_numbers=(("NHWC", "HWIO", "NHWC") if D == 2 else ("NHWDC", "HWDIO", "NHWDC")),
         feature_group_count=channel_length,  # each tensor component is treated separately
+        preferred_element_type=preferred_element_type,
     )
     return convolved_array
 
@@ -410,6 +429,8 @@ def convolve_contract(
     padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]] = None,
     lhs_dilation: Optional[tuple[int, ...]] = None,
     rhs_dilation: Union[int, tuple[int, ...]] = 1,
+    dtype: Optional[jnp.dtype] = jnp.float32,
+    preferred_element_type: Optional[jnp.dtype] = None,
 ) -> jax.Array:
     """
     Given an input k image and a k+k' filter, take the tensor convolution that contract k times with one index
@@ -428,13 +449,16 @@ def convolve_contract(
             defaults to 'TORUS' if image.is_torus, else 'SAME'
         lhs_dilation: amount of dilation to apply to image in each dimension D, also transposed conv
         rhs_dilation: amount of dilation to apply to filter in each dimension D, defaults to 1
+        dtype: if present, cast the image and filter to dtype before convolving, defaults to float32
+        preferred_element_type: dtype to accumulate the convolution and contraction in, e.g.
+            float32 for a bfloat16 dtype. Defaults to None, which is the dtype of the inputs.
 
     returns:
         convolved_image, shape (batch,out_c,spatial,tensor)
     """
     _, img_k = parse_shape(image.shape[2:], D)
     _, filter_k = parse_shape(filter_image.shape[2:], D)
-    img_expanded = conv_contract_image_expand(D, image, filter_k).astype("float32")
+    img_expanded = conv_contract_image_expand(D, image, filter_k)
     convolved_img = convolve(
         D,
         img_expanded,
@@ -445,11 +469,171 @@ def convolve_contract(
         lhs_dilation,
         rhs_dilation,
         tensor_expand=False,
+        dtype=dtype,
+        preferred_element_type=preferred_element_type,
     )
     # then sum along first img_k tensor axes, this is the contraction
     return jnp.sum(convolved_img, axis=range(2 + D, 2 + D + img_k))
 
 
+def _convolve_contract_basis_primal(
+    D: int,
+    is_torus: Union[bool, tuple[bool, ...]],
+    stride: Union[int, tuple[int, ...]],
+    padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]],
+    lhs_dilation: Optional[tuple[int, ...]],
+    rhs_dilation: Union[int, tuple[int, ...]],
+    dtype: Optional[jnp.dtype],
+    preferred_element_type: Optional[jnp.dtype],
+    image: jax.Array,
+    weights: jax.Array,
+    basis: jax.Array,
+) -> jax.Array:
+    # (out_c,in_c,num_filters) (num_filters,spatial,tensor) -> (out_c,in_c,spatial,tensor)
+    filter_image = jnp.einsum("ijk,k...->ij...", weights, basis)
+    return convolve_contract(
+        D,
+        image,
+        filter_image,
+        is_torus,
+        stride,
+        padding,
+        lhs_dilation,
+        rhs_dilation,
+        dtype,
+        preferred_element_type,
+    )
+
+
+_convolve_contract_basis = jax.custom_vjp(
+    _convolve_contract_basis_primal, nondiff_argnums=tuple(range(8))
+)
+
+
+def _convolve_contract_basis_fwd(
+    D: int,
+    is_torus: Union[bool, tuple[bool, ...]],
+    stride: Union[int, tuple[int, ...]],
+    padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]],
+    lhs_dilation: Optional[tuple[int, ...]],
+    rhs_dilation: Union[int, tuple[int, ...]],
+    dtype: Optional[jnp.dtype],
+    preferred_element_type: Optional[jnp.dtype],
+    image: jax.Array,
+    weights: jax.Array,
+    basis: jax.Array,
+) -> tuple[jax.Array, tuple[jax.Array, jax.Array, jax.Array]]:
+    out = _convolve_contract_basis_primal(
+        D,
+        is_torus,
+        stride,
+        padding,
+        lhs_dilation,
+        rhs_dilation,
+        dtype,
+        preferred_element_type,
+        image,
+        weights,
+        basis,
+    )
+    # only the inputs are saved, the expanded image and convolution output are not
+    return out, (image, weights, basis)
+
+
+def _convolve_contract_basis_bwd(
+    D: int,
+    is_torus: Union[bool, tuple[bool, ...]],
+    stride: Union[int, tuple[int, ...]],
+    padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]],
+    lhs_dilation: Optional[tuple[int, ...]],
+    rhs_dilation: Union[int, tuple[int, ...]],
+    dtype: Optional[jnp.dtype],
+    preferred_element_type: Optional[jnp.dtype],
+    residuals: tuple[jax.Array, jax.Array, jax.Array],
+    out_cotangent: jax.Array,
+) -> tuple[jax.Array, jax.Array, jax.Array]:
+    image, weights, basis = residuals
+    primal = functools.partial(
+        _convolve_contract_basis_primal,
+        D,
+        is_torus,
+        stride,
+        padding,
+        lhs_dilation,
+        rhs_dilation,
+        dtype,
+        preferred_element_type,
+    )
+    # The operation is linear in the image and in the weights separately, so each cotangent is the
+    # transpose of the operation with the other held fixed. The transposes redo the expansion and
+    # reshapes, and the weights cotangent is projected onto the basis without keeping the full
+    # filter cotangent of the contraction.
+    (image_cotangent,) = jax.linear_transpose(lambda x: primal(x, weights, basis), image)(
+        out_cotangent
+    )
+    (weights_cotangent,) = jax.linear_transpose(lambda w: primal(image, w, basis), weights)(
+        out_cotangent
+    )
+    # the basis of invariant filters is fixed
+    return image_cotangent, weights_cotangent, jnp.zeros_like(basis)
+
+
+_convolve_contract_basis.defvjp(_convolve_contract_basis_fwd, _convolve_contract_basis_bwd)
+
+
+def convolve_contract_basis(
+    D: int,
+    image: jax.Array,
+    weights: jax.Array,
+    basis: jax.Array,
+    is_torus: Union[bool, tuple[bool, ...]],
+    stride: Union[int, tuple[int, ...]] = 1,
+    padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]] = None,
+    lhs_dilation: Optional[tuple[int, ...]] = None,
+    rhs_dilation: Union[int, tuple[int, ...]] = 1,
+    dtype: Optional[jnp.dtype] = jnp.float32,
+    preferred_element_type: Optional[jnp.dtype] = None,
+) -> jax.Array:
+    """
+    The convolve_contract of an image with the filter that is the weighted combination of a basis of
+    filters, such as the invariant filters of ConvContract. This has a custom vjp so that the
+    backward pass only needs the image, weights, and basis. Differentiating convolve_contract
+    directly stores the expanded image and the uncontracted convolution output, which are D^k'
+    times larger than the image. The basis is treated as a constant, its gradient is zero.
+
+    args:
+        D: dimension of the images
+        image: image data, shape (batch,in_c,spatial,tensor)
+        weights: the weights of the basis filters, shape (out_c,in_c,num_filters)
+        basis: the basis filters, shape (num_filters,spatial,tensor)
+        is_torus: what dimensions of the image are toroidal
+        stride: convolution stride, defaults to (1,)*self.D
+        padding: either 'TORUS','VALID', 'SAME', or D length tuple of (upper,lower) pairs,
+            defaults to 'TORUS' if image.is_torus, else 'SAME'
+        lhs_dilation: amount of dilation to apply to image in each dimension D, also transposed conv
+        rhs_dilation: amount of dilation to apply to filter in each dimension D, defaults to 1
+        dtype: if present, cast the image and filter to dtype before convolving, defaults to float32
+        preferred_element_type: dtype to accumulate the convolution and contraction in, e.g.
+            float32 for a bfloat16 dtype. Defaults to None, which is the dtype of the inputs.
+
+    returns:
+        convolved_image, shape (batch,out_c,spatial,tensor)
+    """
+    return _convolve_contract_basis(
+        D,
+        is_torus,
+        stride,
+        padding,
+        lhs_dilation,
+        rhs_dilation,
+        dtype,
+        preferred_element_type,
+        image,
+        weights,
+        basis,
+    )
+
+
 def get_contraction_indices(
     initial_k: int,
     final_k: int,
@@ -673,93 +857,113 @@ def norm(idx_shift: int, data: jax.Array, keepdims: bool = False) -> jax.Array:
         return normed_data
 
 
-@functools.partial(jax.jit, static_argnums=[0, 2, 3])
+def get_patches(
+    D: int, image_data: jax.Array, patch_len: int, n_leading: int = 0
+) -> tuple[jax.Array, tuple[int, ...], int]:
+    """
+    Split the spatial axes into non-overlapping patches with a reshape. Each spatial axis of length
+    N becomes (N/patch_len, patch_len), then the patch axes are moved to the end and flattened,
+    in row-major order, with the tensor raveled after them. No data is copied until the result is
+    used, and every leading axis is handled at once.
+
+    args:
+        D: the dimension of the space
+        image_data: the image data, shape (leading,spatial,tensor)
+        patch_len: the side length of the patches, must evenly divide all spatial dims
+        n_leading: the number of leading axes, such as batch and channels
+
+    returns:
+        the patches, shape (leading,pooled spatial,patch_len**D,raveled tensor), the pooled
+            spatial dims, and the tensor order k
+    """
+    leading_dims = image_data.shape[:n_leading]
+    spatial_dims, k = parse_shape(image_data.shape[n_leading:], D)
+    assert all(N % patch_len == 0 for N in spatial_dims), (
+        f"get_patches: patch_len {patch_len} must evenly divide the spatial dims {spatial_dims}"
+    )
+    pooled_spatial_dims = tuple(N // patch_len for N in spatial_dims)
+
+    # (leading,spatial,tensor) -> (leading,N1/p,p,...,ND/p,p,raveled tensor)
+    patches = image_data.reshape(
+        leading_dims
+        + tuple(it.chain(*((N, patch_len) for N in pooled_spatial_dims)))
+        + (D**k,)
+    )
+    # (leading,N1/p,p,...,ND/p,p,tensor) -> (leading,N1/p,...,ND/p,p,...,p,tensor)
+    pooled_axes = tuple(n_leading + 2 * i for i in range(D))
+    patch_axes = tuple(n_leading + 2 * i + 1 for i in range(D))
+    patches = jnp.transpose(
+        patches,
+        tuple(range(n_leading)) + pooled_axes + patch_axes + (n_leading + 2 * D,),
+    )
+    return (
+        patches.reshape(leading_dims + pooled_spatial_dims + (patch_len**D, D**k)),
+        pooled_spatial_dims,
+        k,
+    )
+
+
+@functools.partial(jax.jit, static_argnums=[0, 2, 3, 5])
 def max_pool(
     D: int,
     image_data: jax.Array,
     patch_len: int,
     use_norm: bool = True,
     comparator_image: Optional[jax.Array] = None,
+    n_leading: int = 0,
 ) -> jax.Array:
     """
     Perform a max pooling operation where the length of the side of each patch is patch_len. Max is
     determined by the value of comparator_image if present, then the norm of image_data if use_norm
-    is true, then finally the image_data otherwise.
+    is true, then finally the image_data otherwise. The patches come from a reshape, and the argmax
+    of every patch is gathered at once, so leading axes such as batch and channels need no vmap.
 
     args:
         D: the dimension of the space
-        image_data: the image data, shape (spatial,tensor)
+        image_data: the image data, shape (leading,spatial,tensor)
         patch_len: the side length of the patches, must evenly divide all spatial dims
         use_norm: if true, use the norm (over the tensor) of the image as the comparator image
-        comparator_image: scalar image whose argmax is used to determine what value to use.
+        comparator_image: scalar image whose argmax is used to determine what value to use, shape
+            (leading,spatial)
+        n_leading: the number of leading axes, such as batch and channels
 
     returns:
-        the image data that has been max pooled, shape (spatial,tensor)
+        the image data that has been max pooled, shape (leading,spatial,tensor)
     """
-    spatial_dims, k = parse_shape(image_data.shape, D)
+    leading_dims = image_data.shape[:n_leading]
+    patches, pooled_spatial_dims, k = get_patches(D, image_data, patch_len, n_leading)
     assert (comparator_image is not None) or use_norm or (k == 0)
 
-    # TODO: use the batch dimension of dilated_patches correctly
-    patches = jax.lax.conv_general_dilated_patches(
-        image_data.reshape((1,) + spatial_dims + (-1,)).astype("float32"),  # NHWDC
-        filter_shape=(patch_len,) * D,  # filter_shape
-        window_strides=(patch_len,) * D,
-        padding=((0, 0),) * D,  # padding
-        dimension_numbers=(("NHWDC", "OIHWD", "NCHWD") if D == 3 else ("NHWC", "OIHW", "NCHW")),
-    )[
-        0
-    ]  # no batch. Out shape (batch,channels,spatial)
-
-    new_spatial_dims = patches.shape[1:]
-    patches = patches.reshape((D**k, patch_len**D, -1))  # (tensor,patch,num_patches)
-
     if comparator_image is not None:
-        assert comparator_image.shape == spatial_dims
-        comparator_patches = jax.lax.conv_general_dilated_patches(
-            comparator_image.reshape((1,) + spatial_dims + (-1,)).astype("float32"),  # NHWDC
-            filter_shape=(patch_len,) * D,  # filter_shape
-            window_strides=(patch_len,) * D,
-            padding=((0, 0),) * D,  # padding
-            dimension_numbers=(("NHWDC", "OIHWD", "NCHWD") if D == 3 else ("NHWC", "OIHW", "NCHW")),
-        )[0]
-        comparator_patches = comparator_patches.reshape((patch_len**D, -1))
+        assert comparator_image.shape == image_data.shape[: n_leading + D]
+        comparator_patches = get_patches(D, comparator_image, patch_len, n_leading)[0][..., 0]
     elif use_norm:
-        comparator_patches = jnp.linalg.norm(patches, axis=0)  # (patch,num_patches)
+        comparator_patches = jnp.linalg.norm(patches, axis=-1)  # (leading,pooled spatial,patch)
     else:
-        assert len(patches) == 1  # can only use image as your comparator if its a scalar image
-        comparator_patches = patches[0]
+        comparator_patches = patches[..., 0]  # the image is a scalar image, so it is the comparator
 
-    idxs = jnp.argmax(comparator_patches, axis=0)  # (num_patches,)
-    vmap_max = jax.vmap(lambda patch, idx: patch[:, idx], in_axes=(2, 0))
-    return vmap_max(patches, idxs).reshape(new_spatial_dims + (D,) * k)
+    idxs = jnp.argmax(comparator_patches, axis=-1)  # (leading,pooled spatial)
+    pooled = jnp.take_along_axis(patches, idxs[..., None, None], axis=-2)
+    return pooled.reshape(leading_dims + pooled_spatial_dims + (D,) * k)
 
 
-@functools.partial(jax.jit, static_argnums=[0, 2])
-def average_pool(D: int, image_data: jax.Array, patch_len: int) -> jax.Array:
+@functools.partial(jax.jit, static_argnums=[0, 2, 3])
+def average_pool(D: int, image_data: jax.Array, patch_len: int, n_leading: int = 0) -> jax.Array:
     """
     Perform a average pooling operation where the length of the side of each patch is patch_len. This is
     equivalent to doing a convolution where each element of the filter is 1 over the number of pixels in the
-    filter, the stride length is patch_len, and the padding is 'VALID'.
+    filter, the stride length is patch_len, and the padding is 'VALID', but it is done as a mean over the
+    patches of a reshape.
 
     args:
         D: dimension of data
-        image_data: image data, shape (spatial,tensor)
+        image_data: image data, shape (leading,spatial,tensor)
         patch_len: the side length of the patches, must evenly divide the sidelength
+        n_leading: the number of leading axes, such as batch and channels
 
     returns:
-        the image data after being averaged pooled, shape (spatial, tensor)
+        the image data after being averaged pooled, shape (leading,spatial,tensor)
     """
-    spatial_dims, _ = parse_shape(image_data.shape, D)
-    assert functools.reduce(lambda carry, N: carry and (N % patch_len == 0), spatial_dims, True)
-    # convolve expects (out_c,in_c,h,w)
-    filter_data = (1 / (patch_len**D)) * jnp.ones((1, 1) + (patch_len,) * D)
-
-    # reshape to (1,h,w,tensor) because convolve expects (c,h,w,tensor)
-    return convolve(
-        D,
-        image_data[None, None],
-        filter_data,
-        False,
-        stride=(patch_len,) * D,
-        padding="VALID",
-    )[0, 0]
+    leading_dims = image_data.shape[:n_leading]
+    patches, pooled_spatial_dims, k = get_patches(D, image_data, patch_len, n_leading)
+    return jnp.mean(patches, axis=-2).reshape(leading_dims + pooled_spatial_dims + (D,) * k)
@@ -484,17 +484,9 @@ class MultiImage:
 
     def average_pool(self: Self, patch_len: int) -> Self:
         out = self.empty()
-        vmap_avg_pool = jax.vmap(average_pool, in_axes=(None, 0, None))
         n_leading_axes = self.get_n_leading()
         for (k, parity), image_block in self.items():
-            img_pooled = vmap_avg_pool(
-                self.D, image_block.reshape((-1,) + image_block.shape[n_leading_axes:]), patch_len
-            )
-            out.append(
-                k,
-                parity,
-                img_pooled.reshape((image_block.shape[:n_leading_axes] + img_pooled.shape[1:])),
-            )
+            out.append(k, parity, average_pool(self.D, image_block, patch_len, n_leading_axes))
 
         return out
 
@@ -4,14 +4,36 @@ from .losses import (
     normalized_smse_loss as normalized_smse_loss,
 )
 
+from .precision import (
+    POLICY_NAMES as POLICY_NAMES,
+    Policy as Policy,
+    cast_floating as cast_floating,
+    set_policy as set_policy,
+    get_policy as get_policy,
+    all_finite as all_finite,
+    LossScale as LossScale,
+    select_tree as select_tree,
+)
+
+from .filter_bank import (
+    get_filter_bank_key as get_filter_bank_key,
+    register_filters as register_filters,
+    get_filters as get_filters,
+)
+
 from .layers import (
     ConvContract as ConvContract,
+    FrozenConvContract as FrozenConvContract,
+    PointwiseConvContract as PointwiseConvContract,
+    SeparableConvContract as SeparableConvContract,
+    SpectralConvContract as SpectralConvContract,
     GroupNorm as GroupNorm,
     LayerNorm as LayerNorm,
     VectorNeuronNonlinear as VectorNeuronNonlinear,
     MaxNormPool as MaxNormPool,
     LayerWrapper as LayerWrapper,
     LayerWrapperAux as LayerWrapperAux,
+    freeze as freeze,
 )
 
 from .stopping_conditions import (
@@ -23,10 +45,15 @@ from .stopping_conditions import (
 from .training import (
     save as save,
     load as load,
+    load_unpacked as load_unpacked,
+    iterate_batches as iterate_batches,
     get_batches as get_batches,
     autoregressive_map as autoregressive_map,
     map_loss_in_batches as map_loss_in_batches,
     map_plus_loss_in_batches as map_plus_loss_in_batches,
+    get_timestep as get_timestep,
+    get_timesteps as get_timesteps,
+    rollout_loss_in_batches as rollout_loss_in_batches,
     train as train,
     benchmark as benchmark,
     BENCHMARK_DATA as BENCHMARK_DATA,
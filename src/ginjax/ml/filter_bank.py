@@ -0,0 +1,67 @@
+import hashlib
+
+import numpy as np
+
+import ginjax.geometric as geom
+
+# ------------------------------------------------------------------------------
+# Shared invariant filter banks
+
+_filter_banks: dict[str, geom.MultiImage] = {}
+
+
+def get_filter_bank_key(filters: geom.MultiImage) -> str:
+    """
+    Get the key of a filter bank, which is a hash of its contents. The same filters always get the
+    same key, so a model constructed again, for example to load a checkpoint, finds its filters.
+
+    args:
+        filters: the invariant filters
+
+    returns:
+        the key
+    """
+    digest = hashlib.sha1(str((filters.D, filters.is_torus)).encode())
+    for (k, parity), filter_block in sorted(filters.items()):
+        filter_block = np.asarray(filter_block)
+        digest.update(str((k, parity, filter_block.shape, filter_block.dtype)).encode())
+        digest.update(np.ascontiguousarray(filter_block).tobytes())
+
+    return f"D{filters.D}-{digest.hexdigest()[:16]}"
+
+
+def register_filters(filters: geom.MultiImage) -> str:
+    """
+    Add a filter bank to the registry, if it is not there already. Layers such as ConvContract keep
+    only the key of their filter bank, so the filters are held once in memory no matter how many
+    layers use them, are not leaves of the model, and are not written to checkpoints.
+
+    args:
+        filters: the invariant filters
+
+    returns:
+        the key of the filter bank
+    """
+    key = get_filter_bank_key(filters)
+    if key not in _filter_banks:
+        _filter_banks[key] = filters
+
+    return key
+
+
+def get_filters(key: str) -> geom.MultiImage:
+    """
+    Get a registered filter bank. This is called when the layers are traced, so the filters are
+    constants of the compiled function.
+
+    args:
+        key: the key of the filter bank
+
+    returns:
+        the invariant filters
+    """
+    assert key in _filter_banks, (
+        f"get_filters: no filter bank {key}, register_filters must be called first, for example "
+        "by constructing the model"
+    )
+    return _filter_banks[key]
@@ -9,6 +9,8 @@ from jaxtyping import ArrayLike
 import equinox as eqx
 
 import ginjax.geometric as geom
+from ginjax.ml.precision import Policy, get_policy
+from ginjax.ml.filter_bank import register_filters, get_filters
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~ Helpers ~~~~~~~~~~~~~~~~~~~~~~
@@ -76,16 +78,107 @@ def _group_norm_K1(
     return whitened_data.reshape(image_block.shape)
 
 
+def _get_padding_plan(
+    is_torus: tuple[bool, ...],
+    filter_spatial_dims: tuple[int, ...],
+    padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]],
+    rhs_dilation: tuple[int, ...],
+) -> tuple[tuple[tuple[int, int], ...], tuple[tuple[int, int], ...]]:
+    """
+    Resolve the padding of a convolution the same way as geom.convolve_ravel, but ahead of time.
+
+    args:
+        is_torus: d-length tuple of bools specifying which spatial dimensions are toroidal
+        filter_spatial_dims: d-length tuple of the spatial dimensions of the filter
+        padding: either 'TORUS','VALID', 'SAME', an int, or D length tuple of (upper,lower) pairs,
+            defaults to 'TORUS' if any of is_torus, else 'SAME'
+        rhs_dilation: dilation to apply to each filter dimension D
+
+    returns:
+        the wrap padding of the image, and the zero padding literal of the convolution
+    """
+    D = len(is_torus)
+    assert not (
+        any(M % 2 == 0 for M in filter_spatial_dims)
+        and (padding == "TORUS" or padding == "SAME" or padding is None)
+    ), (
+        f"_get_padding_plan: Filters with even sidelengths {filter_spatial_dims} require literal "
+        f"padding, not {padding}"
+    )
+
+    if padding is None:  # if unspecified, infer from is_torus
+        padding = "TORUS" if any(is_torus) else "SAME"
+
+    half_pads = tuple(((M - 1) // 2) * d for M, d in zip(filter_spatial_dims, rhs_dilation))
+    no_wrap = ((0, 0),) * D
+    if padding == "TORUS":
+        wrap = tuple((pad, pad) if torus else (0, 0) for pad, torus in zip(half_pads, is_torus))
+        zero = tuple((0, 0) if torus else (pad, pad) for pad, torus in zip(half_pads, is_torus))
+        return wrap, zero
+    elif padding == "VALID":
+        return no_wrap, ((0, 0),) * D
+    elif padding == "SAME":
+        return no_wrap, tuple((pad, pad) for pad in half_pads)
+    elif isinstance(padding, int):
+        return no_wrap, ((padding, padding),) * D
+    else:
+        return no_wrap, padding
+
+
+def _pack_params(
+    weights: dict[tuple[int, int], dict[tuple[int, int], jax.Array]],
+    bias: dict[tuple[int, int], jax.Array],
+) -> tuple[
+    jax.Array,
+    tuple[tuple[tuple[int, int], tuple[int, int], int, tuple[int, ...]], ...],
+    tuple[tuple[tuple[int, int], int, tuple[int, ...]], ...],
+]:
+    """
+    Pack the weights and biases of a ConvContract into one flat array.
+
+    args:
+        weights: for each input key, for each output key, the weights of shape (out_c,in_c,num)
+        bias: for each output key, the bias
+
+    returns:
+        the packed array, the layout of the weights as (in_key,out_key,offset,shape), and the
+            layout of the biases as (out_key,offset,shape)
+    """
+    blocks = []
+    weight_layout = []
+    bias_layout = []
+    offset = 0
+    for in_key, out_weights in weights.items():
+        for out_key, weight_block in out_weights.items():
+            weight_layout.append((in_key, out_key, offset, tuple(weight_block.shape)))
+            blocks.append(weight_block.reshape(-1))
+            offset += weight_block.size
+
+    for out_key, bias_block in bias.items():
+        bias_layout.append((out_key, offset, tuple(bias_block.shape)))
+        blocks.append(bias_block.reshape(-1))
+        offset += bias_block.size
+
+    params = jnp.concatenate(blocks) if len(blocks) else jnp.zeros((0,))
+    return params, tuple(weight_layout), tuple(bias_layout)
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~ Layers ~~~~~~~~~~~~~~~~~~~~~~
 class ConvContract(eqx.Module):
     """
-    A layer then performs the convolution followed by contraction.
+    A layer then performs the convolution followed by contraction. The invariant filters are kept
+    in the shared filter bank registry, and the layer only stores their key. The weights and biases
+    of every pair of types are packed into one array, params, and the static layouts give where
+    each block is, so a deep model does not have thousands of tiny leaves.
     """
 
-    weights: dict[tuple[int, int], dict[tuple[int, int], jax.Array]]
-    bias: dict[tuple[int, int], jax.Array]
-    invariant_filters: geom.MultiImage
+    params: jax.Array
 
+    filter_bank: str = eqx.field(static=True)
+    weight_layout: tuple[
+        tuple[tuple[int, int], tuple[int, int], int, tuple[int, ...]], ...
+    ] = eqx.field(static=True)
+    bias_layout: tuple[tuple[tuple[int, int], int, tuple[int, ...]], ...] = eqx.field(static=True)
     input_keys: geom.Signature = eqx.field(static=True)
     target_keys: geom.Signature = eqx.field(static=True)
     use_bias: Union[str, bool] = eqx.field(static=True)
@@ -96,18 +189,20 @@ class ConvContract(eqx.Module):
     D: int = eqx.field(static=True)
     fast_mode: bool = eqx.field(static=True)
     missing_filter: bool = eqx.field(static=True)
+    policy: Policy = eqx.field(static=True)
 
     def __init__(
         self: Self,
         input_keys: geom.Signature,
         target_keys: geom.Signature,
-        invariant_filters: geom.MultiImage,
+        invariant_filters: Union[geom.MultiImage, str],
         use_bias: Union[str, bool] = "auto",
         stride: Union[int, tuple[int, ...]] = 1,
         padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]] = None,
         lhs_dilation: Optional[tuple[int, ...]] = None,
         rhs_dilation: Union[int, tuple[int, ...]] = 1,
         key: Any = None,
+        policy: Optional[Policy] = None,
     ):
         """
         Constructor for equivariant tensor convolution then contraction.
@@ -115,7 +210,8 @@ class ConvContract(eqx.Module):
         args:
             input_keys: A mapping of (k,p) to an integer representing the input channels
             target_keys: A mapping of (k,p) to an integer representing the output channels
-            invariant_filters: A MultiImage of the invariant filters to build the convolution filters
+            invariant_filters: A MultiImage of the invariant filters to build the convolution filters,
+                which is added to the filter bank registry, or the key of a registered filter bank
             use_bias: One of 'auto', 'mean', or 'scalar', or True for 'auto' or False for no bias.
                 Mean uses a mean scale for every type, scalar uses a regular bias for scalars only
                 and auto does regular bias for scalars and mean for non-scalars.
@@ -124,17 +220,24 @@ class ConvContract(eqx.Module):
                 defaults to 'TORUS' if image.is_torus, else 'SAME'
             lhs_dilation: amount of dilation to apply to image in each dimension D, also transposed conv
             rhs_dilation: amount of dilation to apply to filter in each dimension D
+            key: jax.random key
+            policy: the mixed precision policy, defaults to the global policy
         """
         self.input_keys = input_keys
         self.target_keys = target_keys
-        self.invariant_filters = invariant_filters
+        if isinstance(invariant_filters, geom.MultiImage):
+            self.filter_bank = register_filters(invariant_filters)
+        else:
+            self.filter_bank = invariant_filters
+
         self.use_bias = use_bias
         self.stride = stride
         self.padding = padding
         self.lhs_dilation = lhs_dilation
         self.rhs_dilation = rhs_dilation
+        self.policy = get_policy() if policy is None else policy
 
-        self.D = invariant_filters.D
+        self.D = self.invariant_filters.D
         # if a particular desired convolution for input_keys -> target_keys is missing the needed
         # filter (possibly because an equivariant one doesn't exist), this is set to true
         self.missing_filter = False
@@ -148,11 +251,11 @@ class ConvContract(eqx.Module):
                 f"ConvContract: bias must be str or bool, but found {type(use_bias)}:{use_bias}"
             )
 
-        self.weights = {}  # presumably some way to jax.lax.scan this?
-        self.bias = {}
+        weights = {}  # presumably some way to jax.lax.scan this?
+        bias = {}
         all_filter_spatial_dims = []
         for (in_k, in_p), in_c in self.input_keys:
-            self.weights[(in_k, in_p)] = {}
+            weights[(in_k, in_p)] = {}
             for (out_k, out_p), out_c in self.target_keys:
                 key, subkey1, subkey2 = random.split(key, num=3)
 
@@ -181,7 +284,7 @@ class ConvContract(eqx.Module):
                         weight_per_ff.append(
                             random.uniform(subkey, shape=(out_c, in_c), minval=-bound, maxval=bound)
                         )
-                    self.weights[(in_k, in_p)][(out_k, out_p)] = jnp.stack(weight_per_ff, axis=-1)
+                    weights[(in_k, in_p)][(out_k, out_p)] = jnp.stack(weight_per_ff, axis=-1)
 
                     # # bound = jnp.sqrt(3 / (0.085 * in_c * num_filters)) # tanh multiplier
                     # bound = jnp.sqrt(3 / (in_c * num_filters))
@@ -189,7 +292,7 @@ class ConvContract(eqx.Module):
                     # rand_weights = random.uniform(
                     #     subkey, shape=(out_c, in_c, num_filters), minval=-bound, maxval=bound
                     # )
-                    # self.weights[(in_k, in_p)][(out_k, out_p)] = rand_weights
+                    # weights[(in_k, in_p)][(out_k, out_p)] = rand_weights
 
                 else:
                     # Works really well, not sure why?
@@ -198,7 +301,7 @@ class ConvContract(eqx.Module):
                     )
                     bound_shape = (in_c,) + filter_spatial_dims + (self.D,) * in_k
                     bound = 1 / jnp.sqrt(math.prod(bound_shape))
-                    self.weights[(in_k, in_p)][(out_k, out_p)] = random.uniform(
+                    weights[(in_k, in_p)][(out_k, out_p)] = random.uniform(
                         subkey1,
                         shape=(out_c, in_c, len(self.invariant_filters[filter_key])),
                         minval=-bound,
@@ -208,7 +311,7 @@ class ConvContract(eqx.Module):
 
                 if use_bias:
                     # this may get set multiple times, bound could be different but not a huge issue?
-                    self.bias[(out_k, out_p)] = random.uniform(
+                    bias[(out_k, out_p)] = random.uniform(
                         subkey2,
                         shape=(out_c,) + (1,) * (self.D + out_k),
                         minval=-bound,
@@ -223,6 +326,93 @@ class ConvContract(eqx.Module):
             and (len(set(all_filter_spatial_dims)) == 1)
         )
         self.fast_mode = False
+        params, self.weight_layout, self.bias_layout = _pack_params(weights, bias)
+        self.params = self.policy.cast_to_param(params)
+
+    @property
+    def weights(self: Self) -> dict[tuple[int, int], dict[tuple[int, int], jax.Array]]:
+        """
+        The weights, unpacked from params, of shape (out_c,in_c,num_filters) for each input key and
+        output key. Input keys without any filters map to empty dicts.
+
+        returns:
+            the weights
+        """
+        weights = {in_key: {} for in_key, _ in self.input_keys}
+        for in_key, out_key, offset, shape in self.weight_layout:
+            weights[in_key][out_key] = self.params[offset : offset + math.prod(shape)].reshape(
+                shape
+            )
+
+        return weights
+
+    @property
+    def bias(self: Self) -> dict[tuple[int, int], jax.Array]:
+        """
+        The biases, unpacked from params, for each output key.
+
+        returns:
+            the biases
+        """
+        return {
+            key: self.params[offset : offset + math.prod(shape)].reshape(shape)
+            for key, offset, shape in self.bias_layout
+        }
+
+    def replace_params(
+        self: Self,
+        weights: dict[tuple[int, int], dict[tuple[int, int], jax.Array]],
+        bias: dict[tuple[int, int], jax.Array],
+    ) -> Self:
+        """
+        Get a copy of this layer with new weights and biases, which must have the same keys and
+        shapes as the current ones.
+
+        args:
+            weights: the weights, in the format of ConvContract.weights
+            bias: the biases, in the format of ConvContract.bias
+
+        returns:
+            the new layer
+        """
+        _, weight_layout, bias_layout = _pack_params(weights, bias)
+        assert {(i, o, shape) for i, o, _, shape in weight_layout} == {
+            (i, o, shape) for i, o, _, shape in self.weight_layout
+        } and {(o, shape) for o, _, shape in bias_layout} == {
+            (o, shape) for o, _, shape in self.bias_layout
+        }, "ConvContract::replace_params: weights and bias must match the layout of the layer"
+        # the dicts may be in another order, so pack in the order of this layer's layout
+        params = jnp.concatenate(
+            [weights[in_key][out_key].reshape(-1) for in_key, out_key, _, _ in self.weight_layout]
+            + [bias[key].reshape(-1) for key, _, _ in self.bias_layout]
+            + [jnp.zeros((0,), dtype=self.params.dtype)]
+        )
+        return eqx.tree_at(lambda layer: layer.params, self, params.astype(self.params.dtype))
+
+    def to_unpacked(self: Self, with_filters: bool = True) -> "UnpackedConvContract":
+        """
+        Get the layout of the leaves of this layer before its parameters were packed, which is
+        used to load old checkpoints.
+
+        args:
+            with_filters: whether the old layout also had the invariant filters as leaves
+
+        returns:
+            the unpacked layer
+        """
+        return UnpackedConvContract(
+            self.weights, self.bias, self.invariant_filters if with_filters else None
+        )
+
+    @property
+    def invariant_filters(self: Self) -> geom.MultiImage:
+        """
+        The invariant filters, from the filter bank registry.
+
+        returns:
+            the invariant filters
+        """
+        return get_filters(self.filter_bank)
 
     def fast_convolve(
         self: Self,
@@ -283,13 +473,14 @@ class ConvContract(eqx.Module):
 
         out = geom.convolve_ravel(
             self.D,
-            image_ravel[None],  # add batch dim
-            filter_ravel,
+            image_ravel[None].astype(self.policy.compute_dtype),  # add batch dim
+            filter_ravel.astype(self.policy.compute_dtype),
             input_multi_image.is_torus,
             self.stride,
             self.padding,
             self.lhs_dilation,
             self.rhs_dilation,
+            self.policy.accumulate_dtype,
         )[0]
         new_spatial_dims = out.shape[: self.D]
         # (spatial,tensor_sum*out_c) -> (out_c,spatial,tensor_sum)
@@ -337,6 +528,7 @@ class ConvContract(eqx.Module):
         Function to perform convolve_contract on an entire MultiImage by doing the pairwise convolutions
         individually. This is necessary when filters have unequal sizes, or the in_c or out_c are
         not all equal. Weights is passed as an argument to make it easier to test this function.
+        Each convolution uses convolve_contract_basis, so backpropagation only stores the input.
 
         args:
             input_multi_image: the input
@@ -350,22 +542,18 @@ class ConvContract(eqx.Module):
             for (out_k, out_p), weight_block in weights[(in_k, in_p)].items():
                 filter_key = (in_k + out_k, (in_p + out_p) % 2)
 
-                # (out_c,in_c,num_inv_filters) (num, spatial, tensor) -> (out_c,in_c,spatial,tensor)
-                filter_block = jnp.einsum(
-                    "ijk,k...->ij...",
-                    weight_block,
-                    jax.lax.stop_gradient(self.invariant_filters[filter_key]),
-                )
-
-                convolve_contracted_imgs = geom.convolve_contract(
+                convolve_contracted_imgs = geom.convolve_contract_basis(
                     input_multi_image.D,
                     images_block[None],  # add batch dim
-                    filter_block,
+                    weight_block,  # (out_c,in_c,num_inv_filters)
+                    jax.lax.stop_gradient(self.invariant_filters[filter_key]),
                     input_multi_image.is_torus,
                     self.stride,
                     self.padding,
                     self.lhs_dilation,
                     self.rhs_dilation,
+                    self.policy.compute_dtype,
+                    self.policy.accumulate_dtype,
                 )[0]
 
                 if (out_k, out_p) in out:  # it already has that key
@@ -378,7 +566,9 @@ class ConvContract(eqx.Module):
     def __call__(self: Self, x: geom.MultiImage) -> geom.MultiImage:
         """
         The callable, calls either fast_convolve or individual_convolve. Currently fast_convolve
-        is not used because it is not much faster.
+        is not used because it is not much faster. The convolutions take their inputs in the
+        compute dtype of the policy, and the contractions, sums over the input types, and bias are
+        done in the accumulate dtype before the output is cast back to the compute dtype.
 
         args:
             x: the input
@@ -392,19 +582,698 @@ class ConvContract(eqx.Module):
             x = self.individual_convolve(x, self.weights)
 
         if self.use_bias:
+            bias = self.bias
             biased_x = x.empty()
             for (k, p), image in x.items():
                 if (k, p) == (0, 0) and (self.use_bias == "scalar" or self.use_bias == "auto"):
-                    biased_x.append(k, p, image + self.bias[(k, p)])
+                    biased_x.append(k, p, image + bias[(k, p)])
                 elif ((k, p) != (0, 0) and self.use_bias == "auto") or self.use_bias == "mean":
                     mean_image = jnp.mean(
                         image, axis=tuple(range(1, 1 + self.invariant_filters.D)), keepdims=True
                     )
-                    biased_x.append(k, p, image + mean_image * self.bias[(k, p)])
+                    biased_x.append(k, p, image + mean_image * bias[(k, p)])
+
+            return self.policy.cast_to_compute(biased_x)
+        else:
+            return self.policy.cast_to_compute(x)
+
+    def freeze(self: Self, is_torus: Union[bool, tuple[bool, ...]] = True) -> "FrozenConvContract":
+        """
+        Fold the weights and invariant filters into a FrozenConvContract for inference.
+
+        args:
+            is_torus: what dimensions of the inputs will be toroidal
+
+        returns:
+            the frozen layer
+        """
+        return FrozenConvContract(self, is_torus)
+
+
+class PointwiseConvContract(ConvContract):
+    """
+    ConvContract with invariant filters of sidelength 1, that is equivariant channel mixing. The
+    filters are the invariant tensors of each order and parity, such as the identity, Kronecker
+    delta, and Levi-Civita symbol, so each pair of types is an einsum over the channels and tensor
+    indices rather than a convolution.
+    """
+
+    def __init__(
+        self: Self,
+        input_keys: geom.Signature,
+        target_keys: geom.Signature,
+        invariant_filters: Union[geom.MultiImage, str],
+        use_bias: Union[str, bool] = "auto",
+        stride: Union[int, tuple[int, ...]] = 1,
+        padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]] = None,
+        key: Any = None,
+        policy: Optional[Policy] = None,
+    ):
+        """
+        Constructor for the equivariant pointwise convolution then contraction. The weights are
+        initialized as in ConvContract.
+
+        args:
+            input_keys: A mapping of (k,p) to an integer representing the input channels
+            target_keys: A mapping of (k,p) to an integer representing the output channels
+            invariant_filters: A MultiImage of invariant filters of sidelength 1, or the key of a
+                registered filter bank
+            use_bias: One of 'auto', 'mean', or 'scalar', or True for 'auto' or False for no bias.
+            stride: convolution stride, defaults to (1,)*self.D
+            padding: 'TORUS', 'VALID', 'SAME' or None, which all mean no padding for a 1x1 filter
+            key: jax.random key
+            policy: the mixed precision policy, defaults to the global policy
+        """
+        super(PointwiseConvContract, self).__init__(
+            input_keys,
+            target_keys,
+            invariant_filters,
+            use_bias,
+            stride,
+            padding,
+            key=key,
+            policy=policy,
+        )
+        D = self.invariant_filters.D
+        assert self.invariant_filters.get_spatial_dims() == (1,) * D, (
+            "PointwiseConvContract: invariant_filters must have sidelength 1, but got "
+            f"{self.invariant_filters.get_spatial_dims()}"
+        )
+        assert padding in {None, "TORUS", "VALID", "SAME"}, (
+            f"PointwiseConvContract: padding must be TORUS, VALID, SAME, or None, but got {padding}"
+        )
+
+    def individual_convolve(
+        self: Self,
+        input_multi_image: geom.MultiImage,
+        weights: dict[tuple[int, int], dict[tuple[int, int], jax.Array]],
+    ) -> geom.MultiImage:
+        """
+        Apply the pointwise maps between each pair of types as einsums over channels and tensor
+        indices, accumulating in the accumulate dtype of the policy.
+
+        args:
+            input_multi_image: the input
+            weights: the weights used to combine the invariant filters
+
+        returns:
+            the convolved MultiImage
+        """
+        D = input_multi_image.D
+        stride = self.stride if isinstance(self.stride, tuple) else (self.stride,) * D
+        strided_slices = (slice(None),) + tuple(slice(None, None, s) for s in stride)
+
+        out = input_multi_image.empty()
+        for (in_k, in_p), image_block in input_multi_image.items():
+            image_block = image_block[strided_slices].astype(self.policy.compute_dtype)
+            for (out_k, out_p), weight_block in weights[(in_k, in_p)].items():
+                filter_key = (in_k + out_k, (in_p + out_p) % 2)
+                # (num,(1,)*D,in_tensor,out_tensor) -> (num,in_tensor,out_tensor)
+                basis = jax.lax.stop_gradient(self.invariant_filters[filter_key])
+                basis = basis.reshape((len(basis),) + (D,) * (in_k + out_k))
+                # (out_c,in_c,num),(num,in_tensor,out_tensor) -> (out_c,in_c,in_tensor,out_tensor)
+                kernel = jnp.einsum(
+                    "ijk,k...->ij...", weight_block.astype(self.policy.compute_dtype), basis
+                ).astype(self.policy.compute_dtype)
+
+                # contract in_c and the input tensor, (out_c,in_c,in_tensor,out_tensor),
+                # (in_c,spatial,in_tensor) -> (out_c,out_tensor,spatial)
+                out_block = jnp.tensordot(
+                    kernel,
+                    image_block,
+                    axes=(
+                        (1,) + tuple(range(2, 2 + in_k)),
+                        (0,) + tuple(range(1 + D, 1 + D + in_k)),
+                    ),
+                    preferred_element_type=self.policy.accumulate_dtype,
+                )
+                # (out_c,out_tensor,spatial) -> (out_c,spatial,out_tensor)
+                out_block = jnp.moveaxis(
+                    out_block, tuple(range(1, 1 + out_k)), tuple(range(1 + D, 1 + D + out_k))
+                )
+
+                if (out_k, out_p) in out:  # it already has that key
+                    out[(out_k, out_p)] = out_block + out[(out_k, out_p)]
+                else:
+                    out.append(out_k, out_p, out_block)
+
+        return out
+
 
-            return biased_x
+class SeparableConvContract(eqx.Module):
+    """
+    Depthwise-separable equivariant convolution. First each channel of each input type is convolved
+    with its own invariant filter that maps the type to itself, then a PointwiseConvContract mixes
+    the channels and types. Per pair of types, the weights go from out_c*in_c*num_filters for
+    ConvContract to in_c*num_filters for the depthwise part plus out_c*in_c*num_pointwise_filters,
+    which is usually 1 or 2, for the mixing.
+    """
+
+    depthwise_weights: dict[tuple[int, int], jax.Array]
+    pointwise: PointwiseConvContract
+
+    filter_bank: str = eqx.field(static=True)
+    input_keys: geom.Signature = eqx.field(static=True)
+    target_keys: geom.Signature = eqx.field(static=True)
+    stride: Union[int, tuple[int, ...]] = eqx.field(static=True)
+    padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]] = eqx.field(static=True)
+    rhs_dilation: Union[int, tuple[int, ...]] = eqx.field(static=True)
+    D: int = eqx.field(static=True)
+    policy: Policy = eqx.field(static=True)
+
+    def __init__(
+        self: Self,
+        input_keys: geom.Signature,
+        target_keys: geom.Signature,
+        invariant_filters: Union[geom.MultiImage, str],
+        pointwise_filters: Union[geom.MultiImage, str],
+        use_bias: Union[str, bool] = "auto",
+        stride: Union[int, tuple[int, ...]] = 1,
+        padding: Optional[Union[str, int, tuple[tuple[int, int], ...]]] = None,
+        rhs_dilation: Union[int, tuple[int, ...]] = 1,
+        key: Any = None,
+        policy: Optional[Policy] = None,
+    ):
+        """
+        Constructor for the depthwise-separable equivariant convolution. A type (k,p) is convolved
+        with filters of type (2k,0), contracted k times, so those filters must be present.
+
+        args:
+            input_keys: A mapping of (k,p) to an integer representing the input channels
+            target_keys: A mapping of (k,p) to an integer representing the output channels
+            invariant_filters: A MultiImage of the invariant filters for the depthwise convolution,
+                or the key of a registered filter bank
+            pointwise_filters: A MultiImage of invariant filters of sidelength 1 for the mixing, or
+                the key of a registered filter bank
+            use_bias: the bias of the mixing, see ConvContract. The depthwise part has no bias.
+            stride: convolution stride, defaults to (1,)*self.D
+            padding: either 'TORUS','VALID', 'SAME', or D length tuple of (upper,lower) pairs,
+                defaults to 'TORUS' if image.is_torus, else 'SAME'
+            rhs_dilation: amount of dilation to apply to filter in each dimension D
+            key: jax.random key
+            policy: the mixed precision policy, defaults to the global policy
+        """
+        self.input_keys = input_keys
+        self.target_keys = target_keys
+        if isinstance(invariant_filters, geom.MultiImage):
+            self.filter_bank = register_filters(invariant_filters)
         else:
-            return x
+            self.filter_bank = invariant_filters
+
+        self.stride = stride
+        self.padding = padding
+        self.rhs_dilation = rhs_dilation
+        self.policy = get_policy() if policy is None else policy
+        self.D = self.invariant_filters.D
+
+        depthwise_weights = {}
+        for (k, p), in_c in self.input_keys:
+            filter_key = (2 * k, 0)
+            assert filter_key in self.invariant_filters, (
+                f"SeparableConvContract: input type {(k, p)} needs invariant filters of type "
+                f"{filter_key}, but got {tuple(self.invariant_filters.keys())}"
+            )
+            key, subkey = random.split(key)
+            filter_spatial_dims, _ = geom.parse_shape(
+                self.invariant_filters[filter_key].shape[1:], self.D
+            )
+            # like ConvContract, but each output channel only sees one input channel
+            bound = 1 / jnp.sqrt(math.prod(filter_spatial_dims + (self.D,) * k))
+            depthwise_weights[(k, p)] = random.uniform(
+                subkey,
+                shape=(in_c, len(self.invariant_filters[filter_key])),
+                minval=-bound,
+                maxval=bound,
+            )
+
+        self.depthwise_weights = self.policy.cast_to_param(depthwise_weights)
+
+        key, subkey = random.split(key)
+        self.pointwise = PointwiseConvContract(
+            input_keys, target_keys, pointwise_filters, use_bias, key=subkey, policy=self.policy
+        )
+
+    @property
+    def invariant_filters(self: Self) -> geom.MultiImage:
+        """
+        The invariant filters of the depthwise convolution, from the filter bank registry.
+
+        returns:
+            the invariant filters
+        """
+        return get_filters(self.filter_bank)
+
+    def depthwise_convolve(
+        self: Self,
+        input_multi_image: geom.MultiImage,
+        depthwise_weights: dict[tuple[int, int], jax.Array],
+    ) -> geom.MultiImage:
+        """
+        Convolve each channel of each type with its own filter. Each type is a single grouped
+        convolution with a group per channel, where each group maps the tensor components of its
+        channel to themselves.
+
+        args:
+            input_multi_image: the input
+            depthwise_weights: the weights used to combine the invariant filters, (in_c,num_filters)
+                for each type
+
+        returns:
+            the convolved MultiImage, with the same signature as the input
+        """
+        D = input_multi_image.D
+        out = input_multi_image.empty()
+        for (k, p), image_block in input_multi_image.items():
+            in_c = len(image_block)
+            spatial_dims = image_block.shape[1 : 1 + D]
+            basis = jax.lax.stop_gradient(self.invariant_filters[(2 * k, 0)])
+            filter_spatial_dims = basis.shape[1 : 1 + D]
+
+            # (in_c,num),(num,spatial,in_tensor,out_tensor) -> (in_c,spatial,in_tensor,out_tensor)
+            filter_block = jnp.einsum(
+                "ij,j...->i...", depthwise_weights[(k, p)].astype(self.policy.compute_dtype), basis
+            ).reshape((in_c,) + filter_spatial_dims + (D**k, D**k))
+            # (in_c,spatial,in_tensor,out_tensor) -> (spatial,in_tensor,in_c*out_tensor)
+            filter_ravel = jnp.moveaxis(filter_block, 0, -2).reshape(
+                filter_spatial_dims + (D**k, in_c * D**k)
+            )
+            # (in_c,spatial,tensor) -> (spatial,in_c*tensor)
+            image_ravel = jnp.moveaxis(image_block.reshape((in_c,) + spatial_dims + (-1,)), 0, -2)
+            image_ravel = image_ravel.reshape(spatial_dims + (in_c * D**k,))
+
+            out_block = geom.convolve_ravel(
+                D,
+                image_ravel[None].astype(self.policy.compute_dtype),  # add batch dim
+                filter_ravel,
+                input_multi_image.is_torus,
+                self.stride,
+                self.padding,
+                None,
+                self.rhs_dilation,
+                self.policy.accumulate_dtype,
+            )[0]
+            # (spatial,in_c*tensor) -> (in_c,spatial,tensor)
+            new_spatial_dims = out_block.shape[:D]
+            out_block = jnp.moveaxis(out_block.reshape(new_spatial_dims + (in_c, -1)), -2, 0)
+            out.append(k, p, out_block.reshape((in_c,) + new_spatial_dims + (D,) * k))
+
+        return out
+
+    def __call__(self: Self, x: geom.MultiImage) -> geom.MultiImage:
+        """
+        The callable, the depthwise convolution followed by the pointwise mixing. The depthwise
+        output is cast to the compute dtype before the mixing, which accumulates as ConvContract.
+
+        args:
+            x: the input
+
+        returns:
+            the convolved MultiImage, which is a new object
+        """
+        x = self.policy.cast_to_compute(self.depthwise_convolve(x, self.depthwise_weights))
+        return self.pointwise(x)
+
+
+class SpectralConvContract(ConvContract):
+    """
+    Equivariant convolution with a global filter on a torus, applied in the Fourier domain. The
+    filter only has the frequencies in the cube [-modes,modes]^D, and its Fourier transform is a
+    combination of the invariant filters of sidelength 2*modes+1: an invariant filter satisfies
+    F(gs) = g.F(s) for every hyperoctahedral group element g, and so does the Fourier transform of
+    an invariant filter, with the frequencies in place of the offsets. This gives global mixing in
+    O(N log N) with the weights, biases, and filter bank registry of ConvContract.
+    """
+
+    def __init__(
+        self: Self,
+        input_keys: geom.Signature,
+        target_keys: geom.Signature,
+        invariant_filters: Union[geom.MultiImage, str],
+        use_bias: Union[str, bool] = "auto",
+        key: Any = None,
+        policy: Optional[Policy] = None,
+    ):
+        """
+        Constructor for the equivariant spectral convolution then contraction. The weights are
+        initialized as in ConvContract.
+
+        args:
+            input_keys: A mapping of (k,p) to an integer representing the input channels
+            target_keys: A mapping of (k,p) to an integer representing the output channels
+            invariant_filters: A MultiImage of invariant filters of sidelength 2*modes+1, or the key
+                of a registered filter bank. These are the Fourier coefficients of the filters.
+            use_bias: One of 'auto', 'mean', or 'scalar', or True for 'auto' or False for no bias.
+            key: jax.random key
+            policy: the mixed precision policy, defaults to the global policy
+        """
+        super(SpectralConvContract, self).__init__(
+            input_keys, target_keys, invariant_filters, use_bias, key=key, policy=policy
+        )
+        filter_spatial_dims = self.invariant_filters.get_spatial_dims()
+        assert len(set(filter_spatial_dims)) == 1 and filter_spatial_dims[0] % 2 == 1, (
+            "SpectralConvContract: invariant_filters must have the same odd sidelength in every "
+            f"dimension, but got {filter_spatial_dims}"
+        )
+
+    @property
+    def modes(self: Self) -> int:
+        """
+        The largest frequency kept in each dimension.
+
+        returns:
+            the number of modes
+        """
+        return (self.invariant_filters.get_spatial_dims()[0] - 1) // 2
+
+    def individual_convolve(
+        self: Self,
+        input_multi_image: geom.MultiImage,
+        weights: dict[tuple[int, int], dict[tuple[int, int], jax.Array]],
+    ) -> geom.MultiImage:
+        """
+        Take the real FFT of each input type, keep the frequencies up to modes, multiply by the
+        Fourier coefficients of the filters and contract, then take the inverse FFT of each output
+        type. The FFT uses norm='forward', so the output of a smooth input does not depend on the
+        resolution. The FFTs are done in the accumulate dtype of the policy.
+
+        args:
+            input_multi_image: the input, which must be a torus
+            weights: the weights used to combine the invariant filters
+
+        returns:
+            the convolved MultiImage
+        """
+        D = input_multi_image.D
+        spatial_dims = input_multi_image.get_spatial_dims()
+        spatial_axes = tuple(range(1, 1 + D))
+        modes = self.modes
+        assert all(input_multi_image.is_torus), (
+            f"SpectralConvContract: the input must be a torus, but got {input_multi_image.is_torus}"
+        )
+        assert all(N > 2 * modes for N in spatial_dims), (
+            f"SpectralConvContract: spatial dims {spatial_dims} must be larger than 2*modes, "
+            f"but modes is {modes}"
+        )
+
+        out_hats = {}
+        for (in_k, in_p), image_block in input_multi_image.items():
+            in_c = len(image_block)
+            # (in_c,spatial,tensor) -> (in_c,frequencies,raveled tensor)
+            image_hat = jnp.fft.rfftn(
+                image_block.reshape((in_c,) + spatial_dims + (-1,)).astype(
+                    self.policy.accumulate_dtype
+                ),
+                axes=spatial_axes,
+                norm="forward",
+            )
+            # keep the frequencies in [-modes,modes], in the order of the FFT
+            for axis, N in zip(spatial_axes[:-1], spatial_dims[:-1]):
+                image_hat = jnp.concatenate(
+                    [
+                        jax.lax.slice_in_dim(image_hat, 0, modes + 1, axis=axis),
+                        jax.lax.slice_in_dim(image_hat, N - modes, N, axis=axis),
+                    ],
+                    axis=axis,
+                )
+            image_hat = jax.lax.slice_in_dim(image_hat, 0, modes + 1, axis=D)
+
+            for (out_k, out_p), weight_block in weights[(in_k, in_p)].items():
+                filter_key = (in_k + out_k, (in_p + out_p) % 2)
+                # Put the frequencies of the filters in the order of the FFT, the last dimension
+                # only has the non-negative frequencies because the input is real.
+                basis = jnp.roll(
+                    jax.lax.stop_gradient(self.invariant_filters[filter_key]),
+                    -modes,
+                    axis=spatial_axes[:-1],
+                )
+                basis = jax.lax.slice_in_dim(basis, modes, None, axis=D)
+                # (out_c,in_c,num),(num,frequencies,tensor) -> (out_c,in_c,frequencies,tensor)
+                spectral_filter = jnp.einsum(
+                    "ijk,k...->ij...", weight_block.astype(self.policy.accumulate_dtype), basis
+                )
+                spectral_filter = spectral_filter.reshape(
+                    spectral_filter.shape[: 2 + D] + (D**in_k, D**out_k)
+                )
+                # The transform of a real filter is even or odd under -I like the filters, which
+                # is (-1)^k * det(-I)^parity. Odd Fourier coefficients must be imaginary.
+                if ((-1) ** (in_k + out_k)) * ((-1) ** (D * filter_key[1])) == -1:
+                    spectral_filter = 1j * spectral_filter
+
+                # (out_c,in_c,frequencies,in_tensor,out_tensor),(in_c,frequencies,in_tensor)
+                # -> (out_c,frequencies,out_tensor)
+                out_hat = jnp.einsum("ij...ab,j...a->i...b", spectral_filter, image_hat)
+                if (out_k, out_p) in out_hats:
+                    out_hats[(out_k, out_p)] = out_hats[(out_k, out_p)] + out_hat
+                else:
+                    out_hats[(out_k, out_p)] = out_hat
+
+        out = input_multi_image.empty()
+        for (out_k, out_p), out_hat in out_hats.items():
+            # put the zeros of the dropped frequencies back
+            for axis, N in zip(spatial_axes[:-1], spatial_dims[:-1]):
+                zeros_shape = list(out_hat.shape)
+                zeros_shape[axis] = N - 2 * modes - 1
+                out_hat = jnp.concatenate(
+                    [
+                        jax.lax.slice_in_dim(out_hat, 0, modes + 1, axis=axis),
+                        jnp.zeros(zeros_shape, dtype=out_hat.dtype),
+                        jax.lax.slice_in_dim(out_hat, modes + 1, None, axis=axis),
+                    ],
+                    axis=axis,
+                )
+            last_pad = spatial_dims[-1] // 2 - modes
+            out_hat = jnp.pad(out_hat, ((0, 0),) * D + ((0, last_pad), (0, 0)))
+
+            out_block = jnp.fft.irfftn(out_hat, s=spatial_dims, axes=spatial_axes, norm="forward")
+            out.append(
+                out_k, out_p, out_block.reshape((len(out_block),) + spatial_dims + (D,) * out_k)
+            )
+
+        return out
+
+    def freeze(self: Self, is_torus: Union[bool, tuple[bool, ...]] = True) -> Self:
+        """
+        The spectral layer is already applied in one pass, so it is not folded into a
+        FrozenConvContract.
+
+        args:
+            is_torus: what dimensions of the inputs will be toroidal, must all be True
+
+        returns:
+            the same layer
+        """
+        assert is_torus is True or all(is_torus), (
+            f"SpectralConvContract::freeze: the input must be a torus, but got {is_torus}"
+        )
+        return self
+
+
+class UnpackedConvContract(eqx.Module):
+    """
+    The leaves of a ConvContract before its parameters were packed, and optionally before its
+    invariant filters were moved to the filter bank registry. Only used to load old checkpoints,
+    see ml.load_unpacked.
+    """
+
+    weights: dict[tuple[int, int], dict[tuple[int, int], jax.Array]]
+    bias: dict[tuple[int, int], jax.Array]
+    invariant_filters: Optional[geom.MultiImage]
+
+
+class FrozenConvContract(eqx.Module):
+    """
+    An inference version of ConvContract. The weights and invariant filters of every pair of input
+    and output types are folded into one raveled kernel, so each call is a single dense convolution
+    of all the input types to all the output types, with the contractions done by the kernel.
+    Smaller filters are zero padded to the largest filter when the padding is centered. The padding
+    is resolved ahead of time for the is_torus of the inputs.
+    """
+
+    kernel: jax.Array
+    bias: dict[tuple[int, int], jax.Array]
+
+    input_keys: geom.Signature = eqx.field(static=True)
+    output_keys: geom.Signature = eqx.field(static=True)
+    mean_bias_keys: tuple[tuple[int, int], ...] = eqx.field(static=True)
+    is_torus: tuple[bool, ...] = eqx.field(static=True)
+    stride: tuple[int, ...] = eqx.field(static=True)
+    wrap_padding: tuple[tuple[int, int], ...] = eqx.field(static=True)
+    padding_literal: tuple[tuple[int, int], ...] = eqx.field(static=True)
+    lhs_dilation: Optional[tuple[int, ...]] = eqx.field(static=True)
+    rhs_dilation: tuple[int, ...] = eqx.field(static=True)
+    D: int = eqx.field(static=True)
+    policy: Policy = eqx.field(static=True)
+
+    def __init__(
+        self: Self, conv: ConvContract, is_torus: Union[bool, tuple[bool, ...]] = True
+    ) -> None:
+        """
+        Constructor for FrozenConvContract, usually called by ConvContract.freeze.
+
+        args:
+            conv: the trained ConvContract
+            is_torus: what dimensions of the inputs will be toroidal
+        """
+        D = conv.D
+        self.D = D
+        self.is_torus = (is_torus,) * D if isinstance(is_torus, bool) else is_torus
+        self.stride = conv.stride if isinstance(conv.stride, tuple) else (conv.stride,) * D
+        self.lhs_dilation = conv.lhs_dilation
+        self.rhs_dilation = (
+            conv.rhs_dilation if isinstance(conv.rhs_dilation, tuple) else (conv.rhs_dilation,) * D
+        )
+        self.policy = conv.policy
+        self.input_keys = conv.input_keys
+
+        # (out_c,in_c,num_filters),(num,spatial,tensor) -> (out_c,in_c,spatial,in_tensor,out_tensor)
+        filter_blocks = {}
+        for (in_k, in_p), _ in conv.input_keys:
+            for (out_k, out_p), weight_block in conv.weights[(in_k, in_p)].items():
+                filter_key = (in_k + out_k, (in_p + out_p) % 2)
+                filter_blocks[((in_k, in_p), (out_k, out_p))] = jnp.einsum(
+                    "ijk,k...->ij...",
+                    weight_block.astype(jnp.float32),
+                    conv.invariant_filters[filter_key].astype(jnp.float32),
+                )
+
+        # the output types in the order that ConvContract produces them, dropping the types that
+        # its bias drops, and whether each one gets a mean bias
+        target_c = dict(conv.target_keys)
+        output_keys = []
+        mean_bias_keys = []
+        for _, out_key in filter_blocks.keys():
+            if out_key in [key for key, _ in output_keys]:
+                continue
+
+            if conv.use_bias:
+                if out_key == (0, 0) and (conv.use_bias == "scalar" or conv.use_bias == "auto"):
+                    pass
+                elif (out_key != (0, 0) and conv.use_bias == "auto") or conv.use_bias == "mean":
+                    mean_bias_keys.append(out_key)
+                else:
+                    continue
+
+            output_keys.append((out_key, target_c[out_key]))
+
+        self.output_keys = geom.Signature(tuple(output_keys))
+        self.mean_bias_keys = tuple(mean_bias_keys)
+        conv_bias = conv.bias
+        self.bias = {key: conv_bias[key] for key, _ in self.output_keys} if conv.use_bias else {}
+
+        all_filter_spatial_dims = [
+            geom.parse_shape(block.shape[2:], D)[0] for block in filter_blocks.values()
+        ]
+        kernel_spatial_dims = tuple(max(dims) for dims in zip(*all_filter_spatial_dims))
+        assert (conv.padding in {None, "TORUS", "SAME"}) or (
+            len(set(all_filter_spatial_dims)) == 1
+        ), (
+            f"FrozenConvContract: filters of unequal sizes {set(all_filter_spatial_dims)} "
+            f"require centered padding, but got {conv.padding}"
+        )
+        self.wrap_padding, self.padding_literal = _get_padding_plan(
+            self.is_torus, kernel_spatial_dims, conv.padding, self.rhs_dilation
+        )
+
+        # assemble the kernel, (kernel_spatial,in_c*in_tensor summed over inputs,out_c*out_tensor
+        # summed over outputs), with zeros for pairs without a filter
+        kernel_rows = []
+        for (in_k, in_p), in_c in self.input_keys:
+            kernel_row = []
+            for (out_k, out_p), out_c in self.output_keys:
+                if ((in_k, in_p), (out_k, out_p)) not in filter_blocks:
+                    kernel_row.append(
+                        jnp.zeros(kernel_spatial_dims + (in_c * D**in_k, out_c * D**out_k))
+                    )
+                    continue
+
+                filter_block = filter_blocks[((in_k, in_p), (out_k, out_p))]
+                filter_spatial_dims, _ = geom.parse_shape(filter_block.shape[2:], D)
+                # zero pad the smaller filters evenly, the sidelengths are all odd
+                spatial_pad = tuple(
+                    ((M - m) // 2, (M - m) // 2)
+                    for M, m in zip(kernel_spatial_dims, filter_spatial_dims)
+                )
+                filter_block = jnp.pad(
+                    filter_block, ((0, 0), (0, 0)) + spatial_pad + ((0, 0),) * (in_k + out_k)
+                )
+                # (out_c,in_c,spatial,in_tensor,out_tensor) ->
+                # (spatial,in_c,in_tensor,out_c,out_tensor)
+                idxs = (
+                    tuple(range(2, 2 + D + in_k))
+                    + (0,)
+                    + tuple(range(2 + D + in_k, 2 + D + in_k + out_k))
+                )
+                filter_block = jnp.moveaxis(filter_block.transpose((1,) + idxs), 0, D)
+                kernel_row.append(
+                    filter_block.reshape(kernel_spatial_dims + (in_c * D**in_k, out_c * D**out_k))
+                )
+
+            kernel_rows.append(jnp.concatenate(kernel_row, axis=-1))
+
+        self.kernel = jnp.concatenate(kernel_rows, axis=-2).astype(self.policy.compute_dtype)
+
+    def __call__(self: Self, x: geom.MultiImage) -> geom.MultiImage:
+        """
+        The callable for FrozenConvContract, which matches the ConvContract it was frozen from.
+
+        args:
+            x: the input, whose is_torus must match the is_torus the layer was frozen with
+
+        returns:
+            the convolved MultiImage, which is a new object
+        """
+        assert x.is_torus == self.is_torus, (
+            f"FrozenConvContract: layer was frozen for is_torus={self.is_torus}, but input has "
+            f"is_torus={x.is_torus}"
+        )
+        spatial_dims = x.get_spatial_dims()
+        # (in_c,spatial,tensor) -> (spatial,in_c*tensor), concatenated over the input types
+        image = jnp.concatenate(
+            [
+                jnp.moveaxis(x[key], 0, self.D).reshape(spatial_dims + (-1,))
+                for key, _ in self.input_keys
+            ],
+            axis=-1,
+        ).astype(self.policy.compute_dtype)
+        if any(pad != (0, 0) for pad in self.wrap_padding):
+            image = jnp.pad(image, self.wrap_padding + ((0, 0),), mode="wrap")
+
+        out = jax.lax.conv_general_dilated(
+            image[None],  # add batch dim
+            self.kernel,
+            self.stride,
+            self.padding_literal,
+            lhs_dilation=self.lhs_dilation,
+            rhs_dilation=self.rhs_dilation,
+            dimension_numbers=(
+                ("NHWC", "HWIO", "NHWC") if self.D == 2 else ("NHWDC", "HWDIO", "NHWDC")
+            ),
+            preferred_element_type=self.policy.accumulate_dtype,
+        )[0]
+        new_spatial_dims = out.shape[: self.D]
+
+        out_multi_image = x.empty()
+        idx = 0
+        for (k, p), out_c in self.output_keys:
+            length = out_c * self.D**k
+            # (spatial,out_c*tensor) -> (out_c,spatial,tensor)
+            image_block = jnp.moveaxis(
+                out[..., idx : idx + length].reshape(new_spatial_dims + (out_c,) + (self.D,) * k),
+                self.D,
+                0,
+            )
+            if (k, p) in self.mean_bias_keys:
+                mean_image = jnp.mean(
+                    image_block, axis=tuple(range(1, 1 + self.D)), keepdims=True
+                )
+                image_block = image_block + mean_image * self.bias[(k, p)]
+            elif (k, p) in self.bias:
+                image_block = image_block + self.bias[(k, p)]
+
+            out_multi_image.append(k, p, image_block)
+            idx += length
+
+        return self.policy.cast_to_compute(out_multi_image)
 
 
 class GroupNorm(eqx.Module):
@@ -419,6 +1288,7 @@ class GroupNorm(eqx.Module):
     D: int = eqx.field(static=False)
     groups: int = eqx.field(static=False)
     eps: float = eqx.field(static=False)
+    policy: Policy = eqx.field(static=True)
 
     def __init__(
         self: Self,
@@ -426,6 +1296,7 @@ class GroupNorm(eqx.Module):
         D: int,
         groups: int,
         eps: float = 1e-5,
+        policy: Optional[Policy] = None,
     ) -> None:
         """
         Constructor for GroupNorm. When num_groups=num_channels, this is equivalent to instance_norm. When
@@ -436,10 +1307,12 @@ class GroupNorm(eqx.Module):
             D: dimension
             groups: the number of channel groups for group_norm
             eps: number to add to variance so we aren't dividing by 0
+            policy: the mixed precision policy, defaults to the global policy
         """
         self.D = D
         self.groups = groups
         self.eps = eps
+        self.policy = get_policy() if policy is None else policy
 
         self.scale = {}
         self.bias = {}
@@ -459,9 +1332,13 @@ class GroupNorm(eqx.Module):
                     f"ml::group_norm: Equivariant group_norm not implemented for k>1, but k={k}",
                 )
 
+        self.scale = self.policy.cast_to_param(self.scale)
+        self.bias = self.policy.cast_to_param(self.bias)
+        self.vanilla_norm = self.policy.cast_to_param(self.vanilla_norm)
+
     def __call__(self: Self, x: geom.MultiImage) -> geom.MultiImage:
         """
-        Callable for GroupNorm,
+        Callable for GroupNorm. The statistics are computed in the accumulate dtype of the policy.
 
         args:
             x: input MultiImage
@@ -470,7 +1347,7 @@ class GroupNorm(eqx.Module):
             the output normed MultiImage
         """
         out_x = x.empty()
-        for (k, p), image_block in x.items():
+        for (k, p), image_block in self.policy.cast_to_accumulate(x).items():
             if k == 0:
                 whitened_data = self.vanilla_norm[(k, p)](image_block)  # normal norm
             elif k == 1:
@@ -484,7 +1361,7 @@ class GroupNorm(eqx.Module):
                     f"ml::group_norm: Equivariant group_norm not implemented for k>1, but k={k}",
                 )
 
-            out_x.append(k, p, whitened_data)
+            out_x.append(k, p, whitened_data.astype(self.policy.compute_dtype))
 
         return out_x
 
@@ -494,7 +1371,13 @@ class LayerNorm(GroupNorm):
     LayerNorm, which is GroupNorm with a single group.
     """
 
-    def __init__(self: Self, input_keys: geom.Signature, D: int, eps: float = 1e-5) -> None:
+    def __init__(
+        self: Self,
+        input_keys: geom.Signature,
+        D: int,
+        eps: float = 1e-5,
+        policy: Optional[Policy] = None,
+    ) -> None:
         """
         Constructor for LayerNorm.
 
@@ -502,8 +1385,9 @@ class LayerNorm(GroupNorm):
             input_keys: the input signature
             D: the dimension
             eps: number to add to variance so we aren't dividing by 0
+            policy: the mixed precision policy, defaults to the global policy
         """
-        super(LayerNorm, self).__init__(input_keys, D, 1, eps)
+        super(LayerNorm, self).__init__(input_keys, D, 1, eps, policy)
 
 
 class VectorNeuronNonlinear(eqx.Module):
@@ -520,6 +1404,7 @@ class VectorNeuronNonlinear(eqx.Module):
     eps: float = eqx.field(static=True)
     D: int = eqx.field(static=True)
     scalar_activation: Callable = eqx.field(static=True)
+    policy: Policy = eqx.field(static=True)
 
     def __init__(
         self: Self,
@@ -528,6 +1413,7 @@ class VectorNeuronNonlinear(eqx.Module):
         scalar_activation: Callable[[ArrayLike], jax.Array] = jax.nn.relu,
         eps: float = 1e-5,
         key: Any = None,
+        policy: Optional[Policy] = None,
     ) -> None:
         """
         Constructor for VectorNeuronNonlinear.
@@ -538,10 +1424,12 @@ class VectorNeuronNonlinear(eqx.Module):
             scalar_activation: nonlinearity used for scalars
             eps: small value to avoid dividing by zero if the k_vec is close to 0
             key: jax.random key
+            policy: the mixed precision policy, defaults to the global policy
         """
         self.eps = eps
         self.D = D
         self.scalar_activation = scalar_activation
+        self.policy = get_policy() if policy is None else policy
 
         self.weights = {}
         for (k, p), in_c in input_keys:
@@ -552,9 +1440,12 @@ class VectorNeuronNonlinear(eqx.Module):
                     subkey, shape=(in_c, in_c), minval=-bound, maxval=bound
                 )
 
+        self.weights = self.policy.cast_to_param(self.weights)
+
     def __call__(self: Self, x: geom.MultiImage) -> geom.MultiImage:
         """
-        Callable for VectorNeuronNonlinearity
+        Callable for VectorNeuronNonlinearity. The channel mixing takes its inputs in the compute
+        dtype of the policy, while the normalization and projections are in the accumulate dtype.
 
         args:
             x: the input
@@ -563,13 +1454,19 @@ class VectorNeuronNonlinear(eqx.Module):
             a new MultiImage output
         """
         out_x = x.empty()
-        for (k, p), img_block in x.items():
+        for (k, p), img_block in self.policy.cast_to_compute(x).items():
 
             if (k, p) == (0, 0):
                 out_x.append(k, p, self.scalar_activation(img_block))
             else:
                 # -> (out_c,spatial,tensor)
-                k_vec = jnp.einsum("ij,j...->i...", self.weights[(k, p)], img_block)
+                k_vec = jnp.einsum(
+                    "ij,j...->i...",
+                    self.weights[(k, p)].astype(self.policy.compute_dtype),
+                    img_block,
+                    preferred_element_type=self.policy.accumulate_dtype,
+                )
+                img_block = img_block.astype(self.policy.accumulate_dtype)
                 k_vec_normed = k_vec / (geom.norm(1 + self.D, k_vec, keepdims=True) + self.eps)
 
                 inner_prod = jnp.einsum(
@@ -586,7 +1483,7 @@ class VectorNeuronNonlinear(eqx.Module):
                 scaled_parallel = jnp.einsum(
                     f"...,...{geom.LETTERS[:k]}->...{geom.LETTERS[:k]}", h, v_parallel
                 )
-                out_x.append(k, p, scaled_parallel + v_perp)
+                out_x.append(k, p, (scaled_parallel + v_perp).astype(self.policy.compute_dtype))
 
         return out_x
 
@@ -612,7 +1509,7 @@ class MaxNormPool(eqx.Module):
 
     def __call__(self: Self, x: geom.MultiImage) -> geom.MultiImage:
         """
-        Callable for MaxNormPool.
+        Callable for MaxNormPool. Each block is pooled with all its leading axes at once.
 
         args:
             x: the input to the layer
@@ -620,12 +1517,16 @@ class MaxNormPool(eqx.Module):
         returns:
             a new max normed output MultiImage
         """
-        in_axes = (None, 0, None, None)
-        vmap_max_pool = jax.vmap(geom.max_pool, in_axes=in_axes)
-
+        n_leading = x.get_n_leading()
         out_x = x.empty()
         for (k, p), image_block in x.items():
-            out_x.append(k, p, vmap_max_pool(x.D, image_block, self.patch_len, self.use_norm))
+            out_x.append(
+                k,
+                p,
+                geom.max_pool(
+                    x.D, image_block, self.patch_len, self.use_norm, n_leading=n_leading
+                ),
+            )
 
         return out_x
 
@@ -637,8 +1538,14 @@ class LayerWrapper(eqx.Module):
     """
 
     modules: dict[tuple[int, int], Callable[..., Any]]
+    policy: Optional[Policy] = eqx.field(static=True)
 
-    def __init__(self: Self, module: Callable[..., Any], input_keys: geom.Signature) -> None:
+    def __init__(
+        self: Self,
+        module: Callable[..., Any],
+        input_keys: geom.Signature,
+        policy: Optional[Policy] = None,
+    ) -> None:
         """
         Perform the module or callable (e.g., activation) on each layer of the input MultiImage.
         Since we only take input_keys, module should preserve the shape/tensor order and parity.
@@ -646,7 +1553,14 @@ class LayerWrapper(eqx.Module):
         args:
             module: module should have as input/output an image of shape (channels, spatial)
             input_keys: actual input (and output) signature this module will process
+            policy: if present, the module's arrays are stored in the param dtype of the policy,
+                and the module and input are cast to the compute dtype when it is called. This
+                is needed for modules such as eqx.nn.Conv that require matching dtypes.
         """
+        self.policy = policy
+        if policy is not None:
+            module = policy.cast_to_param(module)
+
         self.modules = {}
         for (k, p), _ in input_keys:
             # I believe this *should* duplicate so they are independent, per the description in
@@ -666,7 +1580,11 @@ class LayerWrapper(eqx.Module):
         """
         out = x.__class__({}, x.D, x.is_torus)
         for (k, p), image in x.items():
-            out.append(k, p, self.modules[(k, p)](image))
+            module = self.modules[(k, p)]
+            if self.policy is not None:
+                module, image = self.policy.cast_to_compute((module, image))
+
+            out.append(k, p, module(image))
 
         return out
 
@@ -678,8 +1596,14 @@ class LayerWrapperAux(eqx.Module):
     """
 
     modules: dict[tuple[int, int], Callable[..., Any]]
+    policy: Optional[Policy] = eqx.field(static=True)
 
-    def __init__(self: Self, module: Callable[..., Any], input_keys: geom.Signature):
+    def __init__(
+        self: Self,
+        module: Callable[..., Any],
+        input_keys: geom.Signature,
+        policy: Optional[Policy] = None,
+    ):
         """
         Perform the module or callable (e.g., activation) on each layer of the input MultiImage.
         Since we only take input_keys, module should preserve the shape/tensor order and parity.
@@ -688,7 +1612,11 @@ class LayerWrapperAux(eqx.Module):
             module: module should have as input/output an image of shape (channels, spatial) and
                 aux data (likely batch_stats for BatchNorm).
             input_keys: actual input (and output) signature this module will process
+            policy: if present, the input is cast to the accumulate dtype of the policy, because
+                modules such as eqx.nn.BatchNorm keep float32 statistics in the aux data, and the
+                output is cast to the compute dtype
         """
+        self.policy = policy
         self.modules = {}
         for (k, p), _ in input_keys:
             # I believe this *should* duplicate so they are independent, per the description in
@@ -711,7 +1639,54 @@ class LayerWrapperAux(eqx.Module):
         """
         out = x.__class__({}, x.D, x.is_torus)
         for (k, p), image in x.items():
+            if self.policy is not None:
+                image = image.astype(self.policy.accumulate_dtype)
+
             out_image, aux_data = self.modules[(k, p)](image, aux_data)
+            if self.policy is not None:
+                out_image = out_image.astype(self.policy.compute_dtype)
+
             out.append(k, p, out_image)
 
         return out, aux_data
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~ Inference ~~~~~~~~~~~~~~~~~~~~~~
+def _freeze_layer(layer: ConvContract, is_torus: Union[bool, tuple[bool, ...]]) -> eqx.Module:
+    """
+    Freeze a ConvContract. The layers of blocks stacked by models.stack_blocks have params with a
+    leading axis over the blocks, so each block is frozen under vmap and the frozen layers are
+    stacked the same way, to be applied with models.apply_scanned.
+
+    args:
+        layer: the ConvContract, possibly stacked
+        is_torus: what dimensions of the inputs will be toroidal
+
+    returns:
+        the frozen layer
+    """
+    if layer.params.ndim > 1:
+        return eqx.filter_vmap(lambda block_layer: _freeze_layer(block_layer, is_torus))(layer)
+
+    return layer.freeze(is_torus)
+
+
+def freeze(model: Any, is_torus: Union[bool, tuple[bool, ...]] = True) -> Any:
+    """
+    Transform a trained model for inference. Every ConvContract is replaced by the
+    FrozenConvContract with its weights and invariant filters folded into one kernel, and layers
+    such as BatchNorm and Dropout are put in inference mode. The frozen model cannot be trained.
+
+    args:
+        model: the trained model
+        is_torus: what dimensions of the inputs will be toroidal
+
+    returns:
+        the frozen model
+    """
+    model = eqx.nn.inference_mode(model)
+    return jax.tree_util.tree_map(
+        lambda layer: _freeze_layer(layer, is_torus) if isinstance(layer, ConvContract) else layer,
+        model,
+        is_leaf=lambda layer: isinstance(layer, ConvContract),
+    )
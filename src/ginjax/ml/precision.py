@@ -0,0 +1,310 @@
+from typing_extensions import Any, Self, Union
+
+import jax
+import jax.numpy as jnp
+import equinox as eqx
+
+# ------------------------------------------------------------------------------
+# Mixed precision policies
+
+POLICY_NAMES = ("float32", "bfloat16", "float16")
+
+
+class Policy:
+    """
+    A mixed precision policy, the dtypes that a model stores its parameters in, computes in, and
+    returns its output in. Convolutions and contractions are given their inputs in the compute dtype
+    but accumulate in the accumulate dtype, the wider of the compute dtype and float32, and
+    normalizations compute their statistics in the accumulate dtype as well. The default policy is
+    float32 throughout, which is the usual behavior of the layers.
+    """
+
+    param_dtype: jnp.dtype
+    compute_dtype: jnp.dtype
+    output_dtype: jnp.dtype
+    accumulate_dtype: jnp.dtype
+
+    def __init__(
+        self: Self,
+        param_dtype: Union[str, jnp.dtype] = "float32",
+        compute_dtype: Union[str, jnp.dtype] = "float32",
+        output_dtype: Union[str, jnp.dtype] = "float32",
+    ) -> None:
+        """
+        Constructor for a Policy.
+
+        args:
+            param_dtype: dtype the parameters are stored, and thus optimized, in
+            compute_dtype: dtype of the activations between layers
+            output_dtype: dtype of the output of the model, which is what the loss sees
+        """
+        self.param_dtype = jnp.dtype(param_dtype)
+        self.compute_dtype = jnp.dtype(compute_dtype)
+        self.output_dtype = jnp.dtype(output_dtype)
+        self.accumulate_dtype = jnp.promote_types(self.compute_dtype, jnp.float32)
+
+    @classmethod
+    def from_name(cls, name: str) -> Self:
+        """
+        Get the policy for one of POLICY_NAMES, which is the compute dtype. The parameters and the
+        output are always float32, so the optimizer and the loss are unaffected.
+
+        args:
+            name: the compute dtype, one of POLICY_NAMES
+
+        returns:
+            the policy
+        """
+        assert name in POLICY_NAMES, f"Policy::from_name: name must be one of {POLICY_NAMES}"
+        return cls("float32", name, "float32")
+
+    def __eq__(self: Self, other: object) -> bool:
+        return isinstance(other, Policy) and (self._dtypes() == other._dtypes())
+
+    def __hash__(self: Self) -> int:
+        # layers keep the policy as a static field, so it must hash by value
+        return hash(self._dtypes())
+
+    def __repr__(self: Self) -> str:
+        return (
+            f"Policy(param={self.param_dtype}, compute={self.compute_dtype}, "
+            f"output={self.output_dtype})"
+        )
+
+    def _dtypes(self: Self) -> tuple[str, str, str]:
+        return (str(self.param_dtype), str(self.compute_dtype), str(self.output_dtype))
+
+    def is_mixed(self: Self) -> bool:
+        """
+        Whether the compute dtype is narrower than the accumulate dtype.
+
+        returns:
+            true if the policy computes in reduced precision
+        """
+        return self.compute_dtype != self.accumulate_dtype
+
+    def cast_to_param(self: Self, tree: Any) -> Any:
+        """
+        Cast the floating point arrays of a pytree, such as a layer's weights, to the param dtype.
+
+        args:
+            tree: the pytree
+
+        returns:
+            the cast pytree
+        """
+        return cast_floating(tree, self.param_dtype)
+
+    def cast_to_compute(self: Self, tree: Any) -> Any:
+        """
+        Cast the floating point arrays of a pytree, such as a MultiImage, to the compute dtype.
+
+        args:
+            tree: the pytree
+
+        returns:
+            the cast pytree
+        """
+        return cast_floating(tree, self.compute_dtype)
+
+    def cast_to_accumulate(self: Self, tree: Any) -> Any:
+        """
+        Cast the floating point arrays of a pytree to the accumulate dtype.
+
+        args:
+            tree: the pytree
+
+        returns:
+            the cast pytree
+        """
+        return cast_floating(tree, self.accumulate_dtype)
+
+    def cast_to_output(self: Self, tree: Any) -> Any:
+        """
+        Cast the floating point arrays of a pytree, such as a model output, to the output dtype.
+
+        args:
+            tree: the pytree
+
+        returns:
+            the cast pytree
+        """
+        return cast_floating(tree, self.output_dtype)
+
+
+def cast_floating(tree: Any, dtype: jnp.dtype) -> Any:
+    """
+    Cast the floating point arrays of a pytree to dtype, leaving all other leaves alone.
+
+    args:
+        tree: the pytree
+        dtype: the dtype to cast to
+
+    returns:
+        the cast pytree
+    """
+
+    def cast(leaf: Any) -> Any:
+        if eqx.is_inexact_array(leaf) and leaf.dtype != dtype:
+            return leaf.astype(dtype)
+        else:
+            return leaf
+
+    return jax.tree_util.tree_map(cast, tree)
+
+
+_global_policy = Policy()
+
+
+def set_policy(policy: Policy) -> None:
+    """
+    Set the global policy, which is used by layers and models constructed without a policy. Layers
+    keep the policy they were constructed with, so this must be set before building the model.
+
+    args:
+        policy: the new global policy
+    """
+    global _global_policy
+    _global_policy = policy
+
+
+def get_policy() -> Policy:
+    """
+    Get the global policy.
+
+    returns:
+        the global policy
+    """
+    return _global_policy
+
+
+# ------------------------------------------------------------------------------
+# Loss scaling
+
+
+def all_finite(tree: Any) -> jax.Array:
+    """
+    Check whether every array of a pytree, such as the gradients, is finite.
+
+    args:
+        tree: the pytree
+
+    returns:
+        boolean scalar, true if there are no infs or nans
+    """
+    leaves = jax.tree_util.tree_leaves(eqx.filter(tree, eqx.is_inexact_array))
+    return jnp.all(jnp.array([jnp.all(jnp.isfinite(leaf)) for leaf in leaves]))
+
+
+class LossScale(eqx.Module):
+    """
+    Loss scaling for training in float16, whose small range causes the gradients of the activations
+    to underflow. The loss is multiplied by the scale before differentiating, and the gradients are
+    divided by it before the update. A dynamic loss scale skips updates whose gradients overflow and
+    halves the scale, then doubles the scale after every `period` steps without an overflow. The
+    scale and counter are arrays, so the loss scale is updated without synchronizing with the host.
+    """
+
+    scale: jax.Array
+    counter: jax.Array
+
+    dynamic: bool = eqx.field(static=True)
+    period: int = eqx.field(static=True)
+    factor: float = eqx.field(static=True)
+
+    def __init__(
+        self: Self,
+        scale: float = 2.0**15,
+        dynamic: bool = True,
+        period: int = 2000,
+        factor: float = 2.0,
+        counter: Union[int, jax.Array] = 0,
+    ) -> None:
+        """
+        Constructor for LossScale.
+
+        args:
+            scale: the initial scale
+            dynamic: whether to adjust the scale, otherwise it is fixed
+            period: number of steps without an overflow before the scale is increased
+            factor: what the scale is multiplied or divided by when it is adjusted
+            counter: number of steps without an overflow so far
+        """
+        self.scale = jnp.asarray(scale, dtype=jnp.float32)
+        self.counter = jnp.asarray(counter, dtype=jnp.int32)
+        self.dynamic = dynamic
+        self.period = period
+        self.factor = factor
+
+    def scale_loss(self: Self, loss: jax.Array) -> jax.Array:
+        """
+        Multiply the loss by the scale.
+
+        args:
+            loss: the loss
+
+        returns:
+            the scaled loss
+        """
+        return loss * self.scale.astype(loss.dtype)
+
+    def unscale(self: Self, tree: Any) -> Any:
+        """
+        Divide the floating point arrays of a pytree, the gradients of the scaled loss, by the
+        scale. The gradients are cast to float32 first, so they do not overflow.
+
+        args:
+            tree: the pytree
+
+        returns:
+            the unscaled pytree
+        """
+        inv_scale = 1.0 / self.scale
+        return jax.tree_util.tree_map(
+            lambda leaf: (
+                leaf.astype(jnp.promote_types(leaf.dtype, jnp.float32)) * inv_scale
+                if eqx.is_inexact_array(leaf)
+                else leaf
+            ),
+            tree,
+        )
+
+    def adjust(self: Self, grads_finite: jax.Array) -> Self:
+        """
+        Get the loss scale for the next step.
+
+        args:
+            grads_finite: whether the gradients of this step were finite
+
+        returns:
+            the adjusted LossScale, which is unchanged if it is not dynamic
+        """
+        if not self.dynamic:
+            return self
+
+        grow = grads_finite & (self.counter == self.period - 1)
+        scale = jnp.where(
+            grads_finite,
+            jnp.where(grow, self.scale * self.factor, self.scale),
+            jnp.maximum(self.scale / self.factor, 1.0),
+        )
+        counter = jnp.where(grads_finite & ~grow, self.counter + 1, 0)
+        return self.__class__(scale, self.dynamic, self.period, self.factor, counter)
+
+
+def select_tree(pred: jax.Array, on_true: Any, on_false: Any) -> Any:
+    """
+    Select between the arrays of two pytrees with the same structure, such as the updated and the
+    previous models. Leaves that are not arrays are taken from on_true.
+
+    args:
+        pred: boolean scalar
+        on_true: pytree selected if pred is true
+        on_false: pytree selected if pred is false
+
+    returns:
+        the selected pytree
+    """
+    return jax.tree_util.tree_map(
+        lambda a, b: jnp.where(pred, a, b) if eqx.is_array(a) else a, on_true, on_false
+    )
@@ -1,7 +1,7 @@
 import time
 import math
 import functools
-from typing import Any, Callable, Optional, Sequence, Union
+from typing import Any, Callable, Iterator, Optional, Sequence, Union
 import numpy as np
 import wandb
 
@@ -13,6 +13,10 @@ import equinox as eqx
 import optax
 
 import ginjax.geometric as geom
+from ginjax.data import DeviceCache, GroupAugmentation, MultiImageDataset, WorkerLoader
+from ginjax.ml.layers import ConvContract
+from ginjax.ml.losses import smse_loss
+from ginjax.ml.precision import LossScale, all_finite, select_tree
 from ginjax.ml.stopping_conditions import StopCondition, ValLoss
 import ginjax.models as models
 
@@ -45,21 +49,57 @@ def load(filename: str, model: models.MultiImageModule) -> models.MultiImageModu
         return eqx.tree_deserialise_leaves(f, model)
 
 
+def load_unpacked(
+    filename: str, model: models.MultiImageModule, with_filters: bool = True
+) -> models.MultiImageModule:
+    """
+    Load an equinox model saved before ConvContract packed its weights and biases into one array.
+    The checkpoint is read with each ConvContract in its old layout, then the parameters are packed.
+
+    args:
+        filename: the file to load the model from
+        model: the type of model we are loading, the parameter values will be set to the loaded ones
+        with_filters: whether the checkpoint also has the invariant filters of every ConvContract,
+            which is the case for checkpoints from before the filter bank registry
+
+    returns:
+        the loaded model
+    """
+    is_conv = lambda layer: isinstance(layer, ConvContract)
+    unpacked_model = jax.tree_util.tree_map(
+        lambda layer: layer.to_unpacked(with_filters) if is_conv(layer) else layer,
+        model,
+        is_leaf=is_conv,
+    )
+    with open(filename, "rb") as f:
+        unpacked_model = eqx.tree_deserialise_leaves(f, unpacked_model)
+
+    return jax.tree_util.tree_map(
+        lambda layer, loaded: (
+            layer.replace_params(loaded.weights, loaded.bias) if is_conv(layer) else loaded
+        ),
+        model,
+        unpacked_model,
+        is_leaf=is_conv,
+    )
+
+
 ## Data and Batching operations
 
 
-def get_batches(
-    multi_images: Union[Sequence[geom.MultiImage], geom.MultiImage],
+def iterate_batches(
+    multi_images: Union[
+        Sequence[Union[geom.MultiImage, MultiImageDataset]], geom.MultiImage, MultiImageDataset
+    ],
     batch_size: int,
     rand_key: Optional[ArrayLike],
     devices: Optional[list[jax.Device]] = None,
-) -> list[list[geom.MultiImage]]:
+) -> Iterator[tuple[geom.MultiImage, ...]]:
     """
-    Given a set of MultiImages, construct random batches of those MultiImages. The most common use case
-    is for MultiImagess to be a tuple (X,Y) so that the batches have the inputs and outputs. In this case, it will return
-    a list of length 2 where the first element is a list of the batches of the input data and the second
-    element is the same batches of the output data. Automatically reshapes the batches to use with
-    pmap based on the number of gpus found.
+    Iterate over random batches of a set of MultiImages, one tuple of batches per step. Each batch
+    is only constructed when it is reached, so a MultiImageDataset such as a TimeSeriesWindows
+    never has more than one batch of its samples in memory at a time. Automatically reshapes the
+    batches to use with pmap based on the number of gpus found.
 
     args:
         multi_images: MultiImages which all get simultaneously batched
@@ -68,9 +108,9 @@ def get_batches(
         devices: gpu/cpu devices to use, if None (default) then sets this to jax.devices()
 
     returns:
-        list of lists of batches (which are MultiImages)
+        iterator of tuples of batches, one per item of multi_images
     """
-    if isinstance(multi_images, geom.MultiImage):
+    if isinstance(multi_images, (geom.MultiImage, MultiImageDataset)):
         multi_images = (multi_images,)
 
     L = multi_images[0].get_L()
@@ -79,68 +119,144 @@ def get_batches(
     if devices is None:
         devices = jax.devices()
 
-    batches = [[] for _ in range(len(multi_images))]
     # if L is not divisible by batch, the remainder will be ignored
     for i in range(int(math.floor(L / batch_size))):  # iterate through the batches of an epoch
         idxs = batch_indices[i * batch_size : (i + 1) * batch_size]
-        for j, multi_image in enumerate(multi_images):
-            batches[j].append(multi_image.get_subset(idxs).reshape_pmap(devices))
+        yield tuple(
+            multi_image.get_subset(idxs).reshape_pmap(devices) for multi_image in multi_images
+        )
+
+
+def get_batches(
+    multi_images: Union[
+        Sequence[Union[geom.MultiImage, MultiImageDataset]], geom.MultiImage, MultiImageDataset
+    ],
+    batch_size: int,
+    rand_key: Optional[ArrayLike],
+    devices: Optional[list[jax.Device]] = None,
+) -> list[list[geom.MultiImage]]:
+    """
+    Given a set of MultiImages, construct random batches of those MultiImages. The most common use case
+    is for MultiImagess to be a tuple (X,Y) so that the batches have the inputs and outputs. In this case, it will return
+    a list of length 2 where the first element is a list of the batches of the input data and the second
+    element is the same batches of the output data. Automatically reshapes the batches to use with
+    pmap based on the number of gpus found. This constructs every batch of the epoch at once, use
+    `iterate_batches` to construct them one step at a time.
+
+    args:
+        multi_images: MultiImages which all get simultaneously batched
+        batch_size: length of the batch
+        rand_key: key for the randomness. If None, the order won't be random
+        devices: gpu/cpu devices to use, if None (default) then sets this to jax.devices()
+
+    returns:
+        list of lists of batches (which are MultiImages)
+    """
+    if isinstance(multi_images, (geom.MultiImage, MultiImageDataset)):
+        multi_images = (multi_images,)
+
+    batches = [[] for _ in range(len(multi_images))]
+    for step_batches in iterate_batches(multi_images, batch_size, rand_key, devices):
+        for j, batch in enumerate(step_batches):
+            batches[j].append(batch)
 
     return batches
 
 
+def get_h2d_bytes(
+    multi_images: Sequence[Optional[Union[geom.MultiImage, MultiImageDataset]]],
+) -> int:
+    """
+    Get the total bytes transferred from host to device by the DeviceCaches among multi_images.
+
+    args:
+        multi_images: MultiImages, datasets, or None, of which only DeviceCaches are counted
+
+    returns:
+        the number of bytes
+    """
+    return sum(
+        multi_image.h2d_bytes
+        for multi_image in multi_images
+        if isinstance(multi_image, DeviceCache)
+    )
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~ Training Functions ~~~~~~~~~~~~~~~~~~~~~~
 
 
-def autoregressive_step(
-    input: geom.MultiImage,
+def split_constant_fields(
+    input: geom.MultiImage, constant_fields_dict: dict[tuple[int, int], int] = {}
+) -> tuple[geom.MultiImage, geom.MultiImage]:
+    """
+    Split the input MultiImage into the dynamic fields and the constant fields. The constant fields
+    of each (k,parity) are the last channels. MultiImages should have shape (channels,spatial,tensor).
+
+    args:
+        input: the input to the model
+        constant_fields_dict: a map {key:n_constant_fields} for fields that don't depend on timestep
+
+    returns:
+        the dynamic fields and the constant fields
+    """
+    dynamic_fields = input.empty()
+    constant_fields = input.empty()
+    for (k, parity), image_block in input.items():
+        n_const_fields = constant_fields_dict.get((k, parity), 0)
+        if n_const_fields == 0:
+            dynamic_fields.append(k, parity, image_block)
+        elif n_const_fields == len(image_block):  # entire image type is a constant field
+            constant_fields.append(k, parity, image_block)
+        else:
+            dynamic_fields.append(k, parity, image_block[:-n_const_fields])
+            constant_fields.append(k, parity, image_block[-n_const_fields:])
+
+    for (k, parity), length in constant_fields_dict.items():
+        assert length == 0 or (k, parity) in input, (
+            f"ml::split_constant_fields: constant field {(k, parity)} of length {length} "
+            "is missing from the input"
+        )
+
+    return dynamic_fields, constant_fields
+
+
+def shift_dynamic_fields(
+    dynamic_fields: geom.MultiImage,
     one_step: geom.MultiImage,
     output: geom.MultiImage,
     past_steps: int,
-    constant_fields_dict: dict[tuple[int, int], int] = {},
     future_steps: int = 1,
 ) -> tuple[geom.MultiImage, geom.MultiImage]:
     """
-    Given the input MultiImage, the next step of the model, and the output, update the input
-    and output to be fed into the model next. MultiImages should have shape (channels,spatial,tensor).
-    Channels are c*past_steps + constant_fields where c is some positive integer.
+    Given the dynamic fields of the input, the next step of the model, and the output, shift the
+    past steps window of the dynamic fields by future_steps frames and append the step to the output.
+    MultiImages should have shape (channels,spatial,tensor).
 
     args:
-        input: the input to the model
-        one_step: the model output at this step, assumed to be a single time step
+        dynamic_fields: the dynamic fields of the input, shape (c*past_steps,spatial,tensor)
+        one_step: the model output at this step, shape (c*future_steps,spatial,tensor)
         output: the full output that we are building up
         past_steps: the number of past time steps that are fed into the model
-        constant_fields_dict: a map {key:n_constant_fields} for fields that don't depend on timestep
-        future_steps: number of future steps that the model outputs, currently must be 1
+        future_steps: number of future steps that the model outputs per call
 
     returns:
-        the new input and output
+        the new dynamic fields and output
     """
-    assert (
-        future_steps == 1
-    ), f"ml::autoregressive_step: future_steps must be 1, but found {future_steps}."
-
-    new_input = input.empty()
+    new_dynamic_fields = dynamic_fields.empty()
     new_output = output.empty()
-    constant_fields = input.empty()
     for (k, parity), step_data in one_step.items():
         img_shape = step_data.shape[1:]  # the shape of the image, spatial + tensor
         exp_data = step_data.reshape((-1, future_steps) + img_shape)
         n_channels = exp_data.shape[0]  # number of channels for the key, not timesteps
 
-        if ((k, parity) in constant_fields_dict) and constant_fields_dict[(k, parity)] > 0:
-            n_const_fields = constant_fields_dict[(k, parity)]
-            constant_fields.append(k, parity, input[(k, parity)][-n_const_fields:])
-            dynamic_input = input[(k, parity)][:-n_const_fields]
-        else:
-            dynamic_input = input[(k, parity)]
-
         # get dynamic fields that were the input (c,past_steps,spatial,tensor)
-        exp_input = dynamic_input.reshape((-1, past_steps) + img_shape)
-        new_input.append(
+        exp_input = dynamic_fields[(k, parity)].reshape((-1, past_steps) + img_shape)
+        new_dynamic_fields.append(
             k,
             parity,
-            jnp.concatenate([exp_input[:, 1:], exp_data], axis=1).reshape((-1,) + img_shape),
+            jnp.concatenate([exp_input, exp_data], axis=1)[:, -past_steps:].reshape(
+                (-1,) + img_shape
+            ),
         )
 
         if (k, parity) in output:
@@ -151,13 +267,41 @@ def autoregressive_step(
 
         new_output.append(k, parity, full_output)
 
-    # add constant fields which don't have dynamic fields
-    for (k, parity), length in constant_fields_dict.items():
-        if (k, parity) not in new_input:
-            assert len(input[(k, parity)]) == length  # entire image type must be a constant field
-            constant_fields.append(k, parity, input[(k, parity)])
+    return new_dynamic_fields, new_output
+
+
+def autoregressive_step(
+    input: geom.MultiImage,
+    one_step: geom.MultiImage,
+    output: geom.MultiImage,
+    past_steps: int,
+    constant_fields_dict: dict[tuple[int, int], int] = {},
+    future_steps: int = 1,
+) -> tuple[geom.MultiImage, geom.MultiImage]:
+    """
+    Given the input MultiImage, the next step of the model, and the output, update the input
+    and output to be fed into the model next. MultiImages should have shape (channels,spatial,tensor).
+    Channels are c*past_steps + constant_fields where c is some positive integer. If the model
+    outputs multiple future steps, the past steps window is shifted by future_steps frames. When
+    stepping repeatedly, prefer to split the constant fields once with `split_constant_fields` and
+    use `shift_dynamic_fields`, as `autoregressive_map` does.
 
-    return new_input.concat(constant_fields), new_output
+    args:
+        input: the input to the model
+        one_step: the model output at this step, shape (c*future_steps,spatial,tensor)
+        output: the full output that we are building up
+        past_steps: the number of past time steps that are fed into the model
+        constant_fields_dict: a map {key:n_constant_fields} for fields that don't depend on timestep
+        future_steps: number of future steps that the model outputs per call
+
+    returns:
+        the new input and output
+    """
+    dynamic_fields, constant_fields = split_constant_fields(input, constant_fields_dict)
+    new_dynamic_fields, new_output = shift_dynamic_fields(
+        dynamic_fields, one_step, output, past_steps, future_steps
+    )
+    return new_dynamic_fields.concat(constant_fields), new_output
 
 
 def autoregressive_map(
@@ -167,28 +311,43 @@ def autoregressive_map(
     past_steps: int = 1,
     future_steps: int = 1,
     constant_fields: dict[tuple[int, int], int] = {},
+    model_steps: int = 1,
 ) -> tuple[geom.MultiImage, Optional[eqx.nn.State]]:
     """
-    Given a model, perform an autoregressive step (future_steps) times, and return the output
-    steps in a single MultiImage.
+    Given a model, perform autoregressive steps until there are future_steps output steps, and
+    return the output steps in a single MultiImage. If the model predicts model_steps frames per
+    call (temporal bundling), the model is called ceil(future_steps / model_steps) times and any
+    extra frames from the last call are dropped.
 
     args:
         model: model that operates on MultiImages
         x: the input MultiImage to map
         aux_data: auxilliary data to pass to the network
         past_steps: the number of past steps input to the autoregressive map
-        future_steps: how many times to loop through the autoregression
+        future_steps: the total number of output steps
         constant_fields: data structure which explains which fields are constant fields
+        model_steps: the number of future steps the model outputs per call, defaults to 1
 
     returns:
         the output map with number of steps equal to future steps, and the aux_data
     """
     assert callable(model)
 
+    n_calls = math.ceil(future_steps / model_steps)
+    # the constant fields are split off once and held outside the loop, only the dynamic fields
+    # change each step and the two are joined only for the model call
+    dynamic_x, constant_x = split_constant_fields(x, constant_fields)
     out_x = x.empty()  # assume out matches D and is_torus
-    for _ in range(future_steps):
-        learned_x, aux_data = model(x, aux_data)
-        x, out_x = autoregressive_step(x, learned_x, out_x, past_steps, constant_fields)
+    for _ in range(n_calls):
+        learned_x, aux_data = model(dynamic_x.concat(constant_x), aux_data)
+        dynamic_x, out_x = shift_dynamic_fields(dynamic_x, learned_x, out_x, past_steps, model_steps)
+
+    if n_calls * model_steps > future_steps:
+        # drop the extra steps from the last model call
+        for (k, parity), image_block in out_x.items():
+            img_shape = image_block.shape[1:]
+            exp_block = image_block.reshape((-1, n_calls * model_steps) + img_shape)
+            out_x[(k, parity)] = exp_block[:, :future_steps].reshape((-1,) + img_shape)
 
     return out_x, aux_data
 
@@ -281,8 +440,8 @@ def map_loss_in_batches(
         tuple[jax.Array, Optional[eqx.nn.State]],
     ],
     model: models.MultiImageModule,
-    x: geom.MultiImage,
-    y: geom.MultiImage,
+    x: Union[geom.MultiImage, MultiImageDataset],
+    y: Union[geom.MultiImage, MultiImageDataset],
     batch_size: int,
     rand_key: Optional[ArrayLike],
     devices: Optional[list[jax.Device]] = None,
@@ -301,17 +460,16 @@ def map_loss_in_batches(
         x: input data
         y: target output data
         batch_size: effective batch_size, must be divisible by number of gpus
-        rand_key: rand key passed to get_batches, on None order won't be randomized
+        rand_key: rand key passed to iterate_batches, on None order won't be randomized
         devices: the gpus that the code will run on
         aux_data: auxilliary data, such as batch stats. Passed to the function is has_aux is True.
 
     Returns:
         Average loss over the entire BatchMultiImage
     """
-    X_batches, Y_batches = get_batches((x, y), batch_size, rand_key, devices)
     losses = [
         evaluate(model, map_and_loss, X_batch, Y_batch, aux_data, False)
-        for X_batch, Y_batch in zip(X_batches, Y_batches)
+        for X_batch, Y_batch in iterate_batches((x, y), batch_size, rand_key, devices)
     ]
     return loss_reducer(losses)
 
@@ -322,8 +480,8 @@ def map_plus_loss_in_batches(
         tuple[jax.Array, Optional[eqx.nn.State], geom.MultiImage],
     ],
     model: models.MultiImageModule,
-    x: geom.MultiImage,
-    y: geom.MultiImage,
+    x: Union[geom.MultiImage, MultiImageDataset],
+    y: Union[geom.MultiImage, MultiImageDataset],
     batch_size: int,
     rand_key: Optional[ArrayLike],
     devices: Optional[list[jax.Device]] = None,
@@ -343,17 +501,16 @@ def map_plus_loss_in_batches(
         x: input data
         y: target output data
         batch_size: effective batch_size, must be divisible by number of gpus
-        rand_key: rand key passed to get_batches, on none the order will not be randomized
+        rand_key: rand key passed to iterate_batches, on none the order will not be randomized
         devices: the gpus that the code will run on
         aux_data: auxilliary data, such as batch stats. Passed to the function is has_aux is True.
 
     Returns:
         Average loss over the entire MultiImage, and the mapped entire MultiImage
     """
-    X_batches, Y_batches = get_batches((x, y), batch_size, rand_key, devices)
     losses = []
     out_maps = []
-    for X_batch, Y_batch in zip(X_batches, Y_batches):
+    for X_batch, Y_batch in iterate_batches((x, y), batch_size, rand_key, devices):
         one_loss, one_map = evaluate(model, map_and_loss, X_batch, Y_batch, aux_data, True)
 
         losses.append(one_loss)
@@ -362,6 +519,269 @@ def map_plus_loss_in_batches(
     return loss_reducer(losses), multi_image_reducer(out_maps)
 
 
+def get_timestep(multi_image: geom.MultiImage, step: int, n_steps: int) -> geom.MultiImage:
+    """
+    Select a single timestep from a MultiImage whose image blocks have shape
+    (batch,channels*n_steps,spatial,tensor), where the channels are laid out as (channels,n_steps).
+
+    args:
+        multi_image: the MultiImage to select from
+        step: the timestep to select
+        n_steps: the total number of timesteps in the MultiImage
+
+    returns:
+        a new MultiImage with image blocks of shape (batch,channels,spatial,tensor)
+    """
+    return get_timesteps(multi_image, step, step + 1, n_steps)
+
+
+def get_timesteps(
+    multi_image: geom.MultiImage, start: int, stop: int, n_steps: int
+) -> geom.MultiImage:
+    """
+    Select the timesteps start to stop from a MultiImage whose image blocks have shape
+    (batch,channels*n_steps,spatial,tensor), where the channels are laid out as (channels,n_steps).
+
+    args:
+        multi_image: the MultiImage to select from
+        start: the first timestep to select
+        stop: one past the last timestep to select
+        n_steps: the total number of timesteps in the MultiImage
+
+    returns:
+        a new MultiImage with image blocks of shape (batch,channels*(stop-start),spatial,tensor)
+    """
+    out = multi_image.empty()
+    for (k, parity), image_block in multi_image.items():
+        img_shape = image_block.shape[2:]
+        exp_block = image_block.reshape((len(image_block), -1, n_steps) + img_shape)
+        steps_block = exp_block[:, :, start:stop]
+        out.append(k, parity, steps_block.reshape((len(image_block), -1) + img_shape))
+
+    return out
+
+
+def _rollout_step(
+    model: models.MultiImageModule,
+    dynamic_x: geom.MultiImage,
+    constant_x: geom.MultiImage,
+    y_steps: geom.MultiImage,
+    aux_data: Optional[eqx.nn.State],
+    past_steps: int,
+    metrics: dict[str, Callable[[geom.MultiImage, geom.MultiImage], jax.Array]],
+    model_steps: int = 1,
+) -> tuple[geom.MultiImage, geom.MultiImage, dict[str, jax.Array], Optional[eqx.nn.State]]:
+    """
+    Perform a single autoregressive call of the model for a batch and compute the per sample
+    metrics of each step that it predicts. Used by rollout_loss_in_batches.
+
+    args:
+        model: the model
+        dynamic_x: the dynamic fields of the current model input, shape
+            (batch,channels,spatial,tensor)
+        constant_x: the constant fields of the model input, shape (batch,channels,spatial,tensor)
+        y_steps: the targets of the steps of this call, shape (batch,channels*steps,spatial,tensor)
+            where steps is at most model_steps. Predicted steps past the targets are not evaluated.
+        aux_data: auxilliary data for stateful layers
+        past_steps: the number of past steps input to the model
+        metrics: map from metric name to a function of (prediction, target) returning the metric for
+            each sample in the batch
+        model_steps: the number of future steps the model outputs per call, defaults to 1
+
+    returns:
+        the next dynamic fields, the prediction of shape
+            (batch,channels*model_steps,spatial,tensor), the metrics of each step and sample of
+            shape (steps,batch), and aux_data
+    """
+
+    def one_step(
+        one_dynamic_x: geom.MultiImage,
+        one_constant_x: geom.MultiImage,
+        aux_data: Optional[eqx.nn.State],
+    ) -> tuple[geom.MultiImage, geom.MultiImage, Optional[eqx.nn.State]]:
+        learned_x, aux_data = model(one_dynamic_x.concat(one_constant_x), aux_data)
+        next_dynamic_x, _ = shift_dynamic_fields(
+            one_dynamic_x, learned_x, learned_x.empty(), past_steps, model_steps
+        )
+        return next_dynamic_x, learned_x, aux_data
+
+    vmap_step = jax.vmap(one_step, in_axes=(0, 0, None), out_axes=(0, 0, None), axis_name="batch")
+    next_dynamic_x, prediction, aux_data = vmap_step(dynamic_x, constant_x, aux_data)
+
+    (k, parity), y_block = next(iter(y_steps.items()))
+    n_steps = model_steps * y_block.shape[1] // prediction[(k, parity)].shape[1]
+    all_metrics = {"smse": lambda x, y: smse_loss(x, y, reduce=None), **metrics}
+    step_metrics = {name: [] for name in all_metrics.keys()}
+    for step in range(n_steps):
+        prediction_step = get_timestep(prediction, step, model_steps)
+        y_step = get_timestep(y_steps, step, n_steps)
+        for name, metric in all_metrics.items():
+            step_metrics[name].append(metric(prediction_step, y_step))
+
+    step_metrics = {name: jnp.stack(values) for name, values in step_metrics.items()}
+    return next_dynamic_x, prediction, step_metrics, aux_data
+
+
+def rollout_loss_in_batches(
+    model: models.MultiImageModule,
+    x: Union[geom.MultiImage, MultiImageDataset],
+    y: Union[geom.MultiImage, MultiImageDataset],
+    batch_size: int,
+    past_steps: int,
+    future_steps: int,
+    constant_fields: dict[tuple[int, int], int] = {},
+    metrics: dict[str, Callable[[geom.MultiImage, geom.MultiImage], jax.Array]] = {},
+    devices: Optional[list[jax.Device]] = None,
+    aux_data: Optional[eqx.nn.State] = None,
+    save_prefix: Optional[str] = None,
+    model_steps: int = 1,
+) -> dict[str, jax.Array]:
+    """
+    Rollout the model autoregressively over the entire x, y and compute the per step SMSE along with
+    any other metrics as each step is produced. Unlike `map_plus_loss_in_batches`, the predicted
+    trajectories are never held in memory. Only the running sum of each metric is kept, and the
+    predictions are optionally streamed to disk. The batches are processed in order, and
+    automatically pmaps over multiple gpus, so the number of gpus must evenly divide batch_size as
+    well as any remainder of the MultiImage. As in `autoregressive_map`, a model that predicts
+    model_steps frames per call is called ceil(future_steps / model_steps) times and any extra
+    frames from the last call are dropped.
+
+    If save_prefix is provided, the prediction for each (k,parity) is written to the .npy file
+    `{save_prefix}_k{k}_p{parity}.npy` with shape (L,channels*future_steps,spatial,tensor), the same
+    layout as y. These can be loaded lazily with `np.load(filename, mmap_mode="r")`.
+
+    args:
+        model: the model to rollout
+        x: input data, shape (L,channels,spatial,tensor)
+        y: target data, shape (L,channels*future_steps,spatial,tensor)
+        batch_size: effective batch_size, must be divisible by number of gpus
+        past_steps: the number of past steps input to the model
+        future_steps: the number of steps to rollout
+        constant_fields: a map {key:n_constant_fields} for fields that don't depend on timestep
+        metrics: map from metric name to a function of (prediction, target) MultiImages of shape
+            (batch,channels,spatial,tensor) that returns the metric for each sample, shape (batch,)
+        devices: the gpus that the code will run on
+        aux_data: auxilliary data, such as batch stats
+        save_prefix: if not None, stream the predictions to .npy files with this prefix
+        model_steps: the number of future steps the model outputs per call, defaults to 1
+
+    returns:
+        map from metric name to the mean over samples of that metric at each step, shape (future_steps,)
+    """
+    devices = devices if devices else jax.devices()
+    inference_model = eqx.nn.inference_mode(model)
+    rollout_step_pmap = eqx.filter_pmap(
+        functools.partial(
+            _rollout_step, past_steps=past_steps, metrics=metrics, model_steps=model_steps
+        ),
+        axis_name="pmap_batch",
+        in_axes=(None, 0, 0, 0, None),
+        out_axes=(0, 0, 0, None),
+    )
+    # the constant fields are split off once per batch, only the dynamic fields change each step
+    split_batch = jax.vmap(
+        functools.partial(split_constant_fields, constant_fields_dict=constant_fields)
+    )
+
+    L = x.get_L()
+    metric_sums = {}
+    saved_preds = {}
+    for start in range(0, L, batch_size):
+        idxs = jnp.arange(start, min(start + batch_size, L))
+        dynamic_x, constant_x = split_batch(x.get_subset(idxs))
+        dynamic_x = dynamic_x.reshape_pmap(devices)
+        constant_x = constant_x.reshape_pmap(devices)
+        y_batch = y.get_subset(idxs)
+
+        for first_step in range(0, future_steps, model_steps):
+            n_steps = min(model_steps, future_steps - first_step)
+            y_steps = get_timesteps(y_batch, first_step, first_step + n_steps, future_steps)
+            dynamic_x, prediction, step_metrics, _ = rollout_step_pmap(
+                inference_model, dynamic_x, constant_x, y_steps.reshape_pmap(devices), aux_data
+            )
+
+            for name, values in step_metrics.items():  # (devices,n_steps,batch)
+                if name not in metric_sums:
+                    metric_sums[name] = jnp.zeros(future_steps)
+
+                metric_sums[name] = (
+                    metric_sums[name]
+                    .at[first_step : first_step + n_steps]
+                    .add(jnp.sum(values, axis=(0, 2)))
+                )
+
+            if save_prefix is not None:
+                prediction = get_timesteps(prediction.merge_axes([0, 1]), 0, n_steps, model_steps)
+                for (k, parity), image_block in prediction.items():
+                    if (k, parity) not in saved_preds:
+                        n_channels = image_block.shape[1] // n_steps
+                        saved_preds[(k, parity)] = np.lib.format.open_memmap(
+                            f"{save_prefix}_k{k}_p{parity}.npy",
+                            mode="w+",
+                            dtype=image_block.dtype,
+                            shape=(L, n_channels * future_steps) + image_block.shape[2:],
+                        )
+
+                    out_block = saved_preds[(k, parity)]
+                    exp_out_block = out_block.reshape((L, -1, future_steps) + out_block.shape[2:])
+                    exp_block = image_block.reshape((len(idxs), -1, n_steps) + out_block.shape[2:])
+                    steps = slice(first_step, first_step + n_steps)
+                    exp_out_block[start : start + len(idxs), :, steps] = np.asarray(exp_block)
+
+    for out_block in saved_preds.values():
+        out_block.flush()
+
+    return {name: metric_sum / L for name, metric_sum in metric_sums.items()}
+
+
+def _scaled_map_and_loss(
+    model: models.MultiImageModule,
+    x: geom.MultiImage,
+    y: geom.MultiImage,
+    aux_data: Optional[eqx.nn.State],
+    loss_scale: LossScale,
+    map_and_loss: Callable[
+        [models.MultiImageModule, geom.MultiImage, geom.MultiImage, Optional[eqx.nn.State]],
+        tuple[jax.Array, Optional[eqx.nn.State]],
+    ],
+) -> tuple[jax.Array, Optional[eqx.nn.State]]:
+    """
+    The map_and_loss with the loss multiplied by the loss scale, for scaled_train_step.
+    """
+    loss, aux_data = map_and_loss(model, x, y, aux_data)
+    return loss_scale.scale_loss(loss), aux_data
+
+
+def _pmap_value_and_grad(
+    map_and_loss: Callable[..., tuple[jax.Array, Optional[eqx.nn.State]]],
+    model: models.MultiImageModule,
+    x: geom.MultiImage,
+    y: geom.MultiImage,
+    aux_data: Optional[eqx.nn.State],
+    *extra_args: Any,
+) -> tuple[jax.Array, Optional[eqx.nn.State], models.MultiImageModule]:
+    """
+    The loss and the gradients of map_and_loss averaged over the devices, for train_step and
+    scaled_train_step. The extra_args are passed to map_and_loss after aux_data.
+    """
+    # NOTE: do not `jit` over `pmap` see (https://github.com/google/jax/issues/2926)
+    loss_grad = eqx.filter_value_and_grad(map_and_loss, has_aux=True)
+
+    compute_loss_pmap = eqx.filter_pmap(
+        loss_grad,
+        axis_name="pmap_batch",
+        in_axes=(None, 0, 0, None) + (None,) * len(extra_args),
+        out_axes=((0, None), 0),
+    )
+    (loss, aux_data), grads = compute_loss_pmap(model, x, y, aux_data, *extra_args)
+    loss = jnp.mean(loss, axis=0)
+
+    get_weights = lambda m: jax.tree_util.tree_leaves(m, is_leaf=eqx.is_array)
+    new_grad_arrays = [jnp.mean(x, axis=0) for x in get_weights(grads)]
+    grads = eqx.tree_at(get_weights, grads, new_grad_arrays)
+    return loss, aux_data, grads
+
+
 def train_step(
     map_and_loss: Callable[
         [models.MultiImageModule, geom.MultiImage, geom.MultiImage, Optional[eqx.nn.State]],
@@ -390,30 +810,65 @@ def train_step(
     returns:
         model, opt_state, loss_value, aux_data
     """
-    # NOTE: do not `jit` over `pmap` see (https://github.com/google/jax/issues/2926)
-    loss_grad = eqx.filter_value_and_grad(map_and_loss, has_aux=True)
-
-    compute_loss_pmap = eqx.filter_pmap(
-        loss_grad,
-        axis_name="pmap_batch",
-        in_axes=(None, 0, 0, None),
-        out_axes=((0, None), 0),
-    )
-    (loss, aux_data), grads = compute_loss_pmap(model, x, y, aux_data)
-    loss = jnp.mean(loss, axis=0)
-
-    get_weights = lambda m: jax.tree_util.tree_leaves(m, is_leaf=eqx.is_array)
-    new_grad_arrays = [jnp.mean(x, axis=0) for x in get_weights(grads)]
-    grads = eqx.tree_at(get_weights, grads, new_grad_arrays)
+    loss, aux_data, grads = _pmap_value_and_grad(map_and_loss, model, x, y, aux_data)
 
     updates, opt_state = optim.update(grads, opt_state, model)
     model = eqx.apply_updates(model, updates)
     return model, opt_state, loss, aux_data
 
 
+def scaled_train_step(
+    map_and_loss: Callable[
+        [models.MultiImageModule, geom.MultiImage, geom.MultiImage, Optional[eqx.nn.State]],
+        tuple[jax.Array, Optional[eqx.nn.State]],
+    ],
+    model: models.MultiImageModule,
+    optim: optax.GradientTransformation,
+    opt_state: Any,
+    x: geom.MultiImage,
+    y: geom.MultiImage,
+    aux_data: Optional[eqx.nn.State],
+    loss_scale: LossScale,
+) -> tuple[models.MultiImageModule, Any, jax.Array, Optional[eqx.nn.State], LossScale]:
+    """
+    Perform one step and gradient update of the model like train_step, but with loss scaling. The
+    loss is scaled before taking the gradient, and the gradients are unscaled before the update.
+    Updates with non-finite gradients are skipped, and the loss scale is adjusted.
+
+    args:
+        map_and_loss: map and loss function where the input is a model pytree, x, y, and
+            aux_data, and returns a float loss and aux_data
+        model: the model
+        optim: the optimizer
+        opt_state:
+        x: input data
+        y: target data
+        aux_data: auxilliary data for stateful layers
+        loss_scale: the current loss scale
+
+    returns:
+        model, opt_state, loss_value, aux_data, and the adjusted loss_scale
+    """
+    # eqx.Partial compares equal across steps, so the pmap is not recompiled every step
+    scaled_map_and_loss = eqx.Partial(_scaled_map_and_loss, map_and_loss=map_and_loss)
+    loss, aux_data, grads = _pmap_value_and_grad(
+        scaled_map_and_loss, model, x, y, aux_data, loss_scale
+    )
+
+    loss = loss / loss_scale.scale
+    grads = loss_scale.unscale(grads)
+    grads_finite = all_finite(grads)
+    # zero the non-finite gradients so the skipped update does not put nans in the state
+    grads = select_tree(grads_finite, grads, jax.tree_util.tree_map(jnp.zeros_like, grads))
+    updates, new_opt_state = optim.update(grads, opt_state, model)
+    new_model = eqx.apply_updates(model, updates)
+    model, opt_state = select_tree(grads_finite, (new_model, new_opt_state), (model, opt_state))
+    return model, opt_state, loss, aux_data, loss_scale.adjust(grads_finite)
+
+
 def train(
-    X: geom.MultiImage,
-    Y: geom.MultiImage,
+    X: Union[geom.MultiImage, MultiImageDataset],
+    Y: Union[geom.MultiImage, MultiImageDataset],
     map_and_loss: Callable[
         [models.MultiImageModule, geom.MultiImage, geom.MultiImage, Optional[eqx.nn.State]],
         tuple[jax.Array, Optional[eqx.nn.State]],
@@ -423,12 +878,15 @@ def train(
     stop_condition: StopCondition,
     batch_size: int,
     optimizer: optax.GradientTransformation,
-    validation_X: Optional[geom.MultiImage] = None,
-    validation_Y: Optional[geom.MultiImage] = None,
+    validation_X: Optional[Union[geom.MultiImage, MultiImageDataset]] = None,
+    validation_Y: Optional[Union[geom.MultiImage, MultiImageDataset]] = None,
     save_model: Optional[str] = None,
     devices: Optional[list[jax.Device]] = None,
     aux_data: Optional[eqx.nn.State] = None,
     is_wandb: bool = False,
+    augmentation: Optional[GroupAugmentation] = None,
+    loader: Optional[WorkerLoader] = None,
+    loss_scale: Optional[LossScale] = None,
 ) -> tuple[
     models.MultiImageModule, Optional[eqx.nn.State], Optional[ArrayLike], Optional[ArrayLike]
 ]:
@@ -457,6 +915,10 @@ def train(
         aux_data: initial aux data passed in to map_and_loss when has_aux is true.
         devices: gpu/cpu devices to use, if None (default) then it will use jax.devices()
         is_wandb: whether wandb experiment tracking has been initiated and should be logged to
+        augmentation: if given, each training batch is transformed by random group elements
+        loader: if given, the training batches are assembled by its worker processes
+        loss_scale: if given, scale the loss to keep the gradients of reduced precision models,
+            see ml.Policy, from underflowing. Needed for float16, not for bfloat16.
 
     returns:
         A tuple of best model in inference mode, aux_data, epoch loss, and val loss
@@ -474,25 +936,44 @@ def train(
     epoch_time = 0
     stop_condition.best_model = model
     while not stop_condition.stop(model, epoch, epoch_loss, epoch_val_loss, epoch_time):
+        start_h2d_bytes = get_h2d_bytes((X, Y, validation_X, validation_Y))
         rand_key, subkey = random.split(rand_key)
-        X_batches, Y_batches = get_batches((X, Y), batch_size, subkey, devices)
+        if loader is None:
+            batches = iterate_batches((X, Y), batch_size, subkey, devices)
+        else:
+            batches = loader((X, Y), batch_size, subkey, devices)
+
         epoch_loss = 0
+        n_batches = 0
         start_time = time.time()
-        for X_batch, Y_batch in zip(X_batches, Y_batches):
-            model, opt_state, loss_value, aux_data = train_step(
-                map_and_loss,
-                model,
-                optimizer,
-                opt_state,
-                X_batch,
-                Y_batch,
-                aux_data,
-            )
+        for X_batch, Y_batch in batches:
+            if augmentation is not None:
+                rand_key, aug_key = random.split(rand_key)
+                X_batch, Y_batch = augmentation(aug_key, X_batch, Y_batch)
+
+            if loss_scale is None:
+                model, opt_state, loss_value, aux_data = train_step(
+                    map_and_loss, model, optimizer, opt_state, X_batch, Y_batch, aux_data
+                )
+            else:
+                model, opt_state, loss_value, aux_data, loss_scale = scaled_train_step(
+                    map_and_loss,
+                    model,
+                    optimizer,
+                    opt_state,
+                    X_batch,
+                    Y_batch,
+                    aux_data,
+                    loss_scale,
+                )
             epoch_loss += loss_value
+            n_batches += 1
 
-        epoch_loss = epoch_loss / len(X_batches)
+        epoch_loss = epoch_loss / n_batches
         epoch += 1
         log = {"train/loss": epoch_loss}
+        if loss_scale is not None:
+            log["train/loss_scale"] = loss_scale.scale
 
         # We evaluate the validation loss in batches for memory reasons.
         if validation_X and validation_Y:
@@ -509,6 +990,12 @@ def train(
             val_loss = epoch_val_loss
             log["val/loss"] = val_loss
 
+        epoch_h2d_bytes = get_h2d_bytes((X, Y, validation_X, validation_Y)) - start_h2d_bytes
+        if epoch_h2d_bytes > 0:
+            log["train/h2d_bytes"] = epoch_h2d_bytes
+            if stop_condition.verbose == 2:
+                print(f"Epoch {epoch} host to device transfer: {epoch_h2d_bytes / 2**20:.2f} MiB")
+
         if is_wandb:
             wandb.log(log)
 
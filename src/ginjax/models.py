@@ -5,6 +5,7 @@ from typing_extensions import Self
 import jax
 import jax.numpy as jnp
 import jax.random as random
+from jax.ad_checkpoint import checkpoint_name
 from jaxtyping import ArrayLike
 import equinox as eqx
 
@@ -17,6 +18,15 @@ ACTIVATION_REGISTRY = {
     "tanh": jax.nn.tanh,
 }
 
+# Rematerialization (gradient checkpointing) policies, which trade recomputation in the backward
+# pass for activation memory.
+REMAT_NONE = "none"  # store every activation
+REMAT_BLOCK = "block"  # store only the input of each ConvBlock
+REMAT_EVERY_N = "every_n"  # store only the input of each segment of remat_every blocks
+REMAT_CONV_OUTPUTS = "conv_outputs"  # store the input and convolution output of each ConvBlock
+REMAT_POLICIES = (REMAT_NONE, REMAT_BLOCK, REMAT_EVERY_N, REMAT_CONV_OUTPUTS)
+CONV_OUTPUT_NAME = "conv_output"
+
 
 def handle_activation(
     activation_f: Optional[Union[Callable, str]],
@@ -24,6 +34,7 @@ def handle_activation(
     input_keys: geom.Signature,
     D: int,
     key: ArrayLike,
+    policy: Optional[ml.Policy] = None,
 ) -> Callable[[Any], geom.MultiImage]:
     """
     Parse what activation function to use, return the appropriate callable
@@ -34,6 +45,7 @@ def handle_activation(
         input_keys: the layers input keys
         D: dimension of the model
         key: jax.random key
+        policy: the mixed precision policy, defaults to the global policy
 
     returns:
         A layer that performs the specified activation function
@@ -44,10 +56,10 @@ def handle_activation(
         elif isinstance(activation_f, str):
             assert activation_f in ACTIVATION_REGISTRY
             return ml.VectorNeuronNonlinear(
-                input_keys, D, ACTIVATION_REGISTRY[activation_f], key=key
+                input_keys, D, ACTIVATION_REGISTRY[activation_f], key=key, policy=policy
             )
         else:
-            return ml.VectorNeuronNonlinear(input_keys, D, activation_f, key=key)
+            return ml.VectorNeuronNonlinear(input_keys, D, activation_f, key=key, policy=policy)
     else:
         if activation_f is None:
             return ml.LayerWrapper(eqx.nn.Identity(), input_keys)
@@ -71,10 +83,16 @@ def make_conv(
     lhs_dilation: Optional[tuple[int, ...]] = None,
     rhs_dilation: Union[int, tuple[int, ...]] = 1,
     key: Any = None,  # any instead of arraylike because split cannot handle None
-) -> Union[ml.ConvContract, ml.LayerWrapper]:
+    policy: Optional[ml.Policy] = None,
+    separable: bool = False,
+    pointwise_filters: Optional[geom.MultiImage] = None,
+    spectral: bool = False,
+) -> Union[ml.ConvContract, ml.SeparableConvContract, ml.LayerWrapper]:
     """
     Factory for convolution layer which makes ConvContract if equivariant and makes a regular conv
-    otherwise.
+    otherwise. If the invariant filters have sidelength 1 and the padding is None or a named
+    padding without dilation, it makes a PointwiseConvContract, if separable, it makes a
+    SeparableConvContract, and if spectral, it makes a SpectralConvContract.
 
     args:
         D: dimension of the space
@@ -89,12 +107,66 @@ def make_conv(
         lhs_dilation: left hand side dilation for transpose convolution
         rhs_dilation: right hand side dilation for dilated convolutions
         key: jax.random key
+        policy: the mixed precision policy, defaults to the global policy
+        separable: whether to use a depthwise-separable equivariant layer, only for equivariant
+        pointwise_filters: invariant filters of sidelength 1 for the mixing of the separable layer
+        spectral: whether to use a SpectralConvContract on the torus, then invariant_filters are
+            the Fourier coefficients of the filters and stride, padding, and dilations are not used
 
     returns:
-        either ConvContract or a LayerWrapper around an equinox convolution
+        either ConvContract, PointwiseConvContract, SeparableConvContract, SpectralConvContract, or
+            a LayerWrapper around an equinox convolution
     """
+    policy = ml.get_policy() if policy is None else policy
     if equivariant:
         assert invariant_filters is not None
+        assert not (separable and spectral), "make_conv: cannot be both separable and spectral"
+        if spectral:
+            assert (
+                stride in {1, (1,) * D}
+                and padding is None
+                and lhs_dilation is None
+                and rhs_dilation in {1, (1,) * D}
+            ), "make_conv: spectral does not support stride, padding, or dilation"
+            return ml.SpectralConvContract(
+                input_keys, target_keys, invariant_filters, use_bias, key, policy
+            )
+
+        if separable:
+            assert pointwise_filters is not None, "make_conv: separable needs pointwise_filters"
+            assert lhs_dilation is None, "make_conv: separable does not support lhs_dilation"
+            return ml.SeparableConvContract(
+                input_keys,
+                target_keys,
+                invariant_filters,
+                pointwise_filters,
+                use_bias,
+                stride,
+                padding,
+                rhs_dilation,
+                key,
+                policy,
+            )
+
+        # the pointwise layer only supports the named paddings, explicit paddings and dilations
+        # fall back to the general convolution
+        if (
+            invariant_filters.get_spatial_dims() == (1,) * D
+            and (padding is None or padding in {"TORUS", "VALID", "SAME"})
+            and lhs_dilation is None
+            and rhs_dilation in {1, (1,) * D}
+        ):
+            return ml.PointwiseConvContract(
+                input_keys,
+                target_keys,
+                invariant_filters,
+                use_bias,
+                stride,
+                padding,
+                key,
+                policy,
+            )
+
         return ml.ConvContract(
             input_keys,
             target_keys,
@@ -105,8 +177,12 @@ def make_conv(
             lhs_dilation,
             rhs_dilation,
             key,
+            policy,
         )
     else:
+        assert not (separable or spectral), (
+            "make_conv: separable and spectral are only for equivariant layers"
+        )
         assert kernel_size is not None
         assert len(input_keys) == len(target_keys) == 1
         assert input_keys[0][0] == target_keys[0][0] == (0, 0)
@@ -127,6 +203,7 @@ def make_conv(
                     key=key,
                 ),
                 input_keys,
+                policy,
             )
         else:
             # if there is lhs_dilation, assume its a transpose convolution
@@ -143,6 +220,7 @@ def make_conv(
                     key=key,
                 ),
                 input_keys,
+                policy,
             )
 
 
@@ -186,13 +264,172 @@ class MultiImageModule(eqx.Module):
         return x, aux_data
 
 
+def apply_in_segments(
+    apply_f: Callable[[Any, geom.MultiImage, Optional[eqx.nn.State]], tuple[geom.MultiImage, Any]],
+    layers: Sequence[Any],
+    x: geom.MultiImage,
+    aux_data: Optional[eqx.nn.State] = None,
+    segment_len: Optional[int] = None,
+) -> tuple[geom.MultiImage, Optional[eqx.nn.State]]:
+    """
+    Apply a sequence of layers in order. If segment_len is given, each segment of segment_len
+    consecutive layers is checkpointed, so only the input of each segment is stored for the
+    backward pass, and the rest of the segment is recomputed.
+
+    args:
+        apply_f: function of a layer, x, and aux_data that applies the layer, returning x and
+            aux_data
+        layers: the layers, such as ConvBlocks or residual blocks
+        x: the input
+        aux_data: data used for stuff like batch norm
+        segment_len: number of layers per checkpointed segment, defaults to None, no checkpointing
+
+    returns:
+        the output MultiImage and aux_data
+    """
+
+    def apply_segment(
+        segment: Sequence[Any], x: geom.MultiImage, aux_data: Optional[eqx.nn.State]
+    ) -> tuple[geom.MultiImage, Optional[eqx.nn.State]]:
+        for layer in segment:
+            x, aux_data = apply_f(layer, x, aux_data)
+
+        return x, aux_data
+
+    if segment_len is None:
+        return apply_segment(layers, x, aux_data)
+
+    assert segment_len > 0, f"apply_in_segments: segment_len must be positive, got {segment_len}"
+    for start in range(0, len(layers), segment_len):
+        x, aux_data = eqx.filter_checkpoint(apply_segment)(
+            layers[start : start + segment_len], x, aux_data
+        )
+
+    return x, aux_data
+
+
+def apply_layer(
+    layer: MultiImageModule, x: geom.MultiImage, aux_data: Optional[eqx.nn.State]
+) -> tuple[geom.MultiImage, Optional[eqx.nn.State]]:
+    """
+    Apply a single layer, for apply_in_segments.
+
+    args:
+        layer: the layer, such as a ConvBlock
+        x: the input
+        aux_data: data used for stuff like batch norm
+
+    returns:
+        the output MultiImage and aux_data
+    """
+    return layer(x, aux_data)
+
+
+def apply_residual_block(
+    block: Sequence[MultiImageModule], x: geom.MultiImage, aux_data: Optional[eqx.nn.State]
+) -> tuple[geom.MultiImage, Optional[eqx.nn.State]]:
+    """
+    Apply a residual block, a sequence of layers whose output is added to its input, for
+    apply_in_segments.
+
+    args:
+        block: the layers of the block
+        x: the input
+        aux_data: data used for stuff like batch norm
+
+    returns:
+        the output MultiImage and aux_data
+    """
+    residual_x = x.copy()
+    for layer in block:
+        x, aux_data = layer(x, aux_data)
+
+    return x + residual_x, aux_data
+
+
+def get_remat_kwargs(remat: str, remat_every: int) -> tuple[str, Optional[int]]:
+    """
+    Split a model's remat policy into the policy of its ConvBlocks and the segment length of its
+    checkpointed segments.
+
+    args:
+        remat: one of REMAT_POLICIES
+        remat_every: the number of blocks per segment for REMAT_EVERY_N
+
+    returns:
+        the ConvBlock remat policy, and the segment length or None
+    """
+    assert remat in REMAT_POLICIES, f"get_remat_kwargs: remat must be one of {REMAT_POLICIES}"
+    if remat == REMAT_EVERY_N:
+        return REMAT_NONE, remat_every
+    else:
+        return remat, None
+
+
+def stack_blocks(blocks: Sequence[Any]) -> Any:
+    """
+    Stack structurally identical blocks, such as the residual blocks of a ResNet, into one block
+    whose arrays have a leading axis over the blocks, to be applied with apply_scanned. The blocks
+    must have the same static fields, so the same dilations, activations, and signatures.
+
+    args:
+        blocks: the blocks
+
+    returns:
+        the stacked block
+    """
+    assert len(blocks) > 0, "stack_blocks: blocks must be non-empty"
+    return jax.tree_util.tree_map(
+        lambda *leaves: jnp.stack(leaves) if eqx.is_array(leaves[0]) else leaves[0], *blocks
+    )
+
+
+def apply_scanned(
+    apply_f: Callable[[Any, geom.MultiImage, Optional[eqx.nn.State]], tuple[geom.MultiImage, Any]],
+    stacked_block: Any,
+    x: geom.MultiImage,
+    aux_data: Optional[eqx.nn.State] = None,
+    checkpoint: bool = False,
+) -> tuple[geom.MultiImage, Optional[eqx.nn.State]]:
+    """
+    Apply the blocks of a stacked block in order with lax.scan, so the block is traced and compiled
+    once regardless of the number of blocks. Each block must return x with the same signature and
+    shapes that it received.
+
+    args:
+        apply_f: function of a block, x, and aux_data that applies the block, returning x and
+            aux_data
+        stacked_block: the blocks stacked by stack_blocks
+        x: the input
+        aux_data: data used for stuff like batch norm
+        checkpoint: whether to checkpoint each block, so only its input is stored for the
+            backward pass
+
+    returns:
+        the output MultiImage and aux_data
+    """
+    params, static = eqx.partition(stacked_block, eqx.is_array)
+
+    def step(
+        carry: tuple[geom.MultiImage, Optional[eqx.nn.State]], block_params: Any
+    ) -> tuple[tuple[geom.MultiImage, Optional[eqx.nn.State]], None]:
+        x, aux_data = carry
+        return apply_f(eqx.combine(block_params, static), x, aux_data), None
+
+    if checkpoint:
+        step = eqx.filter_checkpoint(step)
+
+    (x, aux_data), _ = jax.lax.scan(step, (x, aux_data), params)
+    return x, aux_data
+
+
 class ConvBlock(MultiImageModule):
     """
     A convolution block consisting of a convolution, a nonlinearity, and a GroupNorm/BatchNorm.
     Can be equivariant or not, in typical order or in preactivation order.
     """
 
-    conv: Union[ml.ConvContract, ml.LayerWrapper]
+    conv: Union[ml.ConvContract, ml.SeparableConvContract, ml.LayerWrapper]
     group_norm: Optional[Union[ml.GroupNorm, ml.LayerWrapper]]
     batch_norm: Optional[ml.LayerWrapperAux]
     nonlinearity: Union[ml.VectorNeuronNonlinear, ml.LayerWrapper, Callable]
@@ -202,6 +439,7 @@ class ConvBlock(MultiImageModule):
     use_batch_norm: bool = eqx.field(static=True)
     use_group_norm: bool = eqx.field(static=True)
     preactivation_order: bool = eqx.field(static=True)
+    remat: str = eqx.field(static=True)
 
     def __init__(
         self: Self,
@@ -217,6 +455,10 @@ class ConvBlock(MultiImageModule):
         use_batch_norm: bool = False,
         preactivation_order: bool = False,
         key: Any = None,
+        policy: Optional[ml.Policy] = None,
+        remat: str = REMAT_NONE,
+        separable: bool = False,
+        pointwise_filters: Optional[geom.MultiImage] = None,
         **conv_kwargs: Any,
     ) -> None:
         """
@@ -235,6 +477,11 @@ class ConvBlock(MultiImageModule):
             use_batch_norm: whether to use BatchNorm, can only be for non-equivariant
             preactivation_order: whether to use preactivation order
             key: jax.random key
+            policy: the mixed precision policy, defaults to the global policy
+            remat: the rematerialization policy, one of REMAT_NONE, REMAT_BLOCK, or
+                REMAT_CONV_OUTPUTS. REMAT_EVERY_N is handled by the model.
+            separable: whether to use a depthwise-separable equivariant convolution
+            pointwise_filters: invariant filters of sidelength 1 for the separable convolution
             conv_kwargs: further key word args that will be passed to the convolution
         """
         self.D = D
@@ -242,6 +489,12 @@ class ConvBlock(MultiImageModule):
         self.use_group_norm = use_group_norm
         self.use_batch_norm = use_batch_norm
         self.preactivation_order = preactivation_order
+        assert remat in {REMAT_NONE, REMAT_BLOCK, REMAT_CONV_OUTPUTS}, (
+            f"ConvBlock: remat must be one of {REMAT_NONE}, {REMAT_BLOCK}, or "
+            f"{REMAT_CONV_OUTPUTS}, but got {remat}"
+        )
+        self.remat = remat
+        policy = ml.get_policy() if policy is None else policy
 
         subkey1, subkey2 = random.split(key)
         self.conv = make_conv(
@@ -253,35 +506,64 @@ class ConvBlock(MultiImageModule):
             conv_filters,
             kernel_size,
             key=subkey1,
+            policy=policy,
+            separable=separable,
+            pointwise_filters=pointwise_filters,
             **conv_kwargs,
         )
 
         if use_group_norm:
             if self.equivariant:
-                self.group_norm = ml.LayerNorm(output_keys, self.D)
+                self.group_norm = ml.LayerNorm(output_keys, self.D, policy=policy)
             else:
                 self.group_norm = ml.LayerWrapper(
-                    eqx.nn.GroupNorm(1, output_keys[0][1]), output_keys
+                    eqx.nn.GroupNorm(1, output_keys[0][1]), output_keys, policy
                 )
         else:
             self.group_norm = None
 
         if use_batch_norm:
             self.batch_norm = ml.LayerWrapperAux(
-                eqx.nn.BatchNorm(output_keys[0][1], axis_name=["pmap_batch", "batch"]), output_keys
+                eqx.nn.BatchNorm(output_keys[0][1], axis_name=["pmap_batch", "batch"]),
+                output_keys,
+                policy,
             )
         else:
             self.batch_norm = None
 
         self.nonlinearity = handle_activation(
-            activation_f, self.equivariant, output_keys, self.D, subkey2
+            activation_f, self.equivariant, output_keys, self.D, subkey2, policy
         )
 
     def __call__(
         self: Self, x: geom.MultiImage, batch_stats: Optional[eqx.nn.State] = None
     ) -> tuple[geom.MultiImage, Optional[eqx.nn.State]]:
         """
-        Layer callable
+        Layer callable, checkpointed according to the remat policy.
+
+        args:
+            x: the input
+            batch_stats: data for batch norm
+
+        returns:
+            the output MultiImage and batch stats
+        """
+        if self.remat == REMAT_BLOCK:
+            return eqx.filter_checkpoint(ConvBlock.forward)(self, x, batch_stats)
+        elif self.remat == REMAT_CONV_OUTPUTS:
+            return eqx.filter_checkpoint(
+                ConvBlock.forward,
+                policy=jax.checkpoint_policies.save_only_these_names(CONV_OUTPUT_NAME),
+            )(self, x, batch_stats)
+        else:
+            return self.forward(x, batch_stats)
+
+    def forward(
+        self: Self, x: geom.MultiImage, batch_stats: Optional[eqx.nn.State] = None
+    ) -> tuple[geom.MultiImage, Optional[eqx.nn.State]]:
+        """
+        The computation of the layer, without checkpointing. The output of the convolution is named
+        CONV_OUTPUT_NAME so that REMAT_CONV_OUTPUTS can save it.
 
         args:
             x: the input
@@ -299,9 +581,13 @@ class ConvBlock(MultiImageModule):
                 x, batch_stats = self.batch_norm(x, batch_stats)
 
             x = self.nonlinearity(x)
-            x = self.conv(x)
+            x = jax.tree_util.tree_map(
+                lambda block: checkpoint_name(block, CONV_OUTPUT_NAME), self.conv(x)
+            )
         else:
-            x = self.conv(x)
+            x = jax.tree_util.tree_map(
+                lambda block: checkpoint_name(block, CONV_OUTPUT_NAME), self.conv(x)
+            )
             if self.use_group_norm:
                 assert self.group_norm is not None
                 x = self.group_norm(x)
@@ -329,6 +615,8 @@ class UNet(MultiImageModule):
     equivariant: bool = eqx.field(static=True)
     use_batch_norm: bool = eqx.field(static=True)
     output_keys: geom.Signature = eqx.field(static=True)
+    policy: ml.Policy = eqx.field(static=True)
+    remat_segment: Optional[int] = eqx.field(static=True)
 
     def __init__(
         self: Self,
@@ -347,6 +635,11 @@ class UNet(MultiImageModule):
         use_group_norm: bool = False,
         use_batch_norm: bool = False,
         key: Any = None,
+        policy: Optional[ml.Policy] = None,
+        remat: str = REMAT_NONE,
+        remat_every: int = 2,
+        separable: bool = False,
+        pointwise_filters: Optional[geom.MultiImage] = None,
     ) -> None:
         """
         Constructor for the UNet.
@@ -366,11 +659,20 @@ class UNet(MultiImageModule):
             use_group_norm: whether to use GroupNorm
             use_batch_norm: whether to use the BatchNorm, only for non-equivariant version
             key: jax.random key
+            policy: the mixed precision policy, defaults to the global policy. The input is cast
+                to the compute dtype and the output to the output dtype.
+            remat: the rematerialization policy, one of REMAT_POLICIES
+            remat_every: number of blocks per checkpointed segment for REMAT_EVERY_N
+            separable: whether the convolution blocks use depthwise-separable equivariant
+                convolutions, the upsample and decode layers are unchanged
+            pointwise_filters: invariant filters of sidelength 1 for the separable convolutions
         """
         assert num_conv > 0
         assert key is not None
 
         self.output_keys = output_keys
+        self.policy = ml.get_policy() if policy is None else policy
+        block_remat, self.remat_segment = get_remat_kwargs(remat, remat_every)
         if equivariant:
             mid_keys = geom.signature_union(input_keys, output_keys, depth)
             assert not use_batch_norm, "UNet::init Batch Norm cannot be used with equivariant model"
@@ -404,6 +706,10 @@ class UNet(MultiImageModule):
                     use_group_norm,
                     use_batch_norm,
                     key=subkey,
+                    policy=self.policy,
+                    remat=block_remat,
+                    separable=separable,
+                    pointwise_filters=pointwise_filters,
                 )
             )
 
@@ -436,6 +742,10 @@ class UNet(MultiImageModule):
                         use_group_norm,
                         use_batch_norm,
                         key=subkey,
+                        policy=self.policy,
+                        remat=block_remat,
+                        separable=separable,
+                        pointwise_filters=pointwise_filters,
                     )
                 )
 
@@ -472,6 +782,7 @@ class UNet(MultiImageModule):
                     padding,
                     (2,) * self.D,  # lhs_dilation
                     key=subkey,
+                    policy=self.policy,
                 ),
                 [],
             )
@@ -501,6 +812,10 @@ class UNet(MultiImageModule):
                         use_group_norm,
                         use_batch_norm,
                         key=subkey,
+                        policy=self.policy,
+                        remat=block_remat,
+                        separable=separable,
+                        pointwise_filters=pointwise_filters,
                     )
                 )
 
@@ -517,6 +832,7 @@ class UNet(MultiImageModule):
             conv_filters,
             kernel_size,
             key=subkey,
+            policy=self.policy,
         )
 
     def __call__(
@@ -532,26 +848,31 @@ class UNet(MultiImageModule):
         returns:
             the output MultiImage and batch_stats
         """
+        x = self.policy.cast_to_compute(x)
         if not self.equivariant:
             x = x.to_scalar_multi_image()
 
-        for layer in self.embedding:
-            x, batch_stats = layer(x, batch_stats)
+        # segments stay within a level, the skip connections need the output of each level
+        x, batch_stats = apply_in_segments(
+            apply_layer, self.embedding, x, batch_stats, self.remat_segment
+        )
 
         residual_multi_images = []
         for max_pool_layer, conv_blocks in self.downsample_blocks:
             residual_multi_images.append(x)
             x = max_pool_layer(x)
-            for layer in conv_blocks:
-                x, batch_stats = layer(x, batch_stats)
+            x, batch_stats = apply_in_segments(
+                apply_layer, conv_blocks, x, batch_stats, self.remat_segment
+            )
 
         for (upsample_layer, conv_blocks), residual_multi_image in zip(
             self.upsample_blocks, reversed(residual_multi_images)
         ):
             upsample_x = upsample_layer(x)
             x = upsample_x.concat(residual_multi_image)
-            for layer in conv_blocks:
-                x, batch_stats = layer(x, batch_stats)
+            x, batch_stats = apply_in_segments(
+                apply_layer, conv_blocks, x, batch_stats, self.remat_segment
+            )
 
         x = self.decode(x)
         if self.equivariant:
@@ -559,7 +880,7 @@ class UNet(MultiImageModule):
         else:
             out = geom.MultiImage.from_scalar_multi_image(x, self.output_keys)
 
-        return out, batch_stats
+        return self.policy.cast_to_output(out), batch_stats
 
 
 class DilResNet(MultiImageModule):
@@ -568,12 +889,15 @@ class DilResNet(MultiImageModule):
     """
 
     encoder: list[ConvBlock]
-    blocks: list[list[ConvBlock]]
+    blocks: Union[list[list[ConvBlock]], list[ConvBlock]]
     decoder: list[ConvBlock]
 
     D: int = eqx.field(static=True)
     equivariant: bool = eqx.field(static=True)
     output_keys: geom.Signature = eqx.field(static=True)
+    policy: ml.Policy = eqx.field(static=True)
+    remat_segment: Optional[int] = eqx.field(static=True)
+    scan_blocks: bool = eqx.field(static=True)
 
     def __init__(
         self: Self,
@@ -589,6 +913,12 @@ class DilResNet(MultiImageModule):
         kernel_size: Optional[Union[int, Sequence[int]]] = None,
         use_group_norm: bool = False,
         key: Any = None,
+        policy: Optional[ml.Policy] = None,
+        remat: str = REMAT_NONE,
+        remat_every: int = 2,
+        scan_blocks: bool = False,
+        separable: bool = False,
+        pointwise_filters: Optional[geom.MultiImage] = None,
     ) -> None:
         """
         Constructor for the DilatedResNet
@@ -606,10 +936,23 @@ class DilResNet(MultiImageModule):
             kernel_size: sidelength(s) for the non-equivariant version
             use_group_norm: whether to use GroupNorm
             key: jax.random key
+            policy: the mixed precision policy, defaults to the global policy. The input is cast
+                to the compute dtype and the output to the output dtype.
+            remat: the rematerialization policy, one of REMAT_POLICIES
+            remat_every: number of blocks per checkpointed segment for REMAT_EVERY_N
+            scan_blocks: whether to stack the parameters of the identical residual blocks and
+                apply them with lax.scan, so compile time does not grow with num_blocks. With
+                REMAT_EVERY_N, each scanned block is checkpointed rather than every remat_every.
+            separable: whether the convolution blocks use depthwise-separable equivariant
+                convolutions
+            pointwise_filters: invariant filters of sidelength 1 for the separable convolutions
         """
         self.D = D
         self.equivariant = equivariant
         self.output_keys = output_keys
+        self.policy = ml.get_policy() if policy is None else policy
+        block_remat, self.remat_segment = get_remat_kwargs(remat, remat_every)
+        self.scan_blocks = scan_blocks
 
         if equivariant:
             mid_keys = geom.signature_union(input_keys, output_keys, depth)
@@ -636,6 +979,10 @@ class DilResNet(MultiImageModule):
                 conv_filters,
                 1,
                 key=subkey1,
+                policy=self.policy,
+                remat=block_remat,
+                separable=separable,
+                pointwise_filters=pointwise_filters,
             ),
             ConvBlock(
                 D,
@@ -647,6 +994,10 @@ class DilResNet(MultiImageModule):
                 conv_filters,
                 1,
                 key=subkey2,
+                policy=self.policy,
+                remat=block_remat,
+                separable=separable,
+                pointwise_filters=pointwise_filters,
             ),
         ]
 
@@ -669,11 +1020,18 @@ class DilResNet(MultiImageModule):
                         use_group_norm,
                         rhs_dilation=(dilation,) * D,
                         key=subkey,
+                        policy=self.policy,
+                        remat=block_remat,
+                        separable=separable,
+                        pointwise_filters=pointwise_filters,
                     )
                 )
 
             self.blocks.append(dilation_block)
 
+        if self.scan_blocks:
+            self.blocks = stack_blocks(self.blocks)
+
         key, subkey1, subkey2 = random.split(key, num=3)
         self.decoder = [
             ConvBlock(
@@ -686,9 +1044,25 @@ class DilResNet(MultiImageModule):
                 conv_filters,
                 1,
                 key=subkey1,
+                policy=self.policy,
+                remat=block_remat,
+                separable=separable,
+                pointwise_filters=pointwise_filters,
             ),
             ConvBlock(
-                D, mid_keys, output_keys, use_bias, None, equivariant, conv_filters, 1, key=subkey2
+                D,
+                mid_keys,
+                output_keys,
+                use_bias,
+                None,
+                equivariant,
+                conv_filters,
+                1,
+                key=subkey2,
+                policy=self.policy,
+                remat=block_remat,
+                separable=separable,
+                pointwise_filters=pointwise_filters,
             ),
         ]
 
@@ -705,29 +1079,27 @@ class DilResNet(MultiImageModule):
         returns:
             the output MultiImage, aux_data
         """
+        x = self.policy.cast_to_compute(x)
         if not self.equivariant:
             x = x.to_scalar_multi_image()
 
-        for layer in self.encoder:
-            x, _ = layer(x)
-
-        for dilation_block in self.blocks:
-            residual_x = x.copy()
-
-            for layer in dilation_block:
-                x, _ = layer(x)
-
-            x = x + residual_x
-
-        for layer in self.decoder:
-            x, _ = layer(x)
+        x, _ = apply_in_segments(apply_layer, self.encoder, x, None, self.remat_segment)
+        if self.scan_blocks:
+            x, _ = apply_scanned(
+                apply_residual_block, self.blocks, x, None, self.remat_segment is not None
+            )
+        else:
+            x, _ = apply_in_segments(
+                apply_residual_block, self.blocks, x, None, self.remat_segment
+            )
+        x, _ = apply_in_segments(apply_layer, self.decoder, x, None, self.remat_segment)
 
         if self.equivariant:
             out = x
         else:
             out = geom.MultiImage.from_scalar_multi_image(x, self.output_keys)
 
-        return out, aux_data
+        return self.policy.cast_to_output(out), aux_data
 
 
 class ResNet(MultiImageModule):
@@ -736,12 +1108,15 @@ class ResNet(MultiImageModule):
     """
 
     encoder: list[ConvBlock]
-    blocks: list[list[ConvBlock]]
+    blocks: Union[list[list[ConvBlock]], list[ConvBlock]]
     decoder: list[ConvBlock]
 
     D: int = eqx.field(static=True)
     equivariant: bool = eqx.field(static=True)
     output_keys: geom.Signature = eqx.field(static=True)
+    policy: ml.Policy = eqx.field(static=True)
+    remat_segment: Optional[int] = eqx.field(static=True)
+    scan_blocks: bool = eqx.field(static=True)
 
     def __init__(
         self: Self,
@@ -759,6 +1134,10 @@ class ResNet(MultiImageModule):
         use_group_norm: bool = True,
         preactivation_order: bool = True,
         key: Any = None,
+        policy: Optional[ml.Policy] = None,
+        remat: str = REMAT_NONE,
+        remat_every: int = 2,
+        scan_blocks: bool = False,
     ) -> None:
         """
         Constructor for the ResNet
@@ -778,10 +1157,20 @@ class ResNet(MultiImageModule):
             use_group_norm: whether to use GroupNorm
             preactivation_order: whether to use preactivation order
             key: jax.random key
+            policy: the mixed precision policy, defaults to the global policy. The input is cast
+                to the compute dtype and the output to the output dtype.
+            remat: the rematerialization policy, one of REMAT_POLICIES
+            remat_every: number of blocks per checkpointed segment for REMAT_EVERY_N
+            scan_blocks: whether to stack the parameters of the identical residual blocks and
+                apply them with lax.scan, so compile time does not grow with num_blocks. With
+                REMAT_EVERY_N, each scanned block is checkpointed rather than every remat_every.
         """
         self.D = D
         self.equivariant = equivariant
         self.output_keys = output_keys
+        self.policy = ml.get_policy() if policy is None else policy
+        block_remat, self.remat_segment = get_remat_kwargs(remat, remat_every)
+        self.scan_blocks = scan_blocks
 
         if equivariant:
             mid_keys = geom.signature_union(input_keys, output_keys, depth)
@@ -808,6 +1197,8 @@ class ResNet(MultiImageModule):
                 conv_filters,
                 1,
                 key=subkey1,
+                policy=self.policy,
+                remat=block_remat,
             ),
             ConvBlock(
                 D,
@@ -819,6 +1210,8 @@ class ResNet(MultiImageModule):
                 conv_filters,
                 1,
                 key=subkey2,
+                policy=self.policy,
+                remat=block_remat,
             ),
         ]
 
@@ -841,11 +1234,16 @@ class ResNet(MultiImageModule):
                         use_group_norm,
                         preactivation_order=preactivation_order,
                         key=subkey,
+                        policy=self.policy,
+                        remat=block_remat,
                     )
                 )
 
             self.blocks.append(block)
 
+        if self.scan_blocks:
+            self.blocks = stack_blocks(self.blocks)
+
         key, subkey1, subkey2 = random.split(key, num=3)
         self.decoder = [
             ConvBlock(
@@ -858,9 +1256,21 @@ class ResNet(MultiImageModule):
                 conv_filters,
                 1,
                 key=subkey1,
+                policy=self.policy,
+                remat=block_remat,
             ),
             ConvBlock(
-                D, mid_keys, output_keys, use_bias, None, equivariant, conv_filters, 1, key=subkey2
+                D,
+                mid_keys,
+                output_keys,
+                use_bias,
+                None,
+                equivariant,
+                conv_filters,
+                1,
+                key=subkey2,
+                policy=self.policy,
+                remat=block_remat,
             ),
         ]
 
@@ -877,29 +1287,27 @@ class ResNet(MultiImageModule):
         returns:
             the output MultiImage and aux_data
         """
+        x = self.policy.cast_to_compute(x)
         if not self.equivariant:
             x = x.to_scalar_multi_image()
 
-        for layer in self.encoder:
-            x, _ = layer(x)
-
-        for block in self.blocks:
-            residual_x = x.copy()
-
-            for layer in block:
-                x, _ = layer(x)
-
-            x = x + residual_x
-
-        for layer in self.decoder:
-            x, _ = layer(x)
+        x, _ = apply_in_segments(apply_layer, self.encoder, x, None, self.remat_segment)
+        if self.scan_blocks:
+            x, _ = apply_scanned(
+                apply_residual_block, self.blocks, x, None, self.remat_segment is not None
+            )
+        else:
+            x, _ = apply_in_segments(
+                apply_residual_block, self.blocks, x, None, self.remat_segment
+            )
+        x, _ = apply_in_segments(apply_layer, self.decoder, x, None, self.remat_segment)
 
         if self.equivariant:
             out = x
         else:
             out = geom.MultiImage.from_scalar_multi_image(x, self.output_keys)
 
-        return out, aux_data
+        return self.policy.cast_to_output(out), aux_data
 
 
 class ModelWrapper(MultiImageModule):
@@ -0,0 +1,426 @@
+import functools
+import math
+import itertools
+from typing_extensions import Iterable, Optional, Self
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+from jax.typing import ArrayLike
+
+import ginjax.geometric as geom
+
+# ------------------------------------------------------------------------------
+# Particle to grid deposition
+
+DEPOSIT_SCHEMES = ("ngp", "cic", "tsc")
+
+
+def _deposit_stencil(
+    positions: jax.Array, spatial_dims: tuple[int, ...], box_size: ArrayLike, scheme: str
+) -> tuple[jax.Array, jax.Array]:
+    """
+    Get the grid cells that each particle deposits to and the weight of each. Cell i covers
+    [i,i+1)*box_size/N, so its center is at (i+0.5)*box_size/N, and the grid is periodic.
+
+    args:
+        positions: particle positions, shape (particles,D)
+        spatial_dims: number of grid cells along each dimension
+        box_size: side length of the periodic box, in the units of positions
+        scheme: the mass assignment scheme, nearest grid point (ngp), cloud-in-cell (cic), or
+            triangular-shaped-cloud (tsc)
+
+    returns:
+        the flat cell indices and the weights, both shape (stencil,particles)
+    """
+    D = len(spatial_dims)
+    assert positions.shape[-1] == D, f"_deposit_stencil: positions {positions.shape}, D={D}"
+    # positions in units of cells
+    cells = positions * (jnp.array(spatial_dims) / box_size)
+
+    if scheme == "ngp":
+        base = jnp.floor(cells)
+        offsets = (0,)
+        weights_1d = [jnp.ones_like(cells)]
+    elif scheme == "cic":
+        base = jnp.floor(cells - 0.5)
+        frac = cells - 0.5 - base
+        offsets = (0, 1)
+        weights_1d = [1 - frac, frac]
+    elif scheme == "tsc":
+        base = jnp.floor(cells)
+        dist = cells - (base + 0.5)  # distance to the center of the nearest cell
+        offsets = (-1, 0, 1)
+        weights_1d = [0.5 * (0.5 - dist) ** 2, 0.75 - dist**2, 0.5 * (0.5 + dist) ** 2]
+    else:
+        raise ValueError(f"_deposit_stencil: scheme {scheme} must be one of {DEPOSIT_SCHEMES}")
+
+    base = base.astype(int)
+    strides = np.cumprod((1,) + spatial_dims[:0:-1])[::-1]  # row major strides of the grid
+    flat_idxs = []
+    weights = []
+    for stencil_idxs in itertools.product(range(len(offsets)), repeat=D):
+        flat_idx = jnp.zeros(len(positions), dtype=int)
+        weight = jnp.ones(len(positions), dtype=cells.dtype)
+        for d, i in enumerate(stencil_idxs):
+            idx = jnp.mod(base[:, d] + offsets[i], spatial_dims[d])
+            flat_idx = flat_idx + idx * int(strides[d])
+            weight = weight * weights_1d[i][:, d]
+
+        flat_idxs.append(flat_idx)
+        weights.append(weight)
+
+    return jnp.stack(flat_idxs), jnp.stack(weights)
+
+
+@functools.partial(jax.jit, static_argnums=[2, 4])
+def deposit(
+    positions: jax.Array,
+    values: jax.Array,
+    spatial_dims: tuple[int, ...],
+    box_size: ArrayLike,
+    scheme: str = "cic",
+) -> jax.Array:
+    """
+    Scatter particle values onto a periodic grid with a mass assignment scheme. The stencils of all
+    particles are added in a single scatter, and the sum of the values is conserved.
+
+    args:
+        positions: particle positions, shape (particles,D)
+        values: the value of each particle, shape (particles,) or (particles,channels)
+        spatial_dims: number of grid cells along each dimension
+        box_size: side length of the periodic box, in the units of positions
+        scheme: the mass assignment scheme, nearest grid point (ngp), cloud-in-cell (cic), or
+            triangular-shaped-cloud (tsc)
+
+    returns:
+        the grid of summed values, shape spatial_dims + values.shape[1:]
+    """
+    flat_idxs, weights = _deposit_stencil(positions, spatial_dims, box_size, scheme)
+    value_shape = values.shape[1:]
+    values = values.reshape((len(values), -1))  # (particles,channels)
+    grid = jnp.zeros((int(np.prod(spatial_dims)), values.shape[1]), dtype=values.dtype)
+    grid = grid.at[flat_idxs.reshape(-1)].add(
+        (weights[..., None] * values[None]).reshape((-1, values.shape[1]))
+    )
+    return grid.reshape(spatial_dims + value_shape)
+
+
+def _pad_chunk(chunk: np.ndarray, chunk_size: int) -> np.ndarray:
+    """
+    Pad the particle axis of a chunk with zeros up to chunk_size.
+
+    args:
+        chunk: the chunk, shape (particles,...)
+        chunk_size: the number of particles of a full chunk
+
+    returns:
+        the padded chunk, shape (chunk_size,...)
+    """
+    return np.pad(chunk, ((0, chunk_size - len(chunk)),) + ((0, 0),) * (chunk.ndim - 1))
+
+
+def deposit_in_chunks(
+    positions: ArrayLike,
+    values: Optional[ArrayLike],
+    spatial_dims: tuple[int, ...],
+    box_size: float,
+    scheme: str = "cic",
+    chunk_size: int = 2**20,
+) -> jax.Array:
+    """
+    Deposit particles onto a grid in chunks, so that only chunk_size particles are in memory at
+    once. The positions and values may be anything that can be sliced into numpy arrays, such as an
+    h5py Dataset or a memory mapped array. The last chunk is padded with particles of value zero so
+    every chunk uses the same compiled deposit.
+
+    args:
+        positions: particle positions, shape (particles,D)
+        values: the value of each particle, shape (particles,) or (particles,channels), or None to
+            count the particles
+        spatial_dims: number of grid cells along each dimension
+        box_size: side length of the periodic box, in the units of positions
+        scheme: the mass assignment scheme, ngp, cic, or tsc
+        chunk_size: number of particles to deposit at a time
+
+    returns:
+        the grid of summed values, shape spatial_dims + values.shape[1:]
+    """
+    n_particles = len(positions)
+    chunk_size = min(chunk_size, n_particles)
+    grid = None
+    for start in range(0, n_particles, chunk_size):
+        stop = min(start + chunk_size, n_particles)
+        chunk_positions = np.asarray(positions[start:stop], dtype=np.float32)
+        if values is None:
+            chunk_values = np.ones(stop - start, dtype=np.float32)
+        else:
+            chunk_values = np.asarray(values[start:stop], dtype=np.float32)
+
+        chunk_grid = deposit(
+            jnp.array(_pad_chunk(chunk_positions, chunk_size)),
+            jnp.array(_pad_chunk(chunk_values, chunk_size)),
+            spatial_dims,
+            box_size,
+            scheme,
+        )
+        grid = chunk_grid if grid is None else grid + chunk_grid
+
+    assert grid is not None, "deposit_in_chunks: no particles"
+    return grid
+
+
+class _MassMomentum:
+    """
+    The mass and momentum of particles, shape (particles,1+D), which is only computed for the
+    slices of particles that are read, so that it can be passed to `deposit_in_chunks`.
+    """
+
+    velocities: ArrayLike
+    masses: Optional[ArrayLike]
+
+    def __init__(self: Self, velocities: ArrayLike, masses: Optional[ArrayLike]) -> None:
+        self.velocities = velocities
+        self.masses = masses
+
+    def __len__(self: Self) -> int:
+        return len(self.velocities)
+
+    def __getitem__(self: Self, particles: slice) -> np.ndarray:
+        chunk_velocities = np.asarray(self.velocities[particles], dtype=np.float32)
+        if self.masses is None:
+            chunk_masses = np.ones((len(chunk_velocities), 1), dtype=np.float32)
+        else:
+            chunk_masses = np.asarray(self.masses[particles], dtype=np.float32)[:, None]
+
+        return np.concatenate([chunk_masses, chunk_masses * chunk_velocities], axis=-1)
+
+
+def particles_to_fields(
+    positions: ArrayLike,
+    velocities: ArrayLike,
+    spatial_dims: tuple[int, ...],
+    box_size: float,
+    masses: Optional[ArrayLike] = None,
+    scheme: str = "cic",
+    chunk_size: int = 2**20,
+) -> tuple[jax.Array, jax.Array]:
+    """
+    Deposit particles to get the density and the mass weighted velocity on a periodic grid. Mass and
+    momentum are deposited together in one pass over the particles, and the velocity is momentum
+    divided by mass, or 0 in cells that no particle reaches.
+
+    args:
+        positions: particle positions, shape (particles,D)
+        velocities: particle velocities, shape (particles,D)
+        spatial_dims: number of grid cells along each dimension
+        box_size: side length of the periodic box, in the units of positions
+        masses: particle masses, shape (particles,), or None for particles of mass 1
+        scheme: the mass assignment scheme, ngp, cic, or tsc
+        chunk_size: number of particles to deposit at a time
+
+    returns:
+        the density in mass per unit volume, shape spatial_dims, and the velocity, shape
+            spatial_dims + (D,)
+    """
+    grid = deposit_in_chunks(
+        positions,
+        _MassMomentum(velocities, masses),
+        spatial_dims,
+        box_size,
+        scheme,
+        chunk_size,
+    )
+    mass = grid[..., 0]
+    velocity = grid[..., 1:] / jnp.where(mass == 0, 1, mass)[..., None]
+    cell_volume = np.prod(box_size / np.array(spatial_dims))
+    return mass / cell_volume, velocity
+
+
+def particle_time_series(
+    snapshots: Iterable[tuple[ArrayLike, ArrayLike, Optional[ArrayLike]]],
+    spatial_dims: tuple[int, ...],
+    box_size: float,
+    scheme: str = "cic",
+    chunk_size: int = 2**20,
+) -> geom.MultiImage:
+    """
+    Deposit the snapshots of one particle trajectory, producing the density and velocity fields of a
+    MultiImage time series in the layout expected by `data.batch_time_series`. Snapshots are read
+    and deposited one at a time, so they may be lazily loaded.
+
+    args:
+        snapshots: the positions, velocities, and masses (or None) of each snapshot in time order
+        spatial_dims: number of grid cells along each dimension
+        box_size: side length of the periodic box, in the units of positions
+        scheme: the mass assignment scheme, ngp, cic, or tsc
+        chunk_size: number of particles to deposit at a time
+
+    returns:
+        the MultiImage on the torus, shape (1,time,spatial,tensor), with the density as (0,0) and
+            the velocity as (1,0)
+    """
+    densities = []
+    velocities = []
+    for positions, snapshot_velocities, masses in snapshots:
+        density, velocity = particles_to_fields(
+            positions, snapshot_velocities, spatial_dims, box_size, masses, scheme, chunk_size
+        )
+        densities.append(density)
+        velocities.append(velocity)
+
+    return geom.MultiImage(
+        {(0, 0): jnp.stack(densities)[None], (1, 0): jnp.stack(velocities)[None]},
+        len(spatial_dims),
+        is_torus=True,
+    )
+
+
+# ------------------------------------------------------------------------------
+# Gravity
+
+
+FORCE_LAWS = ("inverse_square", "poisson")
+
+
+@functools.partial(jax.jit, static_argnums=(1, 2))
+def gravity_field(
+    density: jax.Array, is_torus: bool = False, force_law: str = "inverse_square"
+) -> jax.Array:
+    """
+    Get the gravitational field of a mass density with FFTs. Distances are in pixels, and the field
+    at the pixel of a point mass due to itself is 0. The force law is either inverse_square, where
+    the field of a point mass m at displacement r is m*r/|r|^3 in any dimension, or poisson, where
+    it is m*r/|r|^D, the solution of the Poisson equation in D dimensions. They agree in 3D, which
+    is Newtonian gravity with G=1.
+
+    If the boundaries are isolated, the density is zero padded to twice its size and convolved with
+    the field of a point mass (Hockney & Eastwood), which is exact for either force law. If
+    is_torus, the box is periodic and the Poisson equation is solved, so the force law must be
+    poisson. The mean density is removed as is usual for periodic gravity, and the field converges
+    to that of the point masses away from them.
+
+    args:
+        density: the mass of each pixel, shape spatial_dims
+        is_torus: whether the box is periodic or isolated
+        force_law: the force law, inverse_square or poisson
+
+    returns:
+        the gravitational field, shape spatial_dims + (D,)
+    """
+    assert force_law in FORCE_LAWS, f"gravity_field: force_law must be one of {FORCE_LAWS}"
+    spatial_dims = density.shape
+    D = len(spatial_dims)
+    if is_torus:
+        assert force_law == "poisson" or D == 3, (
+            "gravity_field: periodic boxes solve the Poisson equation, so force_law must be "
+            f"poisson in {D} dimensions"
+        )
+        surface_area = 2 * math.pi ** (D / 2) / math.gamma(D / 2)  # of the unit sphere in D dims
+        freqs = [2 * jnp.pi * jnp.fft.fftfreq(N) for N in spatial_dims]
+        wave_vecs = jnp.stack(jnp.meshgrid(*freqs, indexing="ij"), axis=-1)  # (spatial,D)
+        # eigenvalues of the discrete laplacian and central difference gradient, as in a
+        # particle-mesh code, which converge to the point mass field away from the mass
+        laplacian = jnp.sum(4 * jnp.sin(wave_vecs / 2) ** 2, axis=-1, keepdims=True)
+        gradient = jnp.sin(wave_vecs)
+        # laplacian(phi) = surface_area*density, field = -grad(phi)
+        density_k = jnp.fft.fftn(density)[..., None]
+        field_k = 1j * gradient * surface_area * density_k / jnp.where(laplacian == 0, 1, laplacian)
+        field = jnp.fft.ifftn(field_k, axes=tuple(range(D))).real
+    else:
+        power = 3 if force_law == "inverse_square" else D
+        padded_dims = tuple(2 * N for N in spatial_dims)
+        # displacement of each pixel of the padded grid, with indices past N being negative
+        offsets = [
+            jnp.where(jnp.arange(M) < M // 2, jnp.arange(M), jnp.arange(M) - M) for M in padded_dims
+        ]
+        displacements = jnp.stack(jnp.meshgrid(*offsets, indexing="ij"), axis=-1)
+        dist = jnp.linalg.norm(displacements, axis=-1, keepdims=True)
+        # field at displacement r from a unit mass, pointing back towards the mass
+        green = -displacements / jnp.where(dist == 0, 1, dist**power)
+        density_k = jnp.fft.fftn(density, s=padded_dims)[..., None]
+        green_k = jnp.fft.fftn(green, axes=tuple(range(D)))
+        field = jnp.fft.ifftn(density_k * green_k, axes=tuple(range(D))).real
+        field = field[tuple(slice(N) for N in spatial_dims)]
+
+    return field.astype(density.dtype)
+
+
+def point_mass_gravity(
+    key: ArrayLike,
+    spatial_dims: tuple[int, ...],
+    n_points: int,
+    is_torus: bool = False,
+    force_law: str = "inverse_square",
+) -> tuple[jax.Array, jax.Array]:
+    """
+    Place point masses on distinct random pixels, and get the mass image and its gravitational
+    field. The masses are uniform random and scaled so the largest is 1.
+
+    args:
+        key: jax.random key
+        spatial_dims: the spatial dimensions of the image
+        n_points: number of point masses
+        is_torus: whether the box is periodic or isolated
+        force_law: the force law, inverse_square or poisson, see gravity_field
+
+    returns:
+        the mass image, shape spatial_dims, and the gravitational field, shape spatial_dims + (D,)
+    """
+    key, subkey = jax.random.split(key)
+    flat_idxs = jax.random.choice(
+        subkey, int(np.prod(spatial_dims)), shape=(n_points,), replace=False
+    )
+    positions = jnp.stack(jnp.unravel_index(flat_idxs, spatial_dims), axis=-1) + 0.5
+
+    masses = jax.random.uniform(key, shape=(n_points,))
+    masses = masses / jnp.max(masses)
+
+    # pixel units, so nearest grid point deposits each mass to its pixel
+    density = deposit(positions, masses, spatial_dims, jnp.array(spatial_dims), "ngp")
+    return density, gravity_field(density, is_torus, force_law)
+
+
+def get_gravity_data(
+    key: ArrayLike,
+    spatial_dims: tuple[int, ...],
+    n_points: int,
+    n_images: int,
+    is_torus: bool = False,
+    batch_size: Optional[int] = None,
+    force_law: str = "inverse_square",
+) -> tuple[geom.MultiImage, geom.MultiImage]:
+    """
+    Generate a dataset of random point masses and their gravitational fields. Images are generated
+    under vmap in batches of batch_size to bound the memory of the FFTs, which matters in 3D.
+
+    args:
+        key: jax.random key
+        spatial_dims: the spatial dimensions of the images
+        n_points: number of point masses per image
+        n_images: number of images
+        is_torus: whether the box is periodic or isolated
+        batch_size: number of images generated at a time, defaults to all of them
+        force_law: the force law, inverse_square or poisson, see gravity_field
+
+    returns:
+        MultiImages of the masses, shape (n_images,1,spatial), and the gravitational fields, shape
+            (n_images,1,spatial,D)
+    """
+    batch_size = n_images if batch_size is None else batch_size
+    vmap_gravity = jax.vmap(point_mass_gravity, in_axes=(0, None, None, None, None))
+    keys = jax.random.split(key, n_images)
+    densities = []
+    fields = []
+    for start in range(0, n_images, batch_size):
+        density, field = vmap_gravity(
+            keys[start : start + batch_size], spatial_dims, n_points, is_torus, force_law
+        )
+        densities.append(density)
+        fields.append(field)
+
+    D = len(spatial_dims)
+    return (
+        geom.MultiImage({(0, 0): jnp.concatenate(densities)[:, None]}, D, is_torus),
+        geom.MultiImage({(1, 0): jnp.concatenate(fields)[:, None]}, D, is_torus),
+    )
@@ -0,0 +1,280 @@
+import os
+import json
+from typing_extensions import Iterable, Optional, Self
+
+import numpy as np
+import jax.numpy as jnp
+
+import ginjax.geometric as geom
+
+# ------------------------------------------------------------------------------
+# Streaming statistics of datasets
+
+
+class RunningStats:
+    """
+    The count, mean, and sum of squared deviations (M2) of a set of values, computed in a single
+    pass by merging the statistics of each chunk with the method of Chan et al., the parallel form
+    of Welford's algorithm. All values are accumulated in float64, so the results do not suffer from
+    the cancellation of the naive sum of squares.
+    """
+
+    count: np.ndarray
+    mean: np.ndarray
+    m2: np.ndarray
+
+    def __init__(self: Self, shape: tuple[int, ...] = ()) -> None:
+        """
+        Construct empty statistics.
+
+        args:
+            shape: the shape of the statistics, e.g. (channels,)
+        """
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def merge(self: Self, count: np.ndarray, mean: np.ndarray, m2: np.ndarray) -> Self:
+        """
+        Merge the statistics of another set of values into these statistics.
+
+        args:
+            count: the number of other values
+            mean: the mean of the other values
+            m2: the sum of squared deviations from the mean of the other values
+
+        returns:
+            these statistics, now updated
+        """
+        total = self.count + count
+        safe_total = np.where(total == 0, 1, total)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / safe_total)
+        self.m2 = self.m2 + m2 + delta**2 * (self.count * count / safe_total)
+        self.count = total
+        return self
+
+    def update(self: Self, values: np.ndarray, axis: tuple[int, ...]) -> Self:
+        """
+        Update the statistics with a chunk of values.
+
+        args:
+            values: the values, reduced over axis to the shape of the statistics
+            axis: the axes to reduce over
+
+        returns:
+            these statistics, now updated
+        """
+        values = np.asarray(values, dtype=np.float64)
+        count = np.full(self.mean.shape, np.prod([values.shape[i] for i in axis]))
+        mean = np.mean(values, axis=axis)
+        m2 = np.sum((values - np.expand_dims(mean, axis)) ** 2, axis=axis)
+        return self.merge(count, mean, m2)
+
+    def variance(self: Self) -> np.ndarray:
+        """
+        Get the population variance of the values.
+
+        returns:
+            the variance
+        """
+        return self.m2 / np.where(self.count == 0, 1, self.count)
+
+
+class MultiImageStats:
+    """
+    Streaming per channel statistics of each (k,parity) of a dataset of MultiImages, used to
+    normalize the data without having all of it in memory at once. To keep the normalization
+    equivariant, only the (0,0) scalars are centered, by their mean, and scaled, by their standard
+    deviation. Pseudoscalars, vectors, and tensors are only scaled, by the root mean square of their
+    norm, which is invariant to rotations and reflections.
+
+    If the channels are time series laid out as (channels,n_steps), such as the output of
+    `data.batch_time_series`, the statistics are pooled over the steps of each channel.
+    """
+
+    n_steps: int
+    stats: dict[tuple[int, int], RunningStats]
+
+    def __init__(self: Self, n_steps: int = 1) -> None:
+        """
+        Construct empty statistics.
+
+        args:
+            n_steps: the number of time steps of each channel
+        """
+        self.n_steps = n_steps
+        self.stats = {}
+
+    def update(self: Self, multi_image: geom.MultiImage) -> Self:
+        """
+        Update the statistics with a chunk of the dataset.
+
+        args:
+            multi_image: the chunk, shape (batch,channels*n_steps,spatial,tensor), with any
+                number of leading axes before channels
+
+        returns:
+            these statistics, now updated
+        """
+        n_leading = multi_image.get_n_leading()
+        for (k, parity), image_block in multi_image.items():
+            image_block = np.asarray(image_block, dtype=np.float64)
+            # (batch,channels,n_steps,spatial,tensor)
+            n_channels = image_block.shape[n_leading - 1] // self.n_steps
+            exp_block = image_block.reshape(
+                (-1, n_channels, self.n_steps) + image_block.shape[n_leading:]
+            )
+            if (k, parity) != (0, 0):
+                # squared norm of each pixel, (batch,channels,n_steps,spatial)
+                tensor_axes = tuple(range(exp_block.ndim - k, exp_block.ndim))
+                exp_block = np.sum(exp_block**2, axis=tensor_axes)
+
+            if (k, parity) not in self.stats:
+                self.stats[(k, parity)] = RunningStats((exp_block.shape[1],))
+
+            axis = (0,) + tuple(range(2, exp_block.ndim))
+            self.stats[(k, parity)].update(exp_block, axis)
+
+        return self
+
+    def get_mean(self: Self, k: int, parity: int) -> np.ndarray:
+        """
+        Get the mean that (k,parity) is centered by, which is 0 for all but the (0,0) scalars.
+
+        args:
+            k: the tensor order
+            parity: the parity
+
+        returns:
+            the mean of each channel, shape (channels,)
+        """
+        running_stats = self.stats[(k, parity)]
+        return running_stats.mean if (k, parity) == (0, 0) else np.zeros_like(running_stats.mean)
+
+    def get_scale(self: Self, k: int, parity: int) -> np.ndarray:
+        """
+        Get the scale that (k,parity) is divided by, the standard deviation for the (0,0) scalars
+        and the root mean square norm otherwise.
+
+        args:
+            k: the tensor order
+            parity: the parity
+
+        returns:
+            the scale of each channel, shape (channels,)
+        """
+        running_stats = self.stats[(k, parity)]
+        if (k, parity) == (0, 0):
+            return np.sqrt(running_stats.variance())
+        else:
+            return np.sqrt(running_stats.mean)  # mean of the squared norms
+
+    def normalize(self: Self, multi_image: geom.MultiImage) -> geom.MultiImage:
+        """
+        Normalize a MultiImage by these statistics.
+
+        args:
+            multi_image: the MultiImage, shape (batch,channels*n_steps,spatial,tensor), with any
+                number of leading axes before channels
+
+        returns:
+            the normalized MultiImage
+        """
+        n_leading = multi_image.get_n_leading()
+        out = multi_image.empty()
+        for (k, parity), image_block in multi_image.items():
+            assert (k, parity) in self.stats, (
+                f"MultiImageStats::normalize: no statistics for {(k, parity)}, "
+                f"only {list(self.stats.keys())}"
+            )
+            channel_shape = (1,) * (n_leading - 1) + (-1, 1) + (1,) * (multi_image.D + k)
+            exp_block = image_block.reshape(
+                image_block.shape[: n_leading - 1]
+                + (-1, self.n_steps)
+                + image_block.shape[n_leading:]
+            )
+            mean = jnp.array(self.get_mean(k, parity), dtype=image_block.dtype)
+            scale = jnp.array(self.get_scale(k, parity), dtype=image_block.dtype)
+            exp_block = (exp_block - mean.reshape(channel_shape)) / scale.reshape(channel_shape)
+            out.append(k, parity, exp_block.reshape(image_block.shape))
+
+        return out
+
+    def save(self: Self, filename: str) -> None:
+        """
+        Save the statistics to a json file.
+
+        args:
+            filename: the file to save to
+        """
+        with open(filename, "w") as f:
+            json.dump(
+                {
+                    "n_steps": self.n_steps,
+                    "stats": [
+                        {
+                            "k": k,
+                            "parity": parity,
+                            "count": running_stats.count.tolist(),
+                            "mean": running_stats.mean.tolist(),
+                            "m2": running_stats.m2.tolist(),
+                        }
+                        for (k, parity), running_stats in self.stats.items()
+                    ],
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, filename: str) -> Self:
+        """
+        Load statistics saved with `save`.
+
+        args:
+            filename: the file to load from
+
+        returns:
+            the loaded statistics
+        """
+        with open(filename, "r") as f:
+            saved = json.load(f)
+
+        multi_image_stats = cls(saved["n_steps"])
+        for saved_stats in saved["stats"]:
+            running_stats = RunningStats()
+            running_stats.count = np.array(saved_stats["count"])
+            running_stats.mean = np.array(saved_stats["mean"])
+            running_stats.m2 = np.array(saved_stats["m2"])
+            multi_image_stats.stats[(saved_stats["k"], saved_stats["parity"])] = running_stats
+
+        return multi_image_stats
+
+
+def compute_stats(
+    chunks: Iterable[geom.MultiImage], n_steps: int = 1, cache: Optional[str] = None
+) -> MultiImageStats:
+    """
+    Compute the statistics of a dataset in a single pass over its chunks. If a cache file is given
+    and exists, the statistics are loaded from it instead, otherwise they are saved to it. The cache
+    is not invalidated if the dataset changes, so it should be named after the data it describes.
+
+    args:
+        chunks: the chunks of the dataset, such as `HDF5TrajectorySource.iter_chunks()`
+        n_steps: the number of time steps of each channel
+        cache: a json file to load the statistics from or save them to, usually next to the data
+
+    returns:
+        the statistics
+    """
+    if cache is not None and os.path.exists(cache):
+        return MultiImageStats.load(cache)
+
+    multi_image_stats = MultiImageStats(n_steps)
+    for chunk in chunks:
+        multi_image_stats.update(chunk)
+
+    if cache is not None:
+        multi_image_stats.save(cache)
+
+    return multi_image_stats
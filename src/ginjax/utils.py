@@ -598,6 +598,13 @@ def get_common_parser() -> argparse.ArgumentParser:
     parser.add_argument("-b", "--batch", help="batch size", type=int, default=8)
     parser.add_argument("-t", "--n_trials", help="number of trials to run", type=int, default=1)
     parser.add_argument("--seed", help="the random number seed", type=int, default=None)
+    parser.add_argument(
+        "--device_budget",
+        help="gigabytes of device memory that each training and validation dataset may be pinned "
+        "in, by default the batches are paged in from the host",
+        type=float,
+        default=None,
+    )
     parser.add_argument(
         "-v", "--verbose", help="verbose argument passed to trainer", type=int, default=1
     )
@@ -1,4 +1,5 @@
 import time
+import itertools as it
 
 import ginjax.geometric as geom
 import pytest
@@ -386,3 +387,86 @@ class TestFunctionalGeometricImage:
 
                 assert convolve_res.shape == vmap_convolve_res.shape
                 assert jnp.allclose(convolve_res, vmap_convolve_res, rtol=geom.TINY, atol=geom.TINY)
+
+    def testConvolveContractBasisGrad(self):
+        D = 2
+        N = 6
+        in_c = 3
+        out_c = 2
+        key = random.PRNGKey(0)
+        operators = geom.make_all_operators(D)
+        basis = geom.get_invariant_filters([3], [0, 1, 2, 3], [0, 1], D, operators)
+
+        conv_kwargs_list = [
+            {"is_torus": True},
+            {"is_torus": (True, False), "stride": (2, 2)},
+            {"is_torus": False, "padding": ((1, 1),) * D, "lhs_dilation": (2,) * D},
+            {"is_torus": True, "rhs_dilation": (2,) * D},
+        ]
+        for img_k, out_k in [(0, 0), (1, 0), (0, 1), (1, 1), (1, 2)]:
+            filter_basis = basis[(img_k + out_k, 0)]
+            for conv_kwargs in conv_kwargs_list:
+                key, subkey1, subkey2, subkey3 = random.split(key, num=4)
+                image = random.normal(subkey1, shape=(2, in_c) + (N,) * D + (D,) * img_k)
+                weights = random.normal(subkey2, shape=(out_c, in_c, len(filter_basis)))
+
+                def direct(image, weights):
+                    filter_image = jnp.einsum("ijk,k...->ij...", weights, filter_basis)
+                    return geom.convolve_contract(D, image, filter_image, **conv_kwargs)
+
+                def with_basis(image, weights):
+                    return geom.convolve_contract_basis(
+                        D, image, weights, filter_basis, **conv_kwargs
+                    )
+
+                out = direct(image, weights)
+                assert jnp.allclose(with_basis(image, weights), out, rtol=TINY, atol=TINY)
+
+                cotangent = random.normal(subkey3, shape=out.shape)
+                direct_grads = jax.grad(
+                    lambda x, w: jnp.sum(direct(x, w) * cotangent), argnums=(0, 1)
+                )(image, weights)
+                basis_grads = jax.grad(
+                    lambda x, w: jnp.sum(with_basis(x, w) * cotangent), argnums=(0, 1)
+                )(image, weights)
+                for direct_grad, basis_grad in zip(direct_grads, basis_grads):
+                    assert jnp.allclose(basis_grad, direct_grad, rtol=1e-4, atol=1e-4)
+
+    def testPoolLeadingAxes(self):
+        key = random.PRNGKey(0)
+        patch_len = 2
+        for D, spatial_dims in [(2, (4, 6)), (3, (4, 2, 4))]:
+            pooled_spatial_dims = tuple(N // patch_len for N in spatial_dims)
+            for k in [0, 1, 2]:
+                key, subkey = random.split(key)
+                image_block = random.normal(subkey, shape=(2, 3) + spatial_dims + (D,) * k)
+
+                max_pooled = geom.max_pool(D, image_block, patch_len, n_leading=2)
+                average_pooled = geom.average_pool(D, image_block, patch_len, n_leading=2)
+                assert max_pooled.shape == average_pooled.shape
+                assert max_pooled.shape == (2, 3) + pooled_spatial_dims + (D,) * k
+                if k == 0:
+                    value_pooled = geom.max_pool(D, image_block, patch_len, False, n_leading=2)
+
+                # compare to looping over the leading axes and patches
+                for b in range(2):
+                    for c in range(3):
+                        for idx in it.product(*[range(N) for N in pooled_spatial_dims]):
+                            patch = image_block[
+                                (b, c) + tuple(slice(i * 2, i * 2 + 2) for i in idx)
+                            ].reshape((patch_len**D,) + (D,) * k)
+                            norms = jnp.linalg.norm(patch.reshape((patch_len**D, -1)), axis=1)
+                            assert jnp.allclose(
+                                max_pooled[(b, c) + idx], patch[jnp.argmax(norms)]
+                            )
+                            assert jnp.allclose(
+                                average_pooled[(b, c) + idx], jnp.mean(patch, axis=0), atol=TINY
+                            )
+                            if k == 0:
+                                assert jnp.allclose(value_pooled[(b, c) + idx], jnp.max(patch))
+
+                # the single image version is the same under vmap
+                vmap_max_pool = jax.vmap(
+                    jax.vmap(geom.max_pool, in_axes=(None, 0, None)), in_axes=(None, 0, None)
+                )
+                assert jnp.allclose(max_pooled, vmap_max_pool(D, image_block, patch_len))
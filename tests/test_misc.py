@@ -1,6 +1,9 @@
 import pytest
+import functools
 import math
+import pickle
 import time
+import numpy as np
 
 import jax
 import jax.numpy as jnp
@@ -8,6 +11,9 @@ import jax.random as random
 
 import ginjax.geometric as geom
 import ginjax.data as gc_data
+import ginjax.ml as ml
+import ginjax.stats as stats
+import ginjax.physics as physics
 
 
 class TestMisc:
@@ -433,3 +439,697 @@ class TestMisc:
             Y2[(1, 0)][0],
             dynamic_fields[(1, 0)][0, past_steps : past_steps + future_steps],
         )
+
+    def testLazyBatchTimeSeries(self):
+        key = random.PRNGKey(0)
+        D = 2
+        batch = 3
+        timesteps = 20
+        N = 4
+        past_steps = 3
+        future_steps = 2
+
+        key, subkey1, subkey2, subkey3 = random.split(key, 4)
+        dynamic_fields = geom.MultiImage(
+            {
+                (0, 0): random.normal(subkey1, shape=(batch, 2 * timesteps) + (N,) * D),
+                (1, 0): random.normal(subkey2, shape=(batch, timesteps) + (N,) * D + (D,)),
+            },
+            D,
+        )
+        constant_fields = geom.MultiImage(
+            {(1, 0): random.normal(subkey3, shape=(batch, 1) + (N,) * D + (D,))}, D
+        )
+
+        for skip_initial, delta_t, downsample in [(0, 1, 0), (2, 2, 1)]:
+            X, Y = gc_data.batch_time_series(
+                dynamic_fields,
+                constant_fields,
+                timesteps,
+                past_steps,
+                future_steps,
+                skip_initial,
+                delta_t,
+                downsample,
+            )
+            lazy_X, lazy_Y = gc_data.lazy_batch_time_series(
+                dynamic_fields,
+                constant_fields,
+                timesteps,
+                past_steps,
+                future_steps,
+                skip_initial,
+                delta_t,
+                downsample,
+            )
+            assert lazy_X.get_L() == lazy_Y.get_L() == X.get_L()
+            assert lazy_X.get_signature() == X.get_signature()
+            assert lazy_X.to_multi_image() == X
+            assert lazy_Y.to_multi_image() == Y
+
+            idxs = random.permutation(key, X.get_L())[:5]
+            assert lazy_X.get_subset(idxs) == X.get_subset(idxs)
+            assert lazy_Y.get_subset(idxs) == Y.get_subset(idxs)
+
+            # batches from the lazy view are the same as those of the materialized MultiImage
+            X_batches, Y_batches = ml.get_batches((X, Y), 4, key)
+            lazy_X_batches, lazy_Y_batches = ml.get_batches((lazy_X, lazy_Y), 4, key)
+            assert len(X_batches) == len(lazy_X_batches)
+            for X_batch, Y_batch, lazy_X_batch, lazy_Y_batch in zip(
+                X_batches, Y_batches, lazy_X_batches, lazy_Y_batches
+            ):
+                assert X_batch == lazy_X_batch
+                assert Y_batch == lazy_Y_batch
+
+    def testBatchTimeSeriesDownsample(self):
+        key = random.PRNGKey(0)
+        D = 2
+        batch = 2
+        timesteps = 10
+        N = 8
+        past_steps = 2
+        future_steps = 3
+
+        key, subkey1, subkey2, subkey3 = random.split(key, 4)
+        dynamic_fields = geom.MultiImage(
+            {
+                (0, 0): random.normal(subkey1, shape=(batch, 2 * timesteps) + (N,) * D),
+                (1, 0): random.normal(subkey2, shape=(batch, timesteps) + (N,) * D + (D,)),
+            },
+            D,
+        )
+        constant_fields = geom.MultiImage(
+            {(0, 0): random.normal(subkey3, shape=(batch, 1) + (N,) * D)}, D
+        )
+
+        # pooling the raw time series is the same as pooling every window
+        X, Y = gc_data.batch_time_series(
+            dynamic_fields, constant_fields, timesteps, past_steps, future_steps
+        )
+        X_down, Y_down = gc_data.batch_time_series(
+            dynamic_fields, constant_fields, timesteps, past_steps, future_steps, downsample=2
+        )
+        assert X_down.get_spatial_dims() == (N // 4,) * D
+        assert X_down.__eq__(X.average_pool(2).average_pool(2), rtol=1e-5, atol=1e-5)
+        assert Y_down.__eq__(Y.average_pool(2).average_pool(2), rtol=1e-5, atol=1e-5)
+
+        pyramid = gc_data.ResolutionPyramid(dynamic_fields, constant_fields)
+        dynamic_fields1, constant_fields1 = pyramid.get(1)
+        assert dynamic_fields1 == dynamic_fields.average_pool(2)
+        assert constant_fields1 == constant_fields.average_pool(2)
+        assert list(pyramid.levels.keys()) == [0, 1]
+
+        dynamic_fields2, constant_fields2 = pyramid.get(2)
+        assert pyramid.get(2)[0] is dynamic_fields2  # cached
+        X_pyramid, Y_pyramid = gc_data.batch_time_series(
+            dynamic_fields2, constant_fields2, timesteps, past_steps, future_steps
+        )
+        assert X_pyramid == X_down
+        assert Y_pyramid == Y_down
+
+    def testBatchTimeSeriesSharedConstants(self):
+        key = random.PRNGKey(0)
+        D = 2
+        batch = 3
+        timesteps = 8
+        N = 4
+        past_steps = 2
+        future_steps = 1
+
+        key, subkey1, subkey2, subkey3 = random.split(key, 4)
+        dynamic_fields = geom.MultiImage(
+            {
+                (0, 0): random.normal(subkey1, shape=(batch, timesteps) + (N,) * D),
+                (1, 0): random.normal(subkey2, shape=(batch, timesteps) + (N,) * D + (D,)),
+            },
+            D,
+        )
+        # shared by all trajectories, so no batch axis
+        constant_fields = geom.MultiImage(
+            {(0, 0): random.normal(subkey3, shape=(2,) + (N,) * D)}, D
+        )
+        batch_constant_fields = geom.MultiImage(
+            {(0, 0): jnp.full((batch,) + constant_fields[(0, 0)].shape, constant_fields[(0, 0)])},
+            D,
+        )
+        assert not gc_data.is_batched_constant(dynamic_fields, constant_fields)
+        assert gc_data.is_batched_constant(dynamic_fields, batch_constant_fields)
+
+        X, Y = gc_data.batch_time_series(
+            dynamic_fields, batch_constant_fields, timesteps, past_steps, future_steps
+        )
+        shared_X, shared_Y = gc_data.batch_time_series(
+            dynamic_fields, constant_fields, timesteps, past_steps, future_steps
+        )
+        # the shared constant fields are stored once, not copied into every window
+        assert isinstance(shared_X, gc_data.ConstantFieldsView)
+        assert shared_X.constant_fields[(0, 0)].shape == (2,) + (N,) * D
+        assert shared_X.fields[(0, 0)].shape[1] == past_steps
+        assert shared_X.to_multi_image() == X
+        assert shared_X.from_host(shared_X.get_host_subset(np.arange(3))) == X.get_subset(
+            jnp.arange(3)
+        )
+        assert shared_Y == Y
+
+        lazy_X, lazy_Y = gc_data.lazy_batch_time_series(
+            dynamic_fields, constant_fields, timesteps, past_steps, future_steps
+        )
+        assert lazy_X.constant_fields[(0, 0)].shape == (2,) + (N,) * D
+        assert lazy_X.to_multi_image() == X
+        assert lazy_Y.to_multi_image() == Y
+
+    def testHDF5TrajectorySource(self, tmp_path):
+        h5py = pytest.importorskip("h5py")
+        D = 2
+        N = 4
+        n_traj = 7
+        timesteps = 6
+        past_steps = 2
+        future_steps = 2
+        rng = np.random.default_rng(0)
+
+        raw = {
+            name: rng.normal(size=(n_traj, timesteps) + (N,) * D).astype(np.float32)
+            for name in ["density", "pressure", "Vx", "Vy"]
+        }
+        filename = str(tmp_path / "trajectories.h5")
+        with h5py.File(filename, "w") as f:
+            for name, data in raw.items():
+                f.create_dataset(
+                    name, data=data, chunks=(3, timesteps) + (N,) * D, compression="gzip"
+                )
+
+        start = 1
+        source = gc_data.HDF5TrajectorySource(
+            filename,
+            {(0, 0): ["density", "pressure"], (1, 0): [["Vx", "Vy"]]},
+            D,
+            start=start,
+            num_workers=2,
+        )
+        assert source.get_L() == n_traj - start
+        assert source.total_steps == timesteps
+        assert source.chunk_len == 3
+
+        expected = geom.MultiImage(
+            {
+                (0, 0): jnp.concatenate([raw["density"], raw["pressure"]], axis=1)[start:],
+                (1, 0): jnp.stack([raw["Vx"], raw["Vy"]], axis=-1)[start:],
+            },
+            D,
+        )
+        assert source.to_multi_image() == expected
+
+        # unsorted and repeated indices across multiple chunks
+        idxs = jnp.array([5, 0, 3, 3, 1])
+        assert source.get_subset(idxs) == expected.get_subset(idxs)
+        chunks = list(source.iter_chunks())
+        assert [chunk.get_L() for chunk in chunks] == [2, 3, 1]  # aligned to the file chunks
+        assert functools.reduce(lambda carry, chunk: carry.concat(chunk), chunks) == expected
+
+        X, Y = gc_data.batch_time_series(
+            expected, geom.MultiImage({}, D), timesteps, past_steps, future_steps
+        )
+        lazy_X, lazy_Y = gc_data.lazy_batch_time_series(
+            source, geom.MultiImage({}, D), timesteps, past_steps, future_steps
+        )
+        assert lazy_X.get_L() == X.get_L()
+
+        # X and Y share the source, so the trajectories of a batch are only read once
+        n_reads = []
+        read_rows = source._read_rows
+        source._read_rows = lambda *task: n_reads.append(1) or read_rows(*task)
+        assert lazy_X.get_subset(idxs) == X.get_subset(idxs)
+        n_batch_reads = len(n_reads)
+        assert lazy_Y.get_subset(idxs) == Y.get_subset(idxs)
+        assert len(n_reads) == n_batch_reads > 0
+        source.close()
+
+        with pytest.warns(UserWarning, match="only found"):
+            gc_data.HDF5TrajectorySource(
+                filename, {(0, 0): ["density"]}, D, start=start, n_trajectories=n_traj
+            ).close()
+
+    def testArrayStore(self, tmp_path):
+        directory = str(tmp_path / "store")
+        gc_data.create_array_store(
+            directory,
+            {"uv": ((4, 3, 5, 2), "float32"), "lat": ((5,), "float64")},
+            {"seeds": ["seed=0", "seed=1"], "offsets": [0, 2, 4]},
+        )
+
+        # fill the store in disjoint slices, as the ingestion workers do
+        rng = np.random.default_rng(0)
+        uv = rng.normal(size=(4, 3, 5, 2)).astype(np.float32)
+        for offset in [0, 2]:
+            store, _ = gc_data.open_array_store(directory, mode="r+")
+            store["uv"][offset : offset + 2] = uv[offset : offset + 2]
+            store["uv"].flush()
+
+        store, metadata = gc_data.open_array_store(directory)
+        assert metadata == {"seeds": ["seed=0", "seed=1"], "offsets": [0, 2, 4]}
+        assert isinstance(store["uv"], np.memmap)
+        assert store["uv"].dtype == np.float32 and store["lat"].dtype == np.float64
+        assert np.array_equal(store["uv"], uv)
+        assert np.array_equal(store["lat"], np.zeros(5))
+        with pytest.raises(ValueError):
+            store["uv"][0] = 0  # read only
+
+    def testArrayStoreSource(self, tmp_path):
+        D = 2
+        N = 4
+        directory = str(tmp_path / "store")
+        rng = np.random.default_rng(0)
+        fields = {
+            "pres": rng.normal(size=(5, 3, N, N)).astype(np.float32),
+            "div": rng.normal(size=(5, 3, N, N)).astype(np.float32),
+            "uv": rng.normal(size=(5, 3, N, N, D)).astype(np.float32),
+        }
+        gc_data.create_array_store(
+            directory, {name: (arr.shape, "float32") for name, arr in fields.items()}
+        )
+        store, _ = gc_data.open_array_store(directory, mode="r+")
+        for name, arr in fields.items():
+            store[name][:] = arr
+            store[name].flush()
+
+        layout = {(0, 0): ["pres", "div"], (1, 0): ["uv"]}
+        source = gc_data.ArrayStoreSource(directory, layout, D, (True, False), 1, 3)
+        assert source.get_L() == 3
+        assert source.is_torus == (True, False)
+        expected = geom.MultiImage(
+            {
+                (0, 0): jnp.array(
+                    np.concatenate([fields["pres"][1:4], fields["div"][1:4]], axis=1)
+                ),
+                (1, 0): jnp.array(fields["uv"][1:4]),
+            },
+            D,
+            (True, False),
+        )
+        idxs = jnp.array([2, 0])
+        assert source.get_subset(idxs) == expected.get_subset(idxs)
+        host_subset = source.get_host_subset(np.asarray(idxs))
+        assert source.from_host(host_subset) == source.get_subset(idxs)
+        assert sum(chunk.get_L() for chunk in source.iter_chunks(2)) == 3
+
+        # the memory maps are reopened when unpickled, such as in the workers of a WorkerLoader
+        unpickled = pickle.loads(pickle.dumps(source))
+        assert isinstance(unpickled.arrays["uv"], np.memmap)
+        assert unpickled.get_subset(idxs) == expected.get_subset(idxs)
+
+        # the transform is applied to each batch
+        double = lambda x: geom.MultiImage({key: 2 * block for key, block in x.items()}, D)
+        doubled = gc_data.ArrayStoreSource(directory, layout, D, transform=double)
+        assert jnp.allclose(doubled.get_subset(idxs)[(1, 0)], 2 * fields["uv"][[2, 0]])
+
+        # the windows of the lazy source match the windows of the data in memory
+        lazy_X, lazy_Y = gc_data.lazy_batch_time_series(source, expected.empty(), 3, 2, 1)
+        X, Y = gc_data.batch_time_series(expected, expected.empty(), 3, 2, 1)
+        window_idxs = jnp.arange(lazy_X.get_L())
+        assert lazy_X.get_subset(window_idxs) == X
+        assert lazy_Y.get_subset(window_idxs) == Y
+
+        with pytest.warns(UserWarning, match="only found"):
+            source = gc_data.ArrayStoreSource(directory, layout, D, n_trajectories=10)
+        assert source.get_L() == 5
+
+    def testMultiImageStats(self, tmp_path):
+        D = 2
+        N = 4
+        batch = 6
+        n_steps = 3
+        key = random.PRNGKey(0)
+        key1, key2, key3 = random.split(key, 3)
+        multi_image = geom.MultiImage(
+            {
+                (0, 0): 3 + 2 * random.normal(key1, shape=(batch, 2 * n_steps) + (N,) * D),
+                (0, 1): random.normal(key2, shape=(batch, n_steps) + (N,) * D),
+                (1, 0): 5 * random.normal(key3, shape=(batch, n_steps) + (N,) * D + (D,)),
+            },
+            D,
+        )
+
+        # merging the statistics of the chunks matches the statistics of everything at once
+        chunked_stats = stats.MultiImageStats(n_steps)
+        for start, stop in [(0, 1), (1, 4), (4, 6)]:
+            chunked_stats.update(multi_image.get_subset(jnp.arange(start, stop)))
+
+        scalars = np.asarray(multi_image[(0, 0)], dtype=np.float64).reshape((batch, 2, -1))
+        assert np.allclose(chunked_stats.get_mean(0, 0), np.mean(scalars, axis=(0, 2)))
+        assert np.allclose(chunked_stats.get_scale(0, 0), np.std(scalars, axis=(0, 2)))
+        assert np.allclose(chunked_stats.get_mean(1, 0), 0)
+        vectors = np.asarray(multi_image[(1, 0)], dtype=np.float64)
+        assert np.allclose(
+            chunked_stats.get_scale(1, 0), np.sqrt(np.mean(np.sum(vectors**2, axis=-1)))
+        )
+
+        normalized = chunked_stats.normalize(multi_image)
+        normalized_scalars = normalized[(0, 0)].reshape((batch, 2, -1))
+        assert jnp.allclose(jnp.mean(normalized_scalars, axis=(0, 2)), 0, atol=1e-5)
+        assert jnp.allclose(jnp.std(normalized_scalars, axis=(0, 2)), 1, atol=1e-5)
+        assert jnp.allclose(jnp.mean(jnp.sum(normalized[(1, 0)] ** 2, axis=-1)), 1, atol=1e-5)
+
+        # the normalization is equivariant
+        for gg in geom.make_all_operators(D):
+            first = chunked_stats.normalize(multi_image.times_group_element(gg))
+            second = normalized.times_group_element(gg)
+            assert first.__eq__(second, rtol=1e-4, atol=1e-4)
+
+        # cached statistics are loaded rather than recomputed
+        cache = str(tmp_path / "stats.json")
+        computed = stats.compute_stats([multi_image], n_steps, cache)
+        loaded = stats.compute_stats([], n_steps, cache)
+        for k, parity in multi_image.keys():
+            assert np.allclose(computed.get_mean(k, parity), loaded.get_mean(k, parity))
+            assert np.allclose(computed.get_scale(k, parity), loaded.get_scale(k, parity))
+            assert np.allclose(computed.get_scale(k, parity), chunked_stats.get_scale(k, parity))
+
+    def testDeposit(self):
+        key = random.PRNGKey(0)
+        spatial_dims = (8, 6)
+        box_size = 2.0
+
+        # a particle at a cell center deposits only to that cell, for every scheme
+        positions = jnp.array([[0.625, 1.5]])  # center of cell (2,4)
+        for scheme in physics.DEPOSIT_SCHEMES:
+            grid = physics.deposit(positions, jnp.ones(1), spatial_dims, box_size, scheme)
+            if scheme == "tsc":
+                assert jnp.allclose(grid[2, 4], 0.75**2)
+            else:
+                assert jnp.allclose(grid, jnp.zeros(spatial_dims).at[2, 4].set(1))
+
+        # a particle on the corner of the box is split over the cells on both sides of the wrap
+        grid = physics.deposit(jnp.zeros((1, 2)), jnp.ones(1), spatial_dims, box_size, "cic")
+        assert jnp.allclose(grid[jnp.array([0, 0, 7, 7]), jnp.array([0, 5, 0, 5])], 0.25)
+
+        key, subkey1, subkey2, subkey3 = random.split(key, 4)
+        positions = random.uniform(subkey1, shape=(1001, 2), maxval=box_size)
+        masses = random.uniform(subkey2, shape=(1001,))
+        velocities = random.normal(subkey3, shape=(1001, 2))
+        for scheme in physics.DEPOSIT_SCHEMES:
+            # mass is conserved, and chunking does not change the result
+            grid = physics.deposit(positions, masses, spatial_dims, box_size, scheme)
+            assert jnp.allclose(jnp.sum(grid), jnp.sum(masses), rtol=1e-5)
+            chunked_grid = physics.deposit_in_chunks(
+                np.array(positions), np.array(masses), spatial_dims, box_size, scheme, 100
+            )
+            assert jnp.allclose(chunked_grid, grid, rtol=1e-5, atol=1e-5)
+
+        # a uniform velocity is recovered wherever there is mass
+        density, velocity = physics.particles_to_fields(
+            positions, jnp.full((1001, 2), jnp.array([1.0, -2.0])), spatial_dims, box_size, masses
+        )
+        cell_volume = (box_size / 8) * (box_size / 6)
+        assert jnp.allclose(jnp.sum(density) * cell_volume, jnp.sum(masses), rtol=1e-5)
+        assert jnp.allclose(velocity, jnp.array([1.0, -2.0]), rtol=1e-5)
+
+        multi_image = physics.particle_time_series(
+            [(positions, velocities, masses), (positions, velocities, None)],
+            spatial_dims,
+            box_size,
+            chunk_size=300,
+        )
+        assert multi_image.get_signature() == geom.Signature((((0, 0), 2), ((1, 0), 2)))
+        assert multi_image[(0, 0)].shape == (1, 2) + spatial_dims
+        assert multi_image[(1, 0)].shape == (1, 2) + spatial_dims + (2,)
+        assert multi_image.is_torus == (True, True)
+
+    def testGravityField(self):
+        key = random.PRNGKey(0)
+        for D, N in [(2, 12), (3, 6)]:
+            key, subkey = random.split(key)
+            masses, fields = physics.get_gravity_data(subkey, (N,) * D, 3, 4)
+            assert masses[(0, 0)].shape == (4, 1) + (N,) * D
+            assert fields[(1, 0)].shape == (4, 1) + (N,) * D + (D,)
+            assert jnp.allclose(jnp.sum(masses[(0, 0)] > 0, axis=range(1, 2 + D)), 3)
+
+            # isolated boundaries match summing the field of each point mass, for either law
+            density = masses[(0, 0)][0, 0]
+            pixels = jnp.stack(jnp.meshgrid(*(jnp.arange(N),) * D, indexing="ij"), axis=-1)
+            for force_law, power in [("inverse_square", 3), ("poisson", D)]:
+                expected = jnp.zeros((N,) * D + (D,))
+                for point in jnp.argwhere(density > 0):
+                    r_vec = point - pixels
+                    dist = jnp.linalg.norm(r_vec, axis=-1, keepdims=True)
+                    expected = expected + density[tuple(point)] * jnp.where(
+                        dist == 0, 0, r_vec / jnp.where(dist == 0, 1, dist**power)
+                    )
+
+                field = physics.gravity_field(density, False, force_law)
+                assert jnp.allclose(field, expected, rtol=1e-4, atol=1e-4)
+
+            # the default is the inverse square law of the benchmark
+            assert jnp.allclose(fields[(1, 0)][0, 0], physics.gravity_field(density))
+
+            # the solve is equivariant, for both boundaries
+            for is_torus, force_law in [(True, "poisson"), (False, "inverse_square")]:
+                fields = geom.MultiImage(
+                    {(1, 0): physics.gravity_field(density, is_torus, force_law)[None]},
+                    D,
+                    is_torus,
+                )
+                mass_image = geom.MultiImage({(0, 0): density[None]}, D, is_torus)
+                for gg in geom.make_all_operators(D):
+                    rotated_density = mass_image.times_group_element(gg)[(0, 0)][0]
+                    rotated_fields = geom.MultiImage(
+                        {(1, 0): physics.gravity_field(rotated_density, is_torus, force_law)[None]},
+                        D,
+                        is_torus,
+                    )
+                    assert rotated_fields.__eq__(
+                        fields.times_group_element(gg, jax.lax.Precision.HIGH), 1e-4, 1e-4
+                    )
+
+        # a periodic point mass converges to the isolated field away from the mass
+        density = jnp.zeros((64, 64)).at[32, 32].set(1)
+        periodic_field = physics.gravity_field(density, True, "poisson")
+        isolated_field = physics.gravity_field(density, False, "poisson")
+        assert jnp.allclose(periodic_field[32, 32], 0)
+        assert jnp.allclose(periodic_field[40, 32], isolated_field[40, 32], rtol=0.05)
+        with pytest.raises(AssertionError):
+            physics.gravity_field(density, True, "inverse_square")
+
+        # generating in batches gives the same data
+        masses, fields = physics.get_gravity_data(key, (8, 8), 2, 5)
+        batch_masses, batch_fields = physics.get_gravity_data(key, (8, 8), 2, 5, batch_size=2)
+        assert masses == batch_masses
+        assert fields == batch_fields
+
+    def testDeviceCache(self):
+        key = random.PRNGKey(0)
+        D = 2
+        N = 4
+        key, subkey1, subkey2 = random.split(key, 3)
+        X = geom.MultiImage(
+            {
+                (0, 0): random.normal(subkey1, shape=(10, 2) + (N,) * D),
+                (1, 0): random.normal(subkey2, shape=(10, 2) + (N,) * D + (D,)),
+            },
+            D,
+        )
+        nbytes = gc_data.get_nbytes(X)
+        assert nbytes == 4 * (10 * 2 * N**D + 10 * 2 * N**D * D)
+
+        idxs = jnp.array([3, 1, 4])
+        pinned = gc_data.DeviceCache(X, memory_budget=nbytes)
+        assert pinned.is_pinned
+        assert pinned.get_L() == 10
+        assert pinned.get_subset(idxs) == X.get_subset(idxs)
+        assert pinned.h2d_bytes == nbytes  # the initial transfer only
+
+        paged = gc_data.DeviceCache(X, memory_budget=nbytes - 1)
+        assert not paged.is_pinned
+        assert paged.get_subset(idxs) == X.get_subset(idxs)
+        assert paged.h2d_bytes == 3 * nbytes // 10
+
+        # without a budget, the cpu doesn't report its memory, so the data is paged
+        assert not gc_data.DeviceCache(X).is_pinned
+
+        # a lazy dataset is pinned as its raw time series, not materialized, and the windows are
+        # gathered on the device
+        lazy_X, _ = gc_data.lazy_batch_time_series(X, X.empty(), 2, 1, 1)
+        assert gc_data.get_nbytes(lazy_X) == nbytes + lazy_X.time_idxs.nbytes
+        lazy_cache = gc_data.DeviceCache(lazy_X, memory_budget=gc_data.get_nbytes(lazy_X))
+        assert lazy_cache.is_pinned
+        assert isinstance(lazy_cache.data, gc_data.TimeSeriesWindows)
+        assert gc_data.get_nbytes(lazy_cache) == gc_data.get_nbytes(lazy_X)
+        (cache_batches,) = ml.get_batches(lazy_cache, 2, key)
+        (lazy_batches,) = ml.get_batches(lazy_X, 2, key)
+        for cache_batch, lazy_batch in zip(cache_batches, lazy_batches):
+            assert cache_batch == lazy_batch
+
+        shared_X, _ = gc_data.batch_time_series(X, X.get_one(keepdims=False), 2, 1, 1)
+        shared_cache = gc_data.DeviceCache(shared_X, memory_budget=gc_data.get_nbytes(shared_X))
+        assert isinstance(shared_cache.data, gc_data.ConstantFieldsView)
+        assert shared_cache.get_subset(idxs) == shared_X.get_subset(idxs)
+
+        paged.h2d_bytes = 0
+        batches = ml.get_batches((paged, paged), 4, key)
+        assert len(batches[0]) == 2
+        assert paged.h2d_bytes == 2 * 2 * 4 * nbytes // 10
+
+    def testGroupAugmentation(self):
+        key = random.PRNGKey(0)
+        for D, spatial_dims in [(2, (4, 4)), (2, (4, 6)), (3, (3, 3, 3))]:
+            key, subkey1, subkey2, subkey3 = random.split(key, 4)
+            multi_image = geom.MultiImage(
+                {
+                    (0, 0): random.normal(subkey1, shape=(5, 2) + spatial_dims),
+                    (1, 1): random.normal(subkey2, shape=(5, 1) + spatial_dims + (D,)),
+                    (2, 0): random.normal(subkey3, shape=(5, 1) + spatial_dims + (D,) * 2),
+                },
+                D,
+            )
+            operators = geom.make_all_operators(D)
+            augmentation = gc_data.GroupAugmentation(D, spatial_dims, operators)
+            if spatial_dims == (4, 6):  # only the flips preserve a non-square grid
+                assert len(augmentation.operators) == 4
+            else:
+                assert len(augmentation.operators) == len(operators)
+
+            # every sample gets its own operator, matching MultiImage.times_group_element
+            op_idxs = jnp.arange(5) % len(augmentation.operators)
+            augmented = augmentation.apply(multi_image, op_idxs, jax.lax.Precision.HIGH)
+            for i, op_idx in enumerate(op_idxs):
+                gg = np.array(augmentation.operators[op_idx]).astype(int)
+                expected = multi_image.get_subset(jnp.array([i])).times_group_element(
+                    gg, jax.lax.Precision.HIGH
+                )
+                assert augmented.get_subset(jnp.array([i])).__eq__(expected, 1e-5, 1e-5)
+
+        # inputs and targets get the same operator, also with a leading pmap axis
+        X = multi_image.reshape_pmap(jax.devices()[:1])
+        aug_X, aug_Y = augmentation(key, X, X)
+        assert aug_X == aug_Y
+        assert aug_X[(2, 0)].shape == X[(2, 0)].shape
+
+        # a half precision batch stays in half precision
+        for dtype in [jnp.bfloat16, jnp.float16]:
+            half_X = geom.MultiImage({k: block.astype(dtype) for k, block in X.items()}, X.D)
+            (aug_half_X,) = augmentation(key, half_X)
+            assert all(block.dtype == dtype for block in aug_half_X.values())
+
+    def testCompressedMultiImage(self, tmp_path):
+        key = random.PRNGKey(0)
+        D = 2
+        key, subkey1, subkey2 = random.split(key, 3)
+        multi_image = geom.MultiImage(
+            {
+                (0, 0): 10 + random.normal(subkey1, shape=(6, 2, 8, 8)),
+                (1, 0): random.normal(subkey2, shape=(6, 1, 8, 8, D)),
+            },
+            D,
+            (True, False),
+        )
+        tolerances = {"float16": 1e-3, "bfloat16": 1e-2, "uint8": 1e-2, "uint16": 1e-4}
+        for dtype in gc_data.COMPRESSED_DTYPES:
+            compressed = gc_data.CompressedMultiImage.from_multi_image(multi_image, dtype)
+            assert compressed.get_L() == 6
+            assert compressed.is_torus == (True, False)
+            nbytes = sum(codes.nbytes for codes in compressed.codes.values())
+            assert nbytes == gc_data.get_nbytes(multi_image) // (4 if "uint8" == dtype else 2)
+
+            errors = gc_data.compression_error(multi_image, compressed, batch_size=4)
+            assert set(errors.keys()) == {(0, 0), (1, 0)}
+            for error in errors.values():
+                assert error["rel_rms"] < tolerances[dtype]
+
+            idxs = jnp.array([4, 0, 5])
+            subset = compressed.get_subset(idxs)
+            assert subset[(0, 0)].dtype == jnp.float32
+            assert subset.__eq__(multi_image.get_subset(idxs), rtol=1e-2, atol=0.05)
+
+            # saved to an array store and memory mapped back
+            compressed.save(f"{tmp_path}/{dtype}")
+            loaded = gc_data.CompressedMultiImage.load(f"{tmp_path}/{dtype}")
+            assert loaded.dtype == dtype
+            assert loaded.get_subset(idxs) == subset
+            assert loaded.is_torus == (True, False)
+
+            # compressing in chunks is the same as compressing all at once
+            chunks = [
+                multi_image.get_subset(jnp.arange(0, 4)),
+                multi_image.get_subset(jnp.arange(4, 6)),
+            ]
+            chunked = gc_data.CompressedMultiImage.from_chunks(chunks, dtype)
+            assert chunked.get_subset(idxs) == subset
+
+            # the compression is equivariant, vectors are not quantized with a per-component offset
+            all_idxs = jnp.arange(6)
+            decoded = compressed.get_subset(all_idxs)
+            for gg in geom.make_all_operators(D):
+                rotated = multi_image.times_group_element(gg, jax.lax.Precision.HIGHEST)
+                rotated_compressed = gc_data.CompressedMultiImage.from_multi_image(rotated, dtype)
+                assert rotated_compressed.get_subset(all_idxs).__eq__(
+                    decoded.times_group_element(gg, jax.lax.Precision.HIGHEST), 1e-5, 1e-5
+                )
+
+    def testWorkerLoader(self, tmp_path):
+        h5py = pytest.importorskip("h5py")
+        key = random.PRNGKey(0)
+        D = 2
+        N = 4
+        timesteps = 6
+        rng = np.random.default_rng(0)
+
+        filename = str(tmp_path / "trajectories.h5")
+        with h5py.File(filename, "w") as f:
+            for name in ["density", "Vx", "Vy"]:
+                data = rng.normal(size=(5, timesteps) + (N,) * D).astype(np.float32)
+                f.create_dataset(name, data=data, chunks=(2, timesteps) + (N,) * D)
+
+        source = gc_data.HDF5TrajectorySource(
+            filename,
+            {(0, 0): ["density"], (1, 0): [["Vx", "Vy"]]},
+            D,
+            transform=lambda multi_image: multi_image * 2,
+        )
+        constant_fields = geom.MultiImage({(0, 0): jnp.ones((1,) + (N,) * D)}, D)
+        X, Y = source.get_subset(jnp.arange(5)), source.get_subset(jnp.arange(5))
+        datasets = [
+            gc_data.lazy_batch_time_series(source, constant_fields, timesteps, 2, 1),
+            gc_data.lazy_batch_time_series(X, constant_fields, timesteps, 2, 1),
+            (X, gc_data.CompressedMultiImage.from_multi_image(Y, "float16")),
+        ]
+        # the batches are the same regardless of the number of workers
+        loaders = [gc_data.WorkerLoader(num_workers, prefetch=1) for num_workers in [1, 3]]
+        for data_X, data_Y in datasets:
+            expected_X, expected_Y = ml.get_batches((data_X, data_Y), 3, key)
+            for loader in loaders:
+                for _ in range(2):  # the workers and their datasets are reused by every epoch
+                    batches = list(loader((data_X, data_Y), 3, key))
+                    assert len(batches) == len(expected_X)
+                    for (batch_X, batch_Y), exp_X, exp_Y in zip(batches, expected_X, expected_Y):
+                        assert batch_X == exp_X
+                        assert batch_Y == exp_Y
+
+        # the workers are only started once
+        loader = loaders[1]
+        pids = [worker.pid for worker in loader.workers]
+        assert len(pids) == 3 and all(worker.is_alive() for worker in loader.workers)
+
+        # stopping early frees the batches that were assembled ahead
+        batches = loader(datasets[0], 1, key)
+        next(batches)
+        batches.close()
+        assert len(list(loader(datasets[0], 1, key))) == datasets[0][0].get_L()
+        assert [worker.pid for worker in loader.workers] == pids
+        source.close()
+
+        # a DeviceCache gathers on the device when pinned, otherwise it pages in the worker batches
+        X = geom.MultiImage({(0, 0): jnp.arange(8 * N**D, dtype=float).reshape((8, 1, N, N))}, D)
+        for memory_budget in [gc_data.get_nbytes(X), 0]:
+            cache = gc_data.DeviceCache(X, memory_budget)
+            expected = ml.get_batches(X, 2, key)[0]
+            batches = list(loader((cache,), 2, key))
+            assert all(batch == exp for (batch,), exp in zip(batches, expected))
+
+        # large arrays are sent to the workers through shared memory
+        X = geom.MultiImage({(0, 0): jnp.ones((64, 1, 64, 64))}, D)
+        expected = ml.get_batches(X, 8, key)[0]
+        assert all(batch == exp for (batch,), exp in zip(loader((X,), 8, key), expected))
+
+        for loader in loaders:
+            loader.close()
+            assert loader.workers == []
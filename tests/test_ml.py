@@ -1,9 +1,16 @@
+import numpy as np
+
 import jax.numpy as jnp
 from jax import random
 import jax
+import equinox as eqx
+import optax
 
 import ginjax.geometric as geom
+import ginjax.data as gc_data
 import ginjax.ml as ml
+import ginjax.models as models
+from ginjax.ml.training import scaled_train_step, train_step
 
 
 class TestMachineLearning:
@@ -97,6 +104,38 @@ class TestMachineLearning:
                 == (num_devices, batch_size, 1) + (N,) * D + (D,) * 1
             )
 
+    def testIterateBatches(self):
+        cpu = [jax.devices("cpu")[0]]
+        key = random.PRNGKey(0)
+        N = 5
+        D = 2
+
+        X = geom.MultiImage({(1, 0): random.normal(key, shape=(12, 1) + (N,) * D + (D,))}, D)
+        Y = geom.MultiImage({(0, 0): random.normal(key, shape=(12, 2) + (N,) * D)}, D)
+
+        class CountingDataset(gc_data.HostMultiImage):
+            n_subsets = 0
+
+            def get_subset(self, idxs: jax.Array) -> geom.MultiImage:
+                CountingDataset.n_subsets += 1
+                return super().get_subset(idxs)
+
+        lazy_X = CountingDataset(X)
+        batches = ml.iterate_batches((lazy_X, Y), 3, key, cpu)
+        assert CountingDataset.n_subsets == 0  # nothing is constructed until it is iterated
+
+        expected_X, expected_Y = ml.get_batches((X, Y), 3, key, cpu)
+        n_batches = 0
+        for (X_batch, Y_batch), expected_X_batch, expected_Y_batch in zip(
+            batches, expected_X, expected_Y
+        ):
+            n_batches += 1
+            assert CountingDataset.n_subsets == n_batches  # one batch at a time
+            assert X_batch == expected_X_batch
+            assert Y_batch == expected_Y_batch
+
+        assert n_batches == 4
+
     def testAutoregressiveStep(self):
         past_steps = 4
         N = 5
@@ -176,3 +215,228 @@ class TestMachineLearning:
         )
         assert jnp.allclose(new_input[(1, 0)], constant_field2)
         assert output == one_step1
+
+    def testAutoregressiveMapMultiStep(self, tmp_path):
+        D = 2
+        N = 5
+        timesteps = 12
+        past_steps = 3
+        model_steps = 2
+
+        class BundledModel(models.MultiImageModule):
+            # predicts the next model_steps frames by continuing the linear trend
+            def __call__(self, x, aux_data=None):
+                out = x.empty()
+                for (k, parity), image_block in x.items():
+                    exp_block = image_block.reshape((-1, past_steps) + image_block.shape[1:])
+                    slope = exp_block[:, -1] - exp_block[:, -2]
+                    steps = jnp.arange(1, model_steps + 1).reshape((1, -1) + (1,) * (k + D))
+                    pred = exp_block[:, -1:] + steps * slope[:, None]
+                    out.append(k, parity, pred.reshape((-1,) + image_block.shape[1:]))
+
+                return out, aux_data
+
+        key = random.PRNGKey(0)
+        key1, key2, key3, key4 = random.split(key, 4)
+        times = jnp.arange(timesteps).reshape((1, 1, timesteps) + (1,) * D)
+        dynamic_fields = geom.MultiImage(
+            {
+                (0, 0): (
+                    random.normal(key1, shape=(1, 2, 1) + (N,) * D)
+                    + times * random.normal(key2, shape=(1, 2, 1) + (N,) * D)
+                ).reshape((1, 2 * timesteps) + (N,) * D),
+                (1, 0): (
+                    random.normal(key3, shape=(1, 1, 1) + (N,) * D + (D,))
+                    + times[..., None] * random.normal(key4, shape=(1, 1, 1) + (N,) * D + (D,))
+                ).reshape((1, timesteps) + (N,) * D + (D,)),
+            },
+            D,
+        )
+        model = BundledModel()
+
+        # training targets for the bundled model match its output layout
+        X, Y = gc_data.batch_time_series(
+            dynamic_fields, dynamic_fields.empty(), timesteps, past_steps, model_steps
+        )
+        out, _ = jax.vmap(model)(X)
+        assert out.__eq__(Y, rtol=1e-4, atol=1e-4)
+
+        # rollout with future_steps not divisible by model_steps
+        for future_steps in [model_steps, 5]:
+            X, Y = gc_data.batch_time_series(
+                dynamic_fields, dynamic_fields.empty(), timesteps, past_steps, future_steps
+            )
+            vmap_map = jax.vmap(
+                ml.autoregressive_map,
+                in_axes=(None, 0, None, None, None, None, None),
+                out_axes=(0, None),
+            )
+            out, _ = vmap_map(model, X, None, past_steps, future_steps, {}, model_steps)
+            assert out.__eq__(Y, rtol=1e-4, atol=1e-4)
+
+        # the streaming rollout of the bundled model matches, step by step
+        for future_steps in [model_steps, 5]:
+            X, Y = gc_data.batch_time_series(
+                dynamic_fields, dynamic_fields.empty(), timesteps, past_steps, future_steps
+            )
+            # offset targets, so the loss of each step is nonzero
+            Y = geom.MultiImage({key: block + 1 for key, block in Y.items()}, D)
+            out, _ = vmap_map(model, X, None, past_steps, future_steps, {}, model_steps)
+            save_prefix = str(tmp_path / f"rollout{future_steps}")
+            results = ml.rollout_loss_in_batches(
+                model,
+                X,
+                Y,
+                2,
+                past_steps,
+                future_steps,
+                devices=[jax.devices("cpu")[0]],
+                save_prefix=save_prefix,
+                model_steps=model_steps,
+            )
+            assert jnp.allclose(
+                results["smse"], ml.timestep_smse_loss(out, Y, future_steps), rtol=1e-4
+            )
+            for (k, parity), image_block in out.items():
+                saved_block = np.load(f"{save_prefix}_k{k}_p{parity}.npy", mmap_mode="r")
+                assert jnp.allclose(jnp.array(saved_block), image_block, rtol=1e-4, atol=1e-4)
+
+    def testRolloutLossInBatches(self, tmp_path):
+        D = 2
+        N = 5
+        L = 7
+        past_steps = 2
+        future_steps = 3
+        key = random.PRNGKey(0)
+        key, subkey1, subkey2, subkey3, subkey4 = random.split(key, 5)
+
+        X = geom.MultiImage(
+            {
+                (0, 0): random.normal(subkey1, shape=(L, past_steps) + (N,) * D),
+                (1, 0): random.normal(subkey2, shape=(L, past_steps) + (N,) * D + (D,)),
+            },
+            D,
+        )
+        Y = geom.MultiImage(
+            {
+                (0, 0): random.normal(subkey3, shape=(L, future_steps) + (N,) * D),
+                (1, 0): random.normal(subkey4, shape=(L, future_steps) + (N,) * D + (D,)),
+            },
+            D,
+        )
+        model = models.ResNet(
+            D,
+            X.get_signature(),
+            geom.Signature((((0, 0), 1), ((1, 0), 1))),
+            depth=2,
+            num_blocks=1,
+            equivariant=False,
+            kernel_size=3,
+            key=key,
+        )
+
+        vmap_map = jax.vmap(
+            ml.autoregressive_map, in_axes=(None, 0, None, None, None), out_axes=(0, None)
+        )
+        expected_out, _ = vmap_map(model, X, None, past_steps, future_steps)
+        expected_loss = ml.timestep_smse_loss(expected_out, Y, future_steps)
+
+        # batch size does not divide L, so the remainder is also evaluated
+        save_prefix = str(tmp_path / "rollout")
+        results = ml.rollout_loss_in_batches(
+            model,
+            X,
+            Y,
+            3,
+            past_steps,
+            future_steps,
+            metrics={"max": lambda x, y: jnp.max(jnp.abs(x[(0, 0)] - y[(0, 0)]), axis=(1, 2, 3))},
+            devices=[jax.devices("cpu")[0]],
+            save_prefix=save_prefix,
+        )
+        assert results["smse"].shape == results["max"].shape == (future_steps,)
+        assert jnp.allclose(results["smse"], expected_loss, rtol=1e-4, atol=1e-4)
+
+        for (k, parity), image_block in expected_out.items():
+            saved_block = np.load(f"{save_prefix}_k{k}_p{parity}.npy", mmap_mode="r")
+            assert saved_block.shape == image_block.shape
+            assert jnp.allclose(jnp.array(saved_block), image_block, rtol=1e-4, atol=1e-4)
+
+    def testLossScale(self):
+        loss_scale = ml.LossScale(8.0, period=2)
+        finite, overflow = jnp.array(True), jnp.array(False)
+        assert float(loss_scale.adjust(overflow).scale) == 4.0
+        assert float(loss_scale.adjust(finite).scale) == 8.0
+        assert float(loss_scale.adjust(finite).adjust(finite).scale) == 16.0
+        assert int(loss_scale.adjust(finite).adjust(finite).counter) == 0
+        assert float(ml.LossScale(8.0, dynamic=False).adjust(overflow).scale) == 8.0
+        assert ml.all_finite({"a": jnp.ones(3), "b": None})
+        assert not ml.all_finite({"a": jnp.ones(3), "b": jnp.array([1.0, jnp.inf])})
+
+        D = 2
+        N = 5
+        key = random.PRNGKey(0)
+        key, subkey1, subkey2 = random.split(key, num=3)
+        X = geom.MultiImage({(1, 0): random.normal(subkey1, shape=(2, 1) + (N,) * D + (D,))}, D)
+        Y = geom.MultiImage({(1, 0): random.normal(subkey2, shape=(2, 1) + (N,) * D + (D,))}, D)
+        operators = geom.make_all_operators(D)
+        conv_filters = geom.get_invariant_filters([3], [0, 1, 2], [0, 1], D, operators)
+
+        key, subkey = random.split(key)
+        model = models.ResNet(
+            D,
+            X.get_signature(),
+            Y.get_signature(),
+            depth=2,
+            num_blocks=0,
+            conv_filters=conv_filters,
+            key=subkey,
+            policy=ml.Policy.from_name("float16"),
+        )
+
+        def map_and_loss(model, x, y, aux_data):
+            out, aux_data = jax.vmap(model, in_axes=(0, None), out_axes=(0, None))(x, aux_data)
+            return ml.smse_loss(out, y), aux_data
+
+        optimizer = optax.sgd(1e-2)
+        opt_state = optimizer.init(eqx.filter(model, eqx.is_array))
+        cpu = [jax.devices("cpu")[0]]
+        X_batch, Y_batch = X.reshape_pmap(cpu), Y.reshape_pmap(cpu)
+        get_params = lambda m: jax.tree_util.tree_leaves(eqx.filter(m, eqx.is_array))
+
+        unscaled_model, _, unscaled_loss, _ = train_step(
+            map_and_loss, model, optimizer, opt_state, X_batch, Y_batch
+        )
+
+        # the gradients are unscaled, so the step matches the step without loss scaling
+        scaled_model, _, loss, _, new_loss_scale = scaled_train_step(
+            map_and_loss, model, optimizer, opt_state, X_batch, Y_batch, None, ml.LossScale(2.0**8)
+        )
+        assert jnp.allclose(loss, unscaled_loss, rtol=1e-3)
+        assert float(new_loss_scale.scale) == 2.0**8
+        for scaled_param, param in zip(get_params(scaled_model), get_params(unscaled_model)):
+            assert jnp.allclose(scaled_param, param, rtol=1e-2, atol=1e-4)
+
+        # the gradients overflow float16, so the update is skipped and the scale is decreased
+        skipped_model, _, _, _, new_loss_scale = scaled_train_step(
+            map_and_loss, model, optimizer, opt_state, X_batch, Y_batch, None, ml.LossScale(2.0**40)
+        )
+        assert float(new_loss_scale.scale) == 2.0**39
+        for skipped_param, param in zip(get_params(skipped_model), get_params(model)):
+            assert jnp.all(skipped_param == param)
+
+        # train handles the steps with and without a loss scale
+        for loss_scale in [None, ml.LossScale(2.0**8)]:
+            _, _, train_loss, _ = ml.train(
+                X,
+                Y,
+                map_and_loss,
+                model,
+                key,
+                ml.EpochStop(1, verbose=0),
+                batch_size=2,
+                optimizer=optimizer,
+                devices=cpu,
+                loss_scale=loss_scale,
+            )
+            assert jnp.isfinite(train_loss)
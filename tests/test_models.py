@@ -1,6 +1,7 @@
 import time
 import itertools as it
 
+import jax
 import jax.numpy as jnp
 from jax import random
 import equinox as eqx
@@ -10,6 +11,54 @@ import ginjax.ml as ml
 import ginjax.models as models
 
 
+# the setup shared by the tests of the model options: small 2D images of scalars and vectors
+D = 2
+N = 8
+OUTPUT_KEYS = geom.Signature((((0, 0), 1), ((1, 0), 1)))
+
+
+def get_filters(M: int = 3, ks: list[int] = [0, 1, 2]) -> geom.MultiImage:
+    """
+    The invariant filters of sidelength M of the 2D group, of every parity.
+    """
+    filters = geom.get_invariant_filters([M], ks, [0, 1], D, geom.make_all_operators(D))
+    assert isinstance(filters, geom.MultiImage)
+    return filters
+
+
+def get_x(
+    key: jax.Array, channels: tuple[int, int] = (2, 2), is_torus: tuple[bool, ...] = (True, True)
+) -> geom.MultiImage:
+    """
+    A random input of scalars and vectors, shape (channels,spatial,tensor).
+    """
+    subkey1, subkey2 = random.split(key)
+    return geom.MultiImage(
+        {
+            (0, 0): random.normal(subkey1, shape=(channels[0],) + (N,) * D),
+            (1, 0): random.normal(subkey2, shape=(channels[1],) + (N,) * D + (D,)),
+        },
+        D,
+        is_torus,
+    )
+
+
+def make_resnet(
+    x: geom.MultiImage,
+    key: jax.Array,
+    output_keys: geom.Signature = OUTPUT_KEYS,
+    **kwargs,
+) -> models.ResNet:
+    """
+    A small ResNet from the signature of x, kwargs override the depth, blocks, and filters.
+    """
+    kwargs = {"depth": 2, "num_blocks": 1, "conv_filters": get_filters(), **kwargs}
+    return models.ResNet(D, x.get_signature(), output_keys, key=key, **kwargs)
+
+
+model_call = eqx.filter_jit(lambda model, x: model(x)[0])
+
+
 class TestModels:
     # Class to test the functions in the models.py file
 
@@ -126,3 +175,370 @@ class TestModels:
             first, _ = inference_model(multi_image_x.times_group_element(gg))
             second = inference_model(multi_image_x)[0].times_group_element(gg)
             assert first.__eq__(second, rtol=1e-3, atol=1e-3)
+
+    def testMixedPrecisionPolicy(self):
+        assert ml.Policy.from_name("bfloat16") == ml.Policy("float32", "bfloat16", "float32")
+        assert hash(ml.Policy.from_name("float16")) == hash(ml.Policy("float32", "float16"))
+        assert ml.Policy() != ml.Policy.from_name("bfloat16")
+
+        key1, key2 = random.split(random.PRNGKey(0))
+        x = get_x(key1)
+        make_model = lambda policy: make_resnet(x, key2, policy=policy)
+        float32_out = model_call(make_model(None), x)
+
+        model = make_model(ml.Policy.from_name("bfloat16"))
+        for leaf in jax.tree_util.tree_leaves(eqx.filter(model, eqx.is_inexact_array)):
+            assert leaf.dtype == jnp.float32
+
+        out = model_call(model, x)
+        assert out.get_signature() == float32_out.get_signature()
+        for image_block in out.values():
+            assert image_block.dtype == jnp.float32
+
+        assert out.__eq__(float32_out, rtol=5e-2, atol=5e-2)
+        assert not out.__eq__(float32_out)  # actually computed in bfloat16
+        for gg in geom.make_all_operators(D):
+            first = model_call(model, x.times_group_element(gg))
+            second = out.times_group_element(gg, jax.lax.Precision.HIGHEST)
+            assert first.__eq__(second, rtol=5e-2, atol=5e-2)
+
+        # the global policy is used by models constructed without one
+        ml.set_policy(ml.Policy.from_name("float16"))
+        try:
+            assert make_model(None).policy == ml.Policy.from_name("float16")
+        finally:
+            ml.set_policy(ml.Policy())
+
+    def testRematPolicies(self):
+        key1, key2 = random.split(random.PRNGKey(0))
+        x = get_x(key1)
+        make_models = {
+            "unet": lambda remat: models.UNet(
+                D,
+                x.get_signature(),
+                OUTPUT_KEYS,
+                depth=2,
+                num_downsamples=1,
+                conv_filters=get_filters(),
+                upsample_filters=get_filters(M=2),
+                key=key2,
+                remat=remat,
+            ),
+            "resnet": lambda remat: make_resnet(
+                x, key2, num_blocks=3, remat=remat, remat_every=2
+            ),
+        }
+        loss_and_grads = eqx.filter_jit(
+            eqx.filter_value_and_grad(lambda model, x: jnp.sum(model(x)[0].to_vector() ** 2))
+        )
+
+        for make_model in make_models.values():
+            loss, grads = loss_and_grads(make_model(models.REMAT_NONE), x)
+            for remat in models.REMAT_POLICIES:
+                remat_loss, remat_grads = loss_and_grads(make_model(remat), x)
+                assert jnp.allclose(remat_loss, loss, rtol=1e-5)
+                for leaf, remat_leaf in zip(
+                    jax.tree_util.tree_leaves(grads), jax.tree_util.tree_leaves(remat_grads)
+                ):
+                    assert jnp.allclose(leaf, remat_leaf, rtol=1e-4, atol=1e-5)
+
+    def testScanBlocks(self):
+        key1, key2 = random.split(random.PRNGKey(0))
+        x = get_x(key1)
+        make_model = lambda num_blocks, scan_blocks: make_resnet(
+            x, key2, num_blocks=num_blocks, scan_blocks=scan_blocks
+        )
+
+        # same parameters, so the same output
+        out = model_call(make_model(3, False), x)
+        scan_model = make_model(3, True)
+        assert models.count_params(scan_model) == models.count_params(make_model(3, False))
+        assert model_call(scan_model, x).__eq__(out, rtol=1e-5, atol=1e-5)
+
+        # the traced program does not grow with the number of blocks
+        hlo_sizes = [len(model_call.lower(make_model(n, True), x).as_text()) for n in [2, 4]]
+        assert hlo_sizes[0] == hlo_sizes[1]
+
+    def testFreeze(self):
+        key = random.PRNGKey(0)
+        key, subkey1, subkey2 = random.split(key, num=3)
+        x = get_x(subkey1, is_torus=(True, False))
+        x.append(1, 1, random.normal(subkey2, shape=(1,) + (N,) * D + (D,)))
+        output_keys = geom.Signature((((0, 0), 2), ((1, 0), 3), ((0, 1), 1)))
+
+        for use_bias in [False, "auto", "mean"]:
+            key, subkey = random.split(key)
+            conv = ml.ConvContract(
+                x.get_signature(), output_keys, get_filters(), use_bias, rhs_dilation=2, key=subkey
+            )
+            frozen_conv = conv.freeze(x.is_torus)
+            assert isinstance(frozen_conv, ml.FrozenConvContract)
+            assert frozen_conv(x).__eq__(conv(x), rtol=1e-5, atol=1e-5)
+
+        key, subkey = random.split(key)
+        model = make_resnet(x, subkey, output_keys)
+        frozen_model = ml.freeze(model, x.is_torus)
+        assert model_call(frozen_model, x).__eq__(model_call(model, x), rtol=1e-4, atol=1e-4)
+        assert not any(
+            isinstance(layer, ml.ConvContract)
+            for layer in jax.tree_util.tree_leaves(
+                frozen_model, is_leaf=lambda layer: isinstance(layer, ml.ConvContract)
+            )
+        )
+
+        # the stacked layers of scanned blocks are frozen block by block, and still scanned
+        key, subkey = random.split(key)
+        scan_model = make_resnet(x, subkey, output_keys, num_blocks=3, scan_blocks=True)
+        frozen_scan_model = ml.freeze(scan_model, x.is_torus)
+        assert model_call(frozen_scan_model, x).__eq__(
+            model_call(scan_model, x), rtol=1e-4, atol=1e-4
+        )
+
+    def testFilterBank(self, tmp_path):
+        key1, key2, key3 = random.split(random.PRNGKey(0), num=3)
+        x = get_x(key1)
+        conv_filters = get_filters()
+
+        # equal filters, even if they are different objects, share one filter bank
+        filter_bank = ml.register_filters(conv_filters)
+        assert filter_bank == ml.register_filters(conv_filters.copy())
+        assert ml.get_filters(filter_bank) == conv_filters
+        conv = ml.ConvContract(x.get_signature(), OUTPUT_KEYS, filter_bank, key=key2)
+        assert conv(x).__eq__(
+            ml.ConvContract(x.get_signature(), OUTPUT_KEYS, conv_filters, key=key2)(x)
+        )
+
+        model = make_resnet(x, key2, conv_filters=conv_filters)
+        # the filters are not leaves of the model, so not in the checkpoint
+        filter_ids = {id(filter_block) for filter_block in conv_filters.values()}
+        assert all(id(leaf) not in filter_ids for leaf in jax.tree_util.tree_leaves(model))
+        for layer in jax.tree_util.tree_leaves(
+            model, is_leaf=lambda layer: isinstance(layer, ml.ConvContract)
+        ):
+            if isinstance(layer, ml.ConvContract):
+                assert layer.filter_bank == filter_bank
+
+        ml.save(f"{tmp_path}/model.eqx", model)
+        loaded_model = ml.load(f"{tmp_path}/model.eqx", make_resnet(x, key3))
+        assert model_call(loaded_model, x).__eq__(model_call(model, x))
+
+    def testPackedParams(self, tmp_path):
+        key1, key2, key3 = random.split(random.PRNGKey(0), num=3)
+        x = get_x(key1)
+        output_keys = geom.Signature((((0, 0), 1), ((1, 0), 3)))
+
+        conv = ml.ConvContract(x.get_signature(), output_keys, get_filters(), key=key2)
+        assert len(jax.tree_util.tree_leaves(conv)) == 1
+        for in_key, in_c in x.get_signature():
+            for out_key, out_c in output_keys:
+                weight_block = conv.weights[in_key][out_key]
+                assert weight_block.shape[:2] == (out_c, in_c)
+        for out_key, out_c in output_keys:
+            assert conv.bias[out_key].shape[0] == out_c
+
+        # replace_params takes the weights and bias in any order
+        weights = {
+            in_key: {out_key: 2 * w for out_key, w in reversed(out_weights.items())}
+            for in_key, out_weights in conv.weights.items()
+        }
+        new_conv = conv.replace_params(weights, conv.bias)
+        assert jnp.allclose(new_conv.weights[(1, 0)][(0, 0)], 2 * conv.weights[(1, 0)][(0, 0)])
+        assert jnp.allclose(new_conv.bias[(1, 0)], conv.bias[(1, 0)])
+
+        # checkpoints in the unpacked layout, with and without the invariant filters
+        model = make_resnet(x, key2, output_keys)
+        is_conv = lambda layer: isinstance(layer, ml.ConvContract)
+        for with_filters in [True, False]:
+            unpacked_model = jax.tree_util.tree_map(
+                lambda layer: layer.to_unpacked(with_filters) if is_conv(layer) else layer,
+                model,
+                is_leaf=is_conv,
+            )
+            ml.save(f"{tmp_path}/unpacked.eqx", unpacked_model)
+            loaded_model = ml.load_unpacked(
+                f"{tmp_path}/unpacked.eqx", make_resnet(x, key3, output_keys), with_filters
+            )
+            assert model_call(loaded_model, x).__eq__(model_call(model, x))
+
+    def testPointwiseConvContract(self):
+        key = random.PRNGKey(0)
+        pointwise_filters = get_filters(M=1, ks=[0, 1, 2, 3, 4])
+        key, subkey1, subkey2 = random.split(key, num=3)
+        x = get_x(subkey1, channels=(3, 2))
+        x.append(2, 0, random.normal(subkey2, shape=(2,) + (N,) * D + (D, D)))
+        output_keys = geom.Signature((((0, 0), 2), ((1, 0), 3), ((2, 0), 1), ((1, 1), 2)))
+
+        for stride in [1, 2]:
+            key, subkey = random.split(key)
+            pointwise = models.make_conv(
+                D,
+                x.get_signature(),
+                output_keys,
+                "auto",
+                True,
+                pointwise_filters,
+                stride=stride,
+                key=subkey,
+            )
+            assert isinstance(pointwise, ml.PointwiseConvContract)
+            conv = ml.ConvContract(
+                x.get_signature(), output_keys, pointwise_filters, stride=stride, key=subkey
+            )
+            assert pointwise(x).__eq__(conv(x), rtol=1e-5, atol=1e-5)
+
+            if stride > 1:
+                continue  # subsampling an even sidelength is not equivariant
+
+            for gg in geom.make_all_operators(D):
+                first = pointwise(x.times_group_element(gg))
+                second = pointwise(x).times_group_element(gg, jax.lax.Precision.HIGHEST)
+                assert first.__eq__(second, rtol=1e-5, atol=1e-5)
+
+        # explicit paddings and dilations are not supported by the pointwise layer
+        for padding, rhs_dilation in [(1, 1), (((0, 0),) * D, 1), (None, (2,) * D)]:
+            key, subkey = random.split(key)
+            conv = models.make_conv(
+                D,
+                x.get_signature(),
+                output_keys,
+                "auto",
+                True,
+                pointwise_filters,
+                padding=padding,
+                rhs_dilation=rhs_dilation,
+                key=subkey,
+            )
+            assert isinstance(conv, ml.ConvContract)
+            assert not isinstance(conv, ml.PointwiseConvContract)
+            expected = ml.ConvContract(
+                x.get_signature(),
+                output_keys,
+                pointwise_filters,
+                padding=padding,
+                rhs_dilation=rhs_dilation,
+                key=subkey,
+            )
+            assert conv(x).__eq__(expected(x), rtol=1e-5, atol=1e-5)
+
+    def testSeparableConvContract(self):
+        key = random.PRNGKey(0)
+        operators = geom.make_all_operators(D)
+        conv_filters = get_filters()
+        pointwise_filters = get_filters(M=1)
+        key, subkey = random.split(key)
+        x = get_x(subkey, channels=(3, 2))
+        output_keys = geom.Signature((((0, 0), 2), ((1, 0), 3), ((1, 1), 1)))
+
+        key, subkey = random.split(key)
+        separable = models.make_conv(
+            D,
+            x.get_signature(),
+            output_keys,
+            "auto",
+            True,
+            conv_filters,
+            rhs_dilation=(2,) * D,
+            key=subkey,
+            separable=True,
+            pointwise_filters=pointwise_filters,
+        )
+        assert isinstance(separable, ml.SeparableConvContract)
+        assert separable(x).get_signature() == output_keys
+
+        # the depthwise convolution of each channel is a ConvContract from its type to itself
+        conv = ml.ConvContract(
+            x.get_signature(), x.get_signature(), conv_filters, rhs_dilation=(2,) * D, key=subkey
+        )
+        depthwise_x = separable.depthwise_convolve(x, separable.depthwise_weights)
+        for (k, p), image_block in x.items():
+            for c in range(len(image_block)):
+                weights = {(k, p): {(k, p): separable.depthwise_weights[(k, p)][c, None, None]}}
+                channel_x = geom.MultiImage({(k, p): image_block[c : c + 1]}, D)
+                assert jnp.allclose(
+                    conv.individual_convolve(channel_x, weights)[(k, p)][0],
+                    depthwise_x[(k, p)][c],
+                    rtol=1e-5,
+                    atol=1e-5,
+                )
+
+        for gg in operators:
+            first = separable(x.times_group_element(gg))
+            second = separable(x).times_group_element(gg, jax.lax.Precision.HIGHEST)
+            assert first.__eq__(second, rtol=1e-5, atol=1e-5)
+
+        # the separable models are equivariant and have fewer parameters
+        key, subkey = random.split(key)
+        for model_f in [
+            lambda separable: models.UNet(
+                D,
+                x.get_signature(),
+                OUTPUT_KEYS,
+                4,
+                num_downsamples=1,
+                conv_filters=conv_filters,
+                upsample_filters=get_filters(M=2),
+                key=subkey,
+                separable=separable,
+                pointwise_filters=pointwise_filters,
+            ),
+            lambda separable: models.DilResNet(
+                D,
+                x.get_signature(),
+                OUTPUT_KEYS,
+                4,
+                num_blocks=1,
+                conv_filters=conv_filters,
+                key=subkey,
+                separable=separable,
+                pointwise_filters=pointwise_filters,
+            ),
+        ]:
+            model = model_f(True)
+            assert models.count_params(model) < models.count_params(model_f(False))
+
+            for gg in operators:
+                first, _ = model(x.times_group_element(gg))
+                second = model(x)[0].times_group_element(gg, jax.lax.Precision.HIGHEST)
+                assert first.__eq__(second, rtol=1e-3, atol=1e-3)
+
+    def testSpectralConvContract(self):
+        key = random.PRNGKey(0)
+        spectral_filters = get_filters(M=5, ks=[0, 1, 2, 3])
+        key, subkey = random.split(key)
+        x = get_x(subkey, channels=(3, 2))
+        output_keys = geom.Signature((((0, 0), 2), ((1, 0), 3), ((2, 0), 1), ((1, 1), 2)))
+
+        key, subkey = random.split(key)
+        spectral = models.make_conv(
+            D,
+            x.get_signature(),
+            output_keys,
+            "auto",
+            True,
+            spectral_filters,
+            key=subkey,
+            spectral=True,
+        )
+        assert isinstance(spectral, ml.SpectralConvContract)
+        assert spectral.modes == 2
+        assert sorted(spectral(x).get_signature()) == sorted(output_keys)
+        assert isinstance(ml.freeze(spectral), ml.SpectralConvContract)
+
+        for gg in geom.make_all_operators(D):
+            first = spectral(x.times_group_element(gg))
+            second = spectral(x).times_group_element(gg, jax.lax.Precision.HIGHEST)
+            assert first.__eq__(second, rtol=1e-5, atol=1e-5)
+
+        # a smooth input gives the same output at any resolution
+        key, subkey = random.split(key)
+        scalar_keys = geom.Signature((((0, 0), 1),))
+        spectral = ml.SpectralConvContract(scalar_keys, scalar_keys, spectral_filters, key=subkey)
+        outputs = []
+        for side_length in [8, 16]:
+            grid = jnp.stack(
+                jnp.meshgrid(*(jnp.arange(side_length) / side_length,) * D, indexing="ij")
+            )
+            smooth = jnp.cos(2 * jnp.pi * grid[0]) + jnp.sin(4 * jnp.pi * (grid[0] + grid[1]))
+            outputs.append(spectral(geom.MultiImage({(0, 0): smooth[None]}, D))[(0, 0)])
+
+        assert jnp.allclose(outputs[0], outputs[1][:, ::2, ::2], rtol=1e-5, atol=1e-5)